@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Union
 
 class AnalysisRequest(BaseModel):
     antibiotic: str = Field(..., description="Name of the antibiotic to analyze")
@@ -11,6 +11,8 @@ class PathogenResult(BaseModel):
     risk_mass: Dict[str, Any]
     weight: float
     directions: Optional[Dict[str, str]] = None
+    count: Optional[int] = Field(None, description="Distinct isolates of this pathogen in the surveillance data")
+    tested_isolates: Optional[int] = Field(None, description="Distinct isolates phenotyped for the antibiotic")
 
 class AnalysisResponse(BaseModel):
     overall_risk_score: float
@@ -18,6 +20,26 @@ class AnalysisResponse(BaseModel):
     gene_drivers: Dict[str, Any]
     pathogen_breakdown: List[PathogenResult]
 
+class AntibiogramRequest(BaseModel):
+    gene_presence: Dict[str, int] = Field(..., description="Dictionary of gene names and their presence (1) or absence (0)")
+    antibiotics: Optional[List[str]] = Field(None, description="Panel to score (default: every antibiotic known to a model)")
+
+class AttributionRequest(BaseModel):
+    antibiotic: str = Field(..., description="Name of the antibiotic to test against")
+    gene_presence: Dict[str, int] = Field(..., description="Dictionary of gene names and their presence (1) or absence (0)")
+    method: str = Field("auto", description="auto, shapley (exact), loo (leave-one-out) or sampled (permutation Shapley)")
+    samples: Optional[int] = Field(None, ge=2, le=2000, description="Permutations for sampled Shapley")
+    seed: int = Field(0, description="Random seed for sampled Shapley")
+
+class AntibiogramEntry(AnalysisResponse):
+    antibiotic: str
+    antibiotic_class: Optional[str] = None
+
+class AntibiogramResponse(BaseModel):
+    antibiotics: List[AntibiogramEntry]
+    panel_size: int
+    unknown: List[str] = Field(default_factory=list, description="Requested antibiotics no model knows (not scored)")
+
 class MapDataPoint(BaseModel):
     region: str
     value: float
@@ -28,3 +50,24 @@ class MapResponse(BaseModel):
     data: List[MapDataPoint]
     status: str
     message: Optional[str] = None
+
+
+class AggregateQuery(BaseModel):
+    group_by: List[str] = Field(default_factory=list, description="Dimensions: state, region, pathogen, antibiotic, antibiotic_class, year")
+    filters: Dict[str, List[Union[int, str]]] = Field(default_factory=dict, description="Dimension → list of allowed values (case-insensitive)")
+    measures: List[str] = Field(default_factory=lambda: ["isolates", "resistance_rate"], description="isolates (distinct genomes), records (test rows), tested, resistant, resistance_rate")
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    min_tested: int = Field(0, ge=0, description="Drop groups with fewer phenotyped records")
+    sort_by: Optional[str] = Field(None, description="A group_by dimension or measure")
+    descending: bool = True
+    limit: int = Field(1000, ge=1, le=10000)
+
+
+class NeighborRequest(BaseModel):
+    gene_presence: Dict[str, int] = Field(..., description="Dictionary of gene names and their presence (1) or absence (0)")
+    antibiotic: Optional[str] = Field(None, description="Report each neighbour's observed phenotype for this antibiotic")
+    pathogen: Optional[str] = Field(None, description="Restrict neighbours to one pathogen")
+    k: int = Field(10, ge=1, le=100)
+    metric: str = Field("jaccard", description="jaccard or hamming")
+    tested_only: bool = Field(True, description="With an antibiotic, only rank isolates phenotyped for it")
@@ -0,0 +1,64 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from app.core.profiling import is_admin_token, list_reports, load_report
+from app.services import evaluation
+from typing import List, Optional
+import logging
+import re
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+_PROFILE_ID_RE = re.compile(r"^[0-9a-f]{6,32}$")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Reject requests that do not carry the configured admin token."""
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Administrator token required.")
+
+
+@router.get("/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles(limit: int = 50):
+    """List the most recent saved request profiles."""
+    return {"profiles": list_reports(limit)}
+
+
+@router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """Return one saved profile: span breakdown plus cProfile report."""
+    if not _PROFILE_ID_RE.match(profile_id):
+        raise HTTPException(status_code=400, detail="Invalid profile id.")
+    report = load_report(profile_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found.")
+    return report
+
+
+@router.get("/evaluations", dependencies=[Depends(require_admin)])
+async def get_evaluations(limit: int = 50):
+    """List model evaluation reports, newest first, plus the background run status."""
+    return {"status": evaluation.evaluation_status(), "reports": evaluation.list_reports(limit)}
+
+
+@router.get("/evaluations/{report_id}", dependencies=[Depends(require_admin)])
+async def get_evaluation(report_id: str):
+    """Return one evaluation report."""
+    if not evaluation.REPORT_ID_RE.match(report_id):
+        raise HTTPException(status_code=400, detail="Invalid report id.")
+    report = evaluation.load_report(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Evaluation report {report_id} not found.")
+    return report
+
+
+@router.post("/evaluations", status_code=202, dependencies=[Depends(require_admin)])
+async def start_evaluation(models: Optional[List[str]] = Query(None), folds: int = Query(evaluation.N_FOLDS, ge=2, le=20),
+                         transfer: bool = True):
+    """Start a cross-dataset evaluation of the shipped models in the background."""
+    try:
+        evaluation.discover_models(models)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not evaluation.start_evaluation(models=models, folds=folds, transfer=transfer):
+        raise HTTPException(status_code=409, detail="An evaluation is already running.")
+    return {"status": "started"}
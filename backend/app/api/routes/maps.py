@@ -1,210 +1,193 @@
-from fastapi import APIRouter
-from app.api.models import MapResponse
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from app.api.models import MapResponse, AggregateQuery
+from app.core.config import DATA_DIR, WATCH_DATA, WATCH_INTERVAL, STORE_BACKEND, SQLITE_DIR
+from app.core.metrics import (DATA_LOAD_DURATION, DATASET_ROWS, DATASET_MEMORY, DATASET_REFRESHES,
+                              DATASET_REFRESH_DURATION)
+from app.core.profiling import span, traced
+from app.core.concurrency import coalesced
+from app.core.wire import negotiated
+from app.core.watcher import Broadcaster, DataWatcher, sse_stream
+from app.core import shared_state
+from app.services.trends import TrendEngine, DIMENSIONS, SMOOTHING_MODES, TREND_YEAR_MAX, TREND_YEAR_MIN
+from app.services.query import QueryEngine, QueryError, canonical_terms
+from app.services.genes import GeneDistributionIndex, GENE_PREFIX
+from app.services.cooccurrence import CooccurrenceEngine, NETWORK_METRICS, MAX_EDGES
+from app.services.isolates import IsolateStore
+from app.services.locations import LocationRollup, LocationError, LEVELS
+from app.services.neighbors import NeighborIndex
+from app.services.smoothing import SpatialSmoother
+from app.services.distinct import IsolateCounts
+from app.services.dashboard import DashboardCube
+from app.services.sqlstore import SQLiteStore, SQLQueryEngine
+from app.services.vocabulary import ANTIBIOTICS, GENES, PATHOGENS
+from app.services import export
+from app.services.datasets import KLEB_PATH, ECOLI_PATH, SAUREUS_PATH
+from app.services.geo import ZONE_TO_STATES, ALL_STATES, STATE_NEIGHBORS, resolve_location
 import logging
+import sqlite3
 import pandas as pd
 import os
-import re
+import threading
+import time
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import Callable, Iterator, List, Dict, Any, Optional, Sequence, Tuple, Union
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Data Paths
-DATA_DIR = "/Users/shivaniyerram/Desktop/Projects/AMR-AI-Platform/data"
-KLEB_PATH = os.path.join(DATA_DIR, "FINAL_AMR_KLEBSIELLA (2).csv")
-ECOLI_PATH = os.path.join(DATA_DIR, "E_Coli_Final_ML_Dataset_v1.csv")
-SAUREUS_PATH = os.path.join(DATA_DIR, "S_aureus.csv")
-
-# ─── Geographic Location → Indian State mapping ───
-# Longest-match-first lookup: cities, districts, and states
-LOCATION_TO_STATE = {
-    # Cities → State
-    "kolkata": "West Bengal", "kharagpur": "West Bengal",
-    "bangalore": "Karnataka", "mysore": "Karnataka", "mysuru": "Karnataka",
-    "bellary": "Karnataka", "ballari": "Karnataka", "hassan": "Karnataka",
-    "gullenahalli": "Karnataka", "adaguru": "Karnataka", "chattanahalli": "Karnataka",
-    "dyapalapura": "Karnataka", "soppinahalli": "Karnataka", "shanthi grama": "Karnataka",
-    "chennai": "Tamil Nadu", "vellore": "Tamil Nadu", "madurai": "Tamil Nadu",
-    "thanjavur": "Tamil Nadu", "hosur": "Tamil Nadu", "ashok nagar": "Tamil Nadu",
-    "vengaivasal": "Tamil Nadu", "vengabakkam": "Tamil Nadu", "madambakkam": "Tamil Nadu",
-    "keerapakkam": "Tamil Nadu", "kanchipuram": "Tamil Nadu",
-    "cochin": "Kerala", "kochi": "Kerala", "amritapuri": "Kerala",
-    "kollam": "Kerala", "alappuzha": "Kerala", "kodungallur": "Kerala",
-    "munambam": "Kerala",
-    "mumbai": "Maharashtra", "pune": "Maharashtra", "nagpur": "Maharashtra",
-    "aurangabad": "Maharashtra", "jawhar": "Maharashtra",
-    "hyderabad": "Telangana", "hyderbad": "Telangana",
-    "ahmedabad": "Gujarat", "vadodara": "Gujarat", "anand": "Gujarat",
-    "banaskantha": "Gujarat", "dantiwada": "Gujarat",
-    "guwahati": "Assam", "silagrant": "Assam", "sila grant": "Assam",
-    "garoghuli": "Assam", "gorchuk": "Assam", "diparbill": "Assam",
-    "north guwahati": "Assam",
-    "shillong": "Meghalaya", "tura": "Meghalaya", "mawbri": "Meghalaya",
-    "nonglakhiat": "Meghalaya", "iewduh": "Meghalaya", "burabazar": "Meghalaya",
-    "agartala": "Tripura",
-    "delhi": "Delhi", "new delhi": "Delhi", "bhajanpura": "Delhi",
-    "safdarjung": "Delhi",
-    "rohtak": "Haryana", "karnal": "Haryana",
-    "chandigarh": "Chandigarh",
-    "aligarh": "Uttar Pradesh", "lucknow": "Uttar Pradesh",
-    "varanasi": "Uttar Pradesh", "allahabad": "Uttar Pradesh",
-    "puttaparthi": "Andhra Pradesh", "guntur": "Andhra Pradesh",
-    # States (for "India: Gujarat" etc.)
-    "tamil nadu": "Tamil Nadu", "tamilnadu": "Tamil Nadu",
-    "karnataka": "Karnataka", "kerala": "Kerala",
-    "maharashtra": "Maharashtra", "gujarat": "Gujarat",
-    "rajasthan": "Rajasthan", "rajsthan": "Rajasthan",
-    "meghalaya": "Meghalaya", "assam": "Assam", "tripura": "Tripura",
-    "mizoram": "Mizoram", "manipur": "Manipur", "nagaland": "Nagaland",
-    "sikkim": "Sikkim", "arunachal pradesh": "Arunachal Pradesh",
-    "west bengal": "West Bengal", "bihar": "Bihar", "odisha": "Odisha",
-    "jharkhand": "Jharkhand",
-    "punjab": "Punjab", "haryana": "Haryana",
-    "telangana": "Telangana", "andhra pradesh": "Andhra Pradesh",
-    "uttar pradesh": "Uttar Pradesh",
-    "madhya pradesh": "Madhya Pradesh",
-    "chattisgarh": "Chhattisgarh", "chhattisgarh": "Chhattisgarh",
-    "puducherry": "Puducherry", "goa": "Goa",
-    "jammu": "Jammu and Kashmir", "kashmir": "Jammu and Kashmir",
-    "himachal": "Himachal Pradesh",
-}
-# Sort by key length descending for longest-match-first
-_SORTED_LOC_KEYS = sorted(LOCATION_TO_STATE.keys(), key=len, reverse=True)
-
-# Zone → States (for fallback when state can't be extracted)
-ZONE_TO_STATES = {
-    "North": ["Delhi", "Uttar Pradesh", "Punjab", "Haryana", "Chandigarh",
-              "Jammu and Kashmir", "Himachal Pradesh", "Uttarakhand"],
-    "South": ["Tamil Nadu", "Kerala", "Karnataka", "Andhra Pradesh",
-              "Telangana", "Puducherry"],
-    "East": ["West Bengal", "Bihar", "Odisha", "Jharkhand"],
-    "North-East": ["Assam", "Sikkim", "Manipur", "Mizoram", "Tripura",
-                   "Meghalaya", "Nagaland", "Arunachal Pradesh"],
-    "West": ["Maharashtra", "Gujarat", "Rajasthan", "Goa",
-             "Dadra and Nagar Haveli", "Daman and Diu"],
-    "Central": ["Madhya Pradesh", "Chhattisgarh"],
-}
-ALL_STATES = [s for states in ZONE_TO_STATES.values() for s in states]
-
-# Neighbors for interpolation (used for states with no data)
-STATE_NEIGHBORS = {
-    "Madhya Pradesh": ["Uttar Pradesh", "Rajasthan", "Gujarat", "Maharashtra", "Chhattisgarh"],
-    "Chhattisgarh": ["Madhya Pradesh", "Uttar Pradesh", "Jharkhand", "Odisha", "Maharashtra", "Telangana"],
-    "Uttarakhand": ["Uttar Pradesh", "Himachal Pradesh", "Delhi", "Haryana"],
-    "Himachal Pradesh": ["Punjab", "Haryana", "Uttarakhand", "Chandigarh"],
-    "Jammu and Kashmir": ["Punjab", "Himachal Pradesh"],
-    "Sikkim": ["West Bengal", "Assam"],
-    "Nagaland": ["Assam", "Manipur"],
-    "Arunachal Pradesh": ["Assam"],
-    "Goa": ["Maharashtra", "Karnataka"],
-    "Dadra and Nagar Haveli": ["Gujarat", "Maharashtra"],
-    "Daman and Diu": ["Gujarat"],
-    "Puducherry": ["Tamil Nadu"],
-    "Lakshadweep": ["Kerala"],
-    "Andaman and Nicobar": ["West Bengal"],
+CARBAPENEMS = ["meropenem", "imipenem", "ertapenem"]
+
+# Per-test columns every source is harmonized to before normalization
+RECORD_COLUMNS = ["genome_id", "pathogen", "state", "region", "year", "district", "city",
+                  "antibiotic_name", "phenotype_label"]
+
+
+def _gene_columns(path: str) -> List[str]:
+    return [c for c in pd.read_csv(path, nrows=0).columns if c.startswith(GENE_PREFIX)]
+
+
+def _resolve_locations(df: pd.DataFrame, column: str):
+    """Add state, district and city columns resolved from a location column
+    (each distinct string is resolved once)."""
+    resolved = {loc: resolve_location(loc) for loc in df[column].dropna().unique()}
+    for level in ("state", "district", "city"):
+        df[level] = df[column].map({loc: path[level] for loc, path in resolved.items()})
+
+
+def _klebsiella(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns={"Genome ID": "genome_id", "Collection Year": "year"})
+    df["phenotype_label"] = pd.to_numeric(df["phenotype_label"], errors='coerce')
+    _resolve_locations(df, "Geographic Location")
+    return df
+
+
+def _e_coli(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns={"collection_year": "year"})
+    df["phenotype_label"] = pd.to_numeric(df["phenotype_label"], errors='coerce')
+    # state_ut contains Geographic Location strings → extract state
+    _resolve_locations(df, "state_ut")
+    return df
+
+
+def _s_aureus(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns={
+        "Genome ID": "genome_id",
+        "Geographic Location": "geo_loc",
+        "Antibiotic": "antibiotic_name",
+        "Resistant Phenotype": "phenotype_status"
+    })
+    _resolve_locations(df, "geo_loc")
+    df["phenotype_label"] = df["phenotype_status"].apply(
+        lambda x: 1 if isinstance(x, str) and x.strip().lower() == "resistant" else 0
+    )
+    df["year"] = "2024"
+    df["region"] = "Other"  # S. aureus has no region column
+    return df
+
+
+# Surveillance sources in load order: pathogen → (CSV path, columns read
+# besides the genes, harmonizer to RECORD_COLUMNS)
+SOURCES: Dict[str, Tuple[str, List[str], Callable[[pd.DataFrame], pd.DataFrame]]] = {
+    "K. pneumoniae": (KLEB_PATH, ["Genome ID", "region", "Geographic Location", "antibiotic_name",
+                                  "phenotype_label", "Collection Year"], _klebsiella),
+    "E. coli": (ECOLI_PATH, ["genome_id", "antibiotic_name", "phenotype_label",
+                             "collection_year", "region", "state_ut"], _e_coli),
+    "S. aureus": (SAUREUS_PATH, ["Genome ID", "Geographic Location", "Antibiotic",
+                                 "Resistant Phenotype"], _s_aureus),
 }
 
 
-def extract_state(geo_loc: str) -> str:
-    """Extract Indian state name from a Geographic Location string.
-    
-    Examples:
-        'India: Vellore'          → 'Tamil Nadu'
-        'India: Kolkata'          → 'West Bengal'
-        'India: Chattisgarh, ...' → 'Chhattisgarh'
-        'India: Gujarat'          → 'Gujarat'
-        'India'                   → None
-    """
-    if not isinstance(geo_loc, str):
+def read_source(pathogen: str, chunk_rows: Optional[int] = None) -> Tuple[List[str], Iterator[pd.DataFrame]]:
+    """
+    (gene panel, harmonized records) of one source CSV. Records hold
+    RECORD_COLUMNS plus one column per gene under its canonical name (without
+    the "gene_" prefix) and come as one frame, or as frames of `chunk_rows`
+    rows read lazily. Read errors surface from the iterator.
+    """
+    path, columns, harmonize = SOURCES[pathogen]
+    raw_genes = _gene_columns(path)
+    names = {g: GENES.names[GENES.add(g)] for g in raw_genes}
+
+    def records() -> Iterator[pd.DataFrame]:
+        t0 = time.perf_counter()
+        try:
+            reader = pd.read_csv(path, usecols=columns + raw_genes, dtype=str, chunksize=chunk_rows)
+            for df in ([reader] if chunk_rows is None else reader):
+                df = harmonize(df)
+                df["pathogen"] = pathogen
+                df = df[RECORD_COLUMNS + raw_genes]
+
+                # Normalize zone-level region column (for fallback)
+                df["region"] = df["region"].fillna("Other").replace({
+                    "east": "East", "west": "West", "north": "North", "south": "South",
+                    "north-east": "North-East", "North-east": "North-East"
+                })
+
+                # Canonical antibiotic names (title case, synonyms merged), one lookup per distinct value
+                df["antibiotic_name"] = ANTIBIOTICS.intern(df["antibiotic_name"])
+                yield df.rename(columns=names)
+        finally:
+            DATA_LOAD_DURATION.set(time.perf_counter() - t0, pathogen)
+
+    return list(names.values()), records()
+
+
+def load_source(pathogen: str) -> Optional[IsolateStore]:
+    """
+    Loads one source CSV into its own normalized store (None if the file is
+    missing or unreadable). Each CSV is read once; its per-antibiotic rows are
+    split into one isolate row per genome (metadata + bit-packed genes) and
+    narrow phenotype rows.
+    """
+    if not os.path.exists(SOURCES[pathogen][0]):
         return None
-    loc = re.sub(r'^India\s*:?\s*', '', geo_loc, flags=re.IGNORECASE).strip().lower()
-    if not loc or loc == 'india':
+    try:
+        genes, records = read_source(pathogen)
+        df = next(records)
+    except Exception as e:
+        logger.error(f"Error loading {pathogen}: {e}")
         return None
-    for key in _SORTED_LOC_KEYS:
-        if key in loc:
-            return LOCATION_TO_STATE[key]
-    return None
+    logger.info(f"{pathogen} loaded: {len(df)} rows, {df['state'].notna().sum()} state-mapped")
+    return IsolateStore.from_records(df, {pathogen: genes})
 
 
-def load_and_aggregate_data():
+def load_isolate_store() -> IsolateStore:
     """
-    Loads K. pneumo, E. coli, and S. aureus data.
-    Extracts Indian state from Geographic Location for state-level granularity.
+    Loads K. pneumo, E. coli, and S. aureus data into the normalized store,
+    one source at a time.
+    Resolves Geographic Location to state, keeping district/city where named.
     Falls back to zone-level region column when state can't be extracted.
-    Returns DataFrame with columns: [state, antibiotic_name, phenotype_label, year, pathogen]
     """
-    dfs = []
+    parts = [load_source(pathogen) for pathogen in SOURCES]
+    return IsolateStore.concat([part for part in parts if part is not None])
 
-    # ── 1. Klebsiella ──
-    if os.path.exists(KLEB_PATH):
-        try:
-            df_k = pd.read_csv(KLEB_PATH,
-                               usecols=["region", "Geographic Location", "antibiotic_name",
-                                        "phenotype_label", "Collection Year"],
-                               dtype=str)
-            df_k.rename(columns={"Collection Year": "year"}, inplace=True)
-            df_k["phenotype_label"] = pd.to_numeric(df_k["phenotype_label"], errors='coerce')
-            df_k["state"] = df_k["Geographic Location"].apply(extract_state)
-            df_k["pathogen"] = "K. pneumoniae"
-            dfs.append(df_k[["state", "region", "antibiotic_name", "phenotype_label", "year", "pathogen"]])
-            logger.info(f"Klebsiella loaded: {len(df_k)} rows, {df_k['state'].notna().sum()} state-mapped")
-        except Exception as e:
-            logger.error(f"Error loading Klebsiella: {e}")
-
-    # ── 2. E. coli ──
-    if os.path.exists(ECOLI_PATH):
-        try:
-            df_e = pd.read_csv(ECOLI_PATH, header=0,
-                               usecols=["antibiotic_name", "phenotype_label",
-                                        "collection_year", "region", "state_ut"],
-                               dtype=str)
-            df_e.rename(columns={"collection_year": "year"}, inplace=True)
-            df_e["phenotype_label"] = pd.to_numeric(df_e["phenotype_label"], errors='coerce')
-            # state_ut contains Geographic Location strings → extract state
-            df_e["state"] = df_e["state_ut"].apply(extract_state)
-            df_e["pathogen"] = "E. coli"
-            dfs.append(df_e[["state", "region", "antibiotic_name", "phenotype_label", "year", "pathogen"]])
-            logger.info(f"E. coli loaded: {len(df_e)} rows, {df_e['state'].notna().sum()} state-mapped")
-        except Exception as e:
-            logger.error(f"Error loading E. Coli: {e}")
-
-    # ── 3. S. aureus ──
-    if os.path.exists(SAUREUS_PATH):
-        try:
-            df_s = pd.read_csv(SAUREUS_PATH,
-                               usecols=["Geographic Location", "Antibiotic", "Resistant Phenotype"],
-                               dtype=str)
-            df_s.rename(columns={
-                "Geographic Location": "geo_loc",
-                "Antibiotic": "antibiotic_name",
-                "Resistant Phenotype": "phenotype_status"
-            }, inplace=True)
-            df_s["state"] = df_s["geo_loc"].apply(extract_state)
-            df_s["phenotype_label"] = df_s["phenotype_status"].apply(
-                lambda x: 1 if isinstance(x, str) and x.strip().lower() == "resistant" else 0
-            )
-            df_s["year"] = "2024"
-            df_s["pathogen"] = "S. aureus"
-            df_s["region"] = "Other"  # S. aureus has no region column
-            dfs.append(df_s[["state", "region", "antibiotic_name", "phenotype_label", "year", "pathogen"]])
-            logger.info(f"S. aureus loaded: {len(df_s)} rows, {df_s['state'].notna().sum()} state-mapped")
-        except Exception as e:
-            logger.error(f"Error loading S. Aureus: {e}")
-
-    if not dfs:
-        return pd.DataFrame()
 
-    df = pd.concat(dfs, ignore_index=True)
+def open_database(version: int = 0) -> Optional[SQLiteStore]:
+    """
+    Opens the on-disk store for the current source CSVs, streaming them in
+    chunk by chunk when no store file matches their content (None if SQLite
+    is unusable, e.g. an unwritable AMR_SQLITE_DIR).
+    """
+    try:
+        return SQLiteStore.ingest({pathogen: path for pathogen, (path, _, _) in SOURCES.items()},
+                                  read_source, SQLITE_DIR, ALL_STATES, version=version)
+    except (sqlite3.Error, OSError) as e:
+        logger.exception(f"SQLite store unavailable: {e}")
+        return None
 
-    # Normalize zone-level region column (for fallback)
-    df["region"] = df["region"].fillna("Other").replace({
-        "east": "East", "west": "West", "north": "North", "south": "South",
-        "north-east": "North-East", "North-east": "North-East"
-    })
 
-    # Clean Antibiotic Names
-    df["antibiotic_name"] = df["antibiotic_name"].str.title().str.strip()
+def load_and_aggregate_data(store: Optional[IsolateStore] = None):
+    """
+    Returns DataFrame with columns: [state, region, antibiotic_name, phenotype_label, year, pathogen, genome_id].
+    Expanded from the normalized isolate store (loaded from the CSVs if not given).
+    String columns are categorical and `year` is numeric, so every column is a
+    flat array that can be memory-mapped in shared-state mode.
+    """
+    store = store if store is not None else load_isolate_store()
+    df = store.phenotype_frame()
+    if df.empty:
+        return pd.DataFrame()
 
     state_mapped = df["state"].notna().sum()
     logger.info(f"Total: {len(df)} rows, {state_mapped} ({state_mapped/len(df)*100:.0f}%) mapped to states")
@@ -219,63 +202,362 @@ def load_and_aggregate_data():
 
 
 # ── Load Data Once ──
+# With AMR_STORE=sqlite the per-test rows stay on disk: GLOBAL_DF is left
+# empty, ISOLATE_STORE holds only the genomes (metadata + genes, for the gene
+# indexes) and every phenotype aggregate is built from, or served by, the
+# store. If the store cannot be opened the data is loaded into memory.
 try:
     print("DEBUG: Loading data...")
-    GLOBAL_DF = load_and_aggregate_data()
+    _load_start = time.perf_counter()
+    ISOLATE_STORE = None
+    GLOBAL_DF = None
+    ATTACHED_ENGINES: Dict[str, Any] = {}
+    DATABASE = open_database() if STORE_BACKEND == "sqlite" else None
+    if DATABASE is not None:
+        # Files of earlier source versions are never read again
+        SQLiteStore.prune(SQLITE_DIR, [DATABASE.path])
+        ISOLATE_STORE = DATABASE.genotype_store()
+        GLOBAL_DF = pd.DataFrame()
+    elif shared_state.is_enabled():
+        _isolates = shared_state.attach_dataframe("isolates")
+        _phenotypes = shared_state.attach_dataframe("phenotypes")
+        if _isolates is not None and _phenotypes is not None:
+            ISOLATE_STORE = IsolateStore.from_frames(_isolates, _phenotypes)
+        GLOBAL_DF = shared_state.attach_dataframe()
+        if ISOLATE_STORE is not None and GLOBAL_DF is not None:
+            # Engines are only valid over the frames they were built from
+            ATTACHED_ENGINES = shared_state.attach_engines()
+    if ISOLATE_STORE is None:
+        ISOLATE_STORE = load_isolate_store()
+    if GLOBAL_DF is None:
+        GLOBAL_DF = load_and_aggregate_data(ISOLATE_STORE)
+    DATA_LOAD_DURATION.set(time.perf_counter() - _load_start, "total")
     print("DEBUG: Data loaded successfully.")
 except Exception as e:
     print(f"DEBUG: Error loading data: {e}")
+    ISOLATE_STORE = IsolateStore.empty()
     GLOBAL_DF = pd.DataFrame()
+    ATTACHED_ENGINES = {}
+    DATABASE = None
+
+
+def _record_dataset_metrics():
+    DATASET_ROWS.clear()
+    if DATABASE is not None:
+        rows = DATABASE.rows_by_pathogen()
+        memory = ISOLATE_STORE.memory_usage()
+    else:
+        rows = GLOBAL_DF["pathogen"].value_counts().to_dict() if not GLOBAL_DF.empty else {}
+        memory = GLOBAL_DF.memory_usage(deep=True).sum()
+    for pathogen, n in rows.items():
+        DATASET_ROWS.set(n, pathogen)
+    DATASET_MEMORY.set(memory)
 
 
-def get_pathogen_counts() -> Dict[str, int]:
-    """Return count of isolates per pathogen."""
-    if GLOBAL_DF.empty:
+_record_dataset_metrics()
+
+
+def build_sql_aggregates(db: SQLiteStore, version: int = 0) -> Tuple[SQLQueryEngine, SpatialSmoother, LocationRollup]:
+    """(/query engine, spatial smoother, location rollup) over the on-disk store."""
+    places, counts = db.location_counts()
+    return (SQLQueryEngine(db, version=version),
+            SpatialSmoother(db.state_counts(), version=version),
+            LocationRollup.from_counts(places, counts, db.pathogens, db.antibiotics, version=version))
+
+
+# Dashboard panels: a resident cube, or indexed queries against the store
+PanelSource = Union[DashboardCube, SQLiteStore]
+
+# Engines published in a shared-state snapshot: snapshot name → module global
+SHARED_ENGINES: Dict[str, str] = {
+    "trends": "TREND_ENGINE", "genes": "GENE_INDEX", "cooccurrence": "COOCCURRENCE",
+    "query": "QUERY_ENGINE", "smoother": "SMOOTHER", "locations": "LOCATION_INDEX",
+    "dashboard": "DASHBOARD_CUBE", "isolate_counts": "ISOLATE_COUNTS", "neighbors": "NEIGHBOR_INDEX",
+}
+
+
+def _engine(name: str, build: Callable[[], Any]) -> Any:
+    """The engine attached from the shared-state snapshot, else a new one."""
+    engine = ATTACHED_ENGINES.get(name)
+    return build() if engine is None else engine
+
+
+def snapshot_engines() -> Dict[str, Any]:
+    """Engines to publish in a shared-state snapshot (memory store only)."""
+    if DATABASE is not None:
         return {}
-    return GLOBAL_DF["pathogen"].value_counts().to_dict()
+    return {name: globals()[attr] for name, attr in SHARED_ENGINES.items()}
+
+
+# Year-indexed sum/count cube behind every trend view
+TREND_ENGINE = (TrendEngine.from_chunks(DATABASE.row_chunks()) if DATABASE is not None
+                else _engine("trends", lambda: TrendEngine.from_frame(GLOBAL_DF)))
+# (gene × pathogen × state × year) carrier counts behind /gene_distribution
+GENE_INDEX = _engine("genes", lambda: GeneDistributionIndex(ISOLATE_STORE, ALL_STATES))
+# Sparse isolate × gene carrier matrix behind /gene_network
+COOCCURRENCE = _engine("cooccurrence", lambda: CooccurrenceEngine(ISOLATE_STORE, ALL_STATES))
+if DATABASE is not None:
+    # /query groups, state counts and location counts by SQL; panels, isolate
+    # counts and neighbours' phenotypes queried per request
+    QUERY_ENGINE, SMOOTHER, LOCATION_INDEX = build_sql_aggregates(DATABASE)
+    DASHBOARD_CUBE = ISOLATE_COUNTS = DATABASE
+    NEIGHBOR_INDEX = NeighborIndex(ISOLATE_STORE, DATABASE.antibiotic_tests)
+else:
+    # Integer-coded columns + cached query plans behind /query
+    QUERY_ENGINE = _engine("query", lambda: QueryEngine(GLOBAL_DF))
+    # State × pathogen × antibiotic counts with empirical-Bayes smoothed rates
+    SMOOTHER = _engine("smoother", lambda: SpatialSmoother(GLOBAL_DF))
+    # national → zone → state → district → city counts behind /locations
+    LOCATION_INDEX = _engine("locations", lambda: LocationRollup(ISOLATE_STORE))
+    # (pathogen × antibiotic × place × year) counts behind the dashboard panels
+    DASHBOARD_CUBE = _engine("dashboard", lambda: DashboardCube(GLOBAL_DF))
+    # Exact distinct-genome counts behind every "isolates" figure
+    ISOLATE_COUNTS = _engine("isolate_counts", lambda: IsolateCounts(ISOLATE_STORE, ALL_STATES))
+    # Packed gene-presence words behind /prediction/neighbors
+    NEIGHBOR_INDEX = _engine("neighbors", lambda: NeighborIndex(ISOLATE_STORE))
+    NEIGHBOR_INDEX.attach_store(ISOLATE_STORE)
 
 
-def _build_state_map(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+# ── Live refresh ──
+# A changed source CSV is re-read on its own; the other sources are sliced
+# from the live store. Aggregates are grouped by the store parts they read,
+# and only groups whose inputs' fingerprints changed are rebuilt (the trend
+# cube swaps the source's rows in place). New objects are built beside the
+# live ones and swapped in at the end: requests in flight keep the objects
+# they started with, and no second copy of the raw CSVs is ever held.
+# With the on-disk store, changed sources are streamed into a new file
+# (unchanged ones are re-read too: the file is one unit) and every aggregate
+# is rebuilt from it; the trend cube swaps the changed sources' rows, read
+# back from the old and new files.
+
+AGGREGATE_INPUTS: Dict[str, Tuple[str, ...]] = {
+    "phenotypes": ("isolates", "phenotypes"),
+    "genes": ("isolates", "genes"),
+}
+# Routes (under /maps) whose responses each aggregate group feeds
+AGGREGATE_ROUTES: Dict[str, List[str]] = {
+    "phenotypes": ["/antibiotics", "/antibiotic_performance", "/carbapenem_resistance",
+                   "/analytics/trends", "/analytics/trend_series", "/analytics/heatmap",
+                   "/analytics/dashboard", "/query", "/locations", "/export/rows", "/export/aggregate"],
+    "genes": ["/genes", "/gene_distribution", "/gene_network"],
+}
+DATASET_VERSION = 0
+AGGREGATE_VERSIONS: Dict[str, int] = {group: 0 for group in AGGREGATE_ROUTES}
+DATASET_EVENTS = Broadcaster()
+_refresh_lock = threading.Lock()
+_watcher: Optional[DataWatcher] = None
+
+
+def dataset_state(sources: Sequence[str] = (), stale: Sequence[str] = ()) -> Dict[str, Any]:
+    """Current dataset version, with the version each route's data last changed at."""
+    return {
+        "version": DATASET_VERSION,
+        "aggregates": dict(AGGREGATE_VERSIONS),
+        "routes": {route: AGGREGATE_VERSIONS[group]
+                   for group, routes in AGGREGATE_ROUTES.items() for route in routes},
+        "sources": list(sources),
+        "stale": list(stale),
+        "isolates": ISOLATE_STORE.n_isolates,
+    }
+
+
+def refresh_sources(paths: Sequence[str]) -> Optional[Dict[str, Any]]:
     """
-    Build per-state resistance data from a DataFrame.
+    Reloads the sources behind changed CSV paths and swaps in rebuilt
+    aggregates. Returns the published dataset event, or None when the
+    files hold no known source or their data did not change.
+    """
+    global ISOLATE_STORE, GLOBAL_DF, QUERY_ENGINE, GENE_INDEX, LOCATION_INDEX, SMOOTHER, ISOLATE_COUNTS
+    global DASHBOARD_CUBE, COOCCURRENCE, NEIGHBOR_INDEX
+    global DATASET_VERSION
+    by_path = {os.path.abspath(path): pathogen for pathogen, (path, _, _) in SOURCES.items()}
+    pathogens = []
+    for path in map(os.path.abspath, paths):
+        if path in by_path:
+            pathogens.append(by_path[path])
+        else:
+            logger.info(f"Ignoring {path}: not a surveillance source")
+    if not pathogens:
+        return None
+    if DATABASE is not None:
+        return _refresh_database(pathogens)
+
+    with _refresh_lock:
+        start = time.perf_counter()
+        store = ISOLATE_STORE
+        reloaded: Dict[str, IsolateStore] = {}
+        changed = set()
+        for pathogen in pathogens:
+            part = load_source(pathogen)
+            if part is None:
+                DATASET_REFRESHES.inc(pathogen, "failed")
+                logger.warning(f"Keeping the loaded {pathogen} data: reload failed")
+                continue
+            old = store.for_pathogens([pathogen]).fingerprint()
+            diff = {k for k, v in part.fingerprint().items() if old[k] != v}
+            DATASET_REFRESHES.inc(pathogen, "changed" if diff else "unchanged")
+            if diff:
+                reloaded[pathogen] = part
+                changed |= diff
+        stale_groups = [g for g, inputs in AGGREGATE_INPUTS.items() if changed & set(inputs)]
+        if not stale_groups:
+            logger.info(f"Reloaded {pathogens}: data unchanged")
+            return None
+
+        loaded = set(store.isolates["pathogen"].astype(object).dropna())
+        new_store = IsolateStore.concat([reloaded[p] if p in reloaded else store.for_pathogens([p])
+                                         for p in SOURCES if p in reloaded or p in loaded])
+        version = DATASET_VERSION + 1
+        df, query, genes, network = GLOBAL_DF, QUERY_ENGINE, GENE_INDEX, COOCCURRENCE
+        locations, smoother, counts, cube = LOCATION_INDEX, SMOOTHER, ISOLATE_COUNTS, DASHBOARD_CUBE
+        if "phenotypes" in stale_groups:
+            df = new_store.phenotype_frame()
+            query = QueryEngine(df, version=version)
+            locations = LocationRollup(new_store, version=version)
+            smoother = SpatialSmoother(df, version=version)
+            cube, counts = DashboardCube(df, version=version), IsolateCounts(new_store, ALL_STATES)
+        if "genes" in stale_groups:
+            genes = GeneDistributionIndex(new_store, ALL_STATES)
+            network = CooccurrenceEngine(new_store, ALL_STATES, version=version)
+        # Reads both genes and phenotypes
+        neighbors = NeighborIndex(new_store)
+
+        # Swap everything in together
+        if "phenotypes" in stale_groups:
+            sources = list(reloaded)
+            old_rows = GLOBAL_DF[GLOBAL_DF["pathogen"].isin(sources)] if not GLOBAL_DF.empty else df.iloc[:0]
+            TREND_ENGINE.replace(old_rows, df[df["pathogen"].isin(sources)], version=version)
+        ISOLATE_STORE, GLOBAL_DF, QUERY_ENGINE, GENE_INDEX, COOCCURRENCE = new_store, df, query, genes, network
+        NEIGHBOR_INDEX = neighbors
+        LOCATION_INDEX, SMOOTHER, ISOLATE_COUNTS, DASHBOARD_CUBE = locations, smoother, counts, cube
+        DATASET_VERSION = version
+        for group in stale_groups:
+            AGGREGATE_VERSIONS[group] = version
+        _record_dataset_metrics()
+        elapsed = time.perf_counter() - start
+        DATASET_REFRESH_DURATION.observe(elapsed)
+        event = dataset_state(sorted(reloaded), [r for g in stale_groups for r in AGGREGATE_ROUTES[g]])
+
+    logger.info(f"Dataset v{version}: reloaded {sorted(reloaded)}, rebuilt {stale_groups} in {elapsed:.2f}s")
+    DATASET_EVENTS.publish(event)
+    return event
+
+
+def _refresh_database(pathogens: List[str]) -> Optional[Dict[str, Any]]:
+    """refresh_sources() for the on-disk store."""
+    global DATABASE, ISOLATE_STORE, QUERY_ENGINE, GENE_INDEX, LOCATION_INDEX, SMOOTHER, ISOLATE_COUNTS
+    global DASHBOARD_CUBE, COOCCURRENCE, NEIGHBOR_INDEX
+    global DATASET_VERSION
+    with _refresh_lock:
+        start = time.perf_counter()
+        old_db = DATABASE
+        version = DATASET_VERSION + 1
+        new_db = open_database(version=version)
+        if new_db is None or new_db.path == old_db.path:
+            for pathogen in pathogens:
+                DATASET_REFRESHES.inc(pathogen, "failed" if new_db is None else "unchanged")
+            logger.info(f"Reloaded {pathogens}: {'store unavailable' if new_db is None else 'data unchanged'}")
+            return None
+        failed = [p for p in pathogens if p not in new_db.sources]
+        if failed:
+            # The file holds every source; keep the old one whole
+            for pathogen in pathogens:
+                DATASET_REFRESHES.inc(pathogen, "failed")
+            logger.warning(f"Keeping the loaded data: reload of {failed} failed")
+            SQLiteStore.prune(SQLITE_DIR, [old_db.path])
+            return None
+        changed = [p for p in SOURCES if old_db.sources.get(p) != new_db.sources.get(p)]
+        for pathogen in pathogens:
+            DATASET_REFRESHES.inc(pathogen, "changed" if pathogen in changed else "unchanged")
+
+        store = new_db.genotype_store()
+        query, smoother, locations = build_sql_aggregates(new_db, version=version)
+        genes = GeneDistributionIndex(store, ALL_STATES)
+        network = CooccurrenceEngine(store, ALL_STATES, version=version)
+        neighbors = NeighborIndex(store, new_db.antibiotic_tests)
+
+        # Swap everything in together
+        TREND_ENGINE.replace_chunks(old_db.row_chunks(pathogen=changed), new_db.row_chunks(pathogen=changed),
+                                    version=version)
+        DATABASE, ISOLATE_STORE, QUERY_ENGINE, GENE_INDEX, COOCCURRENCE = new_db, store, query, genes, network
+        NEIGHBOR_INDEX = neighbors
+        LOCATION_INDEX, SMOOTHER, ISOLATE_COUNTS, DASHBOARD_CUBE = locations, smoother, new_db, new_db
+        # Requests in flight may still read the previous file
+        SQLiteStore.prune(SQLITE_DIR, [new_db.path, old_db.path])
+        DATASET_VERSION = version
+        stale_groups = list(AGGREGATE_ROUTES)
+        for group in stale_groups:
+            AGGREGATE_VERSIONS[group] = version
+        _record_dataset_metrics()
+        elapsed = time.perf_counter() - start
+        DATASET_REFRESH_DURATION.observe(elapsed)
+        event = dataset_state(changed, [r for g in stale_groups for r in AGGREGATE_ROUTES[g]])
+
+    logger.info(f"Dataset v{version}: reloaded {changed} into {new_db.path.name} in {elapsed:.2f}s")
+    DATASET_EVENTS.publish(event)
+    return event
+
+
+def start_data_watcher():
+    """Start polling DATA_DIR for changed sources (once per process)."""
+    global _watcher
+    if not WATCH_DATA or _watcher is not None:
+        return
+    if shared_state.is_enabled():
+        # Each worker would rebuild a private copy of the shared snapshot
+        logger.info("Data watcher disabled in shared-state mode; rebuild the snapshot to refresh data.")
+        return
+    _watcher = DataWatcher(DATA_DIR, refresh_sources, WATCH_INTERVAL)
+    _watcher.start()
+
+
+def stop_data_watcher():
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
+
+
+def get_pathogen_counts(antibiotic: Optional[str] = None) -> Dict[str, int]:
+    """Return count of distinct isolates per pathogen (tested for `antibiotic`, if given)."""
+    counts = ISOLATE_COUNTS.by_pathogen(antibiotic)
+    return {p: n for p, n in counts.items() if n > 0}
+
+
+@traced("maps.build_state_map")
+def _build_state_map(counts: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Build per-state resistance data from DashboardCube.place_counts.
     
     Strategy:
-    1. State-level: group by extracted state, compute mean resistance + count
+    1. State-level: resistant + tested counts of records with a state
     2. Zone fallback: for records without a state, use zone→states mapping
     3. Neighbor interpolation: for remaining empty states, average neighbors
     """
     state_data = {}  # state → {"total_r": float, "total_n": int}
 
     # ── Step 1: Direct state-level aggregation ──
-    state_mapped = df[df["state"].notna()].copy()
-    if not state_mapped.empty:
-        agg = state_mapped.groupby("state")["phenotype_label"].agg(["sum", "count"]).reset_index()
-        for _, row in agg.iterrows():
-            s = row["state"]
-            state_data[s] = {"total_r": row["sum"], "total_n": int(row["count"])}
+    for s, (total_r, total_n) in counts["states"].items():
+        state_data[s] = {"total_r": total_r, "total_n": total_n}
 
     # ── Step 2: Zone fallback for unmapped records ──
-    zone_unmapped = df[df["state"].isna()].copy()
-    if not zone_unmapped.empty:
-        zone_agg = zone_unmapped.groupby("region")["phenotype_label"].agg(["sum", "count"]).reset_index()
-        for _, row in zone_agg.iterrows():
-            zone = row["region"]
-            target_states = ZONE_TO_STATES.get(zone, [])
-            if not target_states:
-                continue
-            # Distribute zone data equally among states not yet directly mapped
-            unmapped_states = [s for s in target_states if s not in state_data]
-            if not unmapped_states:
-                # All states already have data; add proportionally
-                unmapped_states = target_states
-            per_state_r = row["sum"] / len(unmapped_states)
-            per_state_n = max(1, int(row["count"] / len(unmapped_states)))
-            for s in unmapped_states:
-                if s in state_data:
-                    state_data[s]["total_r"] += per_state_r
-                    state_data[s]["total_n"] += per_state_n
-                else:
-                    state_data[s] = {"total_r": per_state_r, "total_n": per_state_n}
+    for zone, (zone_r, zone_n) in counts["zones"].items():
+        target_states = ZONE_TO_STATES.get(zone, [])
+        if not target_states:
+            continue
+        # Distribute zone data equally among states not yet directly mapped
+        unmapped_states = [s for s in target_states if s not in state_data]
+        if not unmapped_states:
+            # All states already have data; add proportionally
+            unmapped_states = target_states
+        per_state_r = zone_r / len(unmapped_states)
+        per_state_n = max(1, int(zone_n / len(unmapped_states)))
+        for s in unmapped_states:
+            if s in state_data:
+                state_data[s]["total_r"] += per_state_r
+                state_data[s]["total_n"] += per_state_n
+            else:
+                state_data[s] = {"total_r": per_state_r, "total_n": per_state_n}
 
     # ── Step 3: Neighbor interpolation for remaining empty states ──
     for state in ALL_STATES:
@@ -290,44 +572,96 @@ def _build_state_map(df: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
                 state_data[state] = {"total_r": avg_rate * 10, "total_n": 10, "interpolated": True}
             else:
                 # Last resort: use global mean
-                global_mean = df["phenotype_label"].mean()
+                global_mean = counts["mean"]
                 state_data[state] = {"total_r": global_mean * 5, "total_n": 5, "interpolated": True}
 
     return state_data
 
 
+def _smoothed_map(rates: Dict[str, Any], label: str, isolates: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Map points from SpatialSmoother.state_rates: value is the posterior
+    mean, states without tests show their neighbourhood prior."""
+    map_data = []
+    for i, state in enumerate(rates["states"]):
+        n = int(rates["tested"][i])
+        rate = round(float(rates["mean"][i]) * 100, 1)
+        low, high = round(float(rates["low"][i]) * 100, 1), round(float(rates["high"][i]) * 100, 1)
+        map_data.append({
+            "region": state,
+            "value": rate,
+            "metadata": {
+                "detail": f"{label}: {rate}% (95% CrI {low}–{high}%){'' if n else ' (est.)'}",
+                "isolates": isolates.get(state, 0),
+                "tests": n,
+                "raw_rate": round(int(rates["resistant"][i]) / n * 100, 1) if n else None,
+                "ci_low": low,
+                "ci_high": high,
+                "sd": round(float(rates["sd"][i]) * 100, 2),
+                "shrinkage": round(float(rates["shrinkage"][i]), 3),
+                "estimated": n == 0,
+            }
+        })
+    return map_data
+
+
 @router.get("/antibiotics")
-async def get_antibiotics():
+@negotiated
+@coalesced("maps.antibiotics")
+def get_antibiotics():
     """Return list of available antibiotics for filtering."""
-    if GLOBAL_DF.empty:
-        return {"antibiotics": []}
-    
+    return {"antibiotics": _antibiotic_list(DASHBOARD_CUBE)}
+
+
+def _antibiotic_list(cube: PanelSource) -> List[str]:
     # improved: filter out low-frequency drugs (<50 isolates)
-    counts = GLOBAL_DF["antibiotic_name"].value_counts()
-    valid_ab = counts[counts >= 50].index.tolist()
-    return {"antibiotics": sorted(valid_ab)}
+    return sorted(ab for ab, n in cube.antibiotic_rows().items() if n >= 50)
 
 
 @router.get("/antibiotic_performance", response_model=MapResponse)
-async def get_antibiotic_performance(antibiotic: Optional[str] = None):
+@negotiated
+@coalesced("maps.antibiotic_performance")
+def get_antibiotic_performance(antibiotic: Optional[str] = None, pathogen: Optional[str] = None,
+                               smoothed: bool = Query(False, description="Empirical-Bayes spatial smoothing")):
     """
     Antibiotic resistance rates by Indian state.
-    Optional: filter by specific antibiotic name.
+    Optional: filter by specific antibiotic name and/or pathogen.
+    With `smoothed`, every state's rate is shrunk toward its bordering
+    states (beta-binomial empirical Bayes) and carries a 95% credible interval.
     """
-    if GLOBAL_DF.empty:
+    _check_terms(antibiotic, pathogen)
+    if not ISOLATE_STORE.n_isolates:
         return {"map_type": "antibiotic_performance", "data": [], "status": "unavailable",
                 "message": "No data loaded."}
 
-    df = GLOBAL_DF.copy()
-    
-    # Filter by antibiotic if provided
-    if antibiotic:
-        df = df[df["antibiotic_name"].str.lower() == antibiotic.lower().strip()]
-        if df.empty:
-             return {"map_type": "antibiotic_performance", "data": [], "status": "unavailable",
-                    "message": f"No data for {antibiotic}."}
+    if smoothed:
+        with span("maps.smoothed_lookup", antibiotic=antibiotic):
+            rates = SMOOTHER.state_rates([antibiotic] if antibiotic else None, pathogen)
+        if rates is None:
+            return {"map_type": "antibiotic_performance", "data": [], "status": "unavailable",
+                    "message": f"No data for {antibiotic or pathogen}."}
+        label = antibiotic or "Resistance"
+        return {
+            "map_type": "antibiotic_performance",
+            "data": _smoothed_map(rates, label, ISOLATE_COUNTS.by_state([antibiotic] if antibiotic else None,
+                                                                        pathogen)),
+            "status": "success",
+            "message": f"{antibiotic if antibiotic else 'Overall'} resistance rates by state "
+                       f"(spatially smoothed{f', {pathogen}' if pathogen else ''}).",
+        }
+
+    return _performance_map(DASHBOARD_CUBE, antibiotic, pathogen)
+
 
-    state_data = _build_state_map(df)
+def _performance_map(cube: PanelSource, antibiotic: Optional[str] = None,
+                     pathogen: Optional[str] = None) -> Dict[str, Any]:
+    with span("maps.place_counts", antibiotic=antibiotic):
+        counts = cube.place_counts([antibiotic] if antibiotic else None, pathogen)
+    if counts is None:
+        return {"map_type": "antibiotic_performance", "data": [], "status": "unavailable",
+                "message": f"No data for {antibiotic or pathogen}."}
+
+    state_data = _build_state_map(counts)
+    isolates = ISOLATE_COUNTS.by_state([antibiotic] if antibiotic else None, pathogen)
 
     map_data = []
     for state in ALL_STATES:
@@ -351,7 +685,8 @@ async def get_antibiotic_performance(antibiotic: Optional[str] = None):
                 "value": rate,
                 "metadata": {
                     "detail": detail_text,
-                    "isolates": n,
+                    "isolates": isolates[state],
+                    "tests": n,
                     "estimated": is_est,
                 }
             })
@@ -359,7 +694,7 @@ async def get_antibiotic_performance(antibiotic: Optional[str] = None):
             map_data.append({
                 "region": state,
                 "value": 0,
-                "metadata": {"detail": "Insufficient data", "isolates": 0}
+                "metadata": {"detail": "Insufficient data", "isolates": isolates[state]}
             })
 
     return {
@@ -371,110 +706,198 @@ async def get_antibiotic_performance(antibiotic: Optional[str] = None):
 
 
 @router.get("/analytics/trends")
-async def get_trends(antibiotic: Optional[str] = None, pathogen: Optional[str] = None):
+@negotiated
+@coalesced("maps.trends")
+def get_trends(antibiotic: Optional[str] = None, pathogen: Optional[str] = None):
     """
     Get resistance trends over years + Pathogen Distribution.
     Optional filters: antibiotic, pathogen.
     """
-    if GLOBAL_DF.empty:
-        return {"labels": [], "datasets": [], "pathogen_distribution": []}
+    _check_terms(antibiotic, pathogen)
+    return _trends(DASHBOARD_CUBE, antibiotic, pathogen)
+
 
+def _check_terms(antibiotic: Optional[str], pathogen: Optional[str]):
+    """400 for an antibiotic or pathogen filter that names no known term."""
     try:
-        df = GLOBAL_DF.copy()
-        
-        # Apply filters
-        if antibiotic:
-            df = df[df["antibiotic_name"].str.lower() == antibiotic.lower().strip()]
-        if pathogen:
-            df = df[df["pathogen"].str.lower() == pathogen.lower().strip()]
-
-        # Trend Analysis
-        df["year"] = pd.to_numeric(df["year"], errors='coerce')
-        trend_df = df.dropna(subset=["year"])
-        trend_df = trend_df[(trend_df["year"] > 2010) & (trend_df["year"] <= 2024)] # Focus on relevant range
-        
-        if trend_df.empty:
-             return {"labels": [], "datasets": [], "pathogen_distribution": []}
+        for dim, value in (("antibiotic", antibiotic), ("pathogen", pathogen)):
+            if value:
+                canonical_terms(dim, [value])
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
-        trend = trend_df.groupby("year")["phenotype_label"].mean().reset_index().sort_values("year")
+def _trends(cube: PanelSource, antibiotic: Optional[str] = None,
+            pathogen: Optional[str] = None) -> Dict[str, Any]:
+    try:
+        # Trend Analysis (served from the dashboard cube), over the default trend years
+        with span("maps.trends_cube"):
+            trend_years, trend_rates = cube.trend(antibiotic, pathogen, year_min=TREND_YEAR_MIN, year_max=TREND_YEAR_MAX)
+            if not trend_years:
+                return {"labels": [], "datasets": [], "pathogen_distribution": []}
 
-        # Pathogen Distribution (for current view)
-        path_counts = df["pathogen"].value_counts().reset_index()
-        path_counts.columns = ["name", "value"]
+            # Pathogen Distribution (for current view): distinct isolates
+            counts = get_pathogen_counts(antibiotic)
+            if pathogen:
+                term = PATHOGENS.resolve(pathogen)
+                counts = {p: n for p, n in counts.items() if PATHOGENS.resolve(p) == term}
+            path_counts = [{"name": p, "value": n}
+                           for p, n in sorted(counts.items(), key=lambda kv: -kv[1])]
 
         title = "Average Resistance Rate"
         if antibiotic: title = f"{antibiotic} Resistance"
         if pathogen: title += f" ({pathogen})"
 
         return {
-            "labels": trend["year"].astype(int).tolist(),
+            "labels": trend_years,
             "datasets": [{
                 "label": title,
-                "data": trend["phenotype_label"].tolist(),
+                "data": trend_rates,
                 "borderColor": "rgb(255, 99, 132)",
                 "backgroundColor": "rgba(255, 99, 132, 0.5)"
             }],
-            "pathogen_distribution": path_counts.to_dict(orient="records")
+            "pathogen_distribution": path_counts
         }
     except Exception as e:
         logger.error(f"Trend error: {e}")
         return {"labels": [], "datasets": [], "pathogen_distribution": []}
 
 
+@router.get("/analytics/trend_series")
+@negotiated
+@coalesced("maps.trend_series")
+def get_trend_series(
+    split_by: List[str] = Query(["pathogen"], description=f"Series key dimensions: {', '.join(DIMENSIONS)}"),
+    pathogen: Optional[List[str]] = Query(None),
+    antibiotic: Optional[List[str]] = Query(None),
+    state: Optional[List[str]] = Query(None),
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    window: int = Query(1, ge=1, le=20, description="Trailing window in years (rolling smoothing)"),
+    smoothing: str = Query("rolling", description=f"One of: {', '.join(SMOOTHING_MODES)}"),
+    alpha: float = Query(0.5, gt=0, le=1, description="EWMA weight of the current year"),
+    min_isolates: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """
+    Many resistance trend series in one request.
+    One series per combination of `split_by` labels (e.g. per pathogen ×
+    antibiotic), with optional rolling/EWMA smoothing and year-over-year change.
+    """
+    unknown = [d for d in split_by if d not in DIMENSIONS]
+    if unknown or len(set(split_by)) != len(split_by):
+        raise HTTPException(status_code=400, detail=f"Invalid split_by {split_by}; choose from {list(DIMENSIONS)}.")
+    if smoothing not in SMOOTHING_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid smoothing '{smoothing}'.")
+
+    try:
+        with span("maps.trend_series", split_by=",".join(split_by)):
+            result = TREND_ENGINE.series(
+                split_by=split_by,
+                filters={"pathogen": pathogen, "antibiotic": antibiotic, "state": state},
+                year_min=year_min, year_max=year_max,
+                window=window, smoothing=smoothing, alpha=alpha,
+                min_isolates=min_isolates, limit=limit,
+            )
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result.update({"split_by": split_by, "window": window, "smoothing": smoothing})
+    return result
+
+
+@router.post("/query")
+@negotiated
+@coalesced("maps.query")
+def run_aggregate_query(query: AggregateQuery):
+    """
+    General aggregate query over the surveillance data.
+    Returns a compact table: `columns` (group-by dims then measures) and `rows`.
+    """
+    try:
+        with span("maps.query", group_by=",".join(query.group_by)):
+            return QUERY_ENGINE.execute(
+                group_by=query.group_by, filters=query.filters, measures=query.measures,
+                year_min=query.year_min, year_max=query.year_max, min_tested=query.min_tested,
+                sort_by=query.sort_by, descending=query.descending, limit=query.limit,
+            )
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/analytics/heatmap")
-async def get_heatmap():
+@negotiated
+@coalesced("maps.heatmap")
+def get_heatmap():
     """
     Generate Antibiotic vs Pathogen Resistance Matrix.
     Returns: x_labels (Pathogens), y_labels (Antibiotics), data (2D array of resistance rates)
     """
-    if GLOBAL_DF.empty:
-        return {"x_labels": [], "y_labels": [], "data": []}
+    # Top drugs (>100 records) only, to keep the heatmap readable;
+    # -1 represents "No Data" distinct from 0% resistance
+    with span("maps.heatmap"):
+        return DASHBOARD_CUBE.heatmap(min_rows=100)
 
-    try:
-        # Filter for top drugs (>100 isolates) to keep heatmap readable
-        top_drugs = GLOBAL_DF["antibiotic_name"].value_counts()
-        top_drugs = top_drugs[top_drugs > 100].index.tolist()
-        df = GLOBAL_DF[GLOBAL_DF["antibiotic_name"].isin(top_drugs)].copy()
-
-        # Pivot: Index=Antibiotic, Col=Pathogen, Val=Resistance
-        pivot = df.pivot_table(index="antibiotic_name", columns="pathogen", 
-                               values="phenotype_label", aggfunc="mean")
-        
-        # Fill NaN with -1 (to represent "No Data" distinct from 0% resistance)
-        pivot = pivot.fillna(-1)
-        
-        # Sort index and columns
-        pivot = pivot.sort_index() 
-        
+
+@router.get("/analytics/dashboard")
+@negotiated
+@coalesced("maps.dashboard")
+def get_dashboard(antibiotic: Optional[str] = None, pathogen: Optional[str] = None,
+                  top: int = Query(10, ge=1, le=50, description="Regions in the top-regions ranking")):
+    """
+    Everything the analytics dashboard shows for one filter state, in one
+    round trip: the antibiotic list, the heatmap, the trend line with the
+    pathogen distribution (as /analytics/trends), and the states with the
+    highest resistance to `antibiotic` (as /antibiotic_performance).
+    Every panel is a slice of the same dashboard cube, so they always
+    describe the same dataset version.
+    """
+    _check_terms(antibiotic, pathogen)
+    cube = DASHBOARD_CUBE
+    with span("maps.dashboard", antibiotic=antibiotic, pathogen=pathogen):
+        regions = [p for p in _performance_map(cube, antibiotic)["data"] if p["value"] > 0]
+        regions.sort(key=lambda p: -p["value"])
         return {
-            "y_labels": pivot.index.tolist(),         # Antibiotics
-            "x_labels": pivot.columns.tolist(),       # Pathogens
-            "data": pivot.values.tolist()             # 2D array [row][col]
+            "version": cube.version,
+            "antibiotics": _antibiotic_list(cube),
+            "heatmap": cube.heatmap(min_rows=100),
+            "trends": _trends(cube, antibiotic, pathogen),
+            "top_regions": regions[:top],
         }
-    except Exception as e:
-        logger.error(f"Heatmap error: {e}")
-        return {"x_labels": [], "y_labels": [], "data": []}
 
 
 @router.get("/carbapenem_resistance", response_model=MapResponse)
-async def get_carbapenem_resistance():
+@negotiated
+@coalesced("maps.carbapenem_resistance")
+def get_carbapenem_resistance(smoothed: bool = Query(False, description="Empirical-Bayes spatial smoothing")):
     """
     Carbapenem (last-resort) resistance rates by Indian state.
     Carbapenems: meropenem, imipenem, ertapenem.
     """
-    if GLOBAL_DF.empty:
+    if not ISOLATE_STORE.n_isolates:
         return {"map_type": "carbapenem_resistance", "data": [], "status": "unavailable",
                 "message": "No data loaded."}
 
-    df = GLOBAL_DF.copy()
-    df["ab_lower"] = df["antibiotic_name"].str.lower().str.strip()
-    carb_df = df[df["ab_lower"].isin(["meropenem", "imipenem", "ertapenem"])]
+    if smoothed:
+        with span("maps.smoothed_lookup"):
+            rates = SMOOTHER.state_rates(CARBAPENEMS)
+        if rates is None:
+            return {"map_type": "carbapenem_resistance", "data": [], "status": "unavailable",
+                    "message": "No carbapenem data available."}
+        return {
+            "map_type": "carbapenem_resistance",
+            "data": _smoothed_map(rates, "Carbapenem R", ISOLATE_COUNTS.by_state(CARBAPENEMS)),
+            "status": "success",
+            "message": "State-level carbapenem resistance, spatially smoothed.",
+        }
 
-    if carb_df.empty:
+    with span("maps.place_counts"):
+        counts = DASHBOARD_CUBE.place_counts(CARBAPENEMS)
+    if counts is None:
         return {"map_type": "carbapenem_resistance", "data": [], "status": "unavailable",
                 "message": "No carbapenem data available."}
 
-    state_data = _build_state_map(carb_df)
+    state_data = _build_state_map(counts)
+    isolates = ISOLATE_COUNTS.by_state(CARBAPENEMS)
 
     map_data = []
     for state in ALL_STATES:
@@ -488,7 +911,8 @@ async def get_carbapenem_resistance():
                 "value": rate,
                 "metadata": {
                     "detail": f"Carbapenem R: {rate}%{' (est.)' if is_est else ''}",
-                    "isolates": n,
+                    "isolates": isolates[state],
+                    "tests": n,
                     "info": "Last-resort antibiotic resistance",
                     "estimated": is_est,
                 }
@@ -497,7 +921,7 @@ async def get_carbapenem_resistance():
             map_data.append({
                 "region": state,
                 "value": 0,
-                "metadata": {"detail": "No carbapenem data", "isolates": 0}
+                "metadata": {"detail": "No carbapenem data", "isolates": isolates[state]}
             })
 
     return {
@@ -508,12 +932,238 @@ async def get_carbapenem_resistance():
     }
 
 
+@router.get("/genes")
+@negotiated
+@coalesced("maps.genes")
+def get_genes():
+    """Genes with genotype data, for the gene distribution map selector."""
+    return {"genes": GENE_INDEX.genes_summary(), "isolates": GENE_INDEX.n_isolates}
+
+
 @router.get("/gene_distribution", response_model=MapResponse)
-async def get_gene_distribution():
-    """Gene distribution data — currently unavailable."""
+@negotiated
+@coalesced("maps.gene_distribution")
+def get_gene_distribution(
+    gene: Optional[str] = Query(None, description="Gene name, e.g. blaNDM (default: any resistance gene)"),
+    pathogen: Optional[str] = None,
+    year: Optional[int] = None,
+):
+    """
+    Resistance gene prevalence by Indian state.
+    Value is the % of genotyped isolates (deduplicated by genome) carrying
+    the gene; without `gene`, the % carrying any indexed resistance gene.
+    """
+    if GENE_INDEX.n_isolates == 0:
+        return {"map_type": "gene_distribution", "data": [], "status": "unavailable",
+                "message": "No gene profile data loaded."}
+
+    with span("maps.gene_index", gene=gene):
+        counts = GENE_INDEX.distribution(gene, pathogen, year, top=0 if gene else 3)
+    if counts is None:
+        return {"map_type": "gene_distribution", "data": [], "status": "unavailable",
+                "message": f"No gene data for {gene or 'any gene'}"
+                           f"{f' in {pathogen}' if pathogen else ''}{f' ({year})' if year else ''}."}
+
+    label = GENE_INDEX.genes[GENE_INDEX.resolve_gene(gene)] if gene else "Any resistance gene"
+    map_data = []
+    for state in ALL_STATES:
+        info = counts[state]
+        if info["typed"] > 0:
+            prevalence = round(info["carriers"] / info["typed"] * 100, 1)
+            metadata = {
+                "detail": f"{label}: {prevalence}%",
+                "isolates": info["typed"],
+                "carriers": info["carriers"],
+            }
+            if "top_genes" in info:
+                metadata["top_genes"] = info["top_genes"]
+            map_data.append({"region": state, "value": prevalence, "metadata": metadata})
+        else:
+            map_data.append({
+                "region": state,
+                "value": 0,
+                "metadata": {"detail": "Insufficient data", "isolates": 0}
+            })
+
     return {
         "map_type": "gene_distribution",
-        "data": [],
-        "status": "unavailable",
-        "message": "Gene distribution data currently separate from regional surveillance."
+        "data": map_data,
+        "status": "success",
+        "message": f"{label} prevalence by state (isolates deduplicated by genome)."
     }
+
+
+@router.get("/gene_network")
+@negotiated
+@coalesced("maps.gene_network")
+def get_gene_network(
+    pathogen: Optional[str] = None,
+    state: Optional[str] = None,
+    year: Optional[int] = None,
+    gene: Optional[str] = Query(None, description="Only edges touching this gene (e.g. blaNDM)"),
+    min_count: int = Query(5, ge=1, description="Minimum isolates carrying both genes"),
+    sort_by: str = Query("phi", description=f"Edge ranking: {', '.join(NETWORK_METRICS)}"),
+    limit: int = Query(200, ge=1, le=MAX_EDGES),
+):
+    """
+    Gene co-occurrence network for one (pathogen, state, year) stratum.
+    Nodes are genes with their carrier prevalence; edges are gene pairs
+    carried by the same genomes, with the co-occurrence count, lift and phi
+    correlation over isolates typed for both genes.
+    """
+    if sort_by not in NETWORK_METRICS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort_by '{sort_by}'; choose from {list(NETWORK_METRICS)}.")
+    engine = COOCCURRENCE
+    with span("maps.gene_network", pathogen=pathogen, state=state, year=year):
+        result = engine.network(pathogen, state, year, gene=gene, min_count=min_count,
+                                sort_by=sort_by, limit=limit)
+    filters = {"pathogen": pathogen, "state": state, "year": year, "gene": gene}
+    if result is None:
+        return {"filters": filters, "nodes": [], "edges": [], "status": "unavailable",
+                "message": f"No gene data for {gene or 'this stratum'}"
+                           f"{f' in {pathogen}' if pathogen else ''}{f' / {state}' if state else ''}"
+                           f"{f' ({year})' if year else ''}."}
+    return {"filters": filters, "status": "success", **result}
+
+
+@router.get("/locations")
+@negotiated
+@coalesced("maps.locations")
+def get_location_rollup(
+    level: str = Query("state", description=f"One of: {', '.join(LEVELS)}"),
+    parent: Optional[str] = Query(None, description="Drill down under this zone / state / district"),
+    antibiotic: Optional[str] = None,
+    pathogen: Optional[str] = None,
+    min_tested: int = Query(1, ge=1),
+):
+    """
+    Resistance at any level of the location hierarchy.
+    Isolates count at the finest location their source names (a city, a
+    district, or only a state / zone) and roll up to every level above, so
+    e.g. `level=city&parent=Tamil Nadu` lists the Tamil Nadu cities while
+    `level=state` still includes the isolates without a city.
+    """
+    _check_terms(antibiotic, pathogen)
+    try:
+        with span("maps.location_lookup", level=level):
+            result = LOCATION_INDEX.view(level, parent, antibiotic, pathogen, min_tested)
+    except LocationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        return {"map_type": "location_rollup", "level": level, "data": [], "status": "unavailable",
+                "message": f"No data for {antibiotic or pathogen}."}
+
+    label = antibiotic or "Overall"
+    map_data = []
+    for row in result["rows"]:
+        rate = round(row["resistant"] / row["tested"] * 100, 1)
+        map_data.append({
+            "region": row["name"],
+            "value": rate,
+            "metadata": {
+                "detail": f"{label}: {rate}%",
+                "level": row["level"],
+                "path": row["path"],
+                "isolates": row["isolates"],
+                "tested": row["tested"],
+                "resistant": row["resistant"],
+                "direct_tested": row["direct_tested"],
+                "children": row["children"],
+            }
+        })
+    total = result["total"]
+    return {
+        "map_type": "location_rollup",
+        "level": level,
+        "parent": result["parent"],
+        "version": result["version"],
+        "total": total,
+        "data": map_data,
+        "status": "success",
+        "message": f"{label} resistance at {level} level, {' › '.join(result['parent'])}.",
+    }
+
+
+# ── Bulk exports ──
+
+def _export_response(chunks, fmt: str, compress: bool, name: str) -> StreamingResponse:
+    filename = export.export_filename(name, fmt, compress)
+    return StreamingResponse(export.encode_stream(chunks, fmt, compress),
+                             media_type=export.export_media_type(fmt, compress),
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.get("/export/rows")
+def export_rows(
+    fmt: str = Query("csv", alias="format", description=f"One of: {', '.join(export.EXPORT_FORMATS)}"),
+    gzip: bool = False,
+    pathogen: Optional[List[str]] = Query(None),
+    antibiotic: Optional[List[str]] = Query(None),
+    state: Optional[List[str]] = Query(None),
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+):
+    """
+    Stream the harmonized per-test rows (one row per genome × antibiotic test)
+    matching the filters as CSV, NDJSON or Parquet, optionally gzipped.
+    """
+    try:
+        export.check_format(fmt)
+        if DATABASE is not None:
+            chunks = DATABASE.row_chunks(pathogen=pathogen, antibiotic=antibiotic, state=state,
+                                         year_min=year_min, year_max=year_max)
+        else:
+            chunks = export.row_chunks(ISOLATE_STORE, pathogen=pathogen, antibiotic=antibiotic, state=state,
+                                       year_min=year_min, year_max=year_max)
+    except (export.ExportError, QueryError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _export_response(chunks, fmt, gzip, "amr_rows")
+
+
+@router.get("/export/aggregate")
+def export_aggregate(
+    group_by: List[str] = Query(["state", "antibiotic"]),
+    measures: List[str] = Query(["isolates", "tested", "resistant", "resistance_rate"]),
+    fmt: str = Query("csv", alias="format", description=f"One of: {', '.join(export.EXPORT_FORMATS)}"),
+    gzip: bool = False,
+    pathogen: Optional[List[str]] = Query(None),
+    antibiotic: Optional[List[str]] = Query(None),
+    state: Optional[List[str]] = Query(None),
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+    min_tested: int = Query(0, ge=0),
+):
+    """
+    Stream an aggregate table (default: the full state × antibiotic matrix)
+    as CSV, NDJSON or Parquet, optionally gzipped.
+    """
+    filters = {"pathogen": pathogen, "antibiotic": antibiotic, "state": state}
+    try:
+        export.check_format(fmt)
+        chunks = export.aggregate_chunks(QUERY_ENGINE, group_by, measures,
+                                         {d: v for d, v in filters.items() if v},
+                                         year_min=year_min, year_max=year_max, min_tested=min_tested)
+    except (export.ExportError, QueryError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _export_response(chunks, fmt, gzip, f"amr_{'_'.join(group_by) or 'total'}")
+
+
+# ── Dataset version ──
+
+@router.get("/dataset")
+def get_dataset_version():
+    """Current dataset version and the version each route's data last changed at."""
+    return dataset_state()
+
+
+@router.get("/dataset/events")
+async def dataset_events(request: Request):
+    """
+    Server-sent events: a `dataset` event with the current state on connect,
+    then one per refresh listing the sources reloaded and the stale routes.
+    Clients refetch the panels whose route version moved.
+    """
+    return StreamingResponse(sse_stream(DATASET_EVENTS, "dataset", dataset_state, request.is_disconnected),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
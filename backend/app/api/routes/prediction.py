@@ -1,14 +1,31 @@
 from fastapi import APIRouter, HTTPException, UploadFile, File
-from app.api.models import AnalysisRequest, AnalysisResponse
+from app.api.models import (AnalysisRequest, AnalysisResponse, AntibiogramRequest,
+                            AntibiogramResponse, AttributionRequest, NeighborRequest)
 from app.services.gaara import GAARA
+from app.services.vocabulary import PATHOGENS
+from app.core.concurrency import coalesced
+from app.core.profiling import span
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 gaara_service = GAARA()
 
+from app.api.routes import maps
 from app.api.routes.maps import get_pathogen_counts
 
+
+def _inject_counts(breakdown, antibiotic: str):
+    """Add distinct isolate counts (all, and phenotyped for `antibiotic`) to
+    each pathogen entry. Model names (e_coli) resolve to display names (E. coli)
+    through the pathogen vocabulary."""
+    counts = get_pathogen_counts()
+    tested = get_pathogen_counts(antibiotic)
+    for p_data in breakdown:
+        name = PATHOGENS.canonical(p_data.get("name")) or p_data.get("name")
+        p_data["count"] = counts.get(name, 0)
+        p_data["tested_isolates"] = tested.get(name, 0)
+
 @router.post("/analyze", response_model=AnalysisResponse)
 async def analyze_sample(request: AnalysisRequest):
     """
@@ -20,21 +37,63 @@ async def analyze_sample(request: AnalysisRequest):
              raise HTTPException(status_code=500, detail=result["error"])
         
         # Inject Isolate Counts
-        counts = get_pathogen_counts()
-        for p_data in result.get("pathogen_breakdown", []):
-            p_name = p_data.get("name")
-            # Map simplified pathogen names if needed, or rely on exact match
-            # K. pneumoniae, E. coli, S. aureus are the keys in maps.py
-            if p_name in counts:
-                p_data["count"] = counts[p_name]
-            else:
-                p_data["count"] = 0 # Or leave as is if frontend handles 0
-                
+        _inject_counts(result.get("pathogen_breakdown", []), request.antibiotic)
         return result
     except Exception as e:
         logger.error(f"Analysis failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@router.post("/antibiogram", response_model=AntibiogramResponse)
+@coalesced("prediction.antibiogram")
+def predict_antibiogram(request: AntibiogramRequest):
+    """
+    Run GAARA for a whole antibiotic panel in one call
+    (one vectorized predict_proba per pathogen model).
+    """
+    try:
+        result = gaara_service.predict_antibiogram(request.gene_presence, request.antibiotics)
+        for entry in result.get("antibiotics", []):
+            _inject_counts(entry.get("pathogen_breakdown", []), entry["antibiotic"])
+        return result
+    except Exception as e:
+        logger.error(f"Antibiogram failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Antibiogram failed: {str(e)}")
+
+
+@router.post("/attribution")
+@coalesced("prediction.attribution")
+def attribute_risk(request: AttributionRequest):
+    """
+    Per-gene contribution to the predicted risk, measured by re-scoring
+    knocked-out gene profiles (leave-one-out or Shapley values).
+    """
+    try:
+        return gaara_service.attribute_risk(request.antibiotic, request.gene_presence,
+                                            method=request.method, samples=request.samples,
+                                            seed=request.seed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Attribution failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Attribution failed: {str(e)}")
+
+
+@router.post("/neighbors")
+@coalesced("prediction.neighbors")
+def find_neighbors(request: NeighborRequest):
+    """
+    Most similar previously observed isolates for a gene profile,
+    with their location, year and measured phenotype for the antibiotic.
+    """
+    try:
+        index = maps.NEIGHBOR_INDEX
+        with span("prediction.neighbors", k=request.k):
+            return index.query(request.gene_presence, antibiotic=request.antibiotic,
+                               pathogen=request.pathogen, k=request.k, metric=request.metric,
+                               tested_only=request.tested_only)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @router.post("/upload_fasta")
 async def upload_fasta(file: UploadFile = File(...)):
     """
@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import json
+import logging
+import math
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.core.config import ADMISSION_CONTROL, ADMISSION_LIMITS
+from app.core.metrics import ADMISSION_QUEUE_WAIT, ADMISSION_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+# ── Admission control ───────────────────────────────────────────────
+# Every request is assigned a cost class from its path. Each class has its
+# own concurrency limit, a bounded FIFO queue and a queue deadline, so a
+# burst of FASTA uploads or exports can only ever occupy the heavy class's
+# slots and never delays interactive scoring behind it in a queue.
+#
+# Shedding is priority-aware: while a higher-priority class has requests
+# waiting, new requests of lower-priority classes are turned away at once
+# instead of queuing for CPU the interactive traffic needs. Rejections are
+# 503s with a Retry-After estimated from the class's queue and recent
+# service times.
+#
+# Long-lived streams (dataset events), health checks, metrics scrapes and
+# CORS preflights bypass admission.
+
+INTERACTIVE = "interactive"
+STANDARD = "standard"
+HEAVY = "heavy"
+PRIORITIES = (INTERACTIVE, STANDARD, HEAVY)   # highest first
+
+# (path prefix, class), first match wins; unmatched paths bypass admission
+ROUTE_CLASSES: List[Tuple[str, Optional[str]]] = [
+    ("/api/v1/maps/dataset/events", None),
+    ("/api/v1/prediction/upload_fasta", HEAVY),
+    ("/api/v1/prediction/attribution", STANDARD),
+    ("/api/v1/prediction/", INTERACTIVE),
+    ("/api/v1/maps/export/", HEAVY),
+    ("/api/v1/maps/query", HEAVY),
+    ("/api/v1/maps/analytics/heatmap", HEAVY),
+    ("/api/v1/maps/analytics/trend_series", HEAVY),
+    ("/api/v1/maps/", STANDARD),
+    ("/api/v1/admin/", STANDARD),
+]
+
+SERVICE_TIME_ALPHA = 0.2   # EWMA weight of the latest request's service time
+
+
+def cost_class(method: str, path: str) -> Optional[str]:
+    """Cost class of a request, or None if it bypasses admission."""
+    if method == "OPTIONS":
+        return None
+    for prefix, name in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return name
+    return None
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CostClass:
+    """Concurrency slots plus a FIFO of waiters with a queue deadline."""
+
+    def __init__(self, name: str, concurrency: int, queue_limit: int, deadline: float):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = queue_limit
+        self.deadline = deadline
+        self.active = 0
+        self.service_time = 0.0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for w in self._waiters if not w.done())
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has likely drained (at least 1)."""
+        backlog = (self.queued + self.active) * self.service_time / self.concurrency
+        return max(1, math.ceil(backlog))
+
+    async def acquire(self, shed: bool):
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            return
+        if shed:
+            raise Rejected("shed", self.retry_after())
+        if self.queued >= self.queue_limit:
+            raise Rejected("queue_full", self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        timer = loop.call_later(self.deadline, self._expire, waiter)
+        start = time.perf_counter()
+        try:
+            granted = await waiter
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the client left
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+            ADMISSION_QUEUE_WAIT.observe(time.perf_counter() - start, self.name)
+        if not granted:
+            raise Rejected("deadline", self.retry_after())
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(False)
+
+    def release(self):
+        # Hand the slot straight to the oldest live waiter
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def observe(self, elapsed: float):
+        self.service_time += SERVICE_TIME_ALPHA * (elapsed - self.service_time)
+
+
+class AdmissionController:
+    def __init__(self, limits: Dict[str, Tuple[int, int, float]]):
+        self.classes = {name: CostClass(name, *limits[name]) for name in PRIORITIES}
+
+    def should_shed(self, name: str) -> bool:
+        """A class is shed while any higher-priority class has requests waiting."""
+        higher = PRIORITIES[:PRIORITIES.index(name)]
+        return any(self.classes[h].queued for h in higher)
+
+    def queue_depths(self) -> Dict[Tuple[str, ...], float]:
+        return {(name,): c.queued for name, c in self.classes.items()}
+
+    def in_flight(self) -> Dict[Tuple[str, ...], float]:
+        return {(name,): c.active for name, c in self.classes.items()}
+
+
+CONTROLLER = AdmissionController(ADMISSION_LIMITS)
+
+
+async def _reject(send, rejected: Rejected, name: str):
+    body = json.dumps({"detail": f"Server busy ({name} requests); retry later.",
+                       "reason": rejected.reason}).encode()
+    await send({"type": "http.response.start", "status": 503,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode()),
+                            (b"retry-after", str(rejected.retry_after).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting requests per cost class (see module notes).
+
+    A slot is held until the response has been fully sent, so streamed
+    exports count against the heavy class for as long as they stream.
+    """
+
+    def __init__(self, app, controller: AdmissionController = CONTROLLER):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        name = cost_class(scope.get("method", ""), scope.get("path", "")) if scope["type"] == "http" else None
+        if name is None or not ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+
+        cls = self.controller.classes[name]
+        try:
+            await cls.acquire(self.controller.should_shed(name))
+        except Rejected as e:
+            ADMISSION_REJECTIONS.inc(name, e.reason)
+            logger.warning(f"Rejected {scope.get('method')} {scope.get('path')}: {name} {e.reason}")
+            await _reject(send, e, name)
+            return
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            cls.observe(time.perf_counter() - start)
+            cls.release()
@@ -0,0 +1,106 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from pydantic import BaseModel
+
+from app.core.config import CPU_WORKERS
+from app.core.metrics import CPU_POOL_WAIT, SINGLEFLIGHT_REQUESTS
+from app.core.profiling import profile_call
+
+logger = logging.getLogger(__name__)
+
+# ── CPU offload + single-flight ─────────────────────────────────────
+# Aggregations run on a bounded thread pool instead of the event loop, so
+# /health and I/O keep being served while they compute (numpy/pandas
+# kernels release the GIL). Threads rather than processes: the handlers
+# work on the in-process dataset and indices, which would otherwise have to
+# be copied or re-attached per worker.
+#
+# Identical concurrent calls are coalesced: the first caller (leader)
+# starts the computation, later callers with the same key await the same
+# task. Nothing is cached once the task finishes.
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def cpu_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="amr-cpu")
+    return _executor
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    """Run `fn` on the CPU pool, keeping the caller's context (request trace
+    and, for a profiled request, cProfile in the pool thread)."""
+    ctx = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def call():
+        CPU_POOL_WAIT.observe(time.perf_counter() - submitted)
+        return ctx.run(profile_call, fn, *args, **kwargs)
+
+    return await asyncio.get_running_loop().run_in_executor(cpu_executor(), call)
+
+
+class SingleFlight:
+    """Share one in-flight computation between identical concurrent calls."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        # Futures belong to one event loop
+        key = (id(asyncio.get_running_loop()), key)
+        task = self._inflight.get(key)
+        if task is not None:
+            SINGLEFLIGHT_REQUESTS.inc(self.name, "follower")
+        else:
+            SINGLEFLIGHT_REQUESTS.inc(self.name, "leader")
+            task = asyncio.ensure_future(run_cpu(fn, *args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._finished, key))
+        # A cancelled caller must not cancel the computation others share
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Mark retrieved even if every waiter has gone away
+            logger.debug(f"Single-flight {self.name} failed: {task.exception()}")
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, BaseModel):
+        return value.model_dump_json()
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def coalesced(name: str):
+    """Decorator for sync route handlers: run on the CPU pool, coalescing
+    concurrent calls with identical arguments into one computation."""
+    flight = SingleFlight(name)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            key = (_freeze(args), _freeze(kwargs))
+            return await flight.do(key, fn, *args, **kwargs)
+        wrapper.single_flight = flight
+        return wrapper
+    return decorator
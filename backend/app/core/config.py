@@ -5,6 +5,12 @@ from pathlib import Path
 BACKEND_DIR = Path(__file__).resolve().parent.parent.parent
 PROJECT_ROOT = BACKEND_DIR.parent
 MODELS_DIR = PROJECT_ROOT / "models"
+DATA_DIR = Path(os.getenv("AMR_DATA_DIR", str(PROJECT_ROOT / "data")))
+
+# Shared-state mode: when set, workers attach to a memory-mapped snapshot of
+# the harmonized dataset and models built once by the parent process
+# (see app.core.shared_state) instead of parsing CSVs / unpickling models.
+SHARED_STATE_DIR = Path(os.environ["AMR_SHARED_STATE_DIR"]) if os.getenv("AMR_SHARED_STATE_DIR") else None
 
 # Expected environment versions for validation
 EXPECTED_ENV = {
@@ -15,3 +21,36 @@ EXPECTED_ENV = {
     "pandas": "2.2.1",
     "joblib": "1.4.2"
 }
+
+# Live refresh: poll DATA_DIR for changed source CSVs and reload them in place
+WATCH_DATA = os.getenv("AMR_WATCH_DATA", "1").lower() not in ("0", "false", "no")
+WATCH_INTERVAL = float(os.getenv("AMR_WATCH_INTERVAL", "2.0"))
+
+# Storage backend for the per-test rows: "memory" (resident frames and cubes)
+# or "sqlite" (streamed into an on-disk store and queried there, for data
+# larger than RAM; only the per-genome gene table stays resident)
+STORE_BACKEND = os.getenv("AMR_STORE", "memory").lower()
+SQLITE_DIR = Path(os.getenv("AMR_SQLITE_DIR", str(BACKEND_DIR / "store")))
+
+# Threads for CPU-bound request work (map aggregation) kept off the event loop
+CPU_WORKERS = int(os.getenv("AMR_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Admission control: per cost class (concurrency, queue length, max queue wait
+# in seconds). Heavy requests (uploads, exports, heatmaps) get few slots so
+# they cannot starve interactive scoring of CPU.
+ADMISSION_CONTROL = os.getenv("AMR_ADMISSION_CONTROL", "1").lower() not in ("0", "false", "no")
+ADMISSION_LIMITS = {
+    "interactive": (int(os.getenv("AMR_ADMIT_INTERACTIVE", "32")), 64, 1.0),
+    "standard": (int(os.getenv("AMR_ADMIT_STANDARD", str(2 * CPU_WORKERS))), 32, 2.0),
+    "heavy": (int(os.getenv("AMR_ADMIT_HEAVY", str(max(1, CPU_WORKERS // 2)))), 8, 5.0),
+}
+
+# Operations / admin
+# Shared secret for admin-only features (request profiling). Unset → disabled.
+ADMIN_TOKEN = os.getenv("AMR_ADMIN_TOKEN")
+PROFILE_DIR = Path(os.getenv("AMR_PROFILE_DIR", str(BACKEND_DIR / "profiles")))
+
+# Model evaluation: cached dataset frames and versioned evaluation reports
+EVAL_DIR = Path(os.getenv("AMR_EVAL_DIR", str(BACKEND_DIR / "evaluation")))
+# Retraining runs: one directory per run with model artifacts and manifest
+TRAIN_DIR = Path(os.getenv("AMR_TRAIN_DIR", str(BACKEND_DIR / "training")))
@@ -9,6 +9,7 @@ import scipy
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 from app.core.config import MODELS_DIR, EXPECTED_ENV
+from app.core import shared_state
 
 logger = logging.getLogger(__name__)
 
@@ -82,6 +83,23 @@ class ModelLoader:
             
         return True
 
+    def attach_shared_models(self) -> bool:
+        """Attach to models published in the shared-state snapshot, if present."""
+        attached = shared_state.attach_models()
+        if not attached:
+            return False
+        for name, model in attached.items():
+            if self.validate_model(model, name):
+                self.models[name] = model
+                self.model_metadata[name] = {
+                    "path": str(shared_state.SHARED_STATE_DIR),
+                    "size": None,
+                    "type": type(model).__name__,
+                    "shared": True,
+                }
+        logger.info(f"Attached {len(self.models)} models from shared-state snapshot.")
+        return True
+
     def load_models(self):
         """Discover and load models from the models directory."""
         logger.info(f"Scanning for models in {MODELS_DIR}...")
@@ -91,6 +109,9 @@ class ModelLoader:
             return
 
         self.check_environment()
+
+        if shared_state.is_enabled() and self.attach_shared_models():
+            return
         
         for pathogen_dir in MODELS_DIR.iterdir():
             if pathogen_dir.is_dir() and not pathogen_dir.name.startswith('.'):
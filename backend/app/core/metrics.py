@@ -0,0 +1,333 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ── Minimal Prometheus registry ─────────────────────────────────────
+# Implements the subset of the Prometheus text exposition format (v0.0.4)
+# this service needs. Recording a sample is a tuple-keyed dict lookup plus
+# an add under a lock, which keeps hot-path instrumentation in the
+# sub-microsecond range without pulling in prometheus_client.
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def collect(self) -> List[str]:
+        """Sample lines in exposition format."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Gauge whose samples are either set explicitly or computed at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, *labelvalues: str):
+        with self._lock:
+            self._values[labelvalues] = float(value)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def collect(self) -> List[str]:
+        if self._callback is not None:
+            items = list(self._callback().items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class _Timer:
+    __slots__ = ("_hist", "_labels", "_start")
+
+    def __init__(self, hist: "Histogram", labels: Tuple[str, ...]):
+        self._hist = hist
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._hist.observe(time.perf_counter() - self._start, *self._labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels → [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(labelvalues)
+            if row is None:
+                row = [0] * (len(self.buckets) + 1) + [0.0]
+                self._values[labelvalues] = row
+            row[idx] += 1
+            row[-1] += value
+
+    def time(self, *labelvalues: str) -> _Timer:
+        """Context manager observing the elapsed wall time of its block."""
+        return _Timer(self, labelvalues)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = []
+        for labels, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render_metrics() -> str:
+    """Render every registered metric in Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# ── Process gauges ──────────────────────────────────────────────────
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _resident_memory() -> Dict[Tuple[str, ...], float]:
+    try:
+        with open("/proc/self/statm") as fh:
+            return {(): int(fh.read().split()[1]) * _PAGE_SIZE}
+    except OSError:
+        # Non-Linux fallback: peak RSS (KiB on Linux, bytes on macOS)
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {(): peak if sys.platform == "darwin" else peak * 1024}
+
+
+def _loaded_models() -> Dict[Tuple[str, ...], float]:
+    from app.core.loader import ModelLoader
+    return {(): len(ModelLoader.get_instance().models)}
+
+
+def _admission(attr: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    def collect():
+        from app.core.admission import CONTROLLER
+        return getattr(CONTROLLER, attr)()
+    return collect
+
+
+# ── Service metrics ─────────────────────────────────────────────────
+
+HTTP_REQUEST_DURATION = Histogram(
+    "amr_http_request_duration_seconds",
+    "HTTP request latency by method, route template and status code.",
+    ("method", "route", "status"),
+)
+GAARA_STAGE_DURATION = Histogram(
+    "amr_gaara_stage_duration_seconds",
+    "Time spent in each GAARA stage (feature_build, predict_proba, decompose_risk, attribution, aggregation).",
+    ("stage", "pathogen"),
+)
+GAARA_ERRORS = Counter(
+    "amr_gaara_errors_total",
+    "Pathogen models skipped during GAARA scoring because of an error.",
+    ("pathogen",),
+)
+CACHE_REQUESTS = Counter(
+    "amr_cache_requests_total",
+    "Cache lookups by cache name and result (hit/miss).",
+    ("cache", "result"),
+)
+SINGLEFLIGHT_REQUESTS = Counter(
+    "amr_singleflight_requests_total",
+    "Coalesced handler calls by group and role (leader computed, follower shared its result).",
+    ("group", "role"),
+)
+CPU_POOL_WAIT = Histogram(
+    "amr_cpu_pool_wait_seconds",
+    "Time CPU-bound request work waited for a free worker thread.",
+)
+RESPONSE_ENCODE_DURATION = Histogram(
+    "amr_response_encode_seconds",
+    "Time spent encoding negotiated responses, by wire format.",
+    ("format",),
+)
+RESPONSE_BYTES = Histogram(
+    "amr_response_bytes",
+    "Encoded size of negotiated responses, by wire format.",
+    ("format",),
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+DATA_LOAD_DURATION = Gauge(
+    "amr_data_load_duration_seconds",
+    "Wall time of the last surveillance dataset load, by source.",
+    ("source",),
+)
+DATASET_ROWS = Gauge(
+    "amr_dataset_rows",
+    "Per-test rows in the harmonized surveillance dataset by pathogen.",
+    ("pathogen",),
+)
+DATASET_MEMORY = Gauge(
+    "amr_dataset_memory_bytes",
+    "Deep memory usage of the resident surveillance data (GLOBAL_DF, or the genotype table with AMR_STORE=sqlite).",
+)
+DATASET_REFRESHES = Counter(
+    "amr_dataset_refreshes_total",
+    "Source reloads triggered by data directory changes, by source and result (changed/unchanged/failed).",
+    ("source", "result"),
+)
+DATASET_REFRESH_DURATION = Histogram(
+    "amr_dataset_refresh_seconds",
+    "Wall time of live dataset refreshes (reload, rebuild and swap).",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "amr_admission_queue_depth",
+    "Requests waiting for an admission slot, by cost class.",
+    ("class",),
+    callback=_admission("queue_depths"),
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "amr_admission_in_flight",
+    "Requests holding an admission slot, by cost class.",
+    ("class",),
+    callback=_admission("in_flight"),
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    "amr_admission_queue_wait_seconds",
+    "Time queued requests waited for an admission slot, by cost class.",
+    ("class",),
+)
+ADMISSION_REJECTIONS = Counter(
+    "amr_admission_rejections_total",
+    "Requests rejected with 503, by cost class and reason (queue_full/deadline/shed).",
+    ("class", "reason"),
+)
+MODELS_LOADED = Gauge(
+    "amr_models_loaded",
+    "Number of pathogen models currently loaded.",
+    callback=_loaded_models,
+)
+RESIDENT_MEMORY = Gauge(
+    "amr_process_resident_memory_bytes",
+    "Resident set size of this worker process.",
+    callback=_resident_memory,
+)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency by route template.
+
+    Uses the matched route's path template (e.g. ``/api/v1/maps/{map}``)
+    rather than the raw URL so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_holder = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Newer FastAPI keeps the un-prefixed APIRoute in scope["route"]
+            # and the mounted path on the effective route context.
+            route = (scope.get("fastapi") or {}).get("effective_route_context") or scope.get("route")
+            route_path = getattr(route, "path_format", None) or "unmatched"
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start,
+                                          scope["method"], route_path, str(status_holder[0]))
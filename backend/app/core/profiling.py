@@ -0,0 +1,285 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import pstats
+import secrets
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from app.core.config import ADMIN_TOKEN, PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+# ── Request tracing ─────────────────────────────────────────────────
+# Spans are only recorded while a profiled request is in flight; otherwise
+# `span()` and `@traced` cost a single ContextVar lookup.
+
+_CURRENT_TRACE: ContextVar[Optional["Trace"]] = ContextVar("amr_trace", default=None)
+
+
+class Trace:
+    """Ordered list of timed spans collected during one request."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.depth = 0
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, start: float, end: float, labels: Dict[str, Any], depth: int):
+        self.spans.append({
+            "name": name,
+            "labels": labels,
+            "start_ms": round((start - self.origin) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+            "depth": depth,
+        })
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Total time and call count per span name."""
+        out: Dict[str, Dict[str, float]] = {}
+        for s in self.spans:
+            agg = out.setdefault(s["name"], {"count": 0, "total_ms": 0.0})
+            agg["count"] += 1
+            agg["total_ms"] = round(agg["total_ms"] + s["duration_ms"], 3)
+        return out
+
+
+class _Span:
+    __slots__ = ("_trace", "_name", "_labels", "_start", "_depth")
+
+    def __init__(self, trace: Trace, name: str, labels: Dict[str, Any]):
+        self._trace = trace
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._depth = self._trace.depth
+        self._trace.depth += 1
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        self._trace.depth -= 1
+        self._trace.add(self._name, self._start, end, self._labels, self._depth)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **labels):
+    """Time a block as a named span of the current request trace (if any)."""
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _Span(trace, name, labels)
+
+
+def record_span(name: str, start: float, end: float, **labels):
+    """Record an already-measured interval (perf_counter timestamps)."""
+    trace = _CURRENT_TRACE.get()
+    if trace is not None:
+        trace.add(name, start, end, labels, trace.depth)
+
+
+def traced(name: str):
+    """Decorator recording each call of the wrapped function as a span."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _CURRENT_TRACE.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            with _Span(trace, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ── Admin-gated profiling middleware ────────────────────────────────
+
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+
+# cProfile hooks are process/thread global; only one request can hold the
+# deterministic profiler at a time. Concurrent profiled requests still get
+# their span breakdown.
+_PROFILER_LOCK = threading.Lock()
+
+# A profiler only hooks the thread it is enabled on. Work the profiled
+# request hands to other threads (run_cpu) is profiled separately into this
+# list, and the stats are merged into the request's report.
+_THREAD_PROFILES: ContextVar[Optional[List[cProfile.Profile]]] = ContextVar("amr_thread_profiles", default=None)
+
+
+def profile_call(fn, *args, **kwargs):
+    """Call `fn`, under its own profiler if the current request holds cProfile."""
+    profiles = _THREAD_PROFILES.get()
+    if profiles is None:
+        return fn(*args, **kwargs)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+def _profile_requested(scope) -> bool:
+    headers = dict(scope.get("headers") or [])
+    if headers.get(PROFILE_HEADER, b"").lower() in (b"1", b"true", b"yes"):
+        return True
+    qs = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return qs.get(PROFILE_QUERY_PARAM, ["0"])[-1].lower() in ("1", "true", "yes")
+
+
+def _save_report(profile_id: str, scope, trace: Trace, stats_text: Optional[str], total_s: float) -> Dict[str, Any]:
+    report = {
+        "id": profile_id,
+        "method": scope.get("method"),
+        "path": scope.get("path"),
+        "query": scope.get("query_string", b"").decode("latin-1"),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "total_ms": round(total_s * 1000, 3),
+        "summary": trace.summary(),
+        "spans": trace.spans,
+        "profile": stats_text,
+    }
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(PROFILE_DIR / f"{profile_id}.json", "w") as fh:
+            json.dump(report, fh, indent=2)
+    except OSError as e:
+        logger.warning(f"Could not write profile {profile_id}: {e}")
+    return report
+
+
+def load_report(profile_id: str) -> Optional[Dict[str, Any]]:
+    path = PROFILE_DIR / f"{profile_id}.json"
+    if not path.is_file() or path.parent != PROFILE_DIR:
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def list_reports(limit: int = 50) -> List[Dict[str, Any]]:
+    if not PROFILE_DIR.exists():
+        return []
+    files = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True)
+    out = []
+    for path in files[:limit]:
+        try:
+            with open(path) as fh:
+                rep = json.load(fh)
+            out.append({k: rep.get(k) for k in ("id", "method", "path", "query", "created", "total_ms")})
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def _server_timing(summary: Dict[str, Dict[str, float]], total_s: float) -> bytes:
+    parts = [f'{name.replace(" ", "_")};dur={v["total_ms"]};desc="x{int(v["count"])}"'
+             for name, v in summary.items()]
+    parts.append(f"total;dur={round(total_s * 1000, 3)}")
+    return ", ".join(parts).encode("latin-1", "replace")
+
+
+class ProfilingMiddleware:
+    """Opt-in per-request profiling for admins.
+
+    Triggered by ``?profile=1`` or an ``X-Profile: 1`` header together with
+    a valid ``X-Admin-Token``. The request runs under cProfile with span
+    tracing enabled; the report is saved to ``PROFILE_DIR`` and referenced
+    from the ``X-Profile-Id`` response header, with a per-stage breakdown in
+    ``Server-Timing``. Handler work offloaded to the CPU pool is profiled
+    in its thread and merged in. Note cProfile sees every coroutine
+    scheduled on the event loop while the request is in flight, not only
+    this one.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        token = dict(scope.get("headers") or []).get(ADMIN_TOKEN_HEADER)
+        if not is_admin_token(token.decode("latin-1") if token else None):
+            body = json.dumps({"detail": "Profiling is restricted to administrators."}).encode()
+            await send({"type": "http.response.start", "status": 403,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode())]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        profile_id = uuid.uuid4().hex[:12]
+        trace = Trace()
+        trace_token = _CURRENT_TRACE.set(trace)
+        profiler = cProfile.Profile() if _PROFILER_LOCK.acquire(blocking=False) else None
+        thread_profiles: List[cProfile.Profile] = []
+        profiles_token = _THREAD_PROFILES.set(thread_profiles if profiler is not None else None)
+        state = {"finished": False}
+        start = time.perf_counter()
+
+        def finish():
+            if state["finished"]:
+                return
+            state["finished"] = True
+            stats_text = None
+            if profiler is not None:
+                profiler.disable()
+                _PROFILER_LOCK.release()
+                buf = io.StringIO()
+                stats = pstats.Stats(profiler, stream=buf)
+                for thread_profiler in thread_profiles:
+                    stats.add(thread_profiler)
+                stats.sort_stats("cumulative").print_stats(60)
+                stats_text = buf.getvalue()
+            total = time.perf_counter() - start
+            _save_report(profile_id, scope, trace, stats_text, total)
+            state["timing"] = _server_timing(trace.summary(), total)
+            logger.info(f"Saved profile {profile_id} for {scope.get('method')} {scope.get('path')} "
+                        f"({total * 1000:.1f} ms)")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                finish()
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-id", profile_id.encode()))
+                headers.append((b"server-timing", state["timing"]))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        if profiler is not None:
+            profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finish()
+            _THREAD_PROFILES.reset(profiles_token)
+            _CURRENT_TRACE.reset(trace_token)
@@ -0,0 +1,236 @@
+"""
+Shared-state mode for multi-worker deployments.
+
+The parent process loads the surveillance data and models once and writes
+a snapshot directory:
+
+    manifest.json            frame/column layout, categories, attrs, model index
+    frames/<frame>/<col>.npy one array per column of each published frame
+                             (categorical codes or numeric values)
+    models/<pathogen>.joblib uncompressed joblib dumps
+    engines/<name>.joblib    uncompressed joblib dumps of the aggregate
+                             engines built over the data (query, trend,
+                             dashboard, ... indexes)
+
+Workers started with AMR_SHARED_STATE_DIR pointing at the snapshot map the
+column arrays read-only (np.load(mmap_mode="r")) and load models and
+engines with joblib's mmap_mode, so the page cache holds one copy for all
+workers and a worker builds no aggregate of its own. Engines attached this
+way are read-only (live refresh is off in shared-state mode).
+Placing the snapshot on tmpfs (/dev/shm, the default) keeps it in RAM.
+
+Usage:
+    python -m app.core.shared_state --workers 4 --port 8000
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.core.config import BACKEND_DIR, SHARED_STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 3
+DEFAULT_FRAME = "surveillance"
+MANIFEST_NAME = "manifest.json"
+
+
+def default_snapshot_dir() -> Path:
+    base = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+    return base / "amr-shared-state"
+
+
+def is_enabled() -> bool:
+    return SHARED_STATE_DIR is not None
+
+
+def _read_manifest(snapshot_dir: Path) -> Optional[Dict[str, Any]]:
+    manifest_path = snapshot_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as fh:
+        manifest = json.load(fh)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        logger.warning(f"Shared-state snapshot {snapshot_dir} has unsupported format "
+                       f"{manifest.get('format')}; ignoring it.")
+        return None
+    return manifest
+
+
+def build_snapshot(frames: Dict[str, pd.DataFrame], models: Dict[str, Any], snapshot_dir: Path,
+                   engines: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Write the named data frames, models and engines to `snapshot_dir`.
+
+    The snapshot is assembled in a sibling temp directory and renamed into
+    place, so workers never observe a half-written manifest.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=snapshot_dir.name + ".", dir=snapshot_dir.parent))
+    (staging / "models").mkdir()
+    (staging / "engines").mkdir()
+
+    frame_layouts = {}
+    for frame_name, df in frames.items():
+        (staging / "frames" / frame_name).mkdir(parents=True)
+        frame_layouts[frame_name] = {"rows": int(len(df)), "columns": _write_columns(df, staging, frame_name),
+                                     "attrs": df.attrs}
+
+    model_files = {}
+    for name, model in models.items():
+        file_name = f"models/{name}.joblib"
+        # Uncompressed so numpy buffers inside the estimator can be mmapped
+        joblib.dump(model, staging / file_name, compress=0)
+        model_files[name] = file_name
+
+    engine_files = {}
+    for name, engine in (engines or {}).items():
+        file_name = f"engines/{name}.joblib"
+        joblib.dump(engine, staging / file_name, compress=0)
+        engine_files[name] = file_name
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "frames": frame_layouts,
+        "models": model_files,
+        "engines": engine_files,
+    }
+    with open(staging / MANIFEST_NAME, "w") as fh:
+        json.dump(manifest, fh, indent=2)
+
+    if snapshot_dir.exists():
+        # Attached workers keep their mappings; unlinked files live on until unmapped.
+        shutil.rmtree(snapshot_dir)
+    os.rename(staging, snapshot_dir)
+    frame_summary = ", ".join(f"{k} ({v['rows']} rows)" for k, v in frame_layouts.items())
+    logger.info(f"Shared-state snapshot written to {snapshot_dir}: "
+                f"{frame_summary}, {len(model_files)} models, {len(engine_files)} engines")
+    return manifest
+
+
+def _write_columns(df: pd.DataFrame, staging: Path, frame_name: str) -> List[Dict[str, Any]]:
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        file_name = f"frames/{frame_name}/{col}.npy"
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(staging / file_name, series.cat.codes.to_numpy())
+            columns.append({"name": col, "kind": "category", "file": file_name,
+                            "categories": [str(c) for c in series.cat.categories]})
+        elif pd.api.types.is_numeric_dtype(series.dtype):
+            np.save(staging / file_name, series.to_numpy())
+            columns.append({"name": col, "kind": "numeric", "file": file_name})
+        else:
+            # Unexpected free-text column: encode on the fly
+            cat = series.astype("category")
+            np.save(staging / file_name, cat.cat.codes.to_numpy())
+            columns.append({"name": col, "kind": "category", "file": file_name,
+                            "categories": [str(c) for c in cat.cat.categories]})
+    return columns
+
+
+def attach_dataframe(frame_name: str = DEFAULT_FRAME, snapshot_dir: Optional[Path] = None) -> Optional[pd.DataFrame]:
+    """Rebuild a published frame as zero-copy views over the snapshot's column files."""
+    snapshot_dir = Path(snapshot_dir or SHARED_STATE_DIR)
+    manifest = _read_manifest(snapshot_dir)
+    if manifest is None or frame_name not in manifest["frames"]:
+        logger.warning(f"No shared-state frame '{frame_name}' at {snapshot_dir}; falling back to CSV load.")
+        return None
+
+    data = {}
+    for col in manifest["frames"][frame_name]["columns"]:
+        arr = np.load(snapshot_dir / col["file"], mmap_mode="r")
+        if col["kind"] == "category":
+            cat = pd.Categorical.from_codes(arr, categories=col["categories"], validate=False)
+            data[col["name"]] = pd.Series(cat, copy=False)
+        else:
+            data[col["name"]] = arr
+    df = pd.DataFrame(data, copy=False)
+    df.attrs = manifest["frames"][frame_name].get("attrs", {})
+    logger.info(f"Attached shared-state frame '{frame_name}' from {snapshot_dir} ({len(df)} rows)")
+    return df
+
+
+def attach_models(snapshot_dir: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    """Load snapshot models with memory-mapped numpy buffers."""
+    snapshot_dir = Path(snapshot_dir or SHARED_STATE_DIR)
+    manifest = _read_manifest(snapshot_dir)
+    if manifest is None:
+        return None
+    models = {}
+    for name, file_name in manifest.get("models", {}).items():
+        try:
+            models[name] = joblib.load(snapshot_dir / file_name, mmap_mode="r")
+        except Exception as e:
+            logger.error(f"Failed to attach shared model {name}: {e}")
+    return models
+
+
+def attach_engines(snapshot_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """Load snapshot engines with memory-mapped numpy buffers (read-only)."""
+    snapshot_dir = Path(snapshot_dir or SHARED_STATE_DIR)
+    manifest = _read_manifest(snapshot_dir)
+    if manifest is None:
+        return {}
+    engines = {}
+    for name, file_name in manifest.get("engines", {}).items():
+        try:
+            engines[name] = joblib.load(snapshot_dir / file_name, mmap_mode="r")
+        except Exception as e:
+            logger.error(f"Failed to attach shared engine {name}: {e}")
+    if engines:
+        logger.info(f"Attached shared-state engines from {snapshot_dir}: {', '.join(engines)}")
+    return engines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a shared-state snapshot and serve it with N uvicorn workers.")
+    parser.add_argument("--dir", type=Path, default=SHARED_STATE_DIR or default_snapshot_dir(),
+                        help="Snapshot directory (default: /dev/shm/amr-shared-state)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--build-only", action="store_true", help="Write the snapshot and exit")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # Imported here: importing the maps router performs the one-time CSV load.
+    from app.api.routes import maps
+    from app.core.loader import ModelLoader
+
+    loader = ModelLoader.get_instance()
+    loader.load_models()
+    build_snapshot({DEFAULT_FRAME: maps.GLOBAL_DF, **maps.ISOLATE_STORE.to_frames()},
+                   loader.models, args.dir, maps.snapshot_engines())
+
+    if args.build_only:
+        return
+
+    # The supervisor only forks/monitors workers; drop its private copies.
+    maps.GLOBAL_DF = pd.DataFrame()
+    maps.ISOLATE_STORE = None
+    for attr in maps.SHARED_ENGINES.values():
+        setattr(maps, attr, None)
+    loader.models.clear()
+    gc.collect()
+
+    os.environ["AMR_SHARED_STATE_DIR"] = str(args.dir)
+    import uvicorn
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers,
+                app_dir=str(BACKEND_DIR))
+
+
+if __name__ == "__main__":
+    main()
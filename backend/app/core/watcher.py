@@ -0,0 +1,142 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ── Live dataset refresh ────────────────────────────────────────────
+# DataWatcher polls the data directory (stat only: no inotify dependency,
+# works on network and container mounts) and hands changed or added CSV
+# paths to a callback once their size and mtime have held still for one
+# full interval, so files still being copied in are not read half-written.
+#
+# Broadcaster fans the resulting dataset-version events out to server-sent
+# event streams. Events carry the cumulative version of every route, so a
+# subscriber only ever needs the latest one: a slow client's queue keeps
+# the newest event and drops older ones.
+
+SUBSCRIBER_BUFFER = 4
+SSE_RETRY_MS = 5000
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+class DataWatcher:
+    """Background thread calling `on_change(paths)` for new or modified files."""
+
+    def __init__(self, directory: Path, on_change: Callable[[List[str]], Any],
+                 interval: float = 2.0, suffix: str = ".csv"):
+        self.directory = Path(directory)
+        self.on_change = on_change
+        self.interval = interval
+        self.suffix = suffix
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(self.suffix):
+                        st = entry.stat()
+                        files[os.path.abspath(entry.path)] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+        return files
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="amr-data-watcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {self.directory} for {self.suffix} changes every {self.interval:g}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def _run(self):
+        seen = self._scan()
+        pending: Dict[str, Tuple[int, int]] = {}
+        while not self._stop.wait(self.interval):
+            current = self._scan()
+            for path in set(seen) - set(current):
+                logger.info(f"Data file removed: {path} (loaded data kept)")
+                del seen[path]
+            changed = {p: st for p, st in current.items() if seen.get(p) != st}
+            ready = sorted(p for p, st in changed.items() if pending.get(p) == st)
+            pending = {p: st for p, st in changed.items() if p not in ready}
+            if not ready:
+                continue
+            seen.update({p: current[p] for p in ready})
+            try:
+                self.on_change(ready)
+            except Exception as e:
+                logger.exception(f"Data refresh failed for {ready}: {e}")
+
+
+class Broadcaster:
+    """Fan events out to asyncio subscribers; `publish` may be called from any thread."""
+
+    def __init__(self):
+        self._subscribers: Dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_BUFFER)
+        with self._lock:
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, event: Dict[str, Any]):
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:  # loop closed: the client is gone
+                self.unsubscribe(queue)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+
+def _offer(queue: asyncio.Queue, event: Dict[str, Any]):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+def sse_message(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def sse_stream(broadcaster: Broadcaster, event: str, current: Callable[[], Dict[str, Any]],
+                     is_disconnected: Callable[[], Awaitable[bool]]):
+    """Server-sent event stream: the current state first, then every published
+    event, with comment keepalives so proxies keep the connection open."""
+    queue = broadcaster.subscribe()
+    try:
+        state = current()
+        yield f"retry: {SSE_RETRY_MS}\n" + sse_message(event, state, state.get("version"))
+        while not await is_disconnected():
+            try:
+                data = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield sse_message(event, data, data.get("version"))
+    finally:
+        broadcaster.unsubscribe(queue)
@@ -0,0 +1,245 @@
+import functools
+import inspect
+import json
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+try:  # fast JSON encoder for every negotiated response
+    import orjson
+except ImportError:
+    orjson = None
+try:  # optional binary formats
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+from app.core.metrics import RESPONSE_BYTES, RESPONSE_ENCODE_DURATION
+
+logger = logging.getLogger(__name__)
+
+# ── Response wire formats ───────────────────────────────────────────
+# Handlers build plain dicts; `negotiated` encodes them straight into a
+# Response for the format the client's Accept header asks for. Returning
+# a Response skips FastAPI's response_model re-validation and jsonable
+# encoding of data the server built itself (response_model still drives
+# the OpenAPI schema).
+#
+#   application/json                    – same layout as before, via orjson
+#   application/vnd.amr.columnar+json   – lists of records become one
+#                                         array per field
+#   application/msgpack                 – the columnar layout as MessagePack
+#   application/vnd.apache.arrow.stream – the response's main table as an
+#                                         Arrow IPC stream; other fields go
+#                                         in the schema metadata ("amr.meta")
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.amr.columnar+json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+MEDIA_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+FORMAT_NAMES = {JSON: "json", COLUMNAR_JSON: "columnar", MSGPACK: "msgpack", ARROW: "arrow"}
+
+
+def available_formats() -> List[str]:
+    formats = [JSON, COLUMNAR_JSON]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    if pa is not None:
+        formats.append(ARROW)
+    return formats
+
+
+def choose_format(accept: Optional[str]) -> Optional[str]:
+    """Best available media type for an Accept header; None if none is acceptable."""
+    if not accept:
+        return JSON
+    offered = available_formats()
+    ranked: List[Tuple[float, int, str]] = []
+    for pos, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media = MEDIA_ALIASES.get(fields[0].lower(), fields[0].lower())
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            ranked.append((-q, pos, media))
+    for _, _, media in sorted(ranked):
+        if media in offered:
+            return media
+        if media in ("*/*", "application/*"):
+            return JSON
+    return None
+
+
+# ── Layout ──
+
+def _flatten(record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    out = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and value and all(isinstance(k, str) for k in value):
+            out.update(_flatten(value, f"{name}."))
+        else:
+            out[name] = value
+    return out
+
+
+def _is_records(value: Any) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(v, dict) for v in value)
+
+
+def records_to_columns(records: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """One array per field (nested dicts flattened to dotted names; gaps → None)."""
+    rows = [_flatten(r) for r in records]
+    names = list(dict.fromkeys(k for r in rows for k in r))
+    return {name: [r.get(name) for r in rows] for name in names}
+
+
+def to_columnar(payload: Any) -> Any:
+    """Columnar layout: lists of records become dicts of equal-length arrays,
+    and a query table's `rows` become arrays keyed by its `columns`."""
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump()
+    if _is_records(payload):
+        return records_to_columns(payload)
+    if isinstance(payload, dict):
+        columns = payload.get("columns")
+        if isinstance(columns, list) and isinstance(payload.get("rows"), list):
+            rows = payload["rows"]
+            out = {k: to_columnar(v) for k, v in payload.items() if k != "rows"}
+            out["rows"] = {c: [r[i] for r in rows] for i, c in enumerate(columns)}
+            return out
+        return {k: to_columnar(v) for k, v in payload.items()}
+    return payload
+
+
+def main_table(payload: Dict[str, Any]) -> Tuple[Dict[str, List[Any]], Dict[str, Any]]:
+    """(columns, remaining fields) for the Arrow format: a query table, the
+    largest list of records, or a labelled matrix in long form."""
+    if isinstance(payload.get("columns"), list) and isinstance(payload.get("rows"), list):
+        rest = {k: v for k, v in payload.items() if k != "rows"}
+        return {c: [r[i] for r in payload["rows"]] for i, c in enumerate(payload["columns"])}, rest
+    candidates = [k for k, v in payload.items() if _is_records(v)]
+    if candidates:
+        key = max(candidates, key=lambda k: len(payload[k]))
+        return records_to_columns(payload[key]), {k: v for k, v in payload.items() if k != key}
+    if {"x_labels", "y_labels", "data"} <= payload.keys():
+        xs, ys = payload["x_labels"], payload["y_labels"]
+        matrix = payload["data"]
+        table = {
+            "y": [y for y in ys for _ in xs],
+            "x": [x for _ in ys for x in xs],
+            "value": [v for row in matrix for v in row],
+        }
+        return table, {k: v for k, v in payload.items() if k not in ("x_labels", "y_labels", "data")}
+    raise HTTPException(status_code=406, detail="This response has no table to send as Arrow.")
+
+
+# ── Encoders ──
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+def _clean_floats(obj: Any) -> Any:
+    """NaN/inf → None for the stdlib fallback (orjson does this itself)."""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _clean_floats(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_clean_floats(v) for v in obj]
+    return obj
+
+
+def dumps_json(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_clean_floats(payload), default=_default, separators=(",", ":")).encode()
+
+
+def _arrow_array(values: List[Any]):
+    try:
+        array = pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed types in one field: send its text form
+        array = pa.array([None if v is None else str(v) for v in values])
+    # Label columns repeat a few values: send each once plus integer codes
+    return array.dictionary_encode() if pa.types.is_string(array.type) else array
+
+
+def _arrow_stream(payload: Dict[str, Any]) -> bytes:
+    columns, rest = main_table(payload)
+    table = pa.table({name: _arrow_array(values) for name, values in columns.items()})
+    table = table.replace_schema_metadata({"amr.meta": dumps_json(rest)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(payload: Any, media_type: str) -> bytes:
+    if media_type == JSON:
+        return dumps_json(payload)
+    if media_type == COLUMNAR_JSON:
+        return dumps_json(to_columnar(payload))
+    if media_type == MSGPACK:
+        return msgpack.packb(to_columnar(payload), default=_default, use_bin_type=True)
+    if isinstance(payload, BaseModel):
+        payload = payload.model_dump()
+    return _arrow_stream(payload)
+
+
+# ── Route decorator ──
+
+def negotiated(fn: Callable) -> Callable:
+    """Encode an async route handler's dict result per the Accept header.
+
+    Wraps the outside of `coalesced`, so identical concurrent requests still
+    share one computation whatever format each client asked for.
+    """
+    sig = inspect.signature(fn)
+    params = list(sig.parameters.values())
+    request_param = inspect.Parameter("_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, _request: Request, **kwargs):
+        media_type = choose_format(_request.headers.get("accept"))
+        if media_type is None:
+            raise HTTPException(status_code=406, detail=f"Acceptable formats: {', '.join(available_formats())}")
+        result = fn(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        if isinstance(result, Response):
+            return result
+        start = time.perf_counter()
+        body = encode(result, media_type)
+        name = FORMAT_NAMES[media_type]
+        RESPONSE_ENCODE_DURATION.observe(time.perf_counter() - start, name)
+        RESPONSE_BYTES.observe(len(body), name)
+        return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+    wrapper.__signature__ = sig.replace(parameters=params + [request_param])
+    return wrapper
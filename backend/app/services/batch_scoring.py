@@ -0,0 +1,553 @@
+"""
+Offline batch scoring of isolate tables with the GAARA pathogen models.
+
+Reads a table in the E_Coli_Final_ML_Dataset_v1.csv layout (or any CSV /
+Parquet file with gene_* columns) in chunks and scores every row the way
+POST /prediction/analyze scores one gene profile: each loaded model
+predicts the row's resistance to its antibiotic, the predictions are
+coverage-weighted into one risk and the risk is decomposed into gene
+drivers. Within a chunk every model is called once (one predict_proba
+over all rows) and the weighting and decomposition are array arithmetic,
+so a row costs microseconds instead of a request. Chunks are scored in a
+process pool whose workers load the models once.
+
+Output rows carry the input row number, the id columns, the antibiotic,
+risk, risk_category and gene_drivers (JSON {gene: {score, direction}},
+strongest first). Each chunk is written to its own part file in
+<out>.parts/ and recorded in a progress manifest there; a run that is
+interrupted and started again with the same arguments skips the chunks
+already done. The parts are merged into <out> (Parquet or CSV, by
+extension) at the end.
+
+Usage:
+    python -m app.services.batch_scoring ../data/E_Coli_Final_ML_Dataset_v1.csv --out scores.parquet --workers 4
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:  # optional: only needed for Parquet input/output
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from app.core.config import MODELS_DIR
+from app.services.gaara import GAARA, GENE_ALIASES
+from app.services.vocabulary import GENES
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_FORMAT = 1
+CHUNK_ROWS = 50000
+DEFAULT_DRIVERS = 5
+GENE_PREFIX = "gene_"
+ANY_GENE_FEATURE = "gene_any_present"
+# Input columns recognised without being named (first match wins)
+ANTIBIOTIC_COLUMNS = ("antibiotic_name", "antibiotic", "Antibiotic")
+ID_COLUMNS = ("genome_id", "Genome ID", "isolate_id")
+OUTPUT_FORMATS = {".parquet": "parquet", ".pq": "parquet", ".csv": "csv"}
+
+
+class BatchInputError(ValueError):
+    """Raised when the input table or the run settings cannot be scored."""
+
+
+# ── Scoring ──
+
+class BatchScorer:
+    """GAARA scoring of many (antibiotic, gene profile) rows at once.
+
+    Produces, row for row, the overall risk, category and gene drivers of
+    GAARA.predict_risk for the antibiotic and the row's gene columns.
+    """
+
+    def __init__(self, gaara: Optional[GAARA] = None):
+        self.gaara = gaara or GAARA()
+        if not self.gaara.loader.models:
+            self.gaara.loader.load_models()
+        self.models = list(self.gaara.loader.models.items())
+
+    def score(self, antibiotics: Sequence[str], genes: Dict[str, np.ndarray]) -> Dict[str, Any]:
+        """Score rows given their antibiotics and 0/1 gene columns (by gene name).
+
+        Returns the row-wise aggregation of GAARA.aggregate_rows: risk and
+        risk_category arrays and per-gene driver scores and directions.
+        """
+        n = len(antibiotics)
+        uniques, codes = np.unique(np.asarray(antibiotics, dtype=object).astype(str), return_inverse=True)
+        genes = {name: np.asarray(values, dtype=np.int64) for name, values in genes.items()}
+
+        # Alias genes switch their targets on, unless the table types the target itself
+        expanded = dict(genes)
+        for alias, targets in GENE_ALIASES.items():
+            if alias in genes:
+                for t in targets:
+                    expanded.setdefault(t.replace("gene_", ""), genes[alias])
+        any_present = np.zeros(n, dtype=np.int64)
+        for values in genes.values():
+            any_present |= values != 0
+
+        total_weight = np.zeros(n)
+        results = []
+        for pathogen, model in self.models:
+            try:
+                result = self._score_model(pathogen, model, uniques, codes, genes, expanded, any_present)
+            except Exception as e:
+                logger.error(f"Error processing {pathogen}: {e}")
+                continue
+            results.append(result)
+            total_weight += result["weight"]
+        return self.gaara.aggregate_rows(results, total_weight)
+
+    def _score_model(self, pathogen: str, model, uniques: np.ndarray, codes: np.ndarray,
+                     genes: Dict[str, np.ndarray], expanded: Dict[str, np.ndarray],
+                     any_present: np.ndarray) -> Dict[str, Any]:
+        """One model's risk, coverage weight and gene drivers for every row."""
+        gaara = self.gaara
+        n = len(codes)
+        features = gaara.get_model_features(model, pathogen)
+        feature_set = set(features)
+
+        # --- A. Feature matrix: antibiotic inputs per distinct antibiotic, then genes ---
+        columns: Dict[str, Any] = {feat: np.zeros(n, dtype=np.int64) for feat in features}
+        inputs = [gaara.build_antibiotic_inputs(features, ab) for ab in uniques]
+        for feat in {f for raw, _ in inputs for f in raw}:
+            columns[feat] = np.array([raw.get(feat, 0) for raw, _ in inputs], dtype=object)[codes]
+        one_hot = {
+            feat: np.array([feat in ohe for _, ohe in inputs], dtype=np.int64)[codes]
+            for feat in {f for _, ohe in inputs for f in ohe}
+        }
+        columns.update(one_hot)
+        index = gaara.gene_feature_index(features)
+        gene_values: Dict[str, np.ndarray] = {}
+        for name, values in expanded.items():
+            for feat in index.get(GENES.resolve(name), ()):
+                gene_values[feat] = values
+        if ANY_GENE_FEATURE in feature_set:
+            gene_values[ANY_GENE_FEATURE] = any_present
+        columns.update(gene_values)
+
+        # --- B. Prediction ---
+        risk = np.zeros(n)
+        if features and hasattr(model, "predict_proba"):
+            try:
+                risk = np.asarray(model.predict_proba(pd.DataFrame(columns)[features])[:, 1], dtype=np.float64)
+            except Exception as e:
+                logger.warning(f"Prediction error for {pathogen}: {e}")
+
+        # --- C. Coverage weight ---
+        weight = np.ones(n)
+        model_genes = {GENES.add(f) for f in features if f.startswith("gene_")}
+        if model_genes:
+            n_present = np.zeros(n, dtype=np.int64)
+            covered = np.zeros(n, dtype=np.int64)
+            for name, values in genes.items():
+                n_present += values == 1
+                if GENES.resolve(name) in model_genes:
+                    covered += values == 1
+            has_genes = n_present > 0
+            weight = np.where(has_genes, 1.0 + 2.0 * (covered / np.where(has_genes, n_present, 1)), 1.0)
+
+        # --- D. Decomposition ---
+        coef_map = gaara.load_feature_importance(pathogen)
+        if not coef_map:
+            coef_map = gaara.get_coefficients_map(model, features or list(getattr(model, "feature_names_in_", [])))
+        zeros = np.zeros(n, dtype=np.int64)
+
+        def lookup(feat: str) -> Optional[np.ndarray]:
+            # The value decompose_risk reads from the row's input map (None: not a key)
+            if feat in gene_values:
+                return gene_values[feat]
+            if feat in one_hot:
+                return one_hot[feat]
+            return zeros if feat in feature_set else None
+
+        def presence(feat: str, clean: str) -> np.ndarray:
+            value = lookup(feat)
+            if value is None:
+                value = lookup(clean)
+            return zeros if value is None else value
+
+        relevance: Dict[str, np.ndarray] = {}
+
+        def relevant(gene_name: str) -> np.ndarray:
+            if gene_name not in relevance:
+                relevance[gene_name] = np.array([gaara.is_gene_relevant(gene_name, ab) for ab in uniques],
+                                                dtype=bool)[codes]
+            return relevance[gene_name]
+
+        drivers: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+        def attribute(gene_name: str, rows: np.ndarray, mass: np.ndarray, susceptible: bool):
+            # Later features overwrite a gene's entry, as in decompose_risk's dict
+            old = drivers.get(gene_name)
+            if old is None:
+                old = (np.zeros(n), np.zeros(n, dtype=bool), np.zeros(n, dtype=bool))
+            drivers[gene_name] = (np.where(rows, mass, old[0]), old[1] | rows, np.where(rows, susceptible, old[2]))
+
+        # Importance-weighted shares of the present, relevant genes
+        active = []
+        total_importance = np.zeros(n)
+        for feat, importance in coef_map.items():
+            clean = feat.replace("num__", "").replace("cat__", "")
+            is_gene = clean != ANY_GENE_FEATURE and (clean.startswith("gene_") or (
+                not clean.startswith("antibiotic") and not clean.startswith("Antibiotic") and "_name_" not in clean))
+            if not is_gene:
+                continue
+            gene_name = clean.replace("gene_", "") if clean.startswith("gene_") else clean
+            rows = (presence(feat, clean) == 1) & relevant(gene_name)
+            if rows.any():
+                active.append((gene_name, importance, rows))
+                total_importance = total_importance + np.where(rows, abs(importance), 0.0)
+        weighted = (risk > 0) & (total_importance > 0)
+        if weighted.any():
+            safe_total = np.where(total_importance > 0, total_importance, 1.0)
+            for gene_name, importance, rows in active:
+                direction = gaara.correct_direction(gene_name, "Resistant" if importance > 0 else "Susceptible")
+                attribute(gene_name, rows & weighted, abs(importance) / safe_total * risk,
+                          direction == "Susceptible")
+
+        # Equal shares when the model gives the genes no importance
+        fallback = (risk > 0) & (total_importance == 0)
+        if fallback.any():
+            listed = []
+            for feat in coef_map:
+                clean = feat.replace("num__", "").replace("cat__", "")
+                if clean.startswith("gene_") and clean != ANY_GENE_FEATURE:
+                    gene_name = clean.replace("gene_", "")
+                    listed.append((gene_name, (presence(feat, clean) == 1) & relevant(gene_name)))
+            inputs_listed = []
+            for feat in features:
+                if feat.startswith("gene_") and feat != ANY_GENE_FEATURE:
+                    gene_name = feat.replace("gene_", "")
+                    inputs_listed.append((gene_name, (lookup(feat) == 1) & relevant(gene_name)))
+            count = sum((rows.astype(np.int64) for _, rows in listed), zeros)
+            count_inputs = sum((rows.astype(np.int64) for _, rows in inputs_listed), zeros)
+            use_coef = count > 0
+            count = np.where(use_coef, count, count_inputs)
+            share = risk / np.where(count > 0, count, 1)
+            fallback &= count > 0
+            for gene_name, rows in listed:
+                attribute(gene_name, rows & fallback & use_coef, share, False)
+            for gene_name, rows in inputs_listed:
+                attribute(gene_name, rows & fallback & ~use_coef, share, False)
+
+        return {"risk": risk, "weight": weight, "drivers": drivers}
+
+
+def driver_json(drivers: Dict[str, Dict[str, np.ndarray]], n: int, top: int = DEFAULT_DRIVERS) -> List[str]:
+    """Per-row JSON of the `top` strongest gene drivers (all if top <= 0)."""
+    if not drivers:
+        return ["{}"] * n
+    names = list(drivers)
+    scores = np.column_stack([drivers[g]["score"] for g in names])
+    has = np.column_stack([drivers[g]["has"] for g in names])
+    susceptible = np.column_stack([drivers[g]["susceptible"] for g in names])
+    order = np.argsort(np.where(has, -scores, np.inf), axis=1, kind="stable")
+    counts = has.sum(axis=1)
+    if top > 0:
+        counts = np.minimum(counts, top)
+    out = []
+    for i in range(n):
+        cols = order[i, :counts[i]]
+        out.append(json.dumps({
+            names[c]: {"score": round(float(scores[i, c]), 6),
+                       "direction": "Susceptible" if susceptible[i, c] else "Resistant"}
+            for c in cols
+        }))
+    return out
+
+
+# ── Input ──
+
+def _table_format(path: Path) -> str:
+    return "parquet" if path.suffix.lower() in (".parquet", ".pq") else "csv"
+
+
+def _require_pyarrow(path: Path):
+    if pq is None:
+        raise BatchInputError(f"Parquet support needs pyarrow, which is not installed ({path}).")
+
+
+def input_columns(path: Path) -> List[str]:
+    if _table_format(path) == "parquet":
+        _require_pyarrow(path)
+        return list(pq.ParquetFile(path).schema_arrow.names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def count_rows(path: Path) -> int:
+    """Data rows in the table (for CSV, a line count: exact unless fields hold newlines)."""
+    if _table_format(path) == "parquet":
+        return pq.ParquetFile(path).metadata.num_rows
+    lines, last = 0, b"\n"
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 22), b""):
+            lines += block.count(b"\n")
+            last = block[-1:]
+    return max(lines + (last != b"\n") - 1, 0)
+
+
+def read_chunks(path: Path, columns: List[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    if _table_format(path) == "parquet":
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    genes = [c for c in columns if c.startswith(GENE_PREFIX)]
+    dtypes = {c: str for c in columns if c not in genes}
+    yield from pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunk_rows)
+
+
+def _plan(path: Path, antibiotic: Optional[str], antibiotic_column: Optional[str],
+          keep: Sequence[str]) -> Dict[str, Any]:
+    """Columns to read and how to use them."""
+    columns = input_columns(path)
+    genes = [c for c in columns if c.startswith(GENE_PREFIX)]
+    if not genes:
+        raise BatchInputError(f"{path} has no {GENE_PREFIX}* columns.")
+    if antibiotic is None:
+        if antibiotic_column is None:
+            antibiotic_column = next((c for c in ANTIBIOTIC_COLUMNS if c in columns), None)
+        if antibiotic_column is None:
+            raise BatchInputError(f"{path} has no antibiotic column ({', '.join(ANTIBIOTIC_COLUMNS)}); "
+                                  "name one or score a single antibiotic.")
+        if antibiotic_column not in columns:
+            raise BatchInputError(f"Unknown antibiotic column '{antibiotic_column}'.")
+    ids = list(keep) or [next((c for c in ID_COLUMNS if c in columns), None)]
+    ids = [c for c in ids if c is not None]
+    missing = [c for c in ids if c not in columns]
+    if missing:
+        raise BatchInputError(f"Unknown columns to keep: {missing}")
+    return {"genes": genes, "antibiotic": antibiotic, "antibiotic_column": antibiotic_column, "keep": ids}
+
+
+# ── Workers ──
+
+_scorer: Optional[BatchScorer] = None
+
+
+def _init_worker():
+    global _scorer
+    logging.getLogger("app.services.gaara").setLevel(logging.WARNING)
+    _scorer = BatchScorer()
+
+
+def score_frame(scorer: BatchScorer, df: pd.DataFrame, start: int, plan: Dict[str, Any],
+                drivers: int = DEFAULT_DRIVERS) -> pd.DataFrame:
+    """Output rows for one input chunk whose first row is input row `start`."""
+    n = len(df)
+    if plan["antibiotic"] is not None:
+        antibiotics = np.full(n, plan["antibiotic"], dtype=object)
+    else:
+        antibiotics = df[plan["antibiotic_column"]].fillna("").astype(str).to_numpy(dtype=object)
+    genes = {
+        g[len(GENE_PREFIX):]: (pd.to_numeric(df[g], errors="coerce").fillna(0) > 0).to_numpy(dtype=np.int64)
+        for g in plan["genes"]
+    }
+    result = scorer.score(antibiotics, genes)
+    out = {"row": np.arange(start, start + n, dtype=np.int64)}
+    for col in plan["keep"]:
+        out[col] = df[col].to_numpy()
+    out["antibiotic"] = antibiotics
+    out["risk"] = result["risk"]
+    out["risk_category"] = result["risk_category"]
+    out["gene_drivers"] = driver_json(result["drivers"], n, drivers)
+    return pd.DataFrame(out)
+
+
+def _write_table(df: pd.DataFrame, path: Path, fmt: str):
+    tmp = path.with_name(path.name + ".tmp")
+    if fmt == "parquet":
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _score_chunk(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Score one chunk and write its part file (runs in a worker or inline)."""
+    t0 = time.perf_counter()
+    out = score_frame(_scorer, task["frame"], task["start"], task["plan"], task["drivers"])
+    _write_table(out, Path(task["part"]), task["format"])
+    return {"chunk": task["chunk"], "rows": len(out), "seconds": round(time.perf_counter() - t0, 3)}
+
+
+# ── Runs ──
+
+def _model_stamps() -> Dict[str, List[float]]:
+    """Size and mtime of each model file, so new models invalidate a run's parts."""
+    stamps = {}
+    for path in sorted(Path(MODELS_DIR).glob("*/model.pkl")):
+        stat = path.stat()
+        stamps[path.parent.name] = [stat.st_size, stat.st_mtime]
+    return stamps
+
+
+def _load_progress(parts_dir: Path, settings: Dict[str, Any], restart: bool) -> Dict[str, Any]:
+    progress_path = parts_dir / "progress.json"
+    if progress_path.exists() and not restart:
+        progress = json.loads(progress_path.read_text())
+        if progress.get("format") == PROGRESS_FORMAT and progress.get("settings") == settings:
+            done = {c: info for c, info in progress["chunks"].items() if (parts_dir / info["part"]).exists()}
+            progress["chunks"] = done
+            return progress
+        raise BatchInputError(f"{parts_dir} holds parts of a different run (input, settings or models "
+                              "changed); run with --restart to discard them.")
+    if parts_dir.exists():
+        shutil.rmtree(parts_dir)
+    parts_dir.mkdir(parents=True)
+    return {"format": PROGRESS_FORMAT, "settings": settings, "chunks": {}}
+
+
+def _save_progress(parts_dir: Path, progress: Dict[str, Any]):
+    tmp = parts_dir / "progress.json.tmp"
+    tmp.write_text(json.dumps(progress, indent=2))
+    os.replace(tmp, parts_dir / "progress.json")
+
+
+def _merge_parts(parts: List[Path], out: Path, fmt: str):
+    tmp = out.with_name(out.name + ".tmp")
+    if fmt == "parquet":
+        writer = None
+        try:
+            for part in parts:
+                table = pq.read_table(part)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp, table.schema)
+                writer.write_table(table.cast(writer.schema))
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        with open(tmp, "wb") as dst:
+            for i, part in enumerate(parts):
+                with open(part, "rb") as src:
+                    if i:
+                        src.readline()   # header
+                    shutil.copyfileobj(src, dst, 1 << 22)
+    os.replace(tmp, out)
+
+
+def run_batch(input_path: Path, out: Path, antibiotic: Optional[str] = None,
+              antibiotic_column: Optional[str] = None, keep: Sequence[str] = (),
+              chunk_rows: int = CHUNK_ROWS, workers: Optional[int] = None,
+              drivers: int = DEFAULT_DRIVERS, restart: bool = False,
+              keep_parts: bool = False) -> Dict[str, Any]:
+    """Score every row of `input_path` into `out`, resuming a previous run's parts."""
+    input_path, out = Path(input_path).resolve(), Path(out).resolve()
+    fmt = OUTPUT_FORMATS.get(out.suffix.lower())
+    if fmt is None:
+        raise BatchInputError(f"Output must end in one of {sorted(OUTPUT_FORMATS)}: {out}")
+    if fmt == "parquet":
+        _require_pyarrow(out)
+    if chunk_rows < 1:
+        raise BatchInputError("chunk_rows must be positive.")
+    workers = workers or os.cpu_count() or 1
+    plan = _plan(input_path, antibiotic, antibiotic_column, keep)
+    stat = input_path.stat()
+    settings = {"input": str(input_path), "size": stat.st_size, "mtime": stat.st_mtime, "plan": plan,
+                "chunk_rows": chunk_rows, "drivers": drivers, "format": fmt, "models": _model_stamps()}
+
+    parts_dir = out.with_name(out.name + ".parts")
+    progress = _load_progress(parts_dir, settings, restart)
+    total = count_rows(input_path)
+    done_rows = sum(info["rows"] for info in progress["chunks"].values())
+    if progress["chunks"]:
+        logger.info(f"Resuming: {len(progress['chunks'])} chunks ({done_rows} rows) already scored")
+
+    columns = plan["keep"] + ([plan["antibiotic_column"]] if plan["antibiotic_column"] else []) + plan["genes"]
+    columns = list(dict.fromkeys(columns))
+    t0 = time.perf_counter()
+    scored_rows = 0
+    n_chunks = 0
+
+    def record(result: Dict[str, Any]):
+        nonlocal scored_rows
+        progress["chunks"][str(result["chunk"])] = {"part": f"part-{result['chunk']:06d}.{fmt}",
+                                                     "rows": result["rows"], "seconds": result["seconds"]}
+        _save_progress(parts_dir, progress)
+        scored_rows += result["rows"]
+        elapsed = time.perf_counter() - t0
+        rate = scored_rows / elapsed if elapsed > 0 else 0.0
+        finished = done_rows + scored_rows
+        eta = f", ETA {max(total - finished, 0) / rate:.0f}s" if rate and total else ""
+        logger.info(f"Chunk {result['chunk']}: {finished}/{total} rows "
+                    f"({finished / max(total, 1):.1%}), {rate:,.0f} rows/s{eta}")
+
+    def tasks() -> Iterator[Dict[str, Any]]:
+        nonlocal n_chunks
+        start = 0
+        for chunk, frame in enumerate(read_chunks(input_path, columns, chunk_rows)):
+            n_chunks = chunk + 1
+            if str(chunk) not in progress["chunks"]:
+                yield {"chunk": chunk, "start": start, "frame": frame, "plan": plan, "drivers": drivers,
+                       "format": fmt, "part": str(parts_dir / f"part-{chunk:06d}.{fmt}")}
+            start += len(frame)
+
+    if workers > 1:
+        # At most two chunks per worker in flight keeps memory bounded
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            pending = set()
+            for task in tasks():
+                pending.add(pool.submit(_score_chunk, task))
+                if len(pending) >= 2 * workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(future.result())
+            for future in pending:
+                record(future.result())
+    else:
+        _init_worker()
+        for task in tasks():
+            record(_score_chunk(task))
+
+    parts = [parts_dir / progress["chunks"][str(c)]["part"] for c in range(n_chunks)]
+    _merge_parts(parts, out, fmt)
+    if not keep_parts:
+        shutil.rmtree(parts_dir)
+    elapsed = time.perf_counter() - t0
+    rows = done_rows + scored_rows
+    summary = {"input": str(input_path), "out": str(out), "rows": rows, "chunks": n_chunks,
+               "resumed_rows": done_rows, "seconds": round(elapsed, 2),
+               "rows_per_hour": round(scored_rows / elapsed * 3600) if elapsed > 0 else None}
+    logger.info(f"Scored {rows} rows into {out} in {elapsed:.1f}s")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score an isolate table with the GAARA pathogen models.")
+    parser.add_argument("input", type=Path, help="CSV or Parquet table with gene_* columns")
+    parser.add_argument("--out", type=Path, required=True, help="Output file (.parquet or .csv)")
+    parser.add_argument("--antibiotic", default=None, help="Score every row for this antibiotic")
+    parser.add_argument("--antibiotic-column", default=None,
+                        help=f"Column naming each row's antibiotic (default: first of {list(ANTIBIOTIC_COLUMNS)})")
+    parser.add_argument("--keep", nargs="*", default=[],
+                        help=f"Input columns to copy to the output (default: first of {list(ID_COLUMNS)})")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument("--drivers", type=int, default=DEFAULT_DRIVERS,
+                        help="Gene drivers kept per row (0: all)")
+    parser.add_argument("--restart", action="store_true", help="Discard the parts of a previous run")
+    parser.add_argument("--keep-parts", action="store_true", help="Keep the part files after merging")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    summary = run_batch(args.input, args.out, antibiotic=args.antibiotic,
+                        antibiotic_column=args.antibiotic_column, keep=args.keep,
+                        chunk_rows=args.chunk_rows, workers=args.workers, drivers=args.drivers,
+                        restart=args.restart, keep_parts=args.keep_parts)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
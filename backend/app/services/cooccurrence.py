@@ -0,0 +1,235 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from app.core.metrics import record_cache
+from app.services.genes import UNKNOWN_LABEL
+from app.services.isolates import IsolateStore
+from app.services.vocabulary import GENES, PATHOGENS
+
+logger = logging.getLogger(__name__)
+
+# ── Gene co-occurrence network ──────────────────────────────────────
+# Resistance genes carried on the same plasmid turn up in the same genomes.
+# The engine keeps the isolate × gene carrier matrix X in CSR form (built
+# from the store's packed bits in chunks, never as a dense matrix), with
+# isolates sorted by their (pathogen, state, year) cell, so any stratum is
+# a set of contiguous row ranges. A network is then one sparse product
+#   C = X_sᵀ X_s      (C[i, j] = isolates in the stratum carrying both)
+# and lift / phi over the nonzero pairs only.
+#
+# Typing panels differ per pathogen, so a pair is judged over the isolates
+# typed for both genes: with n_p isolates of pathogen p in the stratum,
+# m_p the p's panel mask and c_p its carrier counts,
+#   N_ij = Σ_p n_p m_p(i) m_p(j)       population
+#   a_ij = Σ_p c_p(i) m_p(j)           carriers of i within it
+# which reduces to the usual 2×2 table within a single pathogen.
+#
+# Results are cached per (version, stratum, options): the engine is rebuilt
+# whenever the gene data changes, so entries never go stale.
+
+NETWORK_METRICS = ("phi", "lift", "count")
+RESULT_CACHE_SIZE = 256
+MAX_EDGES = 2000
+BUILD_CHUNK = 65536   # isolates unpacked at a time while building X
+
+
+class CooccurrenceEngine:
+    def __init__(self, store: IsolateStore, states: Sequence[str], version: int = 0):
+        self.version = version
+        self.genes: List[str] = list(store.genes)
+        self._gene_lookup = GENES.index(self.genes)
+        self.states: List[str] = list(states) + [UNKNOWN_LABEL]
+        self._state_lookup = {s.lower(): i for i, s in enumerate(self.states)}
+        self._results: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        iso = store.isolates
+        self.n_isolates = store.n_isolates
+
+        # Axis codes: pathogen, state (+Unknown), year (+Unknown)
+        self.pathogens: List[str] = [str(p) for p in iso["pathogen"].cat.categories]
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+        p_idx = iso["pathogen"].cat.codes.to_numpy().astype(np.int64)
+        s_idx = (iso["state"].astype(object).map({s: i for i, s in enumerate(self.states)})
+                 .fillna(len(self.states) - 1).to_numpy(dtype=np.int64))
+        years = pd.to_numeric(iso["year"], errors="coerce").to_numpy(dtype=np.float64)
+        valid = ~np.isnan(years)
+        self.years: List[int] = [int(y) for y in np.unique(years[valid])]
+        y_idx = np.full(len(years), len(self.years), dtype=np.int64)
+        y_idx[valid] = np.searchsorted(self.years, years[valid].astype(np.int64))
+
+        # Pathogen panel masks (+ an all-False row for a missing pathogen)
+        self.panels = np.zeros((len(self.pathogens) + 1, len(self.genes)), dtype=bool)
+        for p, name in enumerate(self.pathogens):
+            self.panels[p, self._gene_lookup.select(store.panels.get(name, []))] = True
+        p_idx[p_idx < 0] = len(self.pathogens)
+
+        # Sort isolates by stratum cell; offsets[c]:offsets[c + 1] are cell c's rows
+        self.shape = (len(self.pathogens) + 1, len(self.states), len(self.years) + 1)
+        cell = np.ravel_multi_index((p_idx, s_idx, y_idx), self.shape)
+        order = np.argsort(cell, kind="stable")
+        self.offsets = np.searchsorted(cell[order], np.arange(int(np.prod(self.shape)) + 1))
+        self.row_pathogen = p_idx[order]
+        self.X = self._carrier_matrix(store, order)
+        logger.info(f"Co-occurrence engine: {self.n_isolates} isolates × {len(self.genes)} genes, "
+                    f"{self.X.nnz} carrier calls")
+
+    def _carrier_matrix(self, store: IsolateStore, order: np.ndarray) -> sparse.csr_matrix:
+        """Isolate × gene 0/1 CSR matrix of typed carriers, rows in `order`."""
+        n, g = len(order), len(self.genes)
+        bits = store.gene_bits[order] if n else store.gene_bits
+        rows, cols = [], []
+        for start in range(0, n, BUILD_CHUNK):
+            present = np.unpackbits(bits[start:start + BUILD_CHUNK], axis=1, count=g).astype(bool)
+            present &= self.panels[self.row_pathogen[start:start + BUILD_CHUNK]]
+            r, c = np.nonzero(present)
+            rows.append(r + start)
+            cols.append(c)
+        rows = np.concatenate(rows) if rows else np.zeros(0, np.int64)
+        cols = np.concatenate(cols) if cols else np.zeros(0, np.int64)
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=(n, g))
+
+    def __getstate__(self):
+        # Shared-state snapshot (see app.core.shared_state): no cached results
+        state = dict(self.__dict__, _results=OrderedDict())
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    # ── Lookup ──
+
+    def resolve_gene(self, gene: str) -> Optional[int]:
+        return self._gene_lookup.get(gene)
+
+    def _stratum_rows(self, pathogen_idx: Optional[int], state: Optional[str],
+                      year: Optional[int]) -> Optional[np.ndarray]:
+        """Row indices of the stratum's isolates; None if the state or year is unknown."""
+        axes = [np.arange(self.shape[0]) if pathogen_idx is None else np.array([pathogen_idx])]
+        if state is None:
+            axes.append(np.arange(self.shape[1]))
+        else:
+            s = self._state_lookup.get(state.strip().lower())
+            if s is None:
+                return None
+            axes.append(np.array([s]))
+        if year is None:
+            axes.append(np.arange(self.shape[2]))
+        elif year in self.years:
+            axes.append(np.array([self.years.index(year)]))
+        else:
+            return None
+        cells = np.ravel_multi_index(np.ix_(*axes), self.shape).ravel()
+        starts, stops = self.offsets[cells], self.offsets[cells + 1]
+        keep = stops > starts
+        if not keep.any():
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([np.arange(a, b) for a, b in zip(starts[keep], stops[keep])])
+
+    # ── Network ──
+
+    def network(self, pathogen: Optional[str] = None, state: Optional[str] = None,
+                year: Optional[int] = None, gene: Optional[str] = None, min_count: int = 5,
+                sort_by: str = "phi", limit: int = 200) -> Optional[Dict[str, Any]]:
+        """Gene co-occurrence network of one stratum (None if a filter is unknown).
+
+        Edges are gene pairs carried together by at least `min_count` isolates
+        (only those touching `gene`, if given), ranked by `sort_by`.
+        """
+        gene_idx = None
+        if gene is not None:
+            gene_idx = self.resolve_gene(gene)
+            if gene_idx is None:
+                return None
+        pathogen_idx = None
+        if pathogen is not None:
+            pathogen_idx = self._pathogen_lookup.get(pathogen)
+            if pathogen_idx is None:
+                return None
+        key = (self.version, pathogen_idx, state and state.strip().lower(),
+               year, gene_idx, min_count, sort_by, limit)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+        record_cache("gene_network", cached is not None)
+        if cached is not None:
+            return cached
+
+        if pathogen is None and state is None and year is None:
+            X, row_pathogen = self.X, self.row_pathogen
+        else:
+            rows = self._stratum_rows(pathogen_idx, state, year)
+            if rows is None:
+                return None
+            X, row_pathogen = self.X[rows], self.row_pathogen[rows]
+        result = self._network(X, row_pathogen, gene_idx, min_count, sort_by, limit)
+
+        with self._lock:
+            self._results[key] = result
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return result
+
+    def _network(self, X: sparse.csr_matrix, row_pathogen: np.ndarray, gene_idx: Optional[int],
+                 min_count: int, sort_by: str, limit: int) -> Dict[str, Any]:
+        n_p = np.bincount(row_pathogen, minlength=len(self.panels)).astype(np.float64)
+        # Per-pathogen carrier counts (pathogens × genes), via a tiny indicator product
+        indicator = sparse.csr_matrix((np.ones(len(row_pathogen)), (row_pathogen, np.arange(len(row_pathogen)))),
+                                      shape=(len(self.panels), len(row_pathogen)))
+        carriers_p = np.asarray((indicator @ X).todense(), dtype=np.float64)
+        mask = self.panels.astype(np.float64)
+        carriers = carriers_p.sum(axis=0)
+        typed = n_p @ mask
+
+        C = sparse.triu(X.T @ X, k=1).tocoo()
+        i, j, both = C.row, C.col, C.data.astype(np.float64)
+        keep = both >= min_count
+        if gene_idx is not None:
+            keep &= (i == gene_idx) | (j == gene_idx)
+        i, j, both = i[keep], j[keep], both[keep]
+
+        population = (n_p[:, None] * mask[:, i] * mask[:, j]).sum(axis=0)
+        a_i = (carriers_p[:, i] * mask[:, j]).sum(axis=0)
+        a_j = (carriers_p[:, j] * mask[:, i]).sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lift = np.where(a_i * a_j > 0, both * population / (a_i * a_j), np.nan)
+            denom = np.sqrt(a_i * (population - a_i) * a_j * (population - a_j))
+            phi = np.where(denom > 0, (population * both - a_i * a_j) / denom, np.nan)
+
+        rank = {"phi": phi, "lift": lift, "count": both}[sort_by]
+        order = np.lexsort((-both, -np.nan_to_num(rank, nan=-np.inf)))
+        total = len(order)
+        order = order[:limit]
+
+        def rounded(values: np.ndarray, k: int) -> List[Optional[float]]:
+            return [None if np.isnan(v) else round(float(v), k) for v in values]
+
+        edges = [
+            {"source": self.genes[a], "target": self.genes[b], "count": int(c), "population": int(n),
+             "lift": lf, "phi": ph}
+            for a, b, c, n, lf, ph in zip(i[order], j[order], both[order], population[order],
+                                          rounded(lift[order], 3), rounded(phi[order], 4))
+        ]
+        in_edges = sorted(set(i[order].tolist()) | set(j[order].tolist()) |
+                          ({gene_idx} if gene_idx is not None else set()))
+        nodes = [
+            {"gene": self.genes[g], "carriers": int(carriers[g]), "typed": int(typed[g]),
+             "prevalence": round(float(carriers[g] / typed[g]) * 100, 1) if typed[g] else None}
+            for g in in_edges
+        ]
+        return {
+            "version": self.version,
+            "isolates": int(len(row_pathogen)),
+            "nodes": nodes,
+            "edges": edges,
+            "total_edges": int(total),
+            "truncated": bool(total > limit),
+        }
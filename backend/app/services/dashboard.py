@@ -0,0 +1,186 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.services.trends import TREND_YEAR_MAX, TREND_YEAR_MIN
+from app.services.vocabulary import ANTIBIOTICS, PATHOGENS
+
+logger = logging.getLogger(__name__)
+
+# ── Dashboard cube ──────────────────────────────────────────────────
+# Every analytics-dashboard panel is a reduction of per-test counts over
+# (pathogen × antibiotic × place × year), where place is the record's
+# state or, for records without one, its zone. One bincount pass over the
+# long frame at build keeps
+#   by_place – (pathogen × antibiotic × place) rows / tested / resistant
+#   by_year  – (pathogen × antibiotic × year)  rows / tested / resistant
+# (each axis with a trailing "missing" slot), so a dashboard request is a
+# few slices and sums of these and never rescans GLOBAL_DF.
+
+COUNTS = ("rows", "tested", "resistant")
+
+
+def _axis(values: pd.Series) -> Tuple[List[str], np.ndarray]:
+    """Labels (category order, or sorted) and codes with missing → len(labels)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        labels = [str(c) for c in values.cat.categories]
+        codes = values.cat.codes.to_numpy().astype(np.int64)
+    else:
+        labels = sorted(str(v) for v in values.dropna().unique())
+        codes = pd.Categorical(values.astype(object).where(values.notna()), categories=labels).codes.astype(np.int64)
+    codes[codes < 0] = len(labels)
+    return labels, codes
+
+
+class DashboardCube:
+    def __init__(self, df: pd.DataFrame, version: int = 0):
+        self.version = version
+        if df.empty:
+            self.pathogens: List[str] = []
+            self.antibiotics: List[str] = []
+            self.states: List[str] = []
+            self.zones: List[str] = []
+            self.years: List[int] = []
+            self.by_place = {k: np.zeros((1, 1, 2)) for k in COUNTS}
+            self.by_year = {k: np.zeros((1, 1, 1)) for k in COUNTS}
+            self._finalize()
+            return
+
+        self.pathogens, p = _axis(df["pathogen"])
+        self.antibiotics, a = _axis(df["antibiotic_name"])
+        self.states, s = _axis(df["state"])
+        self.zones, z = _axis(df["region"])
+        # Place: the state, else the zone (after every state), else a trailing slot
+        place = np.where(s < len(self.states), s, len(self.states) + z)
+
+        years = pd.to_numeric(df["year"], errors="coerce").to_numpy(dtype=np.float64)
+        valid = ~np.isnan(years)
+        self.years = [int(y) for y in np.unique(years[valid])]
+        y = np.full(len(df), len(self.years), dtype=np.int64)
+        y[valid] = np.searchsorted(self.years, years[valid].astype(np.int64))
+
+        labels = pd.to_numeric(df["phenotype_label"], errors="coerce").to_numpy(dtype=np.float64)
+        has_label = ~np.isnan(labels)
+        shape = (len(self.pathogens) + 1, len(self.antibiotics) + 1,
+                 len(self.states) + len(self.zones) + 1, len(self.years) + 1)
+        cell = np.ravel_multi_index((p, a, place, y), shape)
+        size = int(np.prod(shape))
+        cube = {
+            "rows": np.bincount(cell, minlength=size),
+            "tested": np.bincount(cell, weights=has_label, minlength=size),
+            "resistant": np.bincount(cell, weights=np.where(has_label, labels, 0.0), minlength=size),
+        }
+        cube = {k: v.reshape(shape) for k, v in cube.items()}
+        self.by_place = {k: v.sum(axis=3) for k, v in cube.items()}
+        self.by_year = {k: v.sum(axis=2) for k, v in cube.items()}
+        self._finalize()
+        logger.info(f"Dashboard cube: {len(df)} rows → {len(self.pathogens)} pathogens × "
+                    f"{len(self.antibiotics)} antibiotics × {shape[2]} places × {shape[3]} years")
+
+    def _finalize(self):
+        self.totals = {k: v.sum(axis=2) for k, v in self.by_year.items()}  # pathogen × antibiotic
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+        self._antibiotic_lookup = ANTIBIOTICS.index(self.antibiotics)
+
+    def _slab(self, counts: Dict[str, np.ndarray], pathogen: Optional[str],
+              antibiotics: Optional[Sequence[str]]) -> Optional[List[np.ndarray]]:
+        """rows / tested / resistant summed over the selected pathogen and
+        antibiotics (all of them, missing slots included, when not given);
+        None if a filter matches nothing."""
+        p = slice(None)
+        if pathogen:
+            i = self._pathogen_lookup.get(pathogen)
+            if i is None:
+                return None
+            p = slice(i, i + 1)
+        a = slice(None)
+        if antibiotics:
+            a = self._antibiotic_lookup.select(antibiotics)
+            if not a:
+                return None
+        return [counts[k][p][:, a].sum(axis=(0, 1)) for k in COUNTS]
+
+    # ── Panels ──
+
+    def antibiotic_rows(self) -> Dict[str, int]:
+        """Records per antibiotic (any label, all pathogens)."""
+        return antibiotic_rows(self.totals, self.antibiotics)
+
+    def heatmap(self, min_rows: int = 100) -> Dict[str, Any]:
+        """Antibiotic × pathogen resistance matrix over antibiotics with more than
+        `min_rows` records; -1 marks combinations without a tested record."""
+        return heatmap_panel(self.totals, self.pathogens, self.antibiotics, min_rows)
+
+    def trend(self, antibiotic: Optional[str] = None, pathogen: Optional[str] = None,
+              year_min: int = TREND_YEAR_MIN, year_max: int = TREND_YEAR_MAX) -> Tuple[List[int], List[Optional[float]]]:
+        """Yearly pooled resistance rate over years in range that have records."""
+        slab = self._slab(self.by_year, pathogen, [antibiotic] if antibiotic else None)
+        if slab is None:
+            return [], []
+        return trend_panel([v[:-1] for v in slab], self.years, year_min, year_max)
+
+    def place_counts(self, antibiotics: Optional[Sequence[str]] = None,
+                     pathogen: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Per-state and per-zone (records without a state) resistant / tested
+        counts, for places with any record; None if nothing matches."""
+        slab = self._slab(self.by_place, pathogen, antibiotics)
+        if slab is None:
+            return None
+        return place_panel(slab, self.states, self.zones)
+
+
+# ── Panel math ──
+# Shared with the on-disk store (app.services.sqlstore), which produces the
+# same count arrays from indexed queries instead of a resident cube.
+
+def antibiotic_rows(totals: Dict[str, np.ndarray], antibiotics: List[str]) -> Dict[str, int]:
+    rows = totals["rows"].sum(axis=0)
+    return {ab: int(rows[i]) for i, ab in enumerate(antibiotics)}
+
+
+def heatmap_panel(totals: Dict[str, np.ndarray], pathogens: List[str], antibiotics: List[str],
+                  min_rows: int) -> Dict[str, Any]:
+    """`totals`: (pathogens + missing) × (antibiotics + missing) counts."""
+    tested = totals["tested"][:-1, :-1]
+    resistant = totals["resistant"][:-1, :-1]
+    drugs = np.flatnonzero(totals["rows"][:, :-1].sum(axis=0) > min_rows)
+    drugs = drugs[tested[:, drugs].sum(axis=0) > 0]
+    rows = np.flatnonzero(tested[:, drugs].sum(axis=1) > 0)
+    n = tested[np.ix_(rows, drugs)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(n > 0, resistant[np.ix_(rows, drugs)] / n, -1.0)
+    return {
+        "y_labels": [antibiotics[i] for i in drugs],
+        "x_labels": [pathogens[i] for i in rows],
+        "data": rate.T.tolist(),
+    }
+
+
+def trend_panel(slab: Sequence[np.ndarray], years: Sequence[int], year_min: int,
+                year_max: int) -> Tuple[List[int], List[Optional[float]]]:
+    """`slab`: rows / tested / resistant per year of `years`."""
+    rows, tested, resistant = slab
+    years = np.asarray(years, dtype=np.int64)
+    keep = (years >= year_min) & (years <= year_max) & (rows > 0)
+    rates = [float(r / n) if n else None for r, n in zip(resistant[keep], tested[keep])]
+    return years[keep].tolist(), rates
+
+
+def place_panel(slab: Sequence[np.ndarray], states: List[str], zones: List[str]) -> Optional[Dict[str, Any]]:
+    """`slab`: rows / tested / resistant per place (states, then zones, then missing)."""
+    rows, tested, resistant = slab
+    if rows.sum() == 0:
+        return None
+    n_states = len(states)
+    by_state = {states[i]: (float(resistant[i]), int(tested[i]))
+                for i in np.flatnonzero(rows[:n_states])}
+    by_zone = {zones[i]: (float(resistant[n_states + i]), int(tested[n_states + i]))
+               for i in np.flatnonzero(rows[n_states:n_states + len(zones)])}
+    total = tested.sum()
+    return {
+        "states": by_state,
+        "zones": by_zone,
+        "mean": float(resistant.sum() / total) if total else float("nan"),
+    }
@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.core.config import DATA_DIR
+from app.services.geo import extract_state
+from app.services.vocabulary import ANTIBIOTICS, PATHOGEN_TERMS
+
+logger = logging.getLogger(__name__)
+
+# Data Paths
+KLEB_PATH = os.path.join(DATA_DIR, "FINAL_AMR_KLEBSIELLA (2).csv")
+ECOLI_PATH = os.path.join(DATA_DIR, "E_Coli_Final_ML_Dataset_v1.csv")
+SAUREUS_PATH = os.path.join(DATA_DIR, "S_aureus.csv")
+
+# ── Model datasets ──────────────────────────────────────────────────
+# The map endpoints harmonize every source into one display schema
+# (title-cased antibiotics, untested S. aureus rows counted susceptible).
+# Training and evaluation need the sources the way the models see them:
+# raw gene_* columns, lower-case antibiotic names and only rows with a
+# measured phenotype. Every dataset is read into the same frame:
+#   genome_id, antibiotic, state, year, label, gene_<name>...
+
+GENE_PREFIX = "gene_"
+LABEL_COLUMN = "label"
+STRATA_COLUMNS = ["genome_id", "antibiotic", "state", "year"]
+
+# Model directory name → source CSV
+MODEL_DATASETS: Dict[str, str] = {
+    "e_coli": ECOLI_PATH,
+    "k_pneumoniae": KLEB_PATH,
+    "s_aureus": SAUREUS_PATH,
+}
+# Model directory name → display name
+PATHOGEN_NAMES = {spellings[0]: name for name, spellings in PATHOGEN_TERMS.items()}
+
+
+def _gene_columns(path: str) -> List[str]:
+    return [c for c in pd.read_csv(path, nrows=0).columns if c.startswith(GENE_PREFIX)]
+
+
+def _read_e_coli(path: str) -> pd.DataFrame:
+    genes = _gene_columns(path)
+    df = pd.read_csv(path, usecols=["genome_id", "antibiotic_name", "phenotype_label",
+                                    "collection_year", "state_ut"] + genes, dtype=str)
+    return pd.DataFrame({
+        "genome_id": df["genome_id"],
+        "antibiotic": df["antibiotic_name"],
+        "state": df["state_ut"].apply(extract_state),
+        "year": pd.to_numeric(df["collection_year"], errors="coerce"),
+        LABEL_COLUMN: pd.to_numeric(df["phenotype_label"], errors="coerce"),
+        **{g: df[g] for g in genes},
+    })
+
+
+def _read_k_pneumoniae(path: str) -> pd.DataFrame:
+    genes = _gene_columns(path)
+    df = pd.read_csv(path, usecols=["Genome ID", "Geographic Location", "Collection Year",
+                                    "antibiotic_name", "phenotype_label"] + genes, dtype=str)
+    return pd.DataFrame({
+        "genome_id": df["Genome ID"],
+        "antibiotic": df["antibiotic_name"],
+        "state": df["Geographic Location"].apply(extract_state),
+        "year": pd.to_numeric(df["Collection Year"], errors="coerce"),
+        LABEL_COLUMN: pd.to_numeric(df["phenotype_label"], errors="coerce"),
+        **{g: df[g] for g in genes},
+    })
+
+
+def _read_s_aureus(path: str) -> pd.DataFrame:
+    genes = _gene_columns(path)
+    df = pd.read_csv(path, usecols=["Genome ID", "Geographic Location", "Antibiotic",
+                                    "Resistant Phenotype"] + genes, dtype=str)
+    status = df["Resistant Phenotype"].str.strip().str.lower()
+    return pd.DataFrame({
+        "genome_id": df["Genome ID"],
+        "antibiotic": df["Antibiotic"],
+        "state": df["Geographic Location"].apply(extract_state),
+        "year": np.nan,  # source has no collection year
+        LABEL_COLUMN: status.map({"resistant": 1.0, "susceptible": 0.0}),
+        **{g: df[g] for g in genes},
+    })
+
+
+_READERS = {"e_coli": _read_e_coli, "k_pneumoniae": _read_k_pneumoniae, "s_aureus": _read_s_aureus}
+
+
+def load_dataset(name: str) -> pd.DataFrame:
+    """Read one source CSV into the model dataset frame (measured phenotypes only)."""
+    if name not in MODEL_DATASETS:
+        raise ValueError(f"Unknown dataset '{name}'. Choose from {list(MODEL_DATASETS)}.")
+    df = _READERS[name](MODEL_DATASETS[name])
+    df = df[df[LABEL_COLUMN].notna()].reset_index(drop=True)
+    df["antibiotic"] = ANTIBIOTICS.intern(df["antibiotic"]).str.lower()
+    df[LABEL_COLUMN] = df[LABEL_COLUMN].astype(np.int8)
+    df["year"] = df["year"].astype("float32")
+    for col in df.columns:
+        if col.startswith(GENE_PREFIX):
+            df[col] = (pd.to_numeric(df[col], errors="coerce").fillna(0) > 0).astype(np.int8)
+    for col in ("genome_id", "antibiotic", "state"):
+        df[col] = df[col].astype("category")
+    return df
+
+
+def gene_columns(df: pd.DataFrame) -> List[str]:
+    return [c for c in df.columns if c.startswith(GENE_PREFIX)]
+
+
+def file_digest(path) -> str:
+    """SHA-256 of a file's contents."""
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cached_dataset(name: str, cache_dir: Path) -> Tuple[pd.DataFrame, str, Path]:
+    """Load a model dataset through an on-disk cache keyed by the source file digest.
+
+    Returns (frame, source digest, cache file). The cache file can be handed
+    to worker processes, which load it instead of re-parsing the CSV.
+    """
+    digest = file_digest(MODEL_DATASETS[name])
+    cache_path = Path(cache_dir) / f"{name}-{digest[:16]}.joblib"
+    if cache_path.exists():
+        try:
+            return joblib.load(cache_path), digest, cache_path
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable dataset cache {cache_path}: {e}")
+    df = load_dataset(name)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    joblib.dump(df, tmp_path, compress=0)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Cached dataset {name}: {len(df)} rows → {cache_path}")
+    return df, digest, cache_path
+
+
+def antibiotic_feature(model) -> Optional[str]:
+    """Name of the model's raw antibiotic input column (the only non-gene input)."""
+    names = [str(f) for f in getattr(model, "feature_names_in_", [])]
+    others = [f for f in names if not f.startswith(GENE_PREFIX)]
+    return others[0] if others else None
+
+
+def model_inputs(model, df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Input frame for `model` from a dataset frame.
+
+    Genes the dataset does not type are filled with 0 (absent); the second
+    value reports how many of the model's genes the dataset covers.
+    """
+    names = [str(f) for f in model.feature_names_in_]
+    ab_col = antibiotic_feature(model)
+    data = {}
+    missing = []
+    for feat in names:
+        if feat == ab_col:
+            data[feat] = df["antibiotic"].astype(str).to_numpy()
+        elif feat in df.columns:
+            data[feat] = df[feat].to_numpy()
+        else:
+            missing.append(feat)
+            data[feat] = np.zeros(len(df), dtype=np.int8)
+    model_genes = [f for f in names if f != ab_col]
+    coverage = {
+        "model_genes": len(model_genes),
+        "covered_genes": len(model_genes) - len(missing),
+        "missing_genes": [m[len(GENE_PREFIX):] for m in missing],
+    }
+    return pd.DataFrame(data, columns=names), coverage
@@ -0,0 +1,179 @@
+import logging
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.services.isolates import IsolateStore, MISSING_LABEL
+from app.services.vocabulary import ANTIBIOTICS, PATHOGENS
+
+logger = logging.getLogger(__name__)
+
+# ── Distinct isolate counts ─────────────────────────────────────────
+# Source rows are isolate × antibiotic tests, so row counts overstate the
+# number of genomes by the panel size. Two ways to count distinct genomes:
+#
+#   IsolateCounts – exact, from the normalized store. An isolate has one
+#     pathogen and one state, so counts over those axes simply add; only
+#     the antibiotic axis overlaps, and it is kept as a per-isolate
+#     "tested" bitmap. Single antibiotic (or all) lookups are precomputed.
+#
+#   HyperLogLog   – a bank of mergeable cardinality sketches, one per cell,
+#     for the incremental trend cube where rows arrive in batches. The
+#     union of any set of cells is an element-wise max of their registers,
+#     so a filtered count costs O(cells), never a rescan of raw rows.
+
+HLL_PRECISION = 10   # 1024 one-byte registers per cell, ~3% standard error
+
+
+def hash_ids(values) -> np.ndarray:
+    """Stable 64-bit hashes of identifiers, aligned with `values` (same id →
+    same hash in every process). Drop missing ids before adding them."""
+    series = pd.Series(values)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Hash each category once; code -1 (missing) takes the trailing slot
+        cats = series.cat.categories.astype(str).to_numpy(dtype=object)
+        hashed = pd.util.hash_array(np.append(cats, ""), categorize=False)
+        return hashed[series.cat.codes.to_numpy()]
+    return pd.util.hash_array(series.astype(str).to_numpy(dtype=object), categorize=False)
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """Bit length of uint64 values (exact: float log2 is only used on 32-bit halves)."""
+    hi = (x >> np.uint64(32)).astype(np.float64)
+    lo = (x & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide="ignore"):
+        hi_len = np.where(hi > 0, np.floor(np.log2(np.maximum(hi, 1))) + 1 + 32, 0)
+        lo_len = np.where(lo > 0, np.floor(np.log2(np.maximum(lo, 1))) + 1, 0)
+    return np.where(hi > 0, hi_len, lo_len).astype(np.int64)
+
+
+class HyperLogLog:
+    """A bank of HyperLogLog sketches stored as one (n_cells × 2^p) uint8 array."""
+
+    def __init__(self, n_cells: int = 0, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros((n_cells, self.m), dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.registers)
+
+    def grow(self, n_cells: int):
+        if n_cells > len(self.registers):
+            extra = np.zeros((n_cells - len(self.registers), self.m), dtype=np.uint8)
+            self.registers = np.vstack([self.registers, extra])
+
+    def add(self, cells: np.ndarray, hashes: np.ndarray):
+        """Add hashed ids to their cells (vectorized; cells must already exist)."""
+        if len(hashes) == 0:
+            return
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        p = np.uint64(self.precision)
+        bucket = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashes << p
+        rank = np.minimum(65 - _bit_length(rest), 64 - self.precision + 1).astype(np.uint8)
+        registers = self.registers.copy()
+        np.maximum.at(registers, (np.asarray(cells, dtype=np.int64), bucket), rank)
+        # Swap in the updated bank so concurrent readers never see a partial add
+        self.registers = registers
+
+    def merge(self, other: "HyperLogLog"):
+        """In-place union with another bank of the same shape."""
+        self.registers = np.maximum(self.registers, other.registers)
+
+    def union(self, groups: np.ndarray, n_groups: int, cells: Optional[np.ndarray] = None) -> np.ndarray:
+        """Registers of the union of cells per group: groups[i] is the group of
+        cells[i] (default: every cell in order). Returns (n_groups × m)."""
+        cells = np.arange(len(self.registers)) if cells is None else np.asarray(cells, dtype=np.int64)
+        out = np.zeros((n_groups, self.m), dtype=np.uint8)
+        if len(cells):
+            order = np.argsort(groups, kind="stable")
+            g = np.asarray(groups)[order]
+            starts = np.flatnonzero(np.r_[True, g[1:] != g[:-1]])
+            out[g[starts]] = np.maximum.reduceat(self.registers[cells[order]], starts, axis=0)
+        return out
+
+    def estimate(self, registers: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cardinality estimate per row of `registers` (default: every cell)."""
+        regs = self.registers if registers is None else registers
+        regs = np.atleast_2d(regs)
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.power(2.0, -regs.astype(np.float64)).sum(axis=1)
+        zeros = (regs == 0).sum(axis=1)
+        with np.errstate(divide="ignore"):
+            linear = m * np.log(m / np.maximum(zeros, 1))
+        est = np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+        return np.rint(est).astype(np.int64)
+
+
+class IsolateCounts:
+    """Exact distinct-genome counts per state × pathogen × antibiotic."""
+
+    def __init__(self, store: IsolateStore, states: Sequence[str]):
+        iso = store.isolates
+        ph = store.phenotypes
+        self.states: List[str] = list(states)
+        self.pathogens: List[str] = [str(p) for p in iso["pathogen"].cat.categories]
+        self.antibiotics: List[str] = [str(a) for a in ph["antibiotic_name"].cat.categories]
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+        self._antibiotic_lookup = ANTIBIOTICS.index(self.antibiotics)
+        n_s, n_p, n_a = len(self.states), len(self.pathogens), len(self.antibiotics)
+
+        # Axis codes per isolate; trailing slot = unknown state
+        self._state = pd.Categorical(iso["state"].astype(object), categories=self.states).codes.astype(np.int64)
+        self._state[self._state < 0] = n_s
+        self._pathogen = iso["pathogen"].cat.codes.to_numpy().astype(np.int64)
+
+        # isolate × antibiotic: has a measured phenotype
+        labels = ph["phenotype_label"].to_numpy()
+        tested = labels != MISSING_LABEL
+        self.tested = np.zeros((store.n_isolates, n_a), dtype=bool)
+        self.tested[ph["isolate"].to_numpy()[tested],
+                    ph["antibiotic_name"].cat.codes.to_numpy().astype(np.int64)[tested]] = True
+        self.any_tested = self.tested.any(axis=1)
+
+        # (states+unknown) × (pathogens+all) × (antibiotics+all)
+        shape = (n_s + 1, n_p + 1, n_a + 1)
+        cube = np.zeros(shape, dtype=np.int64)
+        cell = self._state * (n_p + 1) + self._pathogen
+        for a in range(n_a):
+            cube[:, :n_p, a] = np.bincount(cell, weights=self.tested[:, a],
+                                           minlength=(n_s + 1) * (n_p + 1)).reshape(n_s + 1, n_p + 1)[:, :n_p]
+        cube[:, :n_p, n_a] = np.bincount(cell, weights=self.any_tested,
+                                         minlength=(n_s + 1) * (n_p + 1)).reshape(n_s + 1, n_p + 1)[:, :n_p]
+        cube[:, n_p, :] = cube[:, :n_p, :].sum(axis=1)
+        self.cube = cube
+        self.totals = {p: int((self._pathogen == i).sum()) for i, p in enumerate(self.pathogens)}
+        logger.info(f"Isolate counts: {store.n_isolates} isolates, {len(ph)} phenotype rows")
+
+    def _pathogen_index(self, pathogen: Optional[str]) -> Optional[int]:
+        return len(self.pathogens) if not pathogen else self._pathogen_lookup.get(pathogen)
+
+    def by_state(self, antibiotics: Optional[Sequence[str]] = None,
+                 pathogen: Optional[str] = None) -> Dict[str, int]:
+        """Distinct genomes tested for any of `antibiotics` (default: any), per state."""
+        p = self._pathogen_index(pathogen)
+        if p is None:
+            return {s: 0 for s in self.states}
+        cols = None if not antibiotics else self._antibiotic_lookup.select(antibiotics)
+        if cols is None:
+            counts = self.cube[:-1, p, -1]
+        elif len(cols) == 1:
+            counts = self.cube[:-1, p, cols[0]]
+        else:
+            hit = self.tested[:, cols].any(axis=1)
+            if p < len(self.pathogens):
+                hit &= self._pathogen == p
+            counts = np.bincount(self._state, weights=hit, minlength=len(self.states) + 1)[:-1]
+        return {s: int(c) for s, c in zip(self.states, counts)}
+
+    def by_pathogen(self, antibiotic: Optional[str] = None) -> Dict[str, int]:
+        """Distinct genomes per pathogen: all of them, or those tested for `antibiotic`."""
+        if not antibiotic:
+            return dict(self.totals)
+        a = self._antibiotic_lookup.get(antibiotic)
+        if a is None:
+            return {p: 0 for p in self.pathogens}
+        return {p: int(c) for p, c in zip(self.pathogens, self.cube[:, :-1, a].sum(axis=0))}
@@ -0,0 +1,424 @@
+"""
+Cross-dataset validation of the pathogen models in models/<name>/model.pkl.
+
+For every model the runner reports
+    apparent          the shipped model scored on its own dataset (in-sample)
+    cross_validation  out-of-fold scores from refitting the model's pipeline
+                      on genome-grouped folds (no genome in train and test)
+    transfer          the shipped model scored on the other pathogens'
+                      datasets, restricted to genes/antibiotics they share
+each with AUC, Brier score, log loss, a reliability (calibration) table and
+per-state / per-year / per-antibiotic breakdowns.
+
+Dataset frames are parsed once and cached on disk keyed by the CSV digest;
+folds and transfer runs execute in a process pool and load the cached
+frames instead of the CSVs. Reports are written as JSON under
+EVAL_DIR/reports/<id>.json together with the model/data digests they cover.
+A task that fails is recorded under its model's "errors" instead of
+aborting the run.
+
+Usage:
+    python -m app.services.evaluation --workers 4
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import brier_score_loss, log_loss, roc_auc_score
+from sklearn.model_selection import GroupKFold
+
+from app.core.config import EVAL_DIR, MODELS_DIR
+from app.services.datasets import (LABEL_COLUMN, MODEL_DATASETS, antibiotic_feature, cached_dataset,
+                                   file_digest, model_inputs)
+
+logger = logging.getLogger(__name__)
+
+REPORT_FORMAT = 1
+N_FOLDS = 5
+CALIBRATION_BINS = 10
+STRATA = ("state", "year", "antibiotic")
+UNKNOWN_LABEL = "Unknown"
+REPORT_ID_RE = re.compile(r"^\d{8}T\d{6}-[0-9a-f]{8}$")
+
+
+# ── Metrics ──
+
+def binary_metrics(y: np.ndarray, p: np.ndarray) -> Dict[str, Any]:
+    """Discrimination and accuracy metrics for one set of predictions."""
+    n = int(len(y))
+    positives = int(y.sum())
+    out: Dict[str, Any] = {"n": n, "positives": positives}
+    if n == 0:
+        return out
+    predicted = p >= 0.5
+    out.update({
+        "prevalence": round(positives / n, 4),
+        "mean_predicted": round(float(p.mean()), 4),
+        "auc": round(float(roc_auc_score(y, p)), 4) if 0 < positives < n else None,
+        "brier": round(float(brier_score_loss(y, p)), 4),
+        "log_loss": round(float(log_loss(y, np.clip(p, 1e-15, 1 - 1e-15), labels=[0, 1])), 4),
+        "accuracy": round(float((predicted == y).mean()), 4),
+        "sensitivity": round(float(predicted[y == 1].mean()), 4) if positives else None,
+        "specificity": round(float((~predicted[y == 0]).mean()), 4) if positives < n else None,
+    })
+    return out
+
+
+def calibration(y: np.ndarray, p: np.ndarray, bins: int = CALIBRATION_BINS) -> Dict[str, Any]:
+    """Equal-width reliability table and expected calibration error."""
+    idx = np.minimum((p * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(idx, minlength=bins)
+    pred_sum = np.bincount(idx, weights=p, minlength=bins)
+    obs_sum = np.bincount(idx, weights=y, minlength=bins)
+    table = []
+    ece = 0.0
+    for b in np.flatnonzero(counts):
+        mean_p, observed = pred_sum[b] / counts[b], obs_sum[b] / counts[b]
+        ece += counts[b] / len(y) * abs(observed - mean_p)
+        table.append({"lower": b / bins, "upper": (b + 1) / bins, "n": int(counts[b]),
+                      "mean_predicted": round(float(mean_p), 4), "observed": round(float(observed), 4)})
+    return {"bins": table, "ece": round(float(ece), 4)}
+
+
+def _stratum_labels(values: pd.Series) -> np.ndarray:
+    if values.name == "year":
+        labels = values.map(lambda v: UNKNOWN_LABEL if pd.isna(v) else str(int(v)))
+    else:
+        labels = values.astype(object).where(values.notna(), UNKNOWN_LABEL).astype(str)
+    return labels.to_numpy()
+
+
+def evaluate_predictions(df: pd.DataFrame, y: np.ndarray, p: np.ndarray,
+                         bins: int = CALIBRATION_BINS) -> Dict[str, Any]:
+    """Overall metrics, calibration and per-stratum metrics for one prediction set."""
+    out = {"overall": binary_metrics(y, p), "calibration": calibration(y, p, bins)}
+    for column in STRATA:
+        labels = _stratum_labels(df[column])
+        codes, uniques = pd.factorize(labels, sort=True)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        out[f"by_{column}"] = {
+            str(u): binary_metrics(y[order[bounds[i]:bounds[i + 1]]], p[order[bounds[i]:bounds[i + 1]]])
+            for i, u in enumerate(uniques)
+        }
+    return out
+
+
+# ── Worker side ──
+
+_WORKER_CACHE: Dict[str, Any] = {}
+
+
+def load_cached(path: str):
+    """joblib.load once per worker process."""
+    obj = _WORKER_CACHE.get(path)
+    if obj is None:
+        obj = _WORKER_CACHE[path] = joblib.load(path)
+    return obj
+
+
+def fold_estimator(model):
+    """Unfitted pipeline with the model's input schema and hyperparameters.
+
+    Rebuilt with training.build_pipeline rather than clone(), which fails
+    on pipelines pickled by an older scikit-learn.
+    """
+    from app.services import training   # training imports this module
+
+    clf = model.steps[-1][1]
+    params = {k: v for k, v in vars(clf).items() if k in type(clf)._get_param_names()}
+    if "n_jobs" in params:
+        # The pool already provides the parallelism
+        params["n_jobs"] = 1
+    ab_col = antibiotic_feature(model)
+    genes = [str(f) for f in model.feature_names_in_ if str(f) != ab_col]
+    return training.build_pipeline(training.estimator_family(clf), genes, ab_col,
+                                   _model_antibiotics(model), params)
+
+
+def _run_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    model = load_cached(task["model_path"])
+    df = load_cached(task["dataset_path"])
+    X, coverage = model_inputs(model, df)
+    y = df[LABEL_COLUMN].to_numpy()
+    result = {"model": task["model"], "dataset": task["dataset"], "kind": task["kind"]}
+
+    if task["kind"] == "fold":
+        train, test = task["train"], task["test"]
+        estimator = fold_estimator(model)
+        estimator.fit(X.iloc[train], y[train])
+        probs = estimator.predict_proba(X.iloc[test])[:, 1]
+        result.update({"fold": task["fold"], "test": test, "probs": probs,
+                       "metrics": binary_metrics(y[test], probs)})
+    else:
+        rows = np.arange(len(df))
+        if task["kind"] == "transfer":
+            # Only antibiotics the model was trained on carry a signal
+            rows = np.flatnonzero(df["antibiotic"].astype(str).isin(task["antibiotics"]).to_numpy())
+        probs = model.predict_proba(X.iloc[rows])[:, 1]
+        result["report"] = evaluate_predictions(df.iloc[rows], y[rows], probs, task["bins"])
+        result["report"]["coverage"] = coverage
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def _try_task(task: Dict[str, Any]) -> Dict[str, Any]:
+    """_run_task, with a failure returned as the task's result."""
+    start = time.perf_counter()
+    try:
+        return _run_task(task)
+    except Exception as e:
+        logger.error(f"Evaluation task {task['kind']} {task['model']} on {task['dataset']} failed: {e}")
+        return {"model": task["model"], "dataset": task["dataset"], "kind": task["kind"],
+                "fold": task.get("fold"), "error": f"{type(e).__name__}: {e}",
+                "seconds": round(time.perf_counter() - start, 3)}
+
+
+# ── Orchestration ──
+
+def discover_models(names: Optional[List[str]] = None) -> Dict[str, Path]:
+    found = {p.parent.name: p for p in sorted(MODELS_DIR.glob("*/model.pkl"))}
+    if names:
+        unknown = [n for n in names if n not in found]
+        if unknown:
+            raise ValueError(f"No model.pkl for {unknown}. Available: {list(found)}.")
+        found = {n: found[n] for n in names}
+    return found
+
+
+def _model_antibiotics(model) -> List[str]:
+    encoder = model.steps[0][1]
+    for _, transformer, _ in encoder.transformers_:
+        if hasattr(transformer, "categories_"):
+            return [str(c) for c in transformer.categories_[0]]
+    return []
+
+
+def run_evaluation(models: Optional[List[str]] = None, folds: int = N_FOLDS, workers: Optional[int] = None,
+                   transfer: bool = True, bins: int = CALIBRATION_BINS,
+                   eval_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """Evaluate the shipped models and write a versioned report. Returns the report."""
+    run_start = time.perf_counter()
+    eval_dir = Path(eval_dir or EVAL_DIR)
+    model_paths = {n: p for n, p in discover_models(models).items() if n in MODEL_DATASETS}
+    if not model_paths:
+        raise ValueError("No evaluable models found.")
+
+    # Each dataset is parsed (or read from cache) exactly once
+    t0 = time.perf_counter()
+    wanted = list(MODEL_DATASETS) if transfer else list(model_paths)
+    datasets = {}
+    for name in wanted:
+        df, digest, cache_path = cached_dataset(name, eval_dir / "cache")
+        datasets[name] = {"frame": df, "sha256": digest, "cache": str(cache_path)}
+    dataset_s = time.perf_counter() - t0
+
+    loaded = {name: joblib.load(path) for name, path in model_paths.items()}
+    tasks = []
+    for name, path in model_paths.items():
+        own = datasets[name]
+        base = {"model": name, "model_path": str(path), "bins": bins}
+        tasks.append({**base, "kind": "apparent", "dataset": name, "dataset_path": own["cache"]})
+
+        df = own["frame"]
+        n_splits = min(folds, df["genome_id"].nunique())
+        if n_splits >= 2:
+            splitter = GroupKFold(n_splits=n_splits)
+            for k, (train, test) in enumerate(splitter.split(df, groups=df["genome_id"].cat.codes)):
+                tasks.append({**base, "kind": "fold", "fold": k, "dataset": name,
+                              "dataset_path": own["cache"], "train": train, "test": test})
+
+        if transfer:
+            antibiotics = _model_antibiotics(loaded[name])
+            for other, info in datasets.items():
+                if other == name:
+                    continue
+                _, coverage = model_inputs(loaded[name], info["frame"].iloc[:0])
+                shared = set(antibiotics) & set(info["frame"]["antibiotic"].astype(str).unique())
+                if coverage["covered_genes"] == 0 or not shared:
+                    continue
+                tasks.append({**base, "kind": "transfer", "dataset": other, "dataset_path": info["cache"],
+                              "antibiotics": sorted(shared)})
+
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    logger.info(f"Evaluating {len(model_paths)} models: {len(tasks)} tasks on {workers} workers")
+    t0 = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_try_task, tasks))
+    else:
+        results = [_try_task(t) for t in tasks]
+    tasks_s = time.perf_counter() - t0
+
+    report_results: Dict[str, Dict[str, Any]] = {name: {"transfer": {}, "errors": []} for name in model_paths}
+    fold_results: Dict[str, List[Dict[str, Any]]] = {name: [] for name in model_paths}
+    for res in results:
+        if "error" in res:
+            report_results[res["model"]]["errors"].append(
+                {k: res[k] for k in ("kind", "dataset", "fold", "error") if res[k] is not None})
+        elif res["kind"] == "apparent":
+            report_results[res["model"]]["apparent"] = res["report"]
+        elif res["kind"] == "transfer":
+            report_results[res["model"]]["transfer"][res["dataset"]] = res["report"]
+        else:
+            fold_results[res["model"]].append(res)
+
+    # Out-of-fold predictions → one cross-validated report per model
+    for name, fold_list in fold_results.items():
+        if not fold_list:
+            continue
+        df = datasets[name]["frame"]
+        y = df[LABEL_COLUMN].to_numpy()
+        # Rows of failed folds have no out-of-fold prediction
+        scored = np.zeros(len(df), dtype=bool)
+        oof = np.empty(len(df))
+        for res in fold_list:
+            oof[res["test"]] = res["probs"]
+            scored[res["test"]] = True
+        if scored.all():
+            cv = evaluate_predictions(df, y, oof, bins)
+        else:
+            cv = evaluate_predictions(df[scored], y[scored], oof[scored], bins)
+        cv["folds"] = [dict(res["metrics"], fold=res["fold"]) for res in sorted(fold_list, key=lambda r: r["fold"])]
+        report_results[name]["cross_validation"] = cv
+
+    settings = {"folds": folds, "bins": bins, "transfer": transfer, "workers": workers}
+    model_info = {name: {"path": str(path), "sha256": file_digest(path),
+                         "features": [str(f) for f in loaded[name].feature_names_in_]}
+                  for name, path in model_paths.items()}
+    dataset_info = {name: {"path": MODEL_DATASETS[name], "sha256": info["sha256"],
+                           "rows": int(len(info["frame"])),
+                           "genomes": int(info["frame"]["genome_id"].nunique())}
+                    for name, info in datasets.items()}
+    fingerprint = hashlib.sha256(json.dumps(
+        [settings, {n: m["sha256"] for n, m in model_info.items()},
+         {n: d["sha256"] for n, d in dataset_info.items()}], sort_keys=True).encode()).hexdigest()
+
+    report = {
+        "format": REPORT_FORMAT,
+        "id": f"{time.strftime('%Y%m%dT%H%M%S')}-{fingerprint[:8]}",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": settings,
+        "models": model_info,
+        "datasets": dataset_info,
+        "results": report_results,
+        "timings": {
+            "datasets_s": round(dataset_s, 3),
+            "tasks_s": round(tasks_s, 3),
+            "task_cpu_s": round(sum(r["seconds"] for r in results), 3),
+            "total_s": round(time.perf_counter() - run_start, 3),
+        },
+    }
+    reports_dir = eval_dir / "reports"
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    with open(reports_dir / f"{report['id']}.json", "w") as fh:
+        json.dump(report, fh, indent=2)
+    logger.info(f"Evaluation report {report['id']} written in {report['timings']['total_s']}s")
+    return report
+
+
+# ── Reports ──
+
+def load_report(report_id: str, eval_dir: Optional[Path] = None) -> Optional[Dict[str, Any]]:
+    if not REPORT_ID_RE.match(report_id):
+        return None
+    path = Path(eval_dir or EVAL_DIR) / "reports" / f"{report_id}.json"
+    if not path.is_file():
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def list_reports(limit: int = 50, eval_dir: Optional[Path] = None) -> List[Dict[str, Any]]:
+    reports_dir = Path(eval_dir or EVAL_DIR) / "reports"
+    if not reports_dir.exists():
+        return []
+    out = []
+    for path in sorted(reports_dir.glob("*.json"), reverse=True)[:limit]:
+        try:
+            with open(path) as fh:
+                rep = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        out.append({
+            "id": rep.get("id"),
+            "created": rep.get("created"),
+            "models": list(rep.get("models", {})),
+            "total_s": rep.get("timings", {}).get("total_s"),
+            "auc": {name: res.get("cross_validation", {}).get("overall", {}).get("auc")
+                    for name, res in rep.get("results", {}).items()},
+        })
+    return out
+
+
+# ── Background runs (admin endpoint) ──
+
+_run_lock = threading.Lock()
+_run_state: Dict[str, Any] = {"running": False, "last_report": None, "error": None}
+
+
+def start_evaluation(**kwargs) -> bool:
+    """Run an evaluation on a background thread; False if one is already running."""
+    if not _run_lock.acquire(blocking=False):
+        return False
+    _run_state.update(running=True, error=None)
+
+    def run():
+        try:
+            _run_state["last_report"] = run_evaluation(**kwargs)["id"]
+        except Exception as e:
+            logger.error(f"Evaluation failed: {e}")
+            _run_state["error"] = str(e)
+        finally:
+            _run_state["running"] = False
+            _run_lock.release()
+
+    threading.Thread(target=run, name="model-evaluation", daemon=True).start()
+    return True
+
+
+def evaluation_status() -> Dict[str, Any]:
+    return dict(_run_state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-dataset validation of the pathogen models.")
+    parser.add_argument("--models", nargs="*", help="Model directories to evaluate (default: all)")
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--bins", type=int, default=CALIBRATION_BINS, help="Calibration bins")
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument("--no-transfer", action="store_true", help="Skip scoring on other datasets")
+    parser.add_argument("--dir", type=Path, default=EVAL_DIR, help="Cache and report directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    report = run_evaluation(args.models, folds=args.folds, workers=args.workers,
+                            transfer=not args.no_transfer, bins=args.bins, eval_dir=args.dir)
+    print(f"\nReport {report['id']} ({report['timings']['total_s']}s)")
+    print(f"{'model':<14}{'dataset':<15}{'run':<18}{'n':>7}{'auc':>8}{'brier':>8}{'ece':>8}")
+    for name, res in report["results"].items():
+        runs = [("apparent", name, res.get("apparent")), ("cross_validation", name, res.get("cross_validation"))]
+        runs += [("transfer", ds, r) for ds, r in res["transfer"].items()]
+        for run, dataset, r in runs:
+            if r is None:
+                continue
+            o = r["overall"]
+            auc = "-" if o.get("auc") is None else f"{o['auc']:.3f}"
+            print(f"{name:<14}{dataset:<15}{run:<18}{o['n']:>7}{auc:>8}{o.get('brier', 0):>8.3f}"
+                  f"{r['calibration']['ece']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
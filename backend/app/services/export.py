@@ -0,0 +1,231 @@
+import io
+import logging
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+try:  # optional: only needed for Parquet exports
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from app.services.isolates import IsolateStore, MISSING_LABEL
+from app.services.query import MAX_RESULT_ROWS, QueryEngine, canonical_terms
+from app.services.vocabulary import ANTIBIOTICS, PATHOGENS, Vocabulary
+
+logger = logging.getLogger(__name__)
+
+# ── Streaming exports ───────────────────────────────────────────────
+# Exports are generators of encoded byte chunks. Row exports walk the
+# normalized phenotype table CHUNK_ROWS rows at a time, filter each slice
+# through per-category lookup tables and expand isolate attributes with a
+# categorical take, so memory stays bounded by one chunk whatever the
+# result size and the first bytes go out as soon as the first chunk is
+# encoded.
+
+EXPORT_FORMATS: Dict[str, Dict[str, str]] = {
+    "csv": {"media_type": "text/csv", "extension": "csv"},
+    "ndjson": {"media_type": "application/x-ndjson", "extension": "ndjson"},
+    "parquet": {"media_type": "application/vnd.apache.parquet", "extension": "parquet"},
+}
+ROW_COLUMNS = ["genome_id", "pathogen", "state", "region", "year", "antibiotic_name", "phenotype_label"]
+CHUNK_ROWS = 65536
+
+
+class ExportError(ValueError):
+    """Raised for unsupported export requests (maps to HTTP 400)."""
+
+
+def check_format(fmt: str):
+    if fmt not in EXPORT_FORMATS:
+        raise ExportError(f"Unknown export format '{fmt}'. Choose from {list(EXPORT_FORMATS)}.")
+    if fmt == "parquet" and pa is None:
+        raise ExportError("Parquet export requires pyarrow, which is not installed on this server.")
+
+
+# ── Row sources ──
+
+def _category_mask(categories: pd.Index, values: Optional[Sequence[str]],
+                   vocabulary: Optional[Vocabulary] = None) -> Optional[np.ndarray]:
+    """Boolean LUT over category codes (+1 trailing slot for missing, code -1).
+
+    With a vocabulary, values match categories by term (any spelling);
+    otherwise case-insensitively.
+    """
+    if not values:
+        return None
+    lut = np.zeros(len(categories) + 1, dtype=bool)
+    if vocabulary is not None:
+        lut[vocabulary.index([str(c) for c in categories]).select(values)] = True
+        return lut
+    wanted = {str(v).strip().lower() for v in values}
+    lut[:-1] = [str(c).lower() in wanted for c in categories]
+    return lut
+
+
+def row_chunks(store: IsolateStore, pathogen: Optional[Sequence[str]] = None,
+               antibiotic: Optional[Sequence[str]] = None, state: Optional[Sequence[str]] = None,
+               year_min: Optional[int] = None, year_max: Optional[int] = None,
+               chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Filtered per-test rows (ROW_COLUMNS) as DataFrame chunks; always yields at least one.
+
+    Filters are checked eagerly (unknown pathogens / antibiotics raise
+    QueryError) so errors surface before the response starts.
+    """
+    if pathogen:
+        pathogen = canonical_terms("pathogen", pathogen)
+    if antibiotic:
+        antibiotic = canonical_terms("antibiotic", antibiotic)
+    iso = store.isolates
+    ph = store.phenotypes
+
+    # Isolate-level filters collapse to one boolean per isolate
+    keep_isolate = np.ones(store.n_isolates, dtype=bool)
+    for col, values, vocabulary in (("pathogen", pathogen, PATHOGENS), ("state", state, None)):
+        lut = _category_mask(iso[col].cat.categories, values, vocabulary)
+        if lut is not None:
+            keep_isolate &= lut[iso[col].cat.codes.to_numpy()]
+    years = iso["year"].to_numpy()
+    if year_min is not None:
+        keep_isolate &= years >= year_min
+    if year_max is not None:
+        keep_isolate &= years <= year_max
+    ab_lut = _category_mask(ph["antibiotic_name"].cat.categories, antibiotic, ANTIBIOTICS)
+
+    iso_codes = {col: iso[col].cat.codes.to_numpy() for col in ("genome_id", "pathogen", "state", "region")}
+    isolate_idx = ph["isolate"].to_numpy()
+    ab_codes = ph["antibiotic_name"].cat.codes.to_numpy()
+    labels = ph["phenotype_label"].to_numpy()
+
+    def frame(sel_iso: np.ndarray, sel_ab: np.ndarray, sel_labels: np.ndarray) -> pd.DataFrame:
+        data: Dict[str, Any] = {}
+        for col in ROW_COLUMNS:
+            if col in iso_codes:
+                data[col] = pd.Categorical.from_codes(iso_codes[col][sel_iso], categories=iso[col].cat.categories,
+                                                      validate=False)
+            elif col == "year":
+                year = years[sel_iso]
+                missing = np.isnan(year)
+                data[col] = pd.arrays.IntegerArray(np.where(missing, 0, year).astype(np.int64), missing)
+            elif col == "antibiotic_name":
+                data[col] = pd.Categorical.from_codes(sel_ab, categories=ph["antibiotic_name"].cat.categories,
+                                                      validate=False)
+            else:
+                data[col] = pd.arrays.IntegerArray(sel_labels.astype(np.int64), sel_labels == MISSING_LABEL)
+        return pd.DataFrame(data, columns=ROW_COLUMNS)
+
+    def chunks() -> Iterator[pd.DataFrame]:
+        emitted = False
+        for lo in range(0, len(ph), chunk_rows):
+            hi = min(lo + chunk_rows, len(ph))
+            idx = isolate_idx[lo:hi]
+            mask = keep_isolate[idx]
+            if ab_lut is not None:
+                mask &= ab_lut[ab_codes[lo:hi]]
+            if not mask.any():
+                continue
+            emitted = True
+            yield frame(idx[mask], ab_codes[lo:hi][mask], labels[lo:hi][mask])
+        if not emitted:
+            empty = np.zeros(0, dtype=np.int64)
+            yield frame(empty, empty, empty)
+
+    return chunks()
+
+
+def aggregate_chunks(engine: QueryEngine, group_by: Sequence[str], measures: Sequence[str],
+                     filters: Dict[str, Sequence[str]], year_min: Optional[int] = None,
+                     year_max: Optional[int] = None, min_tested: int = 0,
+                     chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Aggregate table from the query engine, as DataFrame chunks.
+
+    The query runs eagerly so errors surface before the response starts.
+    """
+    result = engine.execute(group_by=group_by, filters=filters, measures=measures, year_min=year_min,
+                            year_max=year_max, min_tested=min_tested, limit=MAX_RESULT_ROWS)
+    if result["truncated"]:
+        raise ExportError(f"Aggregate has {result['total_groups']} groups, over the export limit of "
+                          f"{MAX_RESULT_ROWS}; add filters or fewer group_by dimensions.")
+    rows = result["rows"]
+    return (pd.DataFrame(rows[lo:lo + chunk_rows], columns=result["columns"])
+            for lo in range(0, max(len(rows), 1), chunk_rows))
+
+
+# ── Encoders ──
+
+class _ByteSink(io.RawIOBase):
+    """Write-only file object whose buffered bytes are drained after each chunk."""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts.clear()
+        return out
+
+
+def _encode(chunks: Iterator[pd.DataFrame], fmt: str) -> Iterator[bytes]:
+    if fmt == "csv":
+        header = True
+        for chunk in chunks:
+            yield chunk.to_csv(index=False, header=header).encode()
+            header = False
+    elif fmt == "ndjson":
+        for chunk in chunks:
+            if len(chunk):
+                text = chunk.to_json(orient="records", lines=True)
+                yield (text if text.endswith("\n") else text + "\n").encode()
+    else:
+        sink = _ByteSink()
+        writer = None
+        for chunk in chunks:
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(sink, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+        yield sink.drain()
+
+
+def encode_stream(chunks: Iterator[pd.DataFrame], fmt: str, compress: bool = False) -> Iterator[bytes]:
+    """Encode DataFrame chunks as CSV / NDJSON / Parquet bytes, optionally gzipped."""
+    check_format(fmt)
+    if not compress:
+        for part in _encode(chunks, fmt):
+            if part:
+                yield part
+        return
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 → gzip container
+    for part in _encode(chunks, fmt):
+        out = gz.compress(part)
+        if out:
+            yield out
+    yield gz.flush()
+
+
+def export_filename(name: str, fmt: str, compress: bool) -> str:
+    return f"{name}.{EXPORT_FORMATS[fmt]['extension']}{'.gz' if compress else ''}"
+
+
+def export_media_type(fmt: str, compress: bool) -> str:
+    return "application/gzip" if compress else EXPORT_FORMATS[fmt]["media_type"]
@@ -1,10 +1,15 @@
 import logging
+import math
+import time
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 from app.core.loader import ModelLoader
 from app.core.config import PROJECT_ROOT
+from app.core.metrics import GAARA_STAGE_DURATION, GAARA_ERRORS, record_cache
+from app.core.profiling import traced, record_span
+from app.services.vocabulary import ANTIBIOTICS, GENES, antibiotic_class, normalize
 
 logger = logging.getLogger(__name__)
 
@@ -53,39 +58,7 @@ GENE_ANTIBIOTIC_RELEVANCE: Dict[str, List[str]] = {
     "oqxA": ["fluoroquinolones"], "oqxB": ["fluoroquinolones"],
 }
 
-# Antibiotic → class mapping (lowercase keys)
-ANTIBIOTIC_CLASSES: Dict[str, str] = {
-    # Carbapenems
-    "meropenem": "carbapenems", "imipenem": "carbapenems", "ertapenem": "carbapenems",
-    # Cephalosporins
-    "ceftriaxone": "cephalosporins", "cefotaxime": "cephalosporins",
-    "ceftazidime": "cephalosporins", "cefepime": "cephalosporins",
-    "cefoxitin": "cephalosporins", "cefuroxime": "cephalosporins",
-    "cefalothin": "cephalosporins", "cefazolin": "cephalosporins",
-    "ceftiofur": "cephalosporins",
-    # Penicillins
-    "ampicillin": "penicillins", "amoxicillin": "penicillins",
-    "ampicillin/sulbactam": "penicillins",
-    "amoxicillin/clavulanic acid": "penicillins",
-    "piperacillin/tazobactam": "penicillins",
-    # Fluoroquinolones
-    "ciprofloxacin": "fluoroquinolones", "levofloxacin": "fluoroquinolones",
-    "norfloxacin": "fluoroquinolones", "nalidixic acid": "fluoroquinolones",
-    # Aminoglycosides
-    "gentamicin": "aminoglycosides", "tobramycin": "aminoglycosides",
-    "amikacin": "aminoglycosides", "streptomycin": "aminoglycosides",
-    # Tetracyclines
-    "tetracycline": "tetracyclines", "doxycycline": "tetracyclines",
-    # Phenicols
-    "chloramphenicol": "phenicols",
-    # Sulfonamides
-    "sulfamethoxazole": "sulfonamides",
-    "trimethoprim/sulfamethoxazole": "sulfonamides",
-    "trimethoprim": "sulfonamides",
-    # Other
-    "aztreonam": "monobactams",
-    "fosfomycin": "fosfomycin",
-}
+# Antibiotic → class mapping and antibiotic spellings: app.services.vocabulary
 
 # Genes that are KNOWN to confer resistance — override model if it says "Susceptible"
 KNOWN_RESISTANCE_GENES = {
@@ -103,12 +76,62 @@ GENE_ALIASES: Dict[str, List[str]] = {
 }
 
 
+# Perturbation attribution: exact Shapley enumerates all 2^m coalitions of the
+# m present genes; above MAX_EXACT_SHAPLEY_GENES permutations are sampled.
+ATTRIBUTION_METHODS = ("auto", "shapley", "loo", "sampled")
+MAX_EXACT_SHAPLEY_GENES = 12
+SAMPLED_SHAPLEY_ROWS = 4096   # default permutation budget, in scored rows
+
+
+# Risk score bands: below LOW_RISK_MAX "Low", below MODERATE_RISK_MAX "Moderate", else "High"
+LOW_RISK_MAX = 0.33
+MODERATE_RISK_MAX = 0.66
+
+
+def risk_category(score):
+    """Category of a risk score, or element-wise for an array of scores."""
+    if np.ndim(score):
+        score = np.asarray(score)
+        return np.where(score < LOW_RISK_MAX, "Low", np.where(score < MODERATE_RISK_MAX, "Moderate", "High"))
+    if score < LOW_RISK_MAX:
+        return "Low"
+    if score < MODERATE_RISK_MAX:
+        return "Moderate"
+    return "High"
+
+
+def attribution_direction(value: float) -> str:
+    """Direction of a signed attribution; a gene that moves the risk neither way is Neutral."""
+    if value > 0:
+        return "Resistant"
+    if value < 0:
+        return "Susceptible"
+    return "Neutral"
+
+
+def _observe_stage(stage: str, pathogen: str, start: float, end: float):
+    """Report a GAARA stage timing to metrics and the active request trace."""
+    GAARA_STAGE_DURATION.observe(end - start, stage, pathogen)
+    record_span(f"gaara.{stage}", start, end, pathogen=pathogen)
+
+
 class GAARA:
     def __init__(self):
         self.loader = ModelLoader.get_instance()
+        # pathogen → (csv mtime, gene importance map)
+        self._importance_cache: Dict[str, Tuple[float, Dict[str, float]]] = {}
+        # pathogen → (model id, antibiotics the model was trained on)
+        self._antibiotic_cache: Dict[str, Tuple[int, List[str]]] = {}
+        # model feature list → gene term id → the model's features for that gene
+        self._gene_features: Dict[Tuple[str, ...], Dict[int, List[str]]] = {}
 
+    @traced("load_feature_importance")
     def load_feature_importance(self, pathogen: str) -> Dict[str, float]:
-        """Load feature importance from CSV if available."""
+        """Load feature importance from CSV if available.
+
+        Parsed tables are cached per pathogen and re-read only when the
+        CSV's modification time changes.
+        """
         try:
             # Map pathogen name to folder name (e.g. "E. coli" -> "e_coli")
             # Currently loader uses keys like "e_coli", "k_pneumoniae"
@@ -117,16 +140,25 @@ class GAARA:
             
             csv_path = PROJECT_ROOT / "models" / pathogen / "feature_importance.csv"
             if csv_path.exists():
+                mtime = csv_path.stat().st_mtime
+                cached = self._importance_cache.get(pathogen)
+                if cached is not None and cached[0] == mtime:
+                    record_cache("feature_importance", True)
+                    return cached[1]
+                record_cache("feature_importance", False)
+
                 df = pd.read_csv(csv_path)
                 # Filter for genes
                 df_genes = df[df["feature_type"] == "gene"]
-                if not df_genes.empty:
-                    return dict(zip(df_genes["feature"], df_genes["model_importance"]))
+                importance = dict(zip(df_genes["feature"], df_genes["model_importance"])) if not df_genes.empty else {}
+                self._importance_cache[pathogen] = (mtime, importance)
+                return importance
             return {}
         except Exception as e:
             logger.warning(f"Could not load feature importance for {pathogen}: {e}")
             return {}
 
+    @traced("get_model_features")
     def get_model_features(self, model, pathogen: str) -> List[str]:
         """Extract feature names from the model."""
         try:
@@ -218,7 +250,7 @@ class GAARA:
             return 1.0
             
         # Filter features that are genes
-        model_genes = [f.replace("gene_", "") for f in expected_features if f.startswith("gene_")]
+        model_genes = {GENES.add(f) for f in expected_features if f.startswith("gene_")}
         
         if not model_genes:
             return 1.0
@@ -232,7 +264,7 @@ class GAARA:
         if not user_genes_present:
             return 1.0
             
-        covered_count = sum(1 for g in user_genes_present if g in model_genes)
+        covered_count = sum(1 for g in user_genes_present if GENES.resolve(g) in model_genes)
         coverage_ratio = covered_count / len(user_genes_present)
         
         # Base weight 1.0, plus up to 2.0 bonus for full coverage
@@ -242,7 +274,7 @@ class GAARA:
     def is_gene_relevant(gene_name: str, antibiotic: str) -> bool:
         """Check if a gene is biologically relevant to the given antibiotic.
         If gene is unknown in our mapping, we allow it through (permissive)."""
-        ab_class = ANTIBIOTIC_CLASSES.get(antibiotic.lower())
+        ab_class = antibiotic_class(antibiotic)
         if ab_class is None:
             return True  # Unknown antibiotic class → allow all genes
         
@@ -260,6 +292,7 @@ class GAARA:
             return "Resistant"
         return model_direction
 
+    @traced("decompose_risk")
     def decompose_risk(self, risk_score: float, coef_map: Dict[str, float],
                        input_presence: Dict[str, int], antibiotic: str = "") -> Dict[str, Dict[str, Any]]:
         """
@@ -348,6 +381,112 @@ class GAARA:
         
         return contributions
 
+    def build_feature_matrix(self, expected_features: List[str], antibiotics: List[str],
+                             gene_columns: Dict[str, Any]) -> Tuple[pd.DataFrame, List[Dict[str, int]]]:
+        """Model input frame with one row per entry of `antibiotics`.
+
+        `gene_columns` maps gene features to a scalar or per-row values; as in
+        predict_risk, gene settings are applied after the antibiotic columns.
+        Returns the frame and each row's one-hot antibiotic inputs.
+        """
+        n = len(antibiotics)
+        columns: Dict[str, Any] = {feat: np.zeros(n, dtype=np.int64) for feat in expected_features}
+        resolved: Dict[str, Tuple[Dict[str, Any], Dict[str, int]]] = {}
+        ohe_rows = []
+        for i, ab in enumerate(antibiotics):
+            if ab not in resolved:
+                resolved[ab] = self.build_antibiotic_inputs(expected_features, ab)
+            raw_ab, ohe_ab = resolved[ab]
+            for feat, value in raw_ab.items():
+                if not isinstance(columns.get(feat), list):
+                    columns[feat] = [0] * n
+                columns[feat][i] = value
+            for feat in ohe_ab:
+                columns[feat][i] = 1
+            ohe_rows.append(ohe_ab)
+        for feat, values in gene_columns.items():
+            columns[feat] = np.broadcast_to(np.asarray(values, dtype=np.int64), (n,))
+
+        df_input = pd.DataFrame(columns)
+        if expected_features:
+            df_input = df_input[expected_features]
+        return df_input, ohe_rows
+
+    # Raw antibiotic columns a pipeline may encode itself
+    ANTIBIOTIC_COLUMNS = ("antibiotic_name", "Antibiotic", "cat__Antibiotic", "cat__antibiotic_name")
+
+    def build_antibiotic_inputs(self, expected_features: List[str],
+                                antibiotic: str) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """Feature values selecting `antibiotic`.
+
+        Returns (raw, one_hot): a raw categorical column set to the name, or
+        the matching one-hot columns set to 1.
+        """
+        for key_variant in self.ANTIBIOTIC_COLUMNS:
+            if key_variant in expected_features:
+                return {key_variant: self.model_antibiotic(antibiotic)}, {}
+        # OHE check
+        # We need to find the column that corresponds to this antibiotic
+        # e.g. "antibiotic_name_meropenem" or "cat__antibiotic_name_meropenem"
+        target_ab = self.model_antibiotic(antibiotic)
+        one_hot = {}
+        for feat in expected_features:
+            # Clean feature to check match
+            clean = feat.lower().replace("num__", "").replace("cat__", "")
+            if f"antibiotic_name_{target_ab}" in clean or f"antibiotic_{target_ab}" in clean:
+                one_hot[feat] = 1
+        return {}, one_hot
+
+    @staticmethod
+    def model_antibiotic(antibiotic: str) -> str:
+        """The spelling models are trained on: the lower-case canonical name
+        for any known spelling (e.g. "Co-trimoxazole" → "trimethoprim/sulfamethoxazole")."""
+        term = ANTIBIOTICS.resolve(antibiotic)
+        return normalize(antibiotic) if term is None else ANTIBIOTICS.term_key(term)
+
+    def gene_feature_index(self, expected_features: List[str]) -> Dict[int, List[str]]:
+        """Gene term id → the model features for that gene, built once per
+        feature list (gene features are classified as in decompose_risk)."""
+        key = tuple(expected_features)
+        index = self._gene_features.get(key)
+        if index is None:
+            index = {}
+            for feat in expected_features:
+                clean = feat.replace("num__", "").replace("cat__", "")
+                is_gene = clean != "gene_any_present" and (clean.startswith("gene_") or (
+                    not clean.startswith(("antibiotic", "Antibiotic")) and "_name_" not in clean))
+                if is_gene:
+                    index.setdefault(GENES.add(clean), []).append(feat)
+            self._gene_features[key] = index
+        return index
+
+    def build_gene_inputs(self, expected_features: List[str], gene_presence: Dict[str, int]) -> Dict[str, int]:
+        """Gene feature values (with alias expansion and gene_any_present).
+
+        User gene names match model features in any case, with or without
+        the gene_ prefix.
+        """
+        index = self.gene_feature_index(expected_features)
+        values = {}
+        any_gene = 0
+        expanded_genes = dict(gene_presence)  # copy
+        for alias, targets in GENE_ALIASES.items():
+            if alias in expanded_genes and expanded_genes[alias] == 1:
+                for t in targets:
+                    clean_t = t.replace("gene_", "")
+                    if clean_t not in expanded_genes:
+                        expanded_genes[clean_t] = 1
+
+        for gene, present in expanded_genes.items():
+            if present: any_gene = 1
+            for feat in index.get(GENES.resolve(gene), ()):
+                values[feat] = present
+
+        if "gene_any_present" in expected_features:
+            values["gene_any_present"] = any_gene
+        return values
+
+    @traced("predict_risk")
     def predict_risk(self, antibiotic: str, gene_presence: Dict[str, int]) -> Dict[str, Any]:
         """
         Run GAARA aggregation for a given antibiotic and gene profile.
@@ -364,69 +503,31 @@ class GAARA:
         for pathogen, model in self.loader.models.items():
             try:
                 # --- A. Feature Extraction & Input Prep ---
+                stage_start = time.perf_counter()
                 expected_features = self.get_model_features(model, pathogen)
                 
-                # Initialize default 0
+                # Initialize default 0, then set antibiotic and genes
                 input_data = {feat: [0] for feat in expected_features}
                 simple_input_map = {feat: 0 for feat in expected_features} # For easier lookup in decomposition
-                
-                # Set Antibiotic
-                # Try various formats including OHE and prefixes
-                target_ab = antibiotic.lower()
-                
-                # Check direct "Antibiotic" or "antibiotic_name" or "cat__Antibiotic"
-                for key_variant in ["antibiotic_name", "Antibiotic", "cat__Antibiotic", "cat__antibiotic_name"]:
-                    if key_variant in expected_features:
-                        input_data[key_variant] = [antibiotic]
-                        break
-                else:
-                    # OHE check
-                    # We need to find the column that corresponds to this antibiotic
-                    # e.g. "antibiotic_name_meropenem" or "cat__antibiotic_name_meropenem"
-                    for feat in expected_features:
-                        # Clean feature to check match
-                        clean = feat.lower().replace("num__", "").replace("cat__", "")
-                        if f"antibiotic_name_{target_ab}" in clean or f"antibiotic_{target_ab}" in clean:
-                             input_data[feat] = [1]
-                             simple_input_map[feat] = 1
-
-                # Set Genes (with alias expansion)
-                any_gene = 0
-                expanded_genes = dict(gene_presence)  # copy
-                for alias, targets in GENE_ALIASES.items():
-                    if alias in expanded_genes and expanded_genes[alias] == 1:
-                        for t in targets:
-                            clean_t = t.replace("gene_", "")
-                            if clean_t not in expanded_genes:
-                                expanded_genes[clean_t] = 1
-                
-                for gene, present in expanded_genes.items():
-                    if present: any_gene = 1
-                    
-                    for feat in expected_features:
-                        clean_feat = feat.replace("num__", "").replace("cat__", "")
-                        
-                        if clean_feat == f"gene_{gene}":
-                            input_data[feat] = [present]
-                            simple_input_map[feat] = present
-                        elif clean_feat.lower() == f"gene_{gene}".lower():
-                             input_data[feat] = [present]
-                             simple_input_map[feat] = present
-                        elif clean_feat == gene:
-                             input_data[feat] = [present]
-                             simple_input_map[feat] = present
-
-                if "gene_any_present" in input_data:
-                    input_data["gene_any_present"] = [any_gene]
-                    simple_input_map["gene_any_present"] = any_gene
-                
+                raw_ab, ohe_ab = self.build_antibiotic_inputs(expected_features, antibiotic)
+                for feat, value in {**raw_ab, **ohe_ab}.items():
+                    input_data[feat] = [value]
+                simple_input_map.update(ohe_ab)
+                for feat, value in self.build_gene_inputs(expected_features, gene_presence).items():
+                    input_data[feat] = [value]
+                    simple_input_map[feat] = value
+
                 # Prepare DF
                 df_input = pd.DataFrame(input_data)
                 # Align columns exactly
                 if expected_features:
                     df_input = df_input[expected_features]
 
+                stage_end = time.perf_counter()
+                _observe_stage("feature_build", pathogen, stage_start, stage_end)
+
                 # --- B. Prediction ---
+                stage_start = stage_end
                 logger.debug(f"{pathogen} - Expected features: {expected_features[:5]}")
                 prob = 0.0
                 if hasattr(model, "predict_proba"):
@@ -436,8 +537,11 @@ class GAARA:
                     except Exception as e:
                         logger.warning(f"Prediction error for {pathogen}: {e}")
                         prob = 0.0
+                stage_end = time.perf_counter()
+                _observe_stage("predict_proba", pathogen, stage_start, stage_end)
                 
                 # --- C. Weighting & Decomposition ---
+                stage_start = stage_end
                 
                 # 1. Coverage Weight
                 weight = self.calculate_coverage_weight(expected_features, gene_presence)
@@ -472,12 +576,318 @@ class GAARA:
                 })
                 
                 total_weight += weight
+                _observe_stage("decompose_risk", pathogen, stage_start, time.perf_counter())
 
             except Exception as e:
                 logger.error(f"Error processing {pathogen}: {str(e)}")
+                GAARA_ERRORS.inc(pathogen)
                 continue
 
         # --- D. Aggregation ---
+        stage_start = time.perf_counter()
+        result = self.aggregate(pathogen_results, total_weight)
+        _observe_stage("aggregation", "all", stage_start, time.perf_counter())
+        return result
+
+    def get_model_antibiotics(self, model, pathogen: str, expected_features: List[str]) -> List[str]:
+        """Antibiotics a model was trained on.
+
+        Read from the fitted encoder of a raw antibiotic column, or parsed
+        from one-hot antibiotic feature names.
+        """
+        cached = self._antibiotic_cache.get(pathogen)
+        if cached is not None and cached[0] == id(model):
+            return cached[1]
+
+        antibiotics: List[str] = []
+        raw_key = next((k for k in self.ANTIBIOTIC_COLUMNS if k in expected_features), None)
+        if raw_key is not None:
+            for _, step in getattr(model, "steps", []):
+                for _, transformer, columns in getattr(step, "transformers_", []):
+                    columns = [columns] if isinstance(columns, str) else list(columns)
+                    if raw_key in columns and hasattr(transformer, "categories_"):
+                        antibiotics = [str(c) for c in transformer.categories_[columns.index(raw_key)]]
+        else:
+            for feat in expected_features:
+                clean = feat.replace("num__", "").replace("cat__", "")
+                for prefix in ("antibiotic_name_", "Antibiotic_", "antibiotic_"):
+                    if clean.startswith(prefix):
+                        antibiotics.append(clean[len(prefix):])
+                        break
+
+        self._antibiotic_cache[pathogen] = (id(model), antibiotics)
+        return antibiotics
+
+    @traced("predict_antibiogram")
+    def predict_antibiogram(self, gene_presence: Dict[str, int],
+                            antibiotics: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Run GAARA for every antibiotic in a panel for one gene profile.
+        Each pathogen model scores a single feature matrix (one row per
+        panel antibiotic) in one predict_proba call; each antibiotic is then
+        decomposed and aggregated exactly as in predict_risk.
+        The default panel is every antibiotic known to any loaded model;
+        requested antibiotics no model knows are listed under "unknown".
+        """
+        models = list(self.loader.models.items())
+        features = {pathogen: self.get_model_features(model, pathogen) for pathogen, model in models}
+        # Model spelling → display name of every antibiotic a model was trained on
+        known: Dict[str, str] = {}
+        for pathogen, model in models:
+            for ab in self.get_model_antibiotics(model, pathogen, features[pathogen]):
+                known.setdefault(self.model_antibiotic(ab), ANTIBIOTICS.canonical(ab) or ab)
+        unknown: List[str] = []
+        if antibiotics:
+            # One row per antibiotic term, whatever spellings were requested;
+            # names no vocabulary or model knows are reported, not scored
+            terms: Dict[str, str] = {}
+            for ab in antibiotics:
+                ab = ab.strip()
+                if not ab:
+                    continue
+                key = self.model_antibiotic(ab)
+                if key in known if known else ANTIBIOTICS.resolve(ab) is not None:
+                    terms.setdefault(key, ab)
+                elif ab not in unknown:
+                    unknown.append(ab)
+            panel = list(terms.values())
+        else:
+            panel = sorted(known.values())
+
+        results: Dict[str, List[Dict[str, Any]]] = {ab: [] for ab in panel}
+        weights: Dict[str, float] = {ab: 0.0 for ab in panel}
+        n = len(panel)
+
+        for pathogen, model in models:
+            if n == 0:
+                break
+            try:
+                # --- A. One row per antibiotic; genes are shared by every row ---
+                stage_start = time.perf_counter()
+                expected_features = features[pathogen]
+                gene_inputs = self.build_gene_inputs(expected_features, gene_presence)
+                df_input, ohe_rows = self.build_feature_matrix(expected_features, panel, gene_inputs)
+                stage_end = time.perf_counter()
+                _observe_stage("feature_build", pathogen, stage_start, stage_end)
+
+                # --- B. Prediction (single call for the whole panel) ---
+                stage_start = stage_end
+                probs = np.zeros(n)
+                if hasattr(model, "predict_proba"):
+                    try:
+                        probs = model.predict_proba(df_input)[:, 1]
+                    except Exception as e:
+                        logger.warning(f"Prediction error for {pathogen}: {e}")
+                stage_end = time.perf_counter()
+                _observe_stage("predict_proba", pathogen, stage_start, stage_end)
+
+                # --- C. Weighting & Decomposition per antibiotic ---
+                stage_start = stage_end
+                weight = self.calculate_coverage_weight(expected_features, gene_presence)
+                feature_names = expected_features
+                if not feature_names and hasattr(model, "feature_names_in_"):
+                    feature_names = list(model.feature_names_in_)
+                coef_map = self.load_feature_importance(pathogen)
+                if not coef_map:
+                    coef_map = self.get_coefficients_map(model, feature_names)
+
+                rows = []
+                for i, ab in enumerate(panel):
+                    simple_input_map = {feat: 0 for feat in expected_features}
+                    simple_input_map.update(ohe_rows[i])
+                    simple_input_map.update(gene_inputs)
+                    gene_attribs = self.decompose_risk(float(probs[i]), coef_map, simple_input_map, ab)
+                    rows.append({
+                        "name": pathogen,
+                        "risk": float(probs[i]),
+                        "weight": weight,
+                        "risk_mass": {g: d["score"] for g, d in gene_attribs.items()},
+                        "directions": {g: d["direction"] for g, d in gene_attribs.items()},
+                    })
+                for ab, row in zip(panel, rows):
+                    results[ab].append(row)
+                    weights[ab] += weight
+                _observe_stage("decompose_risk", pathogen, stage_start, time.perf_counter())
+
+            except Exception as e:
+                logger.error(f"Error processing {pathogen}: {str(e)}")
+                GAARA_ERRORS.inc(pathogen)
+                continue
+
+        # --- D. Aggregation per antibiotic ---
+        stage_start = time.perf_counter()
+        panel_results = []
+        for ab in panel:
+            entry = self.aggregate(results[ab], weights[ab])
+            panel_results.append({"antibiotic": ab, "antibiotic_class": antibiotic_class(ab), **entry})
+        _observe_stage("aggregation", "all", stage_start, time.perf_counter())
+        return {"antibiotics": panel_results, "panel_size": n, "unknown": unknown}
+
+    @staticmethod
+    def _coalitions(m: int, method: str, samples: Optional[int], seed: int):
+        """Coalition matrix (rows × m, bool) for an attribution method plus the
+        state needed to turn coalition values back into per-gene attributions."""
+        if method == "shapley":
+            masks = np.arange(1 << m, dtype=np.int64)
+            return ((masks[:, None] >> np.arange(m)) & 1).astype(bool), masks
+        if method == "loo":
+            # Rows: full profile, empty profile, then each gene knocked out
+            z = np.ones((m + 2, m), dtype=bool)
+            z[1] = False
+            z[np.arange(2, m + 2), np.arange(m)] = False
+            return z, None
+        n_perm = samples or max(32, SAMPLED_SHAPLEY_ROWS // (m + 1))
+        rng = np.random.default_rng(seed)
+        perms = np.argsort(rng.random((n_perm, m)), axis=1)
+        ranks = np.argsort(perms, axis=1)                      # position of each gene
+        steps = np.arange(m + 1)
+        z = ranks[:, None, :] < steps[None, :, None]           # (perm, step, gene)
+        return z.reshape(-1, m), ranks
+
+    @staticmethod
+    def _attributions(v: np.ndarray, m: int, method: str, state) -> Tuple[np.ndarray, Optional[np.ndarray], float, float]:
+        """Per-gene attributions from coalition values: (phi, stderr, full, baseline)."""
+        if method == "shapley":
+            masks = state
+            sizes = ((masks[:, None] >> np.arange(m)) & 1).sum(axis=1)
+            weight = np.array([math.factorial(k) * math.factorial(m - k - 1) / math.factorial(m)
+                               for k in range(m)] + [0.0])
+            phi = np.empty(m)
+            for j in range(m):
+                without = masks[((masks >> j) & 1) == 0]
+                phi[j] = np.sum(weight[sizes[without]] * (v[without | (1 << j)] - v[without]))
+            return phi, None, float(v[-1]), float(v[0])
+        if method == "loo":
+            return v[0] - v[2:], None, float(v[0]), float(v[1])
+        ranks = state
+        path = v.reshape(ranks.shape[0], m + 1)
+        rows = np.arange(ranks.shape[0])[:, None]
+        marginals = path[rows, ranks + 1] - path[rows, ranks]  # (perm, gene)
+        stderr = marginals.std(axis=0, ddof=1) / np.sqrt(len(marginals)) if len(marginals) > 1 else None
+        return marginals.mean(axis=0), stderr, float(path[0, -1]), float(path[0, 0])
+
+    @traced("attribute_risk")
+    def attribute_risk(self, antibiotic: str, gene_presence: Dict[str, int], method: str = "auto",
+                       samples: Optional[int] = None, seed: int = 0) -> Dict[str, Any]:
+        """
+        Attribute each pathogen's predicted risk to the present genes by
+        re-scoring perturbed (knocked-out) profiles.
+        Methods: "loo" (leave-one-out), "shapley" (exact, all coalitions),
+        "sampled" (permutation-sampled Shapley), "auto" (exact Shapley up to
+        MAX_EXACT_SHAPLEY_GENES present genes, sampled above).
+        All perturbations for a model are scored in one predict_proba call.
+        """
+        if method not in ATTRIBUTION_METHODS:
+            raise ValueError(f"Unknown attribution method '{method}'. Choose from {list(ATTRIBUTION_METHODS)}.")
+        if method == "shapley" and sum(1 for v in gene_presence.values() if v == 1) > 20:
+            raise ValueError("Exact Shapley is limited to 20 present genes; use 'sampled'.")
+
+        pathogen_results = []
+        total_weight = 0.0
+        for pathogen, model in self.loader.models.items():
+            try:
+                stage_start = time.perf_counter()
+                expected_features = self.get_model_features(model, pathogen)
+                gene_inputs = self.build_gene_inputs(expected_features, gene_presence)
+                players = [f for f, v in gene_inputs.items() if v == 1 and f != "gene_any_present"]
+                m = len(players)
+                model_method = method
+                if method == "auto":
+                    model_method = "shapley" if m <= MAX_EXACT_SHAPLEY_GENES else "sampled"
+                if m == 0:
+                    model_method = "loo"
+
+                z, state = self._coalitions(m, model_method, samples, seed)
+                gene_columns: Dict[str, Any] = dict(gene_inputs)
+                for j, feat in enumerate(players):
+                    gene_columns[feat] = z[:, j]
+                if "gene_any_present" in gene_inputs:
+                    # Present genes the model has no feature for keep the flag set
+                    outside = gene_inputs["gene_any_present"] == 1 and sum(
+                        1 for v in gene_presence.values() if v == 1) > m
+                    gene_columns["gene_any_present"] = z.any(axis=1) | outside
+
+                # Score each distinct coalition once (sampled permutations repeat prefixes)
+                _, first, inverse = np.unique(np.packbits(z, axis=1), axis=0,
+                                              return_index=True, return_inverse=True)
+                inverse = inverse.ravel()
+                n_rows = len(first)
+                unique_columns = {f: (c[first] if isinstance(c, np.ndarray) else c)
+                                  for f, c in gene_columns.items()}
+                df_input, _ = self.build_feature_matrix(expected_features, [antibiotic] * n_rows, unique_columns)
+                stage_end = time.perf_counter()
+                _observe_stage("feature_build", pathogen, stage_start, stage_end)
+
+                stage_start = stage_end
+                probs = np.zeros(n_rows)
+                if hasattr(model, "predict_proba"):
+                    try:
+                        probs = model.predict_proba(df_input)[:, 1]
+                    except Exception as e:
+                        logger.warning(f"Prediction error for {pathogen}: {e}")
+                v = probs[inverse]
+                stage_end = time.perf_counter()
+                _observe_stage("predict_proba", pathogen, stage_start, stage_end)
+
+                stage_start = stage_end
+                phi, stderr, full, baseline = self._attributions(v, m, model_method, state)
+                attributions = {}
+                for j, feat in enumerate(players):
+                    clean_feat = feat.replace("num__", "").replace("cat__", "")
+                    gene_name = clean_feat.replace("gene_", "") if clean_feat.startswith("gene_") else clean_feat
+                    entry = {
+                        "value": float(phi[j]),
+                        "direction": attribution_direction(phi[j]),
+                        "relevant": self.is_gene_relevant(gene_name, antibiotic),
+                    }
+                    if stderr is not None:
+                        entry["stderr"] = float(stderr[j])
+                    attributions[gene_name] = entry
+
+                weight = self.calculate_coverage_weight(expected_features, gene_presence)
+                pathogen_results.append({
+                    "name": pathogen,
+                    "risk": full,
+                    "baseline": baseline,
+                    "weight": weight,
+                    "method": model_method,
+                    "evaluations": int(n_rows),
+                    "attributions": attributions,
+                })
+                total_weight += weight
+                _observe_stage("attribution", pathogen, stage_start, time.perf_counter())
+
+            except Exception as e:
+                logger.error(f"Error processing {pathogen}: {str(e)}")
+                GAARA_ERRORS.inc(pathogen)
+                continue
+
+        stage_start = time.perf_counter()
+        if total_weight == 0:
+            return {"antibiotic": antibiotic, "overall_risk_score": 0.0, "risk_category": "Low",
+                    "gene_attributions": {}, "pathogen_breakdown": []}
+        overall_risk = sum(r["risk"] * r["weight"] for r in pathogen_results) / total_weight
+        gene_attributions: Dict[str, Dict[str, Any]] = {}
+        for res in pathogen_results:
+            norm_w = res["weight"] / total_weight
+            for gene, entry in res["attributions"].items():
+                agg = gene_attributions.setdefault(gene, {"value": 0.0, "relevant": entry["relevant"]})
+                agg["value"] += entry["value"] * norm_w
+        for agg in gene_attributions.values():
+            agg["direction"] = attribution_direction(agg["value"])
+
+        _observe_stage("aggregation", "all", stage_start, time.perf_counter())
+        return {
+            "antibiotic": antibiotic,
+            "overall_risk_score": overall_risk,
+            "risk_category": risk_category(overall_risk),
+            "gene_attributions": gene_attributions,
+            "pathogen_breakdown": pathogen_results,
+        }
+
+    @staticmethod
+    def aggregate(pathogen_results: List[Dict[str, Any]], total_weight: float) -> Dict[str, Any]:
+        """Combine per-pathogen risks and gene masses into the GAARA response."""
         if total_weight == 0:
             return {
                 "overall_risk_score": 0.0, 
@@ -485,49 +895,63 @@ class GAARA:
                 "gene_drivers": {}, 
                 "pathogen_breakdown": []
             }
-            
-        # 1. Weighted Average of Risk
-        weighted_risk_sum = sum(res["risk"] * res["weight"] for res in pathogen_results)
-        overall_risk = weighted_risk_sum / total_weight
-        
-        # 2. Aggregate Gene contributions
-        # We want the "Global Attribution" of each gene to the final score.
-        # GlobalGeneRisk = Sum( (Weight_p / TotalWeight) * GeneRisk_p )
-        
-        global_gene_risk = {}
-        all_genes = set()
-        for res in pathogen_results:
-            all_genes.update(res["risk_mass"].keys())
-            
-        for gene in all_genes:
-            score = 0.0
-            direction_votes = []
-            
-            for res in pathogen_results:
-                if gene in res["risk_mass"]:
-                    # Normalized weight for this pathogen
-                    norm_w = res["weight"] / total_weight
-                    # Contribution from this pathogen
-                    contrib = res["risk_mass"][gene] * norm_w
-                    score += contrib
-                    direction_votes.append(res["directions"][gene])
-            
-            # Determine direction (majority vote or based on sign of max contrib)
-            # Default to Resistant if present
-            final_dir = "Resistant" 
-            if direction_votes.count("Susceptible") > direction_votes.count("Resistant"):
-                final_dir = "Susceptible"
-                
-            global_gene_risk[gene] = {"score": score, "direction": final_dir}
-
-        # Categories
-        if overall_risk < 0.33: risk_cat = "Low"
-        elif overall_risk < 0.66: risk_cat = "Moderate"
-        else: risk_cat = "High"
 
+        # One profile is a one-row batch
+        rows = GAARA.aggregate_rows([
+            {"risk": np.array([res["risk"]], dtype=np.float64),
+             "weight": np.array([res["weight"]], dtype=np.float64),
+             "drivers": {gene: (np.array([mass], dtype=np.float64), np.ones(1, dtype=bool),
+                                np.array([res["directions"][gene] == "Susceptible"]))
+                         for gene, mass in res["risk_mass"].items()}}
+            for res in pathogen_results
+        ], np.array([total_weight], dtype=np.float64))
+        global_gene_risk = {
+            gene: {"score": float(d["score"][0]),
+                   "direction": "Susceptible" if d["susceptible"][0] else "Resistant"}
+            for gene, d in rows["drivers"].items()
+        }
         return {
-            "overall_risk_score": overall_risk,
-            "risk_category": risk_cat,
+            "overall_risk_score": float(rows["risk"][0]),
+            "risk_category": str(rows["risk_category"][0]),
             "gene_drivers": global_gene_risk,
             "pathogen_breakdown": pathogen_results
         }
+
+    @staticmethod
+    def aggregate_rows(pathogen_results: List[Dict[str, Any]], total_weight: np.ndarray) -> Dict[str, Any]:
+        """Combine per-pathogen results for many profiles at once (row-wise arrays).
+
+        Each result holds per-row "risk" and "weight" arrays and "drivers":
+        gene → (risk mass, has an entry, direction is Susceptible) arrays.
+        Returns per-row "risk" and "risk_category", and per gene its
+        "score", whether the row has it as a driver ("has") and whether the
+        majority direction is Susceptible.
+        """
+        total_weight = np.asarray(total_weight, dtype=np.float64)
+        n = len(total_weight)
+        scored = total_weight > 0
+        safe_weight = np.where(scored, total_weight, 1.0)
+
+        # 1. Weighted Average of Risk
+        weighted_risk_sum = np.zeros(n)
+        for res in pathogen_results:
+            weighted_risk_sum += res["risk"] * res["weight"]
+        overall_risk = np.where(scored, weighted_risk_sum / safe_weight, 0.0)
+
+        # 2. Aggregate Gene contributions
+        # GlobalGeneRisk = Sum( (Weight_p / TotalWeight) * GeneRisk_p ); the
+        # direction is Susceptible only on a strict majority of pathogen votes
+        drivers: Dict[str, Dict[str, np.ndarray]] = {}
+        for res in pathogen_results:
+            norm_w = res["weight"] / safe_weight
+            for gene, (mass, has, susceptible) in res["drivers"].items():
+                entry = drivers.setdefault(gene, {"score": np.zeros(n), "has": np.zeros(n, dtype=bool),
+                                                  "votes": np.zeros(n, dtype=np.int64)})
+                entry["score"] = np.where(has, entry["score"] + mass * norm_w, entry["score"])
+                entry["has"] |= has
+                entry["votes"] += np.where(has, np.where(susceptible, 1, -1), 0)
+        for entry in drivers.values():
+            entry["has"] &= scored
+            entry["susceptible"] = entry.pop("votes") > 0
+
+        return {"risk": overall_risk, "risk_category": risk_category(overall_risk), "drivers": drivers}
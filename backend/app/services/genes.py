@@ -0,0 +1,155 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.services.isolates import IsolateStore
+from app.services.vocabulary import GENES, PATHOGENS
+
+logger = logging.getLogger(__name__)
+
+# ── Gene Distribution Index ─────────────────────────────────────────
+# Built once from the isolate table of the IsolateStore (one row per
+# genome, so no per-antibiotic duplicates). For every gene it keeps
+#   carriers – isolates carrying the gene
+#   typed    – isolates whose genotype panel covers the gene
+# over (gene × pathogen × state × year) cells, plus the pathogen/year
+# marginals for the gene × state view. A map lookup is a slice of
+# O(states) counts; raw isolates are never rescanned per request.
+
+GENE_PREFIX = "gene_"
+ANY_GENE = "any"
+UNKNOWN_LABEL = "Unknown"
+
+
+class GeneDistributionIndex:
+    def __init__(self, store: IsolateStore, states: Sequence[str]):
+        profiles = store.isolates
+        self.genes: List[str] = list(store.genes) + [ANY_GENE]
+        self._gene_lookup = GENES.index(store.genes)   # the trailing "any" row is not a term
+        self.states: List[str] = list(states) + [UNKNOWN_LABEL]
+        self._state_lookup = {s: i for i, s in enumerate(self.states)}
+        self.n_isolates = store.n_isolates
+
+        if profiles.empty:
+            self.pathogens: List[str] = []
+            self.years: List[int] = []
+            self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+            shape = (len(self.genes), 0, len(self.states), 1)
+            self.carriers = np.zeros(shape, dtype=np.int32)
+            self.typed = np.zeros(shape, dtype=np.int32)
+            self._finalize()
+            return
+
+        # Axis codes: pathogen, state (+Unknown), year (+Unknown)
+        pathogen = profiles["pathogen"].astype(str)
+        self.pathogens = sorted(pathogen.unique())
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+        p_idx = pd.Categorical(pathogen, categories=self.pathogens).codes.astype(np.int64)
+
+        unknown_state = len(self.states) - 1
+        s_idx = (profiles["state"].astype(object).map(self._state_lookup)
+                 .fillna(unknown_state).to_numpy(dtype=np.int64))
+
+        years = pd.to_numeric(profiles["year"], errors="coerce").to_numpy(dtype=np.float64)
+        valid = ~np.isnan(years)
+        self.years = [int(y) for y in np.unique(years[valid])]
+        y_idx = np.full(len(years), len(self.years), dtype=np.int64)
+        y_idx[valid] = np.searchsorted(self.years, years[valid].astype(np.int64))
+
+        shape = (len(self.pathogens), len(self.states), len(self.years) + 1)
+        cell = np.ravel_multi_index((p_idx, s_idx, y_idx), shape)
+        n_cells = int(np.prod(shape))
+
+        typed = store.gene_typed()
+        present = store.gene_presence() & typed
+        present = np.column_stack([present, present.any(axis=1)])
+        typed = np.column_stack([typed, typed.any(axis=1)])
+
+        self.carriers = np.stack([
+            np.bincount(cell, weights=present[:, g], minlength=n_cells) for g in range(present.shape[1])
+        ]).astype(np.int32).reshape((len(self.genes),) + shape)
+        self.typed = np.stack([
+            np.bincount(cell, weights=typed[:, g], minlength=n_cells) for g in range(typed.shape[1])
+        ]).astype(np.int32).reshape((len(self.genes),) + shape)
+        self._finalize()
+        logger.info(f"Gene distribution index: {self.n_isolates} isolates, "
+                    f"{len(self.genes) - 1} genes, {len(self.pathogens)} pathogens")
+
+    def _finalize(self):
+        # gene × state marginals for the default (all pathogens, all years) view
+        self.carriers_by_state = self.carriers.sum(axis=(1, 3))
+        self.typed_by_state = self.typed.sum(axis=(1, 3))
+
+    # ── Lookup ──
+
+    def resolve_gene(self, gene: Optional[str]) -> Optional[int]:
+        """Case-insensitive gene lookup, with or without the ``gene_`` prefix."""
+        if gene is None or gene.strip().lower() == ANY_GENE:
+            return len(self.genes) - 1
+        return self._gene_lookup.get(gene)
+
+    def gene_state_counts(self, pathogen: Optional[str] = None,
+                          year: Optional[int] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(carriers, typed) as gene × state arrays; None for an unknown pathogen/year."""
+        if pathogen is None and year is None:
+            return self.carriers_by_state, self.typed_by_state
+        carriers, typed = self.carriers, self.typed
+        if pathogen is not None:
+            p = self._pathogen_lookup.get(pathogen)
+            if p is None:
+                return None
+            carriers, typed = carriers[:, p:p + 1], typed[:, p:p + 1]
+        if year is not None:
+            if year not in self.years:
+                return None
+            y = self.years.index(year)
+            carriers, typed = carriers[..., y:y + 1], typed[..., y:y + 1]
+        return carriers.sum(axis=(1, 3)), typed.sum(axis=(1, 3))
+
+    def distribution(self, gene: Optional[str] = None, pathogen: Optional[str] = None,
+                     year: Optional[int] = None, top: int = 0) -> Optional[Dict[str, Dict[str, Any]]]:
+        """Per-state carriers/typed counts for one gene (or any gene).
+
+        With `top` > 0 each state also lists its most prevalent genes under
+        the same filters. Returns None when the gene, pathogen or year is unknown.
+        """
+        gene_idx = self.resolve_gene(gene)
+        if gene_idx is None:
+            return None
+        counts = self.gene_state_counts(pathogen, year)
+        if counts is None:
+            return None
+        carriers, typed = counts
+        out = {
+            state: {"carriers": int(carriers[gene_idx, i]), "typed": int(typed[gene_idx, i])}
+            for i, state in enumerate(self.states)
+        }
+        if top > 0:
+            # Ranking over real genes only (drop the trailing "any" row)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                prevalence = np.where(typed[:-1] > 0, carriers[:-1] / typed[:-1], 0.0)
+            order = np.argsort(-prevalence, axis=0, kind="stable")[:top]
+            for i, state in enumerate(self.states):
+                out[state]["top_genes"] = [
+                    {"gene": self.genes[g], "prevalence": round(float(prevalence[g, i]) * 100, 1)}
+                    for g in order[:, i] if carriers[g, i] > 0
+                ]
+        return out
+
+    def genes_summary(self) -> List[Dict[str, Any]]:
+        """Every indexed gene with national carrier/typed totals."""
+        carriers = self.carriers_by_state.sum(axis=1)
+        typed = self.typed_by_state.sum(axis=1)
+        pathogen_typed = self.typed.sum(axis=(2, 3))
+        out = []
+        for g, name in enumerate(self.genes[:-1]):
+            out.append({
+                "gene": name,
+                "carriers": int(carriers[g]),
+                "typed": int(typed[g]),
+                "prevalence": round(float(carriers[g] / typed[g]) * 100, 1) if typed[g] else None,
+                "pathogens": [p for i, p in enumerate(self.pathogens) if pathogen_typed[g, i] > 0],
+            })
+        return out
@@ -0,0 +1,209 @@
+import re
+from typing import Dict, Optional
+
+# ── Indian geography ────────────────────────────────────────────────
+# Location-string → state extraction, zones and state adjacency, shared by
+# the map endpoints and the offline dataset loaders. `resolve_location`
+# keeps the full city → district → state → zone path for the rollup index.
+
+# ─── Geographic Location → Indian State mapping ───
+# Longest-match-first lookup: cities, districts, and states
+LOCATION_TO_STATE = {
+    # Cities → State
+    "kolkata": "West Bengal", "kharagpur": "West Bengal",
+    "bangalore": "Karnataka", "mysore": "Karnataka", "mysuru": "Karnataka",
+    "bellary": "Karnataka", "ballari": "Karnataka", "hassan": "Karnataka",
+    "gullenahalli": "Karnataka", "adaguru": "Karnataka", "chattanahalli": "Karnataka",
+    "dyapalapura": "Karnataka", "soppinahalli": "Karnataka", "shanthi grama": "Karnataka",
+    "chennai": "Tamil Nadu", "vellore": "Tamil Nadu", "madurai": "Tamil Nadu",
+    "thanjavur": "Tamil Nadu", "hosur": "Tamil Nadu", "ashok nagar": "Tamil Nadu",
+    "vengaivasal": "Tamil Nadu", "vengabakkam": "Tamil Nadu", "madambakkam": "Tamil Nadu",
+    "keerapakkam": "Tamil Nadu", "kanchipuram": "Tamil Nadu",
+    "cochin": "Kerala", "kochi": "Kerala", "amritapuri": "Kerala",
+    "kollam": "Kerala", "alappuzha": "Kerala", "kodungallur": "Kerala",
+    "munambam": "Kerala",
+    "mumbai": "Maharashtra", "pune": "Maharashtra", "nagpur": "Maharashtra",
+    "aurangabad": "Maharashtra", "jawhar": "Maharashtra",
+    "hyderabad": "Telangana", "hyderbad": "Telangana",
+    "ahmedabad": "Gujarat", "vadodara": "Gujarat", "anand": "Gujarat",
+    "banaskantha": "Gujarat", "dantiwada": "Gujarat",
+    "guwahati": "Assam", "silagrant": "Assam", "sila grant": "Assam",
+    "garoghuli": "Assam", "gorchuk": "Assam", "diparbill": "Assam",
+    "north guwahati": "Assam",
+    "shillong": "Meghalaya", "tura": "Meghalaya", "mawbri": "Meghalaya",
+    "nonglakhiat": "Meghalaya", "iewduh": "Meghalaya", "burabazar": "Meghalaya",
+    "agartala": "Tripura",
+    "delhi": "Delhi", "new delhi": "Delhi", "bhajanpura": "Delhi",
+    "safdarjung": "Delhi",
+    "rohtak": "Haryana", "karnal": "Haryana",
+    "chandigarh": "Chandigarh",
+    "aligarh": "Uttar Pradesh", "lucknow": "Uttar Pradesh",
+    "varanasi": "Uttar Pradesh", "allahabad": "Uttar Pradesh",
+    "puttaparthi": "Andhra Pradesh", "guntur": "Andhra Pradesh",
+    # States (for "India: Gujarat" etc.)
+    "tamil nadu": "Tamil Nadu", "tamilnadu": "Tamil Nadu",
+    "karnataka": "Karnataka", "kerala": "Kerala",
+    "maharashtra": "Maharashtra", "gujarat": "Gujarat",
+    "rajasthan": "Rajasthan", "rajsthan": "Rajasthan",
+    "meghalaya": "Meghalaya", "assam": "Assam", "tripura": "Tripura",
+    "mizoram": "Mizoram", "manipur": "Manipur", "nagaland": "Nagaland",
+    "sikkim": "Sikkim", "arunachal pradesh": "Arunachal Pradesh",
+    "west bengal": "West Bengal", "bihar": "Bihar", "odisha": "Odisha",
+    "jharkhand": "Jharkhand",
+    "punjab": "Punjab", "haryana": "Haryana",
+    "telangana": "Telangana", "andhra pradesh": "Andhra Pradesh",
+    "uttar pradesh": "Uttar Pradesh",
+    "madhya pradesh": "Madhya Pradesh",
+    "chattisgarh": "Chhattisgarh", "chhattisgarh": "Chhattisgarh",
+    "puducherry": "Puducherry", "goa": "Goa",
+    "jammu": "Jammu and Kashmir", "kashmir": "Jammu and Kashmir",
+    "himachal": "Himachal Pradesh",
+}
+# Sort by key length descending for longest-match-first
+_SORTED_LOC_KEYS = sorted(LOCATION_TO_STATE.keys(), key=len, reverse=True)
+
+# Sub-state localities: lookup key → (display name, district).
+# Keys of LOCATION_TO_STATE not listed here name a whole state / UT.
+# District is None where it is not known with confidence; such localities
+# roll up straight to their state.
+LOCALITIES = {
+    "kolkata": ("Kolkata", "Kolkata"), "kharagpur": ("Kharagpur", "Paschim Medinipur"),
+    "bangalore": ("Bengaluru", "Bengaluru Urban"),
+    "mysore": ("Mysuru", "Mysuru"), "mysuru": ("Mysuru", "Mysuru"),
+    "bellary": ("Ballari", "Ballari"), "ballari": ("Ballari", "Ballari"), "hassan": ("Hassan", "Hassan"),
+    "gullenahalli": ("Gullenahalli", None), "adaguru": ("Adaguru", None),
+    "chattanahalli": ("Chattanahalli", None), "dyapalapura": ("Dyapalapura", None),
+    "soppinahalli": ("Soppinahalli", None), "shanthi grama": ("Shanthigrama", "Hassan"),
+    "chennai": ("Chennai", "Chennai"), "vellore": ("Vellore", "Vellore"), "madurai": ("Madurai", "Madurai"),
+    "thanjavur": ("Thanjavur", "Thanjavur"), "hosur": ("Hosur", "Krishnagiri"),
+    "ashok nagar": ("Ashok Nagar", "Chennai"), "vengaivasal": ("Vengaivasal", "Chengalpattu"),
+    "vengabakkam": ("Vengabakkam", None), "madambakkam": ("Madambakkam", "Chengalpattu"),
+    "keerapakkam": ("Keerapakkam", "Chengalpattu"), "kanchipuram": ("Kanchipuram", "Kanchipuram"),
+    "cochin": ("Kochi", "Ernakulam"), "kochi": ("Kochi", "Ernakulam"), "amritapuri": ("Amritapuri", "Kollam"),
+    "kollam": ("Kollam", "Kollam"), "alappuzha": ("Alappuzha", "Alappuzha"),
+    "kodungallur": ("Kodungallur", "Thrissur"), "munambam": ("Munambam", "Ernakulam"),
+    "mumbai": ("Mumbai", "Mumbai"), "pune": ("Pune", "Pune"), "nagpur": ("Nagpur", "Nagpur"),
+    "aurangabad": ("Aurangabad", "Aurangabad"), "jawhar": ("Jawhar", "Palghar"),
+    "hyderabad": ("Hyderabad", "Hyderabad"), "hyderbad": ("Hyderabad", "Hyderabad"),
+    "ahmedabad": ("Ahmedabad", "Ahmedabad"), "vadodara": ("Vadodara", "Vadodara"), "anand": ("Anand", "Anand"),
+    "banaskantha": (None, "Banaskantha"), "dantiwada": ("Dantiwada", "Banaskantha"),
+    "guwahati": ("Guwahati", "Kamrup Metropolitan"), "north guwahati": ("North Guwahati", "Kamrup"),
+    "silagrant": ("Silagrant", "Kamrup Metropolitan"), "sila grant": ("Silagrant", "Kamrup Metropolitan"),
+    "garoghuli": ("Garoghuli", None), "gorchuk": ("Gorchuk", "Kamrup Metropolitan"),
+    "diparbill": ("Dipor Bil", "Kamrup Metropolitan"),
+    "shillong": ("Shillong", "East Khasi Hills"), "tura": ("Tura", "West Garo Hills"),
+    "mawbri": ("Mawbri", None), "nonglakhiat": ("Nonglakhiat", None),
+    "iewduh": ("Iewduh", "East Khasi Hills"), "burabazar": ("Burabazar", "East Khasi Hills"),
+    "agartala": ("Agartala", "West Tripura"),
+    "new delhi": ("New Delhi", "New Delhi"), "bhajanpura": ("Bhajanpura", "North East Delhi"),
+    "safdarjung": ("Safdarjung", None),
+    "rohtak": ("Rohtak", "Rohtak"), "karnal": ("Karnal", "Karnal"),
+    "aligarh": ("Aligarh", "Aligarh"), "lucknow": ("Lucknow", "Lucknow"),
+    "varanasi": ("Varanasi", "Varanasi"), "allahabad": ("Prayagraj", "Prayagraj"),
+    "puttaparthi": ("Puttaparthi", "Sri Sathya Sai"), "guntur": ("Guntur", "Guntur"),
+}
+
+# Zone → States (for fallback when state can't be extracted)
+ZONE_TO_STATES = {
+    "North": ["Delhi", "Uttar Pradesh", "Punjab", "Haryana", "Chandigarh",
+              "Jammu and Kashmir", "Himachal Pradesh", "Uttarakhand"],
+    "South": ["Tamil Nadu", "Kerala", "Karnataka", "Andhra Pradesh",
+              "Telangana", "Puducherry"],
+    "East": ["West Bengal", "Bihar", "Odisha", "Jharkhand"],
+    "North-East": ["Assam", "Sikkim", "Manipur", "Mizoram", "Tripura",
+                   "Meghalaya", "Nagaland", "Arunachal Pradesh"],
+    "West": ["Maharashtra", "Gujarat", "Rajasthan", "Goa",
+             "Dadra and Nagar Haveli", "Daman and Diu"],
+    "Central": ["Madhya Pradesh", "Chhattisgarh"],
+}
+ALL_STATES = [s for states in ZONE_TO_STATES.values() for s in states]
+STATE_TO_ZONE = {s: zone for zone, states in ZONE_TO_STATES.items() for s in states}
+
+# Neighbors for interpolation (used for states with no data)
+STATE_NEIGHBORS = {
+    "Madhya Pradesh": ["Uttar Pradesh", "Rajasthan", "Gujarat", "Maharashtra", "Chhattisgarh"],
+    "Chhattisgarh": ["Madhya Pradesh", "Uttar Pradesh", "Jharkhand", "Odisha", "Maharashtra", "Telangana"],
+    "Uttarakhand": ["Uttar Pradesh", "Himachal Pradesh", "Delhi", "Haryana"],
+    "Himachal Pradesh": ["Punjab", "Haryana", "Uttarakhand", "Chandigarh"],
+    "Jammu and Kashmir": ["Punjab", "Himachal Pradesh"],
+    "Sikkim": ["West Bengal", "Assam"],
+    "Nagaland": ["Assam", "Manipur"],
+    "Arunachal Pradesh": ["Assam"],
+    "Goa": ["Maharashtra", "Karnataka"],
+    "Dadra and Nagar Haveli": ["Gujarat", "Maharashtra"],
+    "Daman and Diu": ["Gujarat"],
+    "Puducherry": ["Tamil Nadu"],
+    "Lakshadweep": ["Kerala"],
+    "Andaman and Nicobar": ["West Bengal"],
+}
+
+
+# Shared land (or enclave) borders, listed once per pair; the spatial
+# smoother symmetrizes them into its adjacency matrix.
+STATE_BORDERS = {
+    "Delhi": ["Haryana", "Uttar Pradesh"],
+    "Uttar Pradesh": ["Uttarakhand", "Himachal Pradesh", "Haryana", "Rajasthan", "Madhya Pradesh",
+                      "Chhattisgarh", "Jharkhand", "Bihar"],
+    "Punjab": ["Jammu and Kashmir", "Himachal Pradesh", "Haryana", "Rajasthan", "Chandigarh"],
+    "Haryana": ["Himachal Pradesh", "Rajasthan", "Chandigarh"],
+    "Himachal Pradesh": ["Jammu and Kashmir", "Uttarakhand"],
+    "Tamil Nadu": ["Kerala", "Karnataka", "Andhra Pradesh", "Puducherry"],
+    "Kerala": ["Karnataka", "Puducherry"],
+    "Karnataka": ["Goa", "Maharashtra", "Telangana", "Andhra Pradesh"],
+    "Andhra Pradesh": ["Telangana", "Odisha", "Chhattisgarh", "Puducherry"],
+    "Telangana": ["Maharashtra", "Chhattisgarh"],
+    "West Bengal": ["Sikkim", "Assam", "Bihar", "Jharkhand", "Odisha"],
+    "Bihar": ["Jharkhand"],
+    "Odisha": ["Jharkhand", "Chhattisgarh"],
+    "Jharkhand": ["Chhattisgarh"],
+    "Assam": ["Arunachal Pradesh", "Nagaland", "Manipur", "Mizoram", "Tripura", "Meghalaya"],
+    "Manipur": ["Nagaland", "Mizoram"],
+    "Mizoram": ["Tripura"],
+    "Nagaland": ["Arunachal Pradesh"],
+    "Maharashtra": ["Gujarat", "Madhya Pradesh", "Chhattisgarh", "Goa", "Dadra and Nagar Haveli"],
+    "Gujarat": ["Rajasthan", "Madhya Pradesh", "Dadra and Nagar Haveli", "Daman and Diu"],
+    "Rajasthan": ["Madhya Pradesh"],
+    "Madhya Pradesh": ["Chhattisgarh"],
+}
+
+def _match_location(geo_loc: str) -> Optional[str]:
+    """Longest LOCATION_TO_STATE key contained in a Geographic Location string."""
+    if not isinstance(geo_loc, str):
+        return None
+    loc = re.sub(r'^India\s*:?\s*', '', geo_loc, flags=re.IGNORECASE).strip().lower()
+    if not loc or loc == 'india':
+        return None
+    for key in _SORTED_LOC_KEYS:
+        if key in loc:
+            return key
+    return None
+
+
+def extract_state(geo_loc: str) -> str:
+    """Extract Indian state name from a Geographic Location string.
+    
+    Examples:
+        'India: Vellore'          → 'Tamil Nadu'
+        'India: Kolkata'          → 'West Bengal'
+        'India: Chattisgarh, ...' → 'Chhattisgarh'
+        'India: Gujarat'          → 'Gujarat'
+        'India'                   → None
+    """
+    key = _match_location(geo_loc)
+    return LOCATION_TO_STATE[key] if key else None
+
+
+def resolve_location(geo_loc: str) -> Dict[str, Optional[str]]:
+    """Full location path of a Geographic Location string, down to the finest
+    level it names; unresolved levels are None.
+
+    Examples:
+        'India: Vellore'  → {city: 'Vellore', district: 'Vellore', state: 'Tamil Nadu', zone: 'South'}
+        'India: Gujarat'  → {city: None, district: None, state: 'Gujarat', zone: 'West'}
+    """
+    key = _match_location(geo_loc)
+    if key is None:
+        return {"city": None, "district": None, "state": None, "zone": None}
+    city, district = LOCALITIES.get(key, (None, None))
+    state = LOCATION_TO_STATE[key]
+    return {"city": city, "district": district, "state": state, "zone": STATE_TO_ZONE.get(state)}
@@ -0,0 +1,248 @@
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# ── Normalized isolate / phenotype storage ──────────────────────────
+# The source CSVs repeat an isolate's metadata and full gene panel on every
+# antibiotic row. The store keeps
+#   isolates   – one row per genome: metadata + bit-packed gene presence
+#   phenotypes – one narrow row per test: (isolate index, antibiotic, label)
+# Gene typing panels are per pathogen, so "was this gene typed" is a
+# pathogen → gene mask rather than a per-isolate matrix.
+
+ISOLATE_COLUMNS = ["genome_id", "pathogen", "state", "region", "year", "district", "city"]
+CATEGORY_COLUMNS = [c for c in ISOLATE_COLUMNS if c != "year"]
+BIT_PREFIX = "bits_"
+MISSING_LABEL = -1
+
+
+class IsolateStore:
+    def __init__(self, isolates: pd.DataFrame, gene_bits: np.ndarray, genes: List[str],
+                 panels: Dict[str, List[str]], phenotypes: pd.DataFrame):
+        self.isolates = isolates
+        self.gene_bits = gene_bits
+        self.genes = genes
+        self.panels = panels
+        self.phenotypes = phenotypes
+        self._gene_index = {g: i for i, g in enumerate(genes)}
+
+    @classmethod
+    def empty(cls) -> "IsolateStore":
+        isolates = pd.DataFrame({c: pd.Series(dtype="category") for c in ISOLATE_COLUMNS})
+        isolates["year"] = isolates["year"].astype("float32")
+        phenotypes = pd.DataFrame({
+            "isolate": np.zeros(0, dtype=np.int32),
+            "antibiotic_name": pd.Categorical([]),
+            "phenotype_label": np.zeros(0, dtype=np.int8),
+        })
+        return cls(isolates, np.zeros((0, 0), dtype=np.uint8), [], {}, phenotypes)
+
+    @classmethod
+    def from_records(cls, records: pd.DataFrame, panels: Dict[str, List[str]]) -> "IsolateStore":
+        """Split denormalized per-test rows into isolates and phenotypes.
+
+        `records` holds ISOLATE_COLUMNS, antibiotic_name, phenotype_label and
+        one 0/1 column per gene in the union of `panels` (genes outside an
+        isolate's panel are ignored). Metadata and genes are taken from the
+        first row of each (pathogen, genome_id).
+        """
+        if records.empty:
+            return cls.empty()
+        genes = list(dict.fromkeys(g for panel in panels.values() for g in panel))
+
+        key = records["pathogen"].astype(str) + "\x00" + records["genome_id"].astype(str)
+        isolate_idx, _ = pd.factorize(key)
+        first = np.unique(isolate_idx, return_index=True)[1]
+
+        isolates = records.iloc[first][ISOLATE_COLUMNS].reset_index(drop=True)
+        isolates["year"] = pd.to_numeric(isolates["year"], errors="coerce").astype("float32")
+        for col in CATEGORY_COLUMNS:
+            isolates[col] = isolates[col].astype("category")
+
+        present = np.zeros((len(isolates), len(genes)), dtype=bool)
+        for j, gene in enumerate(genes):
+            if gene in records.columns:
+                values = pd.to_numeric(records[gene].iloc[first], errors="coerce").to_numpy()
+                present[:, j] = np.nan_to_num(values) > 0
+        gene_bits = np.packbits(present, axis=1) if genes else np.zeros((len(isolates), 0), dtype=np.uint8)
+
+        labels = pd.to_numeric(records["phenotype_label"], errors="coerce")
+        phenotypes = pd.DataFrame({
+            "isolate": isolate_idx.astype(np.int32),
+            "antibiotic_name": records["antibiotic_name"].astype("category").values,
+            "phenotype_label": labels.fillna(MISSING_LABEL).to_numpy().astype(np.int8),
+        })
+        store = cls(isolates, gene_bits, genes, {p: list(g) for p, g in panels.items()}, phenotypes)
+        logger.info(f"Isolate store: {len(isolates)} isolates, {len(phenotypes)} phenotypes, "
+                    f"{len(genes)} genes ({store.memory_usage() / 1024:.0f} KiB)")
+        return store
+
+    # ── Shared-state round trip ──
+
+    def to_frames(self) -> Dict[str, pd.DataFrame]:
+        """Flat frames (plus attrs) for the shared-state snapshot."""
+        isolates = self.isolates.copy()
+        for b in range(self.gene_bits.shape[1]):
+            isolates[f"{BIT_PREFIX}{b}"] = self.gene_bits[:, b]
+        isolates.attrs = {"genes": self.genes, "panels": self.panels}
+        return {"isolates": isolates, "phenotypes": self.phenotypes}
+
+    @classmethod
+    def from_frames(cls, isolates: pd.DataFrame, phenotypes: pd.DataFrame) -> "IsolateStore":
+        bit_cols = [c for c in isolates.columns if c.startswith(BIT_PREFIX)]
+        bit_cols.sort(key=lambda c: int(c[len(BIT_PREFIX):]))
+        gene_bits = (np.column_stack([isolates[c].to_numpy() for c in bit_cols]) if bit_cols
+                     else np.zeros((len(isolates), 0), dtype=np.uint8))
+        # Snapshots written before a column existed attach it as all-missing
+        isolates = isolates.assign(**{c: pd.Categorical([None] * len(isolates))
+                                      for c in CATEGORY_COLUMNS if c not in isolates.columns})
+        return cls(isolates[ISOLATE_COLUMNS], gene_bits.astype(np.uint8, copy=False),
+                   list(isolates.attrs.get("genes", [])), dict(isolates.attrs.get("panels", {})),
+                   phenotypes)
+
+    # ── Per-source partitions ──
+
+    def for_pathogens(self, pathogens: List[str]) -> "IsolateStore":
+        """Sub-store with only the isolates (and phenotypes) of `pathogens`."""
+        keep = self.isolates["pathogen"].astype(object).isin(pathogens).to_numpy()
+        remap = np.full(self.n_isolates, -1, dtype=np.int64)
+        remap[keep] = np.arange(int(keep.sum()))
+        rows = remap[self.phenotypes["isolate"].to_numpy()]
+        selected = rows >= 0
+        phenotypes = self.phenotypes[selected].reset_index(drop=True)
+        phenotypes["isolate"] = rows[selected].astype(np.int32)
+        panels = {p: list(g) for p, g in self.panels.items() if p in pathogens}
+        return IsolateStore(self.isolates[keep].reset_index(drop=True), self.gene_bits[keep],
+                            list(self.genes), panels, phenotypes)
+
+    @classmethod
+    def concat(cls, stores: List["IsolateStore"]) -> "IsolateStore":
+        """Stack stores (e.g. one per source) into one, as if they had been
+        loaded together: categories are re-unioned and gene columns aligned
+        to the union of the panels, in order."""
+        stores = [s for s in stores if s.n_isolates]
+        if not stores:
+            return cls.empty()
+        panels: Dict[str, List[str]] = {}
+        for store in stores:
+            panels.update({p: list(g) for p, g in store.panels.items()})
+        genes = list(dict.fromkeys(g for panel in panels.values() for g in panel))
+
+        isolates = pd.DataFrame({
+            col: (_union_categorical([s.isolates[col] for s in stores]) if col in CATEGORY_COLUMNS
+                  else np.concatenate([s.isolates[col].to_numpy() for s in stores]))
+            for col in ISOLATE_COLUMNS
+        })
+        column = {g: j for j, g in enumerate(genes)}
+        present = np.zeros((len(isolates), len(genes)), dtype=bool)
+        start = 0
+        for store in stores:
+            own = list(dict.fromkeys(g for panel in store.panels.values() for g in panel))
+            present[start:start + store.n_isolates, [column[g] for g in own]] = store.gene_presence(own)
+            start += store.n_isolates
+        gene_bits = np.packbits(present, axis=1) if genes else np.zeros((len(isolates), 0), dtype=np.uint8)
+
+        offsets = np.cumsum([0] + [s.n_isolates for s in stores[:-1]])
+        phenotypes = pd.DataFrame({
+            "isolate": np.concatenate([s.phenotypes["isolate"].to_numpy() + off
+                                       for s, off in zip(stores, offsets)]).astype(np.int32),
+            "antibiotic_name": _union_categorical([s.phenotypes["antibiotic_name"] for s in stores]),
+            "phenotype_label": np.concatenate([s.phenotypes["phenotype_label"].to_numpy() for s in stores]),
+        })
+        store = cls(isolates, gene_bits, genes, panels, phenotypes)
+        logger.info(f"Isolate store: {len(isolates)} isolates, {len(phenotypes)} phenotypes, "
+                    f"{len(genes)} genes from {len(stores)} parts ({store.memory_usage() / 1024:.0f} KiB)")
+        return store
+
+    def fingerprint(self) -> Dict[str, str]:
+        """Content hashes of the isolate metadata, phenotypes and gene calls,
+        independent of category order and gene column layout."""
+        def digest(*arrays) -> str:
+            h = hashlib.sha256()
+            for arr in arrays:
+                h.update(np.ascontiguousarray(arr).tobytes())
+            return h.hexdigest()
+
+        hashed = lambda frame: pd.util.hash_pandas_object(frame, index=False).to_numpy()
+        genes = sorted({g for panel in self.panels.values() for g in panel})
+        panel_key = repr(sorted((p, sorted(g)) for p, g in self.panels.items())).encode()
+        return {
+            "isolates": digest(hashed(self.isolates[ISOLATE_COLUMNS])),
+            "phenotypes": digest(hashed(self.phenotypes)),
+            "genes": digest(np.frombuffer(panel_key, dtype=np.uint8),
+                            self.gene_presence(genes) if genes else np.zeros(0)),
+        }
+
+    # ── Views ──
+
+    @property
+    def n_isolates(self) -> int:
+        return len(self.isolates)
+
+    def gene_presence(self, genes: Optional[List[str]] = None) -> np.ndarray:
+        """Boolean isolate × gene matrix (all genes, or the requested subset)."""
+        present = np.unpackbits(self.gene_bits, axis=1, count=len(self.genes)).astype(bool)
+        if genes is None:
+            return present
+        return present[:, [self._gene_index[g] for g in genes]]
+
+    def gene_typed(self) -> np.ndarray:
+        """Boolean isolate × gene matrix: gene is on the isolate's typing panel."""
+        pathogens = self.isolates["pathogen"]
+        categories = [str(c) for c in pathogens.cat.categories]
+        panel_mask = np.zeros((len(categories) + 1, len(self.genes)), dtype=bool)
+        for i, pathogen in enumerate(categories):
+            for gene in self.panels.get(pathogen, []):
+                panel_mask[i, self._gene_index[gene]] = True
+        # code -1 (missing pathogen) → last, all-False row
+        return panel_mask[pathogens.cat.codes.to_numpy()]
+
+    def phenotype_frame(self) -> pd.DataFrame:
+        """Long per-test frame (the GLOBAL_DF layout) gathered from both tables.
+
+        Columns: [state, region, antibiotic_name, phenotype_label, year, pathogen, genome_id].
+        Isolate attributes are expanded by a take on their categorical codes.
+        """
+        idx = self.phenotypes["isolate"].to_numpy()
+
+        def expand(col: str) -> pd.Categorical:
+            cat = self.isolates[col]
+            return pd.Categorical.from_codes(cat.cat.codes.to_numpy()[idx],
+                                             categories=cat.cat.categories, validate=False)
+
+        labels = self.phenotypes["phenotype_label"].to_numpy()
+        if (labels == MISSING_LABEL).any():
+            label_col = np.where(labels == MISSING_LABEL, np.nan, labels)
+        else:
+            label_col = labels.astype(np.int64)
+        return pd.DataFrame({
+            "state": expand("state"),
+            "region": expand("region"),
+            "antibiotic_name": self.phenotypes["antibiotic_name"].values,
+            "phenotype_label": label_col,
+            "year": self.isolates["year"].to_numpy()[idx],
+            "pathogen": expand("pathogen"),
+            "genome_id": expand("genome_id"),
+        })
+
+    def memory_usage(self) -> int:
+        return int(self.isolates.memory_usage(deep=True).sum()
+                   + self.gene_bits.nbytes
+                   + self.phenotypes.memory_usage(deep=True).sum())
+
+
+def _union_categorical(parts: List[pd.Series]) -> pd.Categorical:
+    """Concatenate categorical columns over the sorted union of their used categories."""
+    values = [p.cat.remove_unused_categories() for p in parts]
+    categories = sorted(set().union(*(map(str, v.cat.categories) for v in values)))
+    index = pd.Index(categories)
+    # Trailing -1 slot keeps missing values (code -1) missing
+    codes = np.concatenate([np.append(index.get_indexer(v.cat.categories.astype(str)), -1)[v.cat.codes.to_numpy()]
+                            for v in values])
+    return pd.Categorical.from_codes(codes, categories=categories, validate=False)
+
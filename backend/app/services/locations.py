@@ -0,0 +1,228 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.services.geo import STATE_TO_ZONE, ZONE_TO_STATES
+from app.services.isolates import IsolateStore, MISSING_LABEL
+from app.services.vocabulary import ANTIBIOTICS, PATHOGENS
+
+logger = logging.getLogger(__name__)
+
+# ── Location rollup index ───────────────────────────────────────────
+# Every isolate sits at the finest location its source string resolves to
+# (city, district, state, zone, or only "India"). Nodes form a tree
+#   national → zone → state → district → city
+# where a level is skipped when unknown (a city without a known district
+# hangs off its state). tested / resistant / isolate counts are binned at
+# each isolate's own node over (node × pathogen × antibiotic), with a
+# trailing "all" slot on both axes, then summed up the tree once. A
+# drill-down request is an index into these arrays.
+
+LEVELS: Tuple[str, ...] = ("national", "zone", "state", "district", "city")
+NATIONAL = "India"
+
+
+class LocationError(ValueError):
+    """Raised for unknown levels or parents (maps to HTTP 400)."""
+
+
+class LocationRollup:
+    def __init__(self, store: IsolateStore, version: int = 0):
+        self.version = version
+        iso = store.isolates
+        ph = store.phenotypes
+        isolate_node = self._build_tree(self._isolate_paths(iso))
+        self._set_axes([str(p) for p in iso["pathogen"].cat.categories],
+                       [str(a) for a in ph["antibiotic_name"].cat.categories])
+        n_nodes, n_p, n_a = len(self.names), len(self.pathogens), len(self.antibiotics)
+        shape = (n_nodes, n_p + 1, n_a + 1)
+
+        labels = ph["phenotype_label"].to_numpy()
+        tested = labels != MISSING_LABEL
+        idx = ph["isolate"].to_numpy()[tested]
+        node = isolate_node[idx]
+        pathogen = iso["pathogen"].cat.codes.to_numpy().astype(np.int64)[idx]
+        antibiotic = ph["antibiotic_name"].cat.codes.to_numpy().astype(np.int64)[tested]
+        resistant = labels[tested] == 1
+        cell = np.ravel_multi_index((node, pathogen, antibiotic), shape)
+        size = int(np.prod(shape))
+        tested_counts = np.bincount(cell, minlength=size).reshape(shape)
+        resistant_counts = np.bincount(cell, weights=resistant, minlength=size).astype(np.int64).reshape(shape)
+
+        # Distinct genomes: per antibiotic, and with any tested phenotype
+        pairs = np.unique(idx * (n_a + 1) + antibiotic)
+        pair_iso = pairs // (n_a + 1)
+        iso_pathogen = iso["pathogen"].cat.codes.to_numpy().astype(np.int64)
+        cell = np.ravel_multi_index((isolate_node[pair_iso], iso_pathogen[pair_iso], pairs % (n_a + 1)), shape)
+        isolates = np.bincount(cell, minlength=size).reshape(shape)
+        any_iso = np.unique(idx)
+        any_cell = np.ravel_multi_index((isolate_node[any_iso], iso_pathogen[any_iso]), shape[:2])
+        isolates[:, :, n_a] = np.bincount(any_cell, minlength=n_nodes * (n_p + 1)).reshape(shape[:2])
+        self._roll_up(tested_counts, resistant_counts, isolates)
+
+    @classmethod
+    def from_counts(cls, places: pd.DataFrame, counts: pd.DataFrame, pathogens: List[str],
+                    antibiotics: List[str], version: int = 0) -> "LocationRollup":
+        """Rollup from counts already grouped by location, e.g. by SQL.
+
+        `places` has one row per distinct (state, district, city, region) of
+        the isolates, in order of their first isolate. `counts` has `place`
+        (a row of `places`), `pathogen` and `antibiotic` codes into the given
+        lists and tested / resistant / isolates; rows with antibiotic
+        len(antibiotics) carry the isolates with any tested phenotype.
+        """
+        rollup = cls.__new__(cls)
+        rollup.version = version
+        place_node = rollup._build_tree(cls._isolate_paths(places))
+        rollup._set_axes(pathogens, antibiotics)
+        shape = (len(rollup.names), len(pathogens) + 1, len(antibiotics) + 1)
+        size = int(np.prod(shape))
+        cell = np.ravel_multi_index((place_node[counts["place"].to_numpy(dtype=np.int64)],
+                                     counts["pathogen"].to_numpy(dtype=np.int64),
+                                     counts["antibiotic"].to_numpy(dtype=np.int64)), shape)
+        rollup._roll_up(*(np.bincount(cell, weights=counts[col].to_numpy(dtype=np.float64), minlength=size)
+                          .astype(np.int64).reshape(shape) for col in ("tested", "resistant", "isolates")))
+        return rollup
+
+    def _build_tree(self, paths) -> np.ndarray:
+        """Create the location nodes; returns the finest node of each path."""
+        self.names: List[str] = [NATIONAL]
+        self.levels: List[int] = [0]
+        self.parents: List[int] = [-1]
+        node_of: Dict[Tuple, int] = {(): 0}
+
+        path_codes, distinct = pd.factorize(pd.Series(list(paths), dtype=object))
+        finest = np.zeros(len(distinct), dtype=np.int64)
+        for i, path in enumerate(distinct):
+            chain: Tuple = ()
+            for depth, name in enumerate(path, start=1):
+                if name is None:
+                    continue
+                key = chain + ((depth, name),)
+                if key not in node_of:
+                    node_of[key] = len(self.names)
+                    self.names.append(name)
+                    self.levels.append(depth)
+                    self.parents.append(node_of[chain])
+                chain = key
+            finest[i] = node_of[chain]
+        self._parents = np.asarray(self.parents, dtype=np.int64)
+        self._levels = np.asarray(self.levels, dtype=np.int64)
+        return finest[path_codes] if len(path_codes) else np.zeros(0, dtype=np.int64)
+
+    def _set_axes(self, pathogens: List[str], antibiotics: List[str]):
+        # Trailing slot on both axes = all
+        self.pathogens = list(pathogens)
+        self.antibiotics = list(antibiotics)
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+        self._antibiotic_lookup = ANTIBIOTICS.index(self.antibiotics)
+
+    def _roll_up(self, tested: np.ndarray, resistant: np.ndarray, isolates: np.ndarray):
+        """Fill the "all" slots, sum every node into its ancestors and index
+        the drill-down slices. `isolates` arrives with its all-antibiotics
+        slot filled (distinct genomes do not sum across antibiotics)."""
+        n_nodes, n_p, n_a = len(self.names), len(self.pathogens), len(self.antibiotics)
+        self.tested, self.resistant, self.isolates = tested, resistant, isolates
+        for arr in (self.tested, self.resistant):
+            arr[:, :, n_a] = arr[:, :, :n_a].sum(axis=2)
+        for arr in (self.tested, self.resistant, self.isolates):
+            arr[:, n_p, :] = arr[:, :n_p, :].sum(axis=1)
+        # Tests recorded at a node without finer location, before rollup
+        self.direct_tested = self.tested.copy()
+        for depth in range(len(LEVELS) - 1, 0, -1):
+            at_depth = np.flatnonzero(self._levels == depth)
+            for arr in (self.tested, self.resistant, self.isolates):
+                np.add.at(arr, self._parents[at_depth], arr[at_depth])
+
+        # ── Precomputed drill-down slices: (ancestor, level) → nodes ──
+        self.children = np.bincount(self._parents[1:], minlength=n_nodes)
+        self._by_level: Dict[Tuple[int, int], np.ndarray] = {}
+        ancestors = [self._ancestors(n) for n in range(n_nodes)]
+        for depth in range(len(LEVELS)):
+            members = np.flatnonzero(self._levels == depth)
+            for anc in {a for n in members for a in ancestors[n]}:
+                self._by_level[(anc, depth)] = np.array([n for n in members if anc in ancestors[n]],
+                                                        dtype=np.int64)
+        self._name_lookup: Dict[str, List[int]] = {}
+        for n, name in enumerate(self.names):
+            self._name_lookup.setdefault(name.lower(), []).append(n)
+        logger.info(f"Location rollup: {n_nodes} nodes "
+                    + ", ".join(f"{(self._levels == d).sum()} {lvl}" for d, lvl in enumerate(LEVELS)))
+
+    @staticmethod
+    def _isolate_paths(iso: pd.DataFrame):
+        """(zone, state, district, city) per isolate; None where unresolved.
+        Isolates without a state fall back to their source zone (region)."""
+        def column(col: str) -> np.ndarray:
+            values = iso[col].astype(object).to_numpy()
+            return np.where(pd.isna(values), None, values)
+
+        states, districts, cities, regions = (column(c) for c in ("state", "district", "city", "region"))
+        for state, district, city, region in zip(states, districts, cities, regions):
+            zone = STATE_TO_ZONE.get(state) if state else (region if region in ZONE_TO_STATES else None)
+            yield (zone, state, district, city)
+
+    def _ancestors(self, node: int) -> List[int]:
+        chain = [node]
+        while self._parents[chain[-1]] >= 0:
+            chain.append(int(self._parents[chain[-1]]))
+        return chain
+
+    def path(self, node: int) -> List[str]:
+        return [self.names[n] for n in reversed(self._ancestors(node))]
+
+    # ── Lookups ──
+
+    def resolve_parent(self, name: Optional[str], level: str) -> int:
+        """Node id of a drill-down parent (the national root when not given)."""
+        depth = LEVELS.index(level)
+        if not name:
+            return 0
+        candidates = [n for n in self._name_lookup.get(name.strip().lower(), []) if self.levels[n] < depth]
+        if not candidates:
+            raise LocationError(f"No location '{name}' above level '{level}'.")
+        # A name shared across levels (e.g. district and city Pune) means the finest one
+        return max(candidates, key=lambda n: self.levels[n])
+
+    def view(self, level: str = "state", parent: Optional[str] = None, antibiotic: Optional[str] = None,
+             pathogen: Optional[str] = None, min_tested: int = 1) -> Optional[Dict[str, Any]]:
+        """Counts for every `level` node under `parent`; None if the antibiotic
+        or pathogen is not in the data."""
+        if level not in LEVELS:
+            raise LocationError(f"Unknown level '{level}'. Choose from {list(LEVELS)}.")
+        root = self.resolve_parent(parent, level)
+        a = len(self.antibiotics) if not antibiotic else self._antibiotic_lookup.get(antibiotic)
+        p = len(self.pathogens) if not pathogen else self._pathogen_lookup.get(pathogen)
+        if a is None or p is None:
+            return None
+
+        nodes = self._by_level.get((root, LEVELS.index(level)), np.zeros(0, dtype=np.int64))
+        tested = self.tested[nodes, p, a]
+        keep = tested >= min_tested
+        nodes, tested = nodes[keep], tested[keep]
+        resistant = self.resistant[nodes, p, a]
+        isolates = self.isolates[nodes, p, a]
+        order = sorted(range(len(nodes)), key=lambda i: (-tested[i], self.names[nodes[i]]))
+        rows = [{
+            "name": self.names[n],
+            "level": level,
+            "path": self.path(n),
+            "tested": int(tested[i]),
+            "resistant": int(resistant[i]),
+            "isolates": int(isolates[i]),
+            "direct_tested": int(self.direct_tested[n, p, a]),
+            "children": int(self.children[n]),
+        } for i, n in ((i, int(nodes[i])) for i in order)]
+        return {
+            "level": level,
+            "parent": self.path(root),
+            "version": self.version,
+            "rows": rows,
+            "total": {
+                "tested": int(self.tested[root, p, a]),
+                "resistant": int(self.resistant[root, p, a]),
+                "isolates": int(self.isolates[root, p, a]),
+            },
+        }
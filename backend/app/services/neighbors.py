@@ -0,0 +1,213 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.gaara import GENE_ALIASES
+from app.services.isolates import IsolateStore
+from app.services.vocabulary import ANTIBIOTICS, GENES, PATHOGENS
+
+logger = logging.getLogger(__name__)
+
+# ── Nearest-neighbour isolate index ─────────────────────────────────
+# Every isolate's gene presence is packed into uint64 words, so comparing a
+# query profile against N isolates is a handful of vectorized AND/OR +
+# popcount passes over N words (one word per 64 genes). A query gene outside
+# an isolate's typing panel counts as a difference: the isolate gives no
+# evidence of carrying it.
+# Neighbours' phenotypes come from the store's phenotype table, or from a
+# per-antibiotic lookup (the SQLite store) when the store holds genotypes only.
+
+METRICS = ("jaccard", "hamming")
+# antibiotic → (tested isolate indices ascending, their labels); None if unknown
+PhenotypeLookup = Callable[[str], Optional[Tuple[np.ndarray, np.ndarray]]]
+RESISTANT, SUSCEPTIBLE = "Resistant", "Susceptible"
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        if words.shape[1] == 1:
+            return np.bitwise_count(words[:, 0])
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+else:  # numpy < 2.0
+    _BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words: np.ndarray) -> np.ndarray:
+        as_bytes = np.ascontiguousarray(words).view(np.uint8).reshape(words.shape[0], -1)
+        return _BYTE_POPCOUNT[as_bytes].sum(axis=-1, dtype=np.int32)
+
+
+def _pack_words(bits: np.ndarray) -> np.ndarray:
+    """uint8 packbits rows → uint64 words (zero padded)."""
+    n, n_bytes = bits.shape
+    n_words = max(1, -(-n_bytes // 8))
+    padded = np.zeros((n, n_words * 8), dtype=np.uint8)
+    padded[:, :n_bytes] = bits
+    return padded.view(np.uint64)
+
+
+class NeighborIndex:
+    def __init__(self, store: IsolateStore, phenotypes: Optional[PhenotypeLookup] = None):
+        self.store = store
+        self.genes = list(store.genes)
+        self._gene_lookup = GENES.index(self.genes)
+        self.n_isolates = store.n_isolates
+        self.words = _pack_words(store.gene_bits)
+
+        iso = store.isolates
+        self.pathogen_codes = iso["pathogen"].cat.codes.to_numpy()
+        self.pathogens = [str(p) for p in iso["pathogen"].cat.categories]
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+
+        self._lookup_phenotypes = phenotypes
+        if phenotypes is not None:
+            logger.info(f"Neighbour index: {self.n_isolates} isolates × {len(self.genes)} genes "
+                        f"({self.words.nbytes} bytes packed), phenotypes looked up per antibiotic")
+            return
+        # Phenotypes grouped by antibiotic: code → (sorted isolate idx, labels)
+        ph = store.phenotypes
+        ab_codes = ph["antibiotic_name"].cat.codes.to_numpy()
+        self.antibiotics = [str(a) for a in ph["antibiotic_name"].cat.categories]
+        self._ab_lookup = ANTIBIOTICS.index(self.antibiotics)
+        order = np.lexsort((ph["isolate"].to_numpy(), ab_codes))
+        sorted_codes = ab_codes[order]
+        bounds = np.searchsorted(sorted_codes, np.arange(len(self.antibiotics) + 1))
+        isolates = ph["isolate"].to_numpy()[order]
+        labels = ph["phenotype_label"].to_numpy()[order]
+        self._phenotypes = {
+            code: (isolates[bounds[code]:bounds[code + 1]], labels[bounds[code]:bounds[code + 1]])
+            for code in range(len(self.antibiotics))
+        }
+        logger.info(f"Neighbour index: {self.n_isolates} isolates × {len(self.genes)} genes "
+                    f"({self.words.nbytes} bytes packed)")
+
+    def __getstate__(self):
+        # Shared-state snapshot (see app.core.shared_state): the store is
+        # published on its own and re-attached with attach_store()
+        state = dict(self.__dict__)
+        del state["store"]
+        return state
+
+    def attach_store(self, store: IsolateStore):
+        self.store = store
+
+    def _pack_genes(self, genes: List[str]) -> np.ndarray:
+        row = np.zeros((1, len(self.genes)), dtype=bool)
+        index = {g: i for i, g in enumerate(self.genes)}
+        for g in genes:
+            if g in index:
+                row[0, index[g]] = True
+        return _pack_words(np.packbits(row, axis=1))[0]
+
+    def resolve_profile(self, gene_presence: Dict[str, int]):
+        """Map user gene names onto indexed genes; returns (present genes, unmatched names)."""
+        expanded = dict(gene_presence)
+        for alias, targets in GENE_ALIASES.items():
+            if expanded.get(alias):
+                for t in targets:
+                    expanded.setdefault(t.replace("gene_", ""), 1)
+        present, unmatched = [], []
+        for name, value in expanded.items():
+            i = self._gene_lookup.get(name)
+            if i is None:
+                if value and name not in GENE_ALIASES:
+                    unmatched.append(name)
+            elif value and self.genes[i] not in present:
+                present.append(self.genes[i])
+        return present, unmatched
+
+    def _phenotype_lookup(self, antibiotic: Optional[str]):
+        if not antibiotic:
+            return None
+        if self._lookup_phenotypes is not None:
+            return self._lookup_phenotypes(antibiotic)
+        code = self._ab_lookup.get(antibiotic)
+        return None if code is None else self._phenotypes[code]
+
+    def query(self, gene_presence: Dict[str, int], antibiotic: Optional[str] = None,
+              pathogen: Optional[str] = None, k: int = 10, metric: str = "jaccard",
+              tested_only: bool = True) -> Dict[str, Any]:
+        """Top-k isolates most similar to a gene profile.
+
+        jaccard: |q ∩ x| / |q ∪ x| (1.0 when both are empty); hamming: number
+        of genes that differ. With an antibiotic and `tested_only`, only
+        isolates phenotyped for it are ranked.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}'. Choose from {list(METRICS)}.")
+        present, unmatched = self.resolve_profile(gene_presence)
+        query_words = self._pack_genes(present)
+
+        candidates = None
+        if pathogen:
+            p = self._pathogen_lookup.get(pathogen)
+            candidates = np.zeros(self.n_isolates, dtype=bool) if p is None else self.pathogen_codes == p
+        phenotypes = self._phenotype_lookup(antibiotic)
+        if antibiotic and tested_only:
+            tested = np.zeros(self.n_isolates, dtype=bool)
+            if phenotypes is not None:
+                tested[phenotypes[0][phenotypes[1] >= 0]] = True
+            candidates = tested if candidates is None else candidates & tested
+        if candidates is None:
+            idx = np.arange(self.n_isolates)
+            x = self.words
+        else:
+            idx = np.flatnonzero(candidates)
+            x = self.words[idx]
+
+        inter = _popcount(x & query_words)
+        union = _popcount(x | query_words)
+        distance = union - inter
+        # Empty vs empty profile counts as identical
+        similarity = (inter + (union == 0)).astype(np.float32) / np.maximum(union, 1)
+
+        score = -similarity if metric == "jaccard" else distance
+        k = min(k, len(idx))
+        top = np.argpartition(score, k - 1)[:k] if 0 < k < len(idx) else np.arange(len(idx))
+        top = top[np.lexsort((idx[top], score[top]))][:k]
+
+        neighbors = [self._describe(int(idx[j]), float(similarity[j]), int(distance[j]),
+                                    int(inter[j]), phenotypes) for j in top]
+        observed = [n["phenotype"] for n in neighbors if n["phenotype"] is not None]
+        return {
+            "query_genes": present,
+            "unmatched_genes": unmatched,
+            "antibiotic": antibiotic,
+            "metric": metric,
+            "candidates": int(len(idx)),
+            "index_size": self.n_isolates,
+            "neighbors": neighbors,
+            "summary": {
+                "resistant": observed.count(RESISTANT),
+                "susceptible": observed.count(SUSCEPTIBLE),
+                "untested": len(neighbors) - len(observed),
+            },
+        }
+
+    def _describe(self, i: int, similarity: float, distance: int, shared: int, phenotypes) -> Dict[str, Any]:
+        iso = self.store.isolates
+        bits = np.unpackbits(self.store.gene_bits[i], count=len(self.genes)).astype(bool)
+        state = iso["state"].iloc[i]
+        year = iso["year"].iloc[i]
+        phenotype, tests = None, 0
+        if phenotypes is not None:
+            isolates, labels = phenotypes
+            lo, hi = np.searchsorted(isolates, [i, i + 1])
+            labels = labels[lo:hi]
+            labels = labels[labels >= 0]
+            tests = int(len(labels))
+            if tests:
+                # Any resistant call among repeat tests marks the isolate resistant
+                phenotype = RESISTANT if labels.max() > 0 else SUSCEPTIBLE
+        return {
+            "genome_id": str(iso["genome_id"].iloc[i]),
+            "pathogen": str(iso["pathogen"].iloc[i]),
+            "state": None if isinstance(state, float) else str(state),
+            "region": str(iso["region"].iloc[i]),
+            "year": None if np.isnan(year) else int(year),
+            "similarity": round(similarity, 4),
+            "distance": distance,
+            "shared_genes": shared,
+            "genes": [g for g, b in zip(self.genes, bits) if b],
+            "phenotype": phenotype,
+            "tests": tests,
+        }
@@ -0,0 +1,358 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.metrics import record_cache
+from app.services.vocabulary import ANTIBIOTIC_CLASSES, DIMENSION_VOCABULARIES, antibiotic_class
+
+logger = logging.getLogger(__name__)
+
+# ── Aggregate Query Engine ──────────────────────────────────────────
+# Every dimension is stored once as an int32 code column. A query is
+# normalized to its *shape* (group-by dims, filtered dims, measures); the
+# plan for a shape holds the pre-combined group key column, so executing a
+# query is a LUT-based filter mask plus one bincount per measure.
+# `isolates` counts distinct genomes exactly (unique (group, genome) pairs);
+# `records` is the raw per-test row count. Validation, caching, sorting and
+# labelling are shared with engines that group elsewhere (see `_measure`),
+# e.g. the SQLite store's.
+
+QUERY_DIMENSIONS: Tuple[str, ...] = ("state", "region", "pathogen", "antibiotic", "antibiotic_class", "year")
+QUERY_MEASURES: Tuple[str, ...] = ("isolates", "records", "tested", "resistant", "resistance_rate")
+DIMENSION_COLUMNS: Dict[str, str] = {
+    "state": "state",
+    "region": "region",
+    "pathogen": "pathogen",
+    "antibiotic": "antibiotic_name",
+}
+UNKNOWN_LABEL = "Unknown"
+OTHER_CLASS = "other"
+
+MAX_RESULT_ROWS = 10000
+MAX_DENSE_CELLS = 1 << 22   # above this, group with np.unique instead of bincount
+PLAN_CACHE_SIZE = 64
+RESULT_CACHE_SIZE = 256
+
+
+class QueryError(ValueError):
+    """Raised for malformed aggregate queries (maps to HTTP 400)."""
+
+
+def canonical_terms(dim: str, values: Sequence[Any]) -> List[Any]:
+    """Canonical names of pathogen / antibiotic filter values (other
+    dimensions pass through unchanged). A value that is no known spelling of
+    a term raises QueryError instead of silently matching nothing."""
+    vocabulary = DIMENSION_VOCABULARIES.get(dim)
+    if vocabulary is None:
+        return list(values)
+    names = []
+    for value in values:
+        name = vocabulary.canonical(str(value))
+        if name is None:
+            raise QueryError(f"Unknown {dim} '{value}'.")
+        names.append(name)
+    return names
+
+
+class _QueryPlan:
+    __slots__ = ("group_by", "measures", "cards", "key", "n_cells", "dense")
+
+    def __init__(self, group_by, measures, cards, key, n_cells, dense):
+        self.group_by = group_by
+        self.measures = measures
+        self.cards = cards
+        self.key = key
+        self.n_cells = n_cells
+        self.dense = dense
+
+
+class QueryEngine:
+    def __init__(self, df: pd.DataFrame, version: int = 0):
+        self.version = version
+        self.n_rows = len(df)
+        self.codes: Dict[str, np.ndarray] = {}
+        self.labels: Dict[str, List[Any]] = {}
+        self._lookup: Dict[str, Dict[Any, int]] = {}
+        self._plans: "OrderedDict[Tuple, _QueryPlan]" = OrderedDict()
+        self._results: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if df.empty:
+            for dim in QUERY_DIMENSIONS:
+                self._set_dimension(dim, np.zeros(0, dtype=np.int32), [UNKNOWN_LABEL])
+            self.tested = np.zeros(0)
+            self.resistant = np.zeros(0)
+            self.genomes, self.n_genomes = np.zeros(0, dtype=np.int64), 0
+            return
+
+        for dim, col in DIMENSION_COLUMNS.items():
+            codes, labels = _encode_column(df[col])
+            self._set_dimension(dim, codes, labels)
+
+        # antibiotic_class derived through a code → code LUT
+        lut, class_labels = antibiotic_class_lut(self.labels["antibiotic"])
+        self._set_dimension("antibiotic_class", lut[self.codes["antibiotic"]], class_labels)
+
+        # year: ordered integer labels, missing years → trailing "Unknown"
+        years = pd.to_numeric(df["year"], errors="coerce").to_numpy(dtype=np.float64)
+        valid = ~np.isnan(years)
+        uniq = np.unique(years[valid]).astype(np.int64)
+        year_codes = np.full(len(years), len(uniq), dtype=np.int32)
+        year_codes[valid] = np.searchsorted(uniq, years[valid].astype(np.int64))
+        self._set_dimension("year", year_codes, [int(y) for y in uniq] + [UNKNOWN_LABEL])
+
+        labels = pd.to_numeric(df["phenotype_label"], errors="coerce").to_numpy(dtype=np.float64)
+        has_label = ~np.isnan(labels)
+        self.tested = has_label.astype(np.float64)
+        self.resistant = np.where(has_label, labels, 0.0)
+
+        # Genome codes for distinct counts (rows without an id count alone)
+        if "genome_id" in df.columns:
+            genomes, names = _encode_column(df["genome_id"])
+            self.genomes = genomes.astype(np.int64)
+            missing = self.genomes == len(names) - 1
+            self.genomes[missing] = len(names) - 1 + np.arange(int(missing.sum()))
+            self.n_genomes = int(self.genomes.max()) + 1 if len(self.genomes) else 0
+        else:
+            self.genomes, self.n_genomes = np.arange(self.n_rows, dtype=np.int64), self.n_rows
+
+    def _set_dimension(self, dim: str, codes: np.ndarray, labels: List[Any]):
+        self.codes[dim] = codes.astype(np.int32, copy=False)
+        self.labels[dim] = labels
+        self._lookup[dim] = {_normalize(l): i for i, l in enumerate(labels)}
+
+    def __getstate__(self):
+        # Shared-state snapshot (see app.core.shared_state): columns only;
+        # every process starts with empty caches
+        state = dict(self.__dict__, _plans=OrderedDict(), _results=OrderedDict())
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    # ── Planning ──
+
+    def plan(self, group_by: Sequence[str], filter_dims: Sequence[str], measures: Sequence[str]) -> _QueryPlan:
+        """Return the (cached) plan for a normalized query shape."""
+        for dim in list(group_by) + list(filter_dims):
+            if dim not in QUERY_DIMENSIONS:
+                raise QueryError(f"Unknown dimension '{dim}'. Choose from {list(QUERY_DIMENSIONS)}.")
+        for m in measures:
+            if m not in QUERY_MEASURES:
+                raise QueryError(f"Unknown measure '{m}'. Choose from {list(QUERY_MEASURES)}.")
+        if len(set(group_by)) != len(group_by):
+            raise QueryError("Duplicate group_by dimension.")
+
+        shape = (tuple(group_by), tuple(sorted(filter_dims)), tuple(measures))
+        with self._lock:
+            plan = self._plans.get(shape)
+            if plan is not None:
+                self._plans.move_to_end(shape)
+        record_cache("query_plan", plan is not None)
+        if plan is not None:
+            return plan
+
+        cards = [len(self.labels[d]) for d in group_by]
+        n_cells = int(np.prod(cards, dtype=np.int64)) if cards else 1
+        plan = _QueryPlan(tuple(group_by), tuple(measures), cards, self._group_key(group_by, cards, n_cells),
+                          n_cells, n_cells <= MAX_DENSE_CELLS)
+
+        with self._lock:
+            self._plans[shape] = plan
+            if len(self._plans) > PLAN_CACHE_SIZE:
+                self._plans.popitem(last=False)
+        return plan
+
+    def _group_key(self, group_by: Sequence[str], cards: List[int], n_cells: int) -> Optional[np.ndarray]:
+        """Combined group key column (row-major over `cards`) for a plan."""
+        key_dtype = np.int32 if n_cells < 2**31 else np.int64
+        key = np.zeros(self.n_rows, dtype=key_dtype)
+        for dim, card in zip(group_by, cards):
+            key = key * card + self.codes[dim]
+        return key
+
+    def _filter_codes(self, dim: str, values: Sequence[Any]) -> List[int]:
+        """Codes of the `dim` labels a filter names (unknown values match nothing)."""
+        lookup = self._lookup[dim]
+        return [lookup[k] for k in (_normalize(v) for v in values) if k in lookup]
+
+    def _mask(self, filters: Dict[str, Sequence[Any]], year_min: Optional[int], year_max: Optional[int]) -> Optional[np.ndarray]:
+        mask = None
+        for dim, values in filters.items():
+            lut = np.zeros(len(self.labels[dim]), dtype=bool)
+            lut[self._filter_codes(dim, values)] = True
+            m = lut[self.codes[dim]]
+            mask = m if mask is None else mask & m
+        if year_min is not None or year_max is not None:
+            lut = np.array([
+                y != UNKNOWN_LABEL and (year_min is None or y >= year_min) and (year_max is None or y <= year_max)
+                for y in self.labels["year"]
+            ], dtype=bool)
+            m = lut[self.codes["year"]]
+            mask = m if mask is None else mask & m
+        return mask
+
+    # ── Execution ──
+
+    def _measure(self, plan: _QueryPlan, filters: Dict[str, Sequence[Any]], year_min: Optional[int],
+                 year_max: Optional[int]) -> Tuple[np.ndarray, ...]:
+        """(groups, records, tested, resistant, isolates) over the non-empty
+        groups, with `groups` the ascending combined keys."""
+        mask = self._mask(filters, year_min, year_max)
+        key = plan.key if mask is None else plan.key[mask]
+        tested_w = self.tested if mask is None else self.tested[mask]
+        resistant_w = self.resistant if mask is None else self.resistant[mask]
+
+        if plan.dense:
+            rows = np.bincount(key, minlength=plan.n_cells)
+            groups = np.flatnonzero(rows)
+            rows = rows[groups]
+            tested = np.bincount(key, weights=tested_w, minlength=plan.n_cells)[groups]
+            resistant = np.bincount(key, weights=resistant_w, minlength=plan.n_cells)[groups]
+        else:
+            groups, inverse = np.unique(key, return_inverse=True)
+            rows = np.bincount(inverse)
+            tested = np.bincount(inverse, weights=tested_w)
+            resistant = np.bincount(inverse, weights=resistant_w)
+
+        if "isolates" in plan.measures:
+            genomes = self.genomes if mask is None else self.genomes[mask]
+            if plan.n_cells * max(self.n_genomes, 1) < 2**62:
+                n = max(self.n_genomes, 1)
+                pair_key = np.unique(key.astype(np.int64) * n + genomes) // n
+            else:
+                pair_key = np.unique(np.column_stack([key.astype(np.int64), genomes]), axis=0)[:, 0]
+            isolates = np.bincount(np.searchsorted(groups, pair_key), minlength=len(groups))
+        else:
+            isolates = rows
+        return groups, rows, tested, resistant, isolates
+
+    def execute(self, group_by: Sequence[str] = (), filters: Optional[Dict[str, Sequence[Any]]] = None,
+                measures: Sequence[str] = ("isolates", "resistance_rate"),
+                year_min: Optional[int] = None, year_max: Optional[int] = None,
+                min_tested: int = 0, sort_by: Optional[str] = None, descending: bool = True,
+                limit: int = 1000) -> Dict[str, Any]:
+        """Run an aggregate query and return a compact columnar table."""
+        # Pathogen and antibiotic filters accept any spelling of a term
+        filters = {d: canonical_terms(d, v) for d, v in (filters or {}).items() if v}
+        if limit > MAX_RESULT_ROWS:
+            raise QueryError(f"limit exceeds the maximum of {MAX_RESULT_ROWS} rows.")
+        if not measures:
+            raise QueryError("At least one measure is required.")
+        plan = self.plan(group_by, list(filters), measures)
+        columns = list(plan.group_by) + list(plan.measures)
+        if sort_by is not None and sort_by not in columns:
+            raise QueryError(f"sort_by must be one of {columns}.")
+
+        cache_key = (
+            self.version, plan.group_by, plan.measures,
+            tuple(sorted((d, tuple(sorted(_normalize(v) for v in vals))) for d, vals in filters.items())),
+            year_min, year_max, min_tested, sort_by, descending, limit,
+        )
+        with self._lock:
+            cached = self._results.get(cache_key)
+            if cached is not None:
+                self._results.move_to_end(cache_key)
+        record_cache("query_result", cached is not None)
+        if cached is not None:
+            return cached
+
+        groups, rows, tested, resistant, isolates = self._measure(plan, filters, year_min, year_max)
+
+        if min_tested > 0:
+            keep = tested >= min_tested
+            groups, rows, tested, resistant = groups[keep], rows[keep], tested[keep], resistant[keep]
+            isolates = isolates[keep]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = np.where(tested > 0, resistant / tested, np.nan)
+        measure_values = {
+            "isolates": isolates.astype(np.int64),
+            "records": rows.astype(np.int64),
+            "tested": tested.astype(np.int64),
+            "resistant": resistant.astype(np.int64),
+            "resistance_rate": np.round(rate, 4),
+        }
+
+        # Decode the combined key back into per-dimension codes
+        dim_codes = np.unravel_index(groups, plan.cards) if plan.cards else ()
+
+        if sort_by in plan.measures:
+            values = measure_values[sort_by].astype(np.float64)
+            values = np.where(np.isnan(values), -np.inf, values)
+            order = np.argsort(-values if descending else values, kind="stable")
+        elif sort_by is not None:
+            order = np.argsort(dim_codes[plan.group_by.index(sort_by)], kind="stable")
+            if descending:
+                order = order[::-1]
+        else:
+            order = np.arange(len(groups))
+        total_groups = len(groups)
+        order = order[:limit]
+
+        out_columns = []
+        for dim, codes in zip(plan.group_by, dim_codes):
+            labels = self.labels[dim]
+            out_columns.append([labels[c] for c in codes[order]])
+        for m in plan.measures:
+            vals = measure_values[m][order]
+            if m == "resistance_rate":
+                obj = vals.astype(object)
+                obj[np.isnan(vals)] = None
+                out_columns.append(obj.tolist())
+            else:
+                out_columns.append(vals.tolist())
+
+        result = {
+            "columns": columns,
+            "rows": [list(r) for r in zip(*out_columns)] if out_columns else [],
+            "total_groups": int(total_groups),
+            "truncated": bool(total_groups > limit),
+            "version": self.version,
+        }
+        with self._lock:
+            self._results[cache_key] = result
+            if len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        return result
+
+
+def antibiotic_class_lut(antibiotics: Sequence[Any]) -> Tuple[np.ndarray, List[str]]:
+    """antibiotic label index → antibiotic_class code, and the class labels."""
+    class_labels = sorted(set(ANTIBIOTIC_CLASSES.values())) + [OTHER_CLASS, UNKNOWN_LABEL]
+    class_index = {c: i for i, c in enumerate(class_labels)}
+    lut = np.array([
+        class_index[UNKNOWN_LABEL] if ab == UNKNOWN_LABEL
+        else class_index[antibiotic_class(str(ab)) or OTHER_CLASS]
+        for ab in antibiotics
+    ], dtype=np.int32)
+    return lut, class_labels
+
+
+def _normalize(value: Any) -> Any:
+    """Lookup key for a label: case-folded strings, integer years."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    text = str(value).strip()
+    if text.lstrip("-").isdigit():
+        return int(text)
+    return text.lower()
+
+
+def _encode_column(series: pd.Series) -> Tuple[np.ndarray, List[Any]]:
+    """Integer codes for a column; missing values map to a trailing UNKNOWN_LABEL."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy().astype(np.int32)
+        labels = [str(c) for c in series.cat.categories]
+    else:
+        codes, uniques = pd.factorize(series)
+        codes = codes.astype(np.int32)
+        labels = [str(u) for u in uniques]
+    codes[codes < 0] = len(labels)
+    return codes, labels + [UNKNOWN_LABEL]
@@ -0,0 +1,183 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import beta as beta_dist
+
+from app.services.geo import ALL_STATES, STATE_BORDERS
+from app.services.vocabulary import ANTIBIOTICS, PATHOGENS, TermIndex
+
+logger = logging.getLogger(__name__)
+
+# ── Empirical-Bayes spatial smoothing ───────────────────────────────
+# Each state's rate for a (pathogen, antibiotic) column is shrunk toward
+# its spatial neighbourhood with a beta-binomial model:
+#   prior mean  m_i = (Σ_k W_ik y_k + κ g) / (Σ_k W_ik n_k + κ)
+#               (pooled rate of the bordering states, plus κ pseudo-tests
+#                at the national rate g so isolated states have a prior)
+#   prior       Beta(m_i M, (1 - m_i) M)
+#   posterior   Beta(m_i M + y_i, (1 - m_i) M + n_i - y_i)
+# The concentration M is estimated per column by the method of moments
+# from how far observed rates scatter around their priors beyond binomial
+# noise; little extra scatter means strong shrinkage. All columns are
+# handled together as (states × columns) matrices and one sparse product.
+
+NATIONAL_PSEUDO_TESTS = 10.0      # κ
+MIN_INTRACLASS = 1e-3             # ρ = 1 / (M + 1) bounds
+MAX_INTRACLASS = 0.5
+DEFAULT_INTRACLASS = 0.05         # columns with fewer than two tested states
+CREDIBLE_MASS = 0.95
+
+
+def adjacency_matrix(states: Sequence[str], borders: Dict[str, List[str]]) -> sparse.csr_matrix:
+    """Symmetric 0/1 state adjacency (no self loops)."""
+    index = {s: i for i, s in enumerate(states)}
+    pairs = [(index[a], index[b]) for a, nbrs in borders.items() for b in nbrs
+             if a in index and b in index and a != b]
+    rows = [i for i, j in pairs] + [j for i, j in pairs]
+    cols = [j for i, j in pairs] + [i for i, j in pairs]
+    w = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(states), len(states)))
+    w.data[:] = 1.0  # duplicate pairs collapse to one edge
+    return w
+
+
+def smooth_rates(tested: np.ndarray, resistant: np.ndarray, adjacency: sparse.spmatrix,
+                 pseudo_tests: float = NATIONAL_PSEUDO_TESTS) -> Dict[str, np.ndarray]:
+    """Posterior rates for (states × columns) tested / resistant counts.
+
+    Returns states × columns arrays (mean, sd, low, high, prior, shrinkage)
+    plus per-column `concentration`. Columns without any tests are NaN.
+    """
+    n = np.asarray(tested, dtype=np.float64)
+    y = np.asarray(resistant, dtype=np.float64)
+    total_n = n.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        national = y.sum(axis=0) / total_n
+        prior = (adjacency @ y + pseudo_tests * national) / (adjacency @ n + pseudo_tests)
+        prior = np.clip(prior, 1e-6, 1 - 1e-6)
+
+        # Method of moments: Σ n(p̂ - m)² ≈ Σ m(1-m)(1 + (n-1)ρ) over tested states
+        has = n > 0
+        p_hat = np.where(has, y / np.where(has, n, 1), 0.0)
+        var = prior * (1 - prior)
+        scatter = np.where(has, n * (p_hat - prior) ** 2, 0.0).sum(axis=0)
+        binomial = np.where(has, var, 0.0).sum(axis=0)
+        excess = np.where(has, var * (n - 1), 0.0).sum(axis=0)
+        rho = (scatter - binomial) / excess
+    rho = np.where((has.sum(axis=0) >= 2) & (excess > 0), rho, DEFAULT_INTRACLASS)
+    rho = np.clip(np.nan_to_num(rho, nan=DEFAULT_INTRACLASS), MIN_INTRACLASS, MAX_INTRACLASS)
+    concentration = 1.0 / rho - 1.0
+
+    a = prior * concentration + y
+    b = (1 - prior) * concentration + n - y
+    tail = (1 - CREDIBLE_MASS) / 2
+    result = {
+        "mean": a / (a + b),
+        "sd": np.sqrt(a * b / ((a + b) ** 2 * (a + b + 1))),
+        "low": beta_dist.ppf(tail, a, b),
+        "high": beta_dist.ppf(1 - tail, a, b),
+        "prior": prior,
+        "shrinkage": concentration / (concentration + n),  # weight on the prior
+    }
+    empty = total_n == 0
+    for arr in result.values():
+        arr[:, empty] = np.nan
+    result["concentration"] = np.where(empty, np.nan, concentration)
+    return result
+
+
+class SpatialSmoother:
+    """State × pathogen × antibiotic counts and their smoothed rates.
+
+    Every column (each pathogen and "all", each antibiotic and "all") is
+    smoothed once at build; antibiotic groups (e.g. carbapenems) are summed
+    and smoothed per request, which is one small sparse product. `df` holds
+    per-test rows, or cells already counted with `tested` / `resistant`
+    columns (e.g. from the SQLite store).
+    """
+
+    def __init__(self, df: pd.DataFrame, states: Sequence[str] = ALL_STATES,
+                 borders: Dict[str, List[str]] = STATE_BORDERS, version: int = 0):
+        self.version = version
+        self.states = list(states)
+        self.adjacency = adjacency_matrix(self.states, borders)
+        if df.empty:
+            self.pathogens: List[str] = []
+            self.antibiotics: List[str] = []
+        else:
+            self.pathogens = sorted(str(p) for p in df["pathogen"].dropna().unique())
+            self.antibiotics = sorted(str(a) for a in df["antibiotic_name"].dropna().unique())
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+        self._antibiotic_lookup = ANTIBIOTICS.index(self.antibiotics)
+
+        # Counts (states × pathogens+1 × antibiotics+1); trailing slot = all
+        n_s, n_p, n_a = len(self.states), len(self.pathogens), len(self.antibiotics)
+        shape = (n_s, n_p + 1, n_a + 1)
+        self.tested = np.zeros(shape, dtype=np.int64)
+        self.resistant = np.zeros(shape, dtype=np.int64)
+        if not df.empty:
+            s = pd.Categorical(df["state"], categories=self.states).codes
+            p = pd.Categorical(df["pathogen"], categories=self.pathogens).codes
+            a = pd.Categorical(df["antibiotic_name"], categories=self.antibiotics).codes
+            keep = (s >= 0) & (p >= 0) & (a >= 0)
+            size = int(np.prod(shape))
+            if "tested" in df.columns:
+                # Pre-aggregated cells
+                cell = np.ravel_multi_index((s[keep], p[keep], a[keep]), shape)
+                tested = df["tested"].to_numpy(dtype=np.float64)[keep]
+                self.tested = np.bincount(cell, weights=tested, minlength=size).astype(np.int64).reshape(shape)
+                resistant = df["resistant"].to_numpy(dtype=np.float64)[keep]
+            else:
+                labels = pd.to_numeric(df["phenotype_label"], errors="coerce").to_numpy(dtype=np.float64)
+                keep &= ~np.isnan(labels)
+                cell = np.ravel_multi_index((s[keep], p[keep], a[keep]), shape)
+                self.tested = np.bincount(cell, minlength=size).reshape(shape)
+                resistant = labels[keep] > 0
+            self.resistant = np.bincount(cell, weights=resistant, minlength=size).astype(np.int64).reshape(shape)
+            for arr in (self.tested, self.resistant):
+                arr[:, :, n_a] = arr[:, :, :n_a].sum(axis=2)
+                arr[:, n_p, :] = arr[:, :n_p, :].sum(axis=1)
+
+        flat = (n_s, (n_p + 1) * (n_a + 1))
+        smoothed = smooth_rates(self.tested.reshape(flat), self.resistant.reshape(flat), self.adjacency)
+        self.smoothed = {k: v.reshape(shape[1:] if k == "concentration" else shape)
+                         for k, v in smoothed.items()}
+        logger.info(f"Spatial smoother: {n_s} states × {flat[1]} columns, "
+                    f"{self.adjacency.nnz // 2} borders")
+
+    def _index(self, lookup: TermIndex, name: Optional[str], all_slot: int) -> Optional[int]:
+        if not name:
+            return all_slot
+        return lookup.get(name)
+
+    def state_rates(self, antibiotics: Optional[Sequence[str]] = None,
+                    pathogen: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Raw counts and smoothed rates for every state.
+
+        `antibiotics` None means all antibiotics; several names are pooled
+        into one column. Returns None when nothing matches.
+        """
+        p = self._index(self._pathogen_lookup, pathogen, len(self.pathogens))
+        if p is None:
+            return None
+        if not antibiotics:
+            cols = [len(self.antibiotics)]
+        else:
+            cols = self._antibiotic_lookup.select(antibiotics)
+            if not cols:
+                return None
+        if len(cols) == 1:
+            tested = self.tested[:, p, cols[0]]
+            resistant = self.resistant[:, p, cols[0]]
+            post = {k: (v[p, cols[0]] if k == "concentration" else v[:, p, cols[0]])
+                    for k, v in self.smoothed.items()}
+        else:
+            tested = self.tested[:, p, cols].sum(axis=1)
+            resistant = self.resistant[:, p, cols].sum(axis=1)
+            post = {k: v[:, 0] if v.ndim == 2 else v[0]
+                    for k, v in smooth_rates(tested[:, None], resistant[:, None], self.adjacency).items()}
+        if tested.sum() == 0:
+            return None
+        return {"states": self.states, "tested": tested, "resistant": resistant, **post}
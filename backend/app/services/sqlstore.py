@@ -0,0 +1,749 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.services.dashboard import COUNTS, antibiotic_rows, heatmap_panel, place_panel, trend_panel
+from app.services.export import ROW_COLUMNS
+from app.services.isolates import IsolateStore, ISOLATE_COLUMNS, MISSING_LABEL
+from app.services.query import QueryEngine, UNKNOWN_LABEL, antibiotic_class_lut, canonical_terms
+from app.services.trends import TREND_YEAR_MAX, TREND_YEAR_MIN
+from app.services.vocabulary import ANTIBIOTICS, PATHOGENS
+
+logger = logging.getLogger(__name__)
+
+# ── On-disk analytical store ────────────────────────────────────────
+# Optional backend (AMR_STORE=sqlite) for data larger than RAM. The source
+# CSVs are streamed into an embedded SQLite file CHUNK_ROWS rows at a time,
+# and the harmonized per-test rows only ever live in that file:
+#   dashboard panels, isolate counts,     – one indexed GROUP BY (or scan)
+#   /query, row exports, neighbour labels   per request
+#   trend cube, spatial smoother,         – built once from the rollups or
+#   location rollup                         one streamed pass, their size
+#                                           set by the dimensions
+# Only the isolates table (metadata + bit-packed gene calls, one row per
+# genome) is loaded back, for the gene indexes, which scan genomes in memory.
+#
+# Chunks are staged in a scratch database (isolates deduplicated on
+# (pathogen, genome_id), first row wins, as in IsolateStore.from_records)
+# and copied into the store once every source is in, with dimension ids in
+# sorted name order like the isolate store's categories. Next to the
+# per-test rows the file keeps rollups built once at write time, whose size
+# depends on the dimensions, not the row count:
+#   cells            – rows / tested / resistant per (pathogen, antibiotic,
+#                      state, year, zone): every rate panel and most queries
+#   tested_isolates  – distinct tested genomes per (pathogen, antibiotic, state)
+#   tested_any       – distinct genomes with any test per (pathogen, state)
+# Distinct counts over several antibiotics at once (the carbapenem map,
+# /query `isolates`) read per-test rows. Every key leads with (pathogen,
+# antibiotic, state, year) and the indexes cover the columns queries read,
+# so they never touch the base tables; with only a handful of pathogens,
+# filters on the antibiotic alone run as a skip-scan over the same index.
+# Neighbour labels read one antibiotic's tests by isolate from their own index.
+#
+# Files are content-addressed (amr-<digest>.sqlite over the source files'
+# digests) and written once, then opened immutable by every reader thread:
+# a restart on unchanged data reuses the file, and a live refresh writes a
+# new file beside the one in-flight requests are still reading. Bump
+# SCHEMA_VERSION when the schema or the harmonization changes.
+#
+# Missing dimension values, years and labels are stored as -1, like the
+# isolate store's MISSING_LABEL, so every column is a plain integer.
+
+SCHEMA_VERSION = 3
+CHUNK_ROWS = 100_000   # rows per CSV chunk while ingesting, and per fetch while streaming
+MMAP_BYTES = 256 * 1024 * 1024   # reads go through the OS page cache, not the heap
+FILE_PREFIX = "amr-"
+
+# Dimension tables and the record columns they encode
+DIMENSIONS: Dict[str, str] = {
+    "pathogens": "pathogen", "antibiotics": "antibiotic_name", "states": "state",
+    "zones": "region", "districts": "district", "cities": "city",
+}
+DIMENSION_IDS: Dict[str, str] = {
+    "pathogens": "pathogen_id", "antibiotics": "antibiotic_id", "states": "state_id",
+    "zones": "zone_id", "districts": "district_id", "cities": "city_id",
+}
+
+SCHEMA = "CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);\n" + "".join(
+    f"CREATE TABLE {dim} (id INTEGER PRIMARY KEY, name TEXT NOT NULL);\n" for dim in DIMENSIONS) + """
+CREATE TABLE isolates (
+    id INTEGER PRIMARY KEY, genome_id TEXT,
+    pathogen_id INTEGER NOT NULL, state_id INTEGER NOT NULL, zone_id INTEGER NOT NULL,
+    district_id INTEGER NOT NULL, city_id INTEGER NOT NULL, year INTEGER NOT NULL,
+    genes BLOB NOT NULL
+);
+CREATE TABLE tests (
+    isolate_id INTEGER NOT NULL, pathogen_id INTEGER NOT NULL, antibiotic_id INTEGER NOT NULL,
+    state_id INTEGER NOT NULL, zone_id INTEGER NOT NULL, year INTEGER NOT NULL,
+    label INTEGER NOT NULL
+);
+"""
+# Scratch tables in provisional (first-seen) dimension ids; `genes` packs the
+# isolate's own source panel
+STAGE_SCHEMA = """
+CREATE TABLE stage.isolates (
+    id INTEGER PRIMARY KEY, genome_id TEXT, pathogen_id INTEGER, state_id INTEGER, zone_id INTEGER,
+    district_id INTEGER, city_id INTEGER, year INTEGER, genes BLOB
+);
+CREATE UNIQUE INDEX stage.isolate_key ON isolates (pathogen_id, IFNULL(genome_id, ''));
+CREATE TABLE stage.tests (pathogen_id INTEGER, genome_id TEXT, antibiotic_id INTEGER, label INTEGER);
+CREATE TABLE stage.remap (dim TEXT, old INTEGER, new INTEGER, PRIMARY KEY (dim, old)) WITHOUT ROWID;
+"""
+ROLLUPS = f"""
+CREATE INDEX tests_covering ON tests (pathogen_id, antibiotic_id, state_id, year, zone_id, label, isolate_id);
+CREATE INDEX tests_antibiotic ON tests (antibiotic_id, isolate_id, label);
+CREATE INDEX isolates_pathogen ON isolates (pathogen_id);
+CREATE TABLE cells (
+    pathogen_id INTEGER NOT NULL, antibiotic_id INTEGER NOT NULL, state_id INTEGER NOT NULL,
+    year INTEGER NOT NULL, zone_id INTEGER NOT NULL,
+    rows INTEGER NOT NULL, tested INTEGER NOT NULL, resistant INTEGER NOT NULL,
+    PRIMARY KEY (pathogen_id, antibiotic_id, state_id, year, zone_id)
+) WITHOUT ROWID;
+INSERT INTO cells
+    SELECT pathogen_id, antibiotic_id, state_id, year, zone_id,
+           COUNT(*), SUM(label != {MISSING_LABEL}), SUM(MAX(label, 0))
+    FROM tests GROUP BY pathogen_id, antibiotic_id, state_id, year, zone_id;
+CREATE TABLE tested_isolates (
+    pathogen_id INTEGER NOT NULL, antibiotic_id INTEGER NOT NULL, state_id INTEGER NOT NULL,
+    isolates INTEGER NOT NULL,
+    PRIMARY KEY (pathogen_id, antibiotic_id, state_id)
+) WITHOUT ROWID;
+INSERT INTO tested_isolates
+    SELECT pathogen_id, antibiotic_id, state_id, COUNT(DISTINCT isolate_id)
+    FROM tests WHERE label != {MISSING_LABEL} GROUP BY pathogen_id, antibiotic_id, state_id;
+CREATE TABLE tested_any (
+    pathogen_id INTEGER NOT NULL, state_id INTEGER NOT NULL, isolates INTEGER NOT NULL,
+    PRIMARY KEY (pathogen_id, state_id)
+) WITHOUT ROWID;
+INSERT INTO tested_any
+    SELECT pathogen_id, state_id, COUNT(DISTINCT isolate_id)
+    FROM tests WHERE label != {MISSING_LABEL} GROUP BY pathogen_id, state_id;
+ANALYZE;
+"""
+
+# rows / tested / resistant of a group of cells, in COUNTS order
+MEASURES = "SUM(rows), SUM(tested), SUM(resistant)"
+
+# pathogen → (gene panel, harmonized record chunks of CHUNK_ROWS rows)
+SourceReader = Callable[[str, int], Tuple[List[str], Iterable[pd.DataFrame]]]
+
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _remap(dim: str, column: str) -> str:
+    """SQL for a staged provisional id → final id (-1 stays missing)."""
+    return f"IFNULL((SELECT new FROM stage.remap WHERE dim = '{dim}' AND old = {column}), -1)"
+
+
+class _Writer:
+    """Stages harmonized record chunks, then writes them out as the store."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.stage = path.with_name(f"{path.name}.stage")
+        self.ids: Dict[str, Dict[str, int]] = {dim: {} for dim in DIMENSIONS}
+        self.panels: Dict[str, List[str]] = {}
+        self.conn = sqlite3.connect(path)
+        # A half-written file is simply rebuilt, so skip journaling entirely
+        self.conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + SCHEMA)
+        self.conn.execute("ATTACH DATABASE ? AS stage", (str(self.stage),))
+        self.conn.executescript("PRAGMA stage.journal_mode=OFF; PRAGMA stage.synchronous=OFF;" + STAGE_SCHEMA)
+
+    def _codes(self, dim: str, values: pd.Series) -> np.ndarray:
+        """Provisional ids in first-seen order; missing → -1."""
+        codes, uniques = pd.factorize(values)
+        ids = self.ids[dim]
+        mapping = np.array([ids.setdefault(str(u), len(ids)) for u in uniques] + [-1], dtype=np.int64)
+        return mapping[codes]
+
+    def add(self, records: pd.DataFrame, genes: List[str]):
+        """Stage a chunk of one source's records (RECORD_COLUMNS + `genes`)."""
+        codes = {dim: self._codes(dim, records[col]) for dim, col in DIMENSIONS.items()}
+        years = pd.to_numeric(records["year"], errors="coerce").to_numpy(dtype=np.float64)
+        years = np.where(np.isnan(years), -1, years).astype(np.int64)
+        labels = pd.to_numeric(records["phenotype_label"], errors="coerce").fillna(MISSING_LABEL)
+        genome = records["genome_id"].astype(object).where(records["genome_id"].notna(), None)
+
+        # Isolates: first row of each genome in the chunk; INSERT OR IGNORE
+        # keeps the first across chunks
+        first = np.flatnonzero(~pd.DataFrame({"p": codes["pathogens"], "g": genome}).duplicated().to_numpy())
+        present = np.zeros((len(first), len(genes)), dtype=bool)
+        for j, gene in enumerate(genes):
+            values = pd.to_numeric(records[gene].iloc[first], errors="coerce").to_numpy()
+            present[:, j] = np.nan_to_num(values) > 0
+        packed = np.packbits(present, axis=1) if genes else np.zeros((len(first), 0), dtype=np.uint8)
+        columns = [genome.iloc[first].tolist()] + [
+            codes[dim][first].tolist() for dim in ("pathogens", "states", "zones", "districts", "cities")]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO stage.isolates (genome_id, pathogen_id, state_id, zone_id, district_id, "
+            "city_id, year, genes) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            zip(*columns, years[first].tolist(), (row.tobytes() for row in packed)))
+        self.conn.executemany(
+            "INSERT INTO stage.tests VALUES (?, ?, ?, ?)",
+            zip(codes["pathogens"].tolist(), genome.tolist(), codes["antibiotics"].tolist(),
+                labels.to_numpy().astype(np.int64).tolist()))
+
+    def discard(self, pathogen: str):
+        """Drop a source's staged rows (it failed part way)."""
+        pid = self.ids["pathogens"].get(pathogen)
+        if pid is not None:
+            self.conn.execute("DELETE FROM stage.isolates WHERE pathogen_id = ?", (pid,))
+            self.conn.execute("DELETE FROM stage.tests WHERE pathogen_id = ?", (pid,))
+
+    def finish(self, fingerprint: str, sources: Dict[str, str]) -> int:
+        """Write the final tables, indexes and rollups; returns the test count."""
+        conn = self.conn
+        # Dimension ids in sorted name order, over the values actually staged
+        for dim, col in DIMENSION_IDS.items():
+            table = "tests" if dim == "antibiotics" else "isolates"
+            used = {r[0] for r in conn.execute(f"SELECT DISTINCT {col} FROM stage.{table}")}
+            names = {name: old for name, old in self.ids[dim].items() if old in used}
+            ordered = sorted(names)
+            conn.executemany(f"INSERT INTO {dim} (id, name) VALUES (?, ?)", enumerate(ordered))
+            conn.executemany("INSERT INTO stage.remap VALUES (?, ?, ?)",
+                             ((dim, names[name], new) for new, name in enumerate(ordered)))
+        conn.execute(f"""
+            INSERT INTO isolates
+            SELECT id - 1, genome_id, {_remap('pathogens', 'pathogen_id')}, {_remap('states', 'state_id')},
+                   {_remap('zones', 'zone_id')}, {_remap('districts', 'district_id')},
+                   {_remap('cities', 'city_id')}, year, genes
+            FROM stage.isolates ORDER BY id""")
+        conn.execute(f"""
+            INSERT INTO tests
+            SELECT f.id, f.pathogen_id, {_remap('antibiotics', 't.antibiotic_id')}, f.state_id, f.zone_id,
+                   f.year, t.label
+            FROM stage.tests t
+            JOIN stage.isolates s ON s.pathogen_id = t.pathogen_id
+                                 AND IFNULL(s.genome_id, '') = IFNULL(t.genome_id, '')
+            JOIN isolates f ON f.id = s.id - 1
+            ORDER BY t.rowid""")
+        conn.commit()
+        conn.execute("DETACH DATABASE stage")
+        self.stage.unlink()
+        conn.executescript(ROLLUPS)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         [("schema", str(SCHEMA_VERSION)), ("fingerprint", fingerprint),
+                          ("panels", json.dumps(self.panels)), ("sources", json.dumps(sources)),
+                          ("built_at", str(time.time()))])
+        conn.commit()
+        return conn.execute("SELECT COUNT(*) FROM tests").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+        if self.stage.exists():
+            self.stage.unlink()
+
+
+def _write(path: Path, digests: Dict[str, str], reader: SourceReader, fingerprint: str) -> int:
+    """Stream every source into a new store file; returns the test count."""
+    writer = _Writer(path)
+    try:
+        loaded = {}
+        for pathogen, digest in digests.items():
+            try:
+                genes, chunks = reader(pathogen, CHUNK_ROWS)
+                for chunk in chunks:
+                    writer.add(chunk, genes)
+            except sqlite3.Error:
+                raise
+            except Exception as e:
+                logger.error(f"Error loading {pathogen}: {e}")
+                writer.discard(pathogen)
+                continue
+            writer.panels[pathogen] = list(genes)
+            loaded[pathogen] = digest
+        return writer.finish(fingerprint, loaded)
+    finally:
+        writer.close()
+
+
+class SQLiteStore:
+    """Per-test rows in an immutable SQLite file: dashboard panels (as
+    DashboardCube), distinct-isolate counts (as IsolateCounts), streamed
+    row chunks and the counts the resident aggregates are built from."""
+
+    def __init__(self, path: Path, states: Sequence[str], version: int = 0):
+        self.path = Path(path).resolve()
+        self.version = version
+        self.all_states: List[str] = list(states)
+        self._local = threading.local()
+        self._totals: Optional[Dict[str, np.ndarray]] = None
+        self._totals_lock = threading.Lock()
+        conn = self._conn()
+        names = {dim: [r[0] for r in conn.execute(f"SELECT name FROM {dim} ORDER BY id")] for dim in DIMENSIONS}
+        self.names = names
+        self.pathogens: List[str] = names["pathogens"]
+        self.antibiotics: List[str] = names["antibiotics"]
+        self.states: List[str] = names["states"]
+        self.zones: List[str] = names["zones"]
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        self.panels: Dict[str, List[str]] = json.loads(meta["panels"])
+        # pathogen → digest of the source file it was read from
+        self.sources: Dict[str, str] = json.loads(meta["sources"])
+        self._pathogen_lookup = PATHOGENS.index(self.pathogens)
+        self._antibiotic_lookup = ANTIBIOTICS.index(self.antibiotics)
+
+    @classmethod
+    def ingest(cls, sources: Dict[str, str], reader: SourceReader, directory: Path,
+               states: Sequence[str], version: int = 0) -> "SQLiteStore":
+        """Open the file for the `sources` CSVs (pathogen → path, in load
+        order), streaming them in through `reader` first if needed.
+
+        A missing source is left out; one that fails to read is logged and
+        left out, the others still load.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        digests = {p: _file_digest(path) for p, path in sources.items() if os.path.exists(path)}
+        fingerprint = json.dumps({"schema": SCHEMA_VERSION, "sources": digests}, sort_keys=True)
+        digest = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+        path = directory / f"{FILE_PREFIX}{digest}.sqlite"
+        if path.exists():
+            logger.info(f"SQLite store: reusing {path}")
+            return cls(path, states, version)
+
+        start = time.perf_counter()
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            n_tests = _write(tmp, digests, reader, fingerprint)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        logger.info(f"SQLite store: wrote {n_tests} tests to {path} "
+                    f"({path.stat().st_size / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s")
+        return cls(path, states, version)
+
+    @staticmethod
+    def prune(directory: Path, keep: Sequence[Path]):
+        """Delete store files other than `keep` (e.g. the live and previous one)."""
+        keep = {Path(p).resolve() for p in keep}
+        for path in Path(directory).glob(f"{FILE_PREFIX}*.sqlite"):
+            if path.resolve() not in keep:
+                try:
+                    path.unlink()
+                    logger.info(f"SQLite store: removed {path}")
+                except OSError as e:
+                    logger.warning(f"Could not remove {path}: {e}")
+
+    # ── Queries ──
+
+    def _conn(self) -> sqlite3.Connection:
+        # One read-only connection per thread; the file never changes once written
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"{self.path.as_uri()}?immutable=1", uri=True)
+            conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+            self._local.conn = conn
+        return conn
+
+    def _query(self, sql: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        return self._conn().execute(sql, params).fetchall()
+
+    def _filters(self, pathogen: Optional[str],
+                 antibiotics: Optional[Sequence[str]]) -> Optional[Tuple[Optional[int], Optional[List[int]]]]:
+        """(pathogen id, antibiotic ids), None for "all"; None if a filter matches nothing."""
+        p = None
+        if pathogen:
+            p = self._pathogen_lookup.get(pathogen)
+            if p is None:
+                return None
+        ids = None
+        if antibiotics:
+            ids = self._antibiotic_lookup.select(antibiotics)
+            if not ids:
+                return None
+        return p, ids
+
+    @staticmethod
+    def _where(pathogen_id: Optional[int], antibiotic_ids: Optional[List[int]],
+               *extra: str) -> Tuple[str, List[Any]]:
+        clauses, params = list(extra), []
+        if pathogen_id is not None:
+            clauses.append("pathogen_id = ?")
+            params.append(pathogen_id)
+        if antibiotic_ids:
+            clauses.append(f"antibiotic_id IN ({', '.join('?' * len(antibiotic_ids))})")
+            params.extend(antibiotic_ids)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def _totals_matrix(self) -> Dict[str, np.ndarray]:
+        """(pathogens + missing) × (antibiotics + missing) counts, computed once."""
+        if self._totals is None:
+            with self._totals_lock:
+                if self._totals is None:
+                    shape = (len(self.pathogens) + 1, len(self.antibiotics) + 1)
+                    totals = {k: np.zeros(shape) for k in COUNTS}
+                    rows = np.array(self._query(
+                        f"SELECT pathogen_id, antibiotic_id, {MEASURES} FROM cells "
+                        f"GROUP BY pathogen_id, antibiotic_id"), dtype=np.float64).reshape(-1, 5)
+                    p = np.where(rows[:, 0] < 0, shape[0] - 1, rows[:, 0]).astype(np.int64)
+                    a = np.where(rows[:, 1] < 0, shape[1] - 1, rows[:, 1]).astype(np.int64)
+                    for j, k in enumerate(COUNTS):
+                        totals[k][p, a] = rows[:, 2 + j]
+                    self._totals = totals
+        return self._totals
+
+    # ── Panels (DashboardCube interface) ──
+
+    def antibiotic_rows(self) -> Dict[str, int]:
+        """Records per antibiotic (any label, all pathogens)."""
+        return antibiotic_rows(self._totals_matrix(), self.antibiotics)
+
+    def heatmap(self, min_rows: int = 100) -> Dict[str, Any]:
+        return heatmap_panel(self._totals_matrix(), self.pathogens, self.antibiotics, min_rows)
+
+    def trend(self, antibiotic: Optional[str] = None, pathogen: Optional[str] = None,
+              year_min: int = TREND_YEAR_MIN, year_max: int = TREND_YEAR_MAX) -> Tuple[List[int], List[Optional[float]]]:
+        filters = self._filters(pathogen, [antibiotic] if antibiotic else None)
+        if filters is None:
+            return [], []
+        clause, params = self._where(*filters, "year BETWEEN ? AND ?")
+        rows = self._query(f"SELECT year, {MEASURES} FROM cells{clause} GROUP BY year ORDER BY year",
+                           [year_min, year_max] + params)
+        if not rows:
+            return [], []
+        table = np.array(rows, dtype=np.float64)
+        return trend_panel([table[:, 1], table[:, 2], table[:, 3]], table[:, 0].astype(np.int64),
+                           year_min, year_max)
+
+    def place_counts(self, antibiotics: Optional[Sequence[str]] = None,
+                     pathogen: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        filters = self._filters(pathogen, antibiotics)
+        if filters is None:
+            return None
+        clause, params = self._where(*filters)
+        rows = np.array(self._query(f"SELECT state_id, zone_id, {MEASURES} FROM cells{clause} "
+                                    f"GROUP BY state_id, zone_id", params), dtype=np.float64).reshape(-1, 5)
+        n_states = len(self.states)
+        # Place: the state, else the zone (after every state), else a trailing slot
+        zone = np.where(rows[:, 1] < 0, len(self.zones), rows[:, 1])
+        place = np.where(rows[:, 0] >= 0, rows[:, 0], n_states + zone).astype(np.int64)
+        size = n_states + len(self.zones) + 1
+        slab = [np.bincount(place, weights=rows[:, 2 + j], minlength=size) for j in range(len(COUNTS))]
+        return place_panel(slab, self.states, self.zones)
+
+    # ── Distinct isolates (IsolateCounts interface) ──
+
+    def by_state(self, antibiotics: Optional[Sequence[str]] = None,
+                 pathogen: Optional[str] = None) -> Dict[str, int]:
+        """Distinct genomes tested for any of `antibiotics` (default: any), per state."""
+        counts = {s: 0 for s in self.all_states}
+        filters = self._filters(pathogen, antibiotics)
+        if filters is None:
+            return counts
+        p, ids = filters
+        if ids is None:
+            clause, params = self._where(p, None, "state_id >= 0")
+            sql = f"SELECT state_id, SUM(isolates) FROM tested_any{clause} GROUP BY state_id"
+        elif len(ids) == 1:
+            clause, params = self._where(p, ids, "state_id >= 0")
+            sql = f"SELECT state_id, SUM(isolates) FROM tested_isolates{clause} GROUP BY state_id"
+        else:
+            # A genome tested for several of them must count once
+            clause, params = self._where(p, ids, f"label != {MISSING_LABEL}", "state_id >= 0")
+            sql = f"SELECT state_id, COUNT(DISTINCT isolate_id) FROM tests{clause} GROUP BY state_id"
+        for state_id, n in self._query(sql, params):
+            name = self.states[state_id]
+            if name in counts:
+                counts[name] = int(n)
+        return counts
+
+    def by_pathogen(self, antibiotic: Optional[str] = None) -> Dict[str, int]:
+        """Distinct genomes per pathogen: all of them, or those tested for `antibiotic`."""
+        counts = {p: 0 for p in self.pathogens}
+        if not antibiotic:
+            rows = self._query("SELECT pathogen_id, COUNT(*) FROM isolates WHERE pathogen_id >= 0 "
+                               "GROUP BY pathogen_id")
+        else:
+            filters = self._filters(None, [antibiotic])
+            if filters is None:
+                return counts
+            clause, params = self._where(*filters, "pathogen_id >= 0")
+            rows = self._query(f"SELECT pathogen_id, SUM(isolates) FROM tested_isolates{clause} "
+                               f"GROUP BY pathogen_id", params)
+        for pathogen_id, n in rows:
+            counts[self.pathogens[pathogen_id]] = int(n)
+        return counts
+
+    # ── Resident aggregates and streams ──
+
+    def _reader(self) -> sqlite3.Connection:
+        """Private connection for a generator, which may resume on any thread."""
+        conn = sqlite3.connect(f"{self.path.as_uri()}?immutable=1", uri=True, check_same_thread=False)
+        conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+        return conn
+
+    def _categorical(self, dim: str, ids: np.ndarray) -> pd.Categorical:
+        return pd.Categorical.from_codes(ids, categories=self.names[dim], validate=False)
+
+    def genotype_store(self) -> IsolateStore:
+        """IsolateStore of the genomes alone (metadata + genes, no phenotypes),
+        laid out as the in-memory loader lays it out; for the gene indexes."""
+        genes = list(dict.fromkeys(g for panel in self.panels.values() for g in panel))
+        column = {g: j for j, g in enumerate(genes)}
+        panel_columns = {self.pathogens.index(p): [column[g] for g in panel]
+                         for p, panel in self.panels.items() if p in self.pathogens}
+        genome_ids: List[Optional[str]] = []
+        codes: Dict[str, List[np.ndarray]] = {dim: [] for dim in ("pathogens", "states", "zones",
+                                                                   "districts", "cities", "year")}
+        bits: List[np.ndarray] = []
+        cursor = self._conn().execute("SELECT genome_id, pathogen_id, state_id, zone_id, district_id, city_id, "
+                                      "year, genes FROM isolates ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                break
+            batch = list(zip(*rows))
+            genome_ids.extend(batch[0])
+            for dim, values in zip(codes, batch[1:7]):
+                codes[dim].append(np.array(values, dtype=np.int64))
+            # Each genome packs its own pathogen's panel; spread it over the union
+            present = np.zeros((len(rows), len(genes)), dtype=bool)
+            pathogen_ids = codes["pathogens"][-1]
+            for p, cols in panel_columns.items():
+                sel = np.flatnonzero(pathogen_ids == p)
+                if len(sel) and cols:
+                    packed = np.frombuffer(b"".join(batch[7][i] for i in sel), dtype=np.uint8).reshape(len(sel), -1)
+                    present[np.ix_(sel, cols)] = np.unpackbits(packed, axis=1, count=len(cols)).astype(bool)
+            bits.append(np.packbits(present, axis=1) if genes else np.zeros((len(rows), 0), dtype=np.uint8))
+
+        joined = {dim: np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+                  for dim, parts in codes.items()}
+        year = joined["year"].astype(np.float32)
+        year[joined["year"] < 0] = np.nan
+        isolates = pd.DataFrame({
+            "genome_id": pd.Categorical(genome_ids),
+            "pathogen": self._categorical("pathogens", joined["pathogens"]),
+            "state": self._categorical("states", joined["states"]),
+            "region": self._categorical("zones", joined["zones"]),
+            "year": year,
+            "district": self._categorical("districts", joined["districts"]),
+            "city": self._categorical("cities", joined["cities"]),
+        }, columns=ISOLATE_COLUMNS)
+        gene_bits = np.concatenate(bits) if bits else np.zeros((0, -(-len(genes) // 8)), dtype=np.uint8)
+        phenotypes = pd.DataFrame({
+            "isolate": np.zeros(0, dtype=np.int32),
+            "antibiotic_name": pd.Categorical([], categories=self.antibiotics),
+            "phenotype_label": np.zeros(0, dtype=np.int8),
+        })
+        store = IsolateStore(isolates, gene_bits, genes, {p: list(g) for p, g in self.panels.items()}, phenotypes)
+        logger.info(f"Genotype store: {store.n_isolates} isolates, {len(genes)} genes from {self.path.name} "
+                    f"({store.memory_usage() / 1024:.0f} KiB)")
+        return store
+
+    def row_chunks(self, pathogen: Optional[Sequence[str]] = None, antibiotic: Optional[Sequence[str]] = None,
+                   state: Optional[Sequence[str]] = None, year_min: Optional[int] = None,
+                   year_max: Optional[int] = None, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        """Filtered per-test rows (ROW_COLUMNS) as DataFrame chunks, in load
+        order; always yields at least one. As export.row_chunks, filters are
+        checked eagerly."""
+        clauses: List[str] = []
+        params: List[Any] = []
+        matches = True
+        for ids, col in (
+                (self._pathogen_lookup.select(canonical_terms("pathogen", pathogen)) if pathogen else None,
+                 "t.pathogen_id"),
+                (self._antibiotic_lookup.select(canonical_terms("antibiotic", antibiotic)) if antibiotic else None,
+                 "t.antibiotic_id"),
+                ([i for i, s in enumerate(self.states) if s.lower() in {str(v).strip().lower() for v in state}]
+                 if state else None, "t.state_id")):
+            if ids is None:
+                continue
+            matches &= bool(ids)
+            clauses.append(f"{col} IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+        if year_min is not None:
+            clauses.append("t.year >= 0 AND t.year >= ?")
+            params.append(year_min)
+        if year_max is not None:
+            clauses.append("t.year >= 0 AND t.year <= ?")
+            params.append(year_max)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        sql = (f"SELECT i.genome_id, t.pathogen_id, t.state_id, t.zone_id, t.year, t.antibiotic_id, t.label "
+               f"FROM tests t JOIN isolates i ON i.id = t.isolate_id{where} ORDER BY t.rowid")
+
+        def frame(rows: List[Tuple]) -> pd.DataFrame:
+            cols = list(zip(*rows)) if rows else [()] * 7
+            ids = [np.array(c, dtype=np.int64) for c in cols[1:]]
+            year, label = ids[3], ids[5]
+            return pd.DataFrame({
+                "genome_id": np.array(cols[0], dtype=object),
+                "pathogen": self._categorical("pathogens", ids[0]),
+                "state": self._categorical("states", ids[1]),
+                "region": self._categorical("zones", ids[2]),
+                "year": pd.arrays.IntegerArray(np.maximum(year, 0), year < 0),
+                "antibiotic_name": self._categorical("antibiotics", ids[4]),
+                "phenotype_label": pd.arrays.IntegerArray(label, label == MISSING_LABEL),
+            }, columns=ROW_COLUMNS)
+
+        def chunks() -> Iterator[pd.DataFrame]:
+            if not matches:
+                yield frame([])
+                return
+            conn = self._reader()
+            try:
+                cursor = conn.execute(sql, params)
+                emitted = False
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    emitted = True
+                    yield frame(rows)
+                if not emitted:
+                    yield frame([])
+            finally:
+                conn.close()
+
+        return chunks()
+
+    def rows_by_pathogen(self) -> Dict[str, int]:
+        """Per-test rows per pathogen."""
+        return {self.pathogens[p]: int(n) for p, n in self._query(
+            "SELECT pathogen_id, SUM(rows) FROM cells WHERE pathogen_id >= 0 GROUP BY pathogen_id")}
+
+    def state_counts(self) -> pd.DataFrame:
+        """tested / resistant per (state, pathogen, antibiotic_name), names
+        missing where unknown; the SpatialSmoother's input."""
+        rows = self._query("SELECT state_id, pathogen_id, antibiotic_id, SUM(tested), SUM(resistant) FROM cells "
+                           "GROUP BY state_id, pathogen_id, antibiotic_id")
+        table = np.array(rows, dtype=np.int64).reshape(-1, 5)
+        return pd.DataFrame({
+            "state": self._categorical("states", table[:, 0]),
+            "pathogen": self._categorical("pathogens", table[:, 1]),
+            "antibiotic_name": self._categorical("antibiotics", table[:, 2]),
+            "tested": table[:, 3],
+            "resistant": table[:, 4],
+        })
+
+    def location_counts(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """(places, counts) for LocationRollup.from_counts, from one pass over
+        the tested rows."""
+        keys = "i.state_id, i.district_id, i.city_id, i.zone_id"
+        place_rows = self._query(f"SELECT {keys} FROM isolates i GROUP BY 1, 2, 3, 4 ORDER BY MIN(i.id)")
+        place_of = {row: n for n, row in enumerate(place_rows)}
+        table = np.array(place_rows, dtype=np.int64).reshape(-1, 4)
+        places = pd.DataFrame({col: self._categorical(dim, table[:, j]) for j, (col, dim) in enumerate(
+            (("state", "states"), ("district", "districts"), ("city", "cities"), ("region", "zones")))})
+
+        tested = f"t.label != {MISSING_LABEL} AND t.pathogen_id >= 0"
+        rows = self._query(f"""
+            SELECT {keys}, t.pathogen_id, t.antibiotic_id, COUNT(*), SUM(t.label = 1), COUNT(DISTINCT t.isolate_id)
+            FROM tests t JOIN isolates i ON i.id = t.isolate_id
+            WHERE {tested} AND t.antibiotic_id >= 0 GROUP BY 1, 2, 3, 4, 5, 6
+            UNION ALL
+            SELECT {keys}, t.pathogen_id, {len(self.antibiotics)}, 0, 0, COUNT(DISTINCT t.isolate_id)
+            FROM tests t JOIN isolates i ON i.id = t.isolate_id
+            WHERE {tested} GROUP BY 1, 2, 3, 4, 5""")
+        counts = pd.DataFrame([(place_of[r[:4]],) + tuple(r[4:]) for r in rows],
+                              columns=["place", "pathogen", "antibiotic", "tested", "resistant", "isolates"])
+        return places, counts
+
+    def antibiotic_tests(self, antibiotic: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(isolate indexes, labels) of every test of `antibiotic`, by
+        isolate; None for an antibiotic not in the data."""
+        code = self._antibiotic_lookup.get(antibiotic)
+        if code is None:
+            return None
+        rows = self._query("SELECT isolate_id, label FROM tests WHERE antibiotic_id = ? ORDER BY isolate_id, rowid",
+                           (code,))
+        table = np.array(rows, dtype=np.int64).reshape(-1, 2)
+        return table[:, 0], table[:, 1].astype(np.int8)
+
+
+# ── /query over the store ──
+
+class SQLQueryEngine(QueryEngine):
+    """QueryEngine whose groups are counted by SQL: from the `cells` rollup,
+    or from per-test rows when distinct isolates are asked for."""
+
+    def __init__(self, db: SQLiteStore, version: int = 0):
+        super().__init__(pd.DataFrame(), version=version)
+        self.db = db
+        self.n_rows = int(db._query("SELECT IFNULL(SUM(rows), 0) FROM cells")[0][0])
+        # Raw column value behind each code; the trailing Unknown is -1
+        self._columns: Dict[str, str] = {}
+        self._raw: Dict[str, List[int]] = {}
+        for dim, table in (("state", "states"), ("region", "zones"), ("pathogen", "pathogens"),
+                           ("antibiotic", "antibiotics")):
+            self._set_dimension(dim, np.zeros(0, dtype=np.int32), db.names[table] + [UNKNOWN_LABEL])
+            self._columns[dim] = DIMENSION_IDS[table]
+            self._raw[dim] = list(range(len(db.names[table]))) + [-1]
+        years = [int(r[0]) for r in db._query("SELECT DISTINCT year FROM cells WHERE year >= 0 ORDER BY year")]
+        self._set_dimension("year", np.zeros(0, dtype=np.int32), years + [UNKNOWN_LABEL])
+        self._columns["year"] = "year"
+        self._raw["year"] = years + [-1]
+        self._class_lut, class_labels = antibiotic_class_lut(self.labels["antibiotic"])
+        self._set_dimension("antibiotic_class", np.zeros(0, dtype=np.int32), class_labels)
+
+    def _group_key(self, group_by: Sequence[str], cards: List[int], n_cells: int) -> Optional[np.ndarray]:
+        return None
+
+    def _expression(self, dim: str) -> str:
+        """SQL for a dimension's code."""
+        if dim == "antibiotic_class":
+            cases = " ".join(f"WHEN {raw} THEN {code}" for raw, code in zip(self._raw["antibiotic"], self._class_lut))
+            return f"CASE antibiotic_id {cases} END"
+        cases = " ".join(f"WHEN {raw} THEN {code}" for code, raw in enumerate(self._raw[dim]))
+        return f"CASE {self._columns[dim]} {cases} ELSE {len(self._raw[dim]) - 1} END"
+
+    def _measure(self, plan, filters: Dict[str, Sequence[Any]], year_min: Optional[int],
+                 year_max: Optional[int]) -> Tuple[np.ndarray, ...]:
+        empty = np.zeros(0, dtype=np.int64)
+        clauses: List[str] = []
+        params: List[Any] = []
+        for dim, values in filters.items():
+            codes = set(self._filter_codes(dim, values))
+            if dim == "antibiotic_class":
+                col, raw = "antibiotic_id", [r for r, c in zip(self._raw["antibiotic"], self._class_lut) if c in codes]
+            else:
+                col, raw = self._columns[dim], [self._raw[dim][c] for c in sorted(codes)]
+            if not raw:
+                return (empty,) * 5
+            clauses.append(f"{col} IN ({', '.join('?' * len(raw))})")
+            params.extend(raw)
+        if year_min is not None or year_max is not None:
+            clauses.append("year >= 0")
+            if year_min is not None:
+                clauses.append("year >= ?")
+                params.append(year_min)
+            if year_max is not None:
+                clauses.append("year <= ?")
+                params.append(year_max)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+
+        keys = [self._expression(dim) for dim in plan.group_by]
+        if "isolates" in plan.measures:
+            measures = (f"COUNT(*), SUM(label != {MISSING_LABEL}), SUM(MAX(label, 0)), "
+                        f"COUNT(DISTINCT isolate_id)")
+            table = "tests"
+        else:
+            measures, table = MEASURES + ", SUM(rows)", "cells"
+        group = f" GROUP BY {', '.join(str(i + 1) for i in range(len(keys)))}" if keys else ""
+        select = ", ".join(keys + [measures])
+        rows = np.array(self.db._query(f"SELECT {select} FROM {table}{where}{group}", params),
+                        dtype=np.float64).reshape(-1, len(keys) + 4)
+        rows = rows[np.nan_to_num(rows[:, len(keys)]) > 0]
+        if keys:
+            groups = np.ravel_multi_index(tuple(rows[:, :len(keys)].astype(np.int64).T), plan.cards)
+        else:
+            groups = np.zeros(len(rows), dtype=np.int64)
+        order = np.argsort(groups, kind="stable")
+        measured = rows[order, len(keys):]
+        return (groups[order], measured[:, 0], measured[:, 1], measured[:, 2], measured[:, 3])
@@ -0,0 +1,399 @@
+"""
+Reproducible retraining of the pathogen models.
+
+For each pathogen the pipeline
+  1. reads the harmonized dataset (cached frame, see app.services.datasets),
+  2. runs a grid search over genome-grouped folds in a process pool,
+     warm-started from the previous models/<name>/model.pkl:
+       logistic regression – solver initialized from the previous
+                             coefficients (matched by feature name)
+       random forest       – previous hyperparameters seed the grid
+  3. refits the best candidate on all rows as a
+     Pipeline([("preprocessor", ColumnTransformer), ("classifier", ...)])
+     with the previous model's input schema,
+  4. writes model.pkl, feature_importance.csv (model + chi-square
+     importance, existing schema) and a manifest.json recording data and
+     model digests, library versions, search results, metrics and timings.
+
+Runs land in TRAIN_DIR/<run id>/<pathogen>/; --install copies the
+artifacts into models/<pathogen>/.
+
+Usage:
+    python -m app.services.training --models e_coli k_pneumoniae --workers 4
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_selection import chi2
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import GroupKFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder
+
+from app.core.config import EVAL_DIR, MODELS_DIR, TRAIN_DIR
+from app.services.datasets import (LABEL_COLUMN, MODEL_DATASETS, antibiotic_feature, cached_dataset,
+                                   file_digest, gene_columns)
+from app.services.evaluation import binary_metrics, load_cached
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FORMAT = 1
+SEED = 42
+N_FOLDS = 5
+DEFAULT_ANTIBIOTIC_FEATURE = "antibiotic_name"
+
+# Estimator family → (fixed parameters, search grid)
+ESTIMATORS: Dict[str, Dict[str, Any]] = {
+    "logistic_regression": {
+        "fixed": {"class_weight": "balanced", "max_iter": 2000, "solver": "lbfgs", "random_state": SEED},
+        "grid": {"C": [0.01, 0.1, 1.0, 10.0]},
+    },
+    "random_forest": {
+        "fixed": {"class_weight": "balanced", "max_features": "sqrt", "random_state": SEED, "n_jobs": 1},
+        "grid": {"n_estimators": [100, 300], "max_depth": [None, 15], "min_samples_leaf": [1, 2]},
+    },
+}
+IMPORTANCE_COLUMNS = ["feature", "model_importance", "abs_model_importance", "chi2_score", "chi2_pvalue",
+                      "feature_type", "direction", "method"]
+
+
+# ── Pipeline construction ──
+
+def estimator_family(estimator) -> str:
+    return "random_forest" if isinstance(estimator, RandomForestClassifier) else "logistic_regression"
+
+
+def build_pipeline(family: str, genes: List[str], ab_col: str, antibiotics: List[str],
+                   params: Dict[str, Any]) -> Pipeline:
+    """Pipeline in the shape ModelLoader.validate_model expects.
+
+    Antibiotic categories are fixed up front so every fold (and the final
+    refit) has the same transformed feature layout.
+    """
+    if family == "logistic_regression":
+        preprocessor = ColumnTransformer([
+            ("cat", OneHotEncoder(categories=[antibiotics], handle_unknown="ignore"), [ab_col]),
+            ("num", "passthrough", genes),
+        ])
+        classifier = LogisticRegression(**{**ESTIMATORS[family]["fixed"], **params})
+    else:
+        preprocessor = ColumnTransformer([
+            ("num", "passthrough", genes),
+            ("cat", OrdinalEncoder(categories=[antibiotics], handle_unknown="use_encoded_value",
+                                   unknown_value=-1), [ab_col]),
+        ])
+        classifier = RandomForestClassifier(**{**ESTIMATORS[family]["fixed"], **params})
+    return Pipeline([("preprocessor", preprocessor), ("classifier", classifier)])
+
+
+def transformed_names(family: str, genes: List[str], ab_col: str, antibiotics: List[str]) -> List[str]:
+    """Output feature names of build_pipeline's preprocessor, without fitting it."""
+    if family == "logistic_regression":
+        return [f"cat__{ab_col}_{a}" for a in antibiotics] + [f"num__{g}" for g in genes]
+    return [f"num__{g}" for g in genes] + [f"cat__{ab_col}"]
+
+
+def _previous_coefficients(model, names: List[str]) -> Optional[Dict[str, np.ndarray]]:
+    """Previous logistic coefficients re-indexed onto `names` (unmatched → 0)."""
+    clf = model.steps[-1][1]
+    if not isinstance(clf, LogisticRegression):
+        return None
+    try:
+        prev_names = [n.split("__", 1)[-1] for n in model.steps[0][1].get_feature_names_out()]
+    except Exception as e:
+        logger.warning(f"Cannot map previous coefficients: {e}")
+        return None
+    prev = dict(zip(prev_names, clf.coef_[0]))
+    coef = np.array([prev.get(n.split("__", 1)[-1], 0.0) for n in names])
+    return {"coef": coef[None, :], "intercept": np.array(clf.intercept_, dtype=np.float64)}
+
+
+def _fit(spec: Dict[str, Any], X: pd.DataFrame, y: np.ndarray, params: Dict[str, Any]) -> Pipeline:
+    pipeline = build_pipeline(spec["family"], spec["genes"], spec["ab_col"], spec["antibiotics"], params)
+    warm = spec.get("warm_start")
+    if warm is not None:
+        clf = pipeline.named_steps["classifier"]
+        clf.set_params(warm_start=True)
+        clf.coef_ = warm["coef"].copy()
+        clf.intercept_ = warm["intercept"].copy()
+    pipeline.fit(X, y)
+    return pipeline
+
+
+# ── Worker side ──
+
+def _run_fold(task: Dict[str, Any]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    df = load_cached(task["dataset_path"])
+    spec = task["spec"]
+    X = df[spec["genes"]].assign(**{spec["ab_col"]: df["antibiotic"].astype(str).to_numpy()})
+    y = df[LABEL_COLUMN].to_numpy()
+    pipeline = _fit(spec, X.iloc[task["train"]], y[task["train"]], task["params"])
+    probs = pipeline.predict_proba(X.iloc[task["test"]])[:, 1]
+    return {"pathogen": task["pathogen"], "candidate": task["candidate"], "fold": task["fold"],
+            "test": task["test"], "probs": probs, "seconds": time.perf_counter() - start}
+
+
+# ── Importance table ──
+
+def importance_table(pipeline: Pipeline, X: pd.DataFrame, y: np.ndarray, spec: Dict[str, Any]) -> pd.DataFrame:
+    """feature_importance.csv rows: model importance plus chi-square for genes."""
+    clf = pipeline.named_steps["classifier"]
+    names = [n.split("__", 1)[-1] for n in pipeline.named_steps["preprocessor"].get_feature_names_out()]
+    genes = spec["genes"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        chi2_scores, chi2_p = chi2(X[genes].to_numpy(dtype=np.float64), y)
+    chi2_by_gene = {g: (s, p) for g, s, p in zip(genes, chi2_scores, chi2_p)}
+
+    if spec["family"] == "logistic_regression":
+        importance = clf.coef_[0]
+        signs = np.sign(importance)
+        method = "logistic_regression + chi_square"
+    else:
+        importance = clf.feature_importances_
+        # Forests have no sign: take it from the resistance rate with vs without the gene
+        signs = np.zeros(len(names))
+        for i, name in enumerate(names):
+            if name in genes:
+                present = X[name].to_numpy() > 0
+                if present.any() and (~present).any():
+                    signs[i] = np.sign(y[present].mean() - y[~present].mean())
+        method = "random_forest + chi_square"
+
+    rows = []
+    for i, name in enumerate(names):
+        is_gene = name in chi2_by_gene
+        score, pvalue = chi2_by_gene.get(name, (np.nan, np.nan))
+        rows.append({
+            "feature": name,
+            "model_importance": float(importance[i]),
+            "abs_model_importance": float(abs(importance[i])),
+            "chi2_score": score,
+            "chi2_pvalue": pvalue,
+            "feature_type": "gene" if is_gene else "antibiotic",
+            "direction": "resistance↑" if signs[i] > 0 else "resistance↓",
+            "method": method,
+        })
+    table = pd.DataFrame(rows, columns=IMPORTANCE_COLUMNS)
+    return table.sort_values("abs_model_importance", ascending=False, kind="stable").reset_index(drop=True)
+
+
+# ── Orchestration ──
+
+def _candidates(family: str, previous_params: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    grid = ESTIMATORS[family]["grid"]
+    keys = sorted(grid)
+    candidates = [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    if previous_params:
+        prev = {k: previous_params[k] for k in keys if k in previous_params}
+        if prev and prev not in candidates:
+            candidates.insert(0, prev)
+    return candidates
+
+
+def _default_family(name: str) -> str:
+    """Estimator family for a pathogen without a previous model: read it off feature_importance.csv."""
+    csv_path = MODELS_DIR / name / "feature_importance.csv"
+    if csv_path.exists():
+        try:
+            methods = pd.read_csv(csv_path, usecols=["method"])["method"].dropna().unique()
+            if len(methods) and str(methods[0]).startswith("random_forest"):
+                return "random_forest"
+        except (ValueError, OSError):
+            pass
+    return "logistic_regression"
+
+
+def _versions() -> Dict[str, str]:
+    return {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "scikit-learn": sklearn.__version__, "joblib": joblib.__version__}
+
+
+def run_training(pathogens: Optional[List[str]] = None, folds: int = N_FOLDS, workers: Optional[int] = None,
+                 warm_start: bool = True, install: bool = False, family: Optional[str] = None,
+                 out_dir: Optional[Path] = None, cache_dir: Optional[Path] = None) -> Dict[str, Any]:
+    """Retrain the given pathogen models; returns the run manifest."""
+    run_start = time.perf_counter()
+    pathogens = pathogens or list(MODEL_DATASETS)
+    unknown = [p for p in pathogens if p not in MODEL_DATASETS]
+    if unknown:
+        raise ValueError(f"No dataset for {unknown}. Choose from {list(MODEL_DATASETS)}.")
+    if family is not None and family not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator family '{family}'. Choose from {list(ESTIMATORS)}.")
+
+    timings: Dict[str, Dict[str, float]] = {p: {} for p in pathogens}
+    specs, frames, tasks, previous = {}, {}, [], {}
+    for name in pathogens:
+        t0 = time.perf_counter()
+        df, digest, cache_path = cached_dataset(name, Path(cache_dir or EVAL_DIR / "cache"))
+        frames[name] = df
+        timings[name]["load_s"] = time.perf_counter() - t0
+
+        prev_path = MODELS_DIR / name / "model.pkl"
+        prev_model = joblib.load(prev_path) if prev_path.exists() else None
+        previous[name] = {"path": str(prev_path), "sha256": file_digest(prev_path)} if prev_model is not None else None
+
+        # Keep the previous input schema (gene order, antibiotic column) when there is one
+        genes = gene_columns(df)
+        ab_col = DEFAULT_ANTIBIOTIC_FEATURE
+        if prev_model is not None and hasattr(prev_model, "feature_names_in_"):
+            ab_col = antibiotic_feature(prev_model) or ab_col
+            prev_genes = [str(f) for f in prev_model.feature_names_in_ if str(f) != ab_col]
+            if set(prev_genes) == set(genes):
+                genes = prev_genes
+        model_family = family or (estimator_family(prev_model.steps[-1][1]) if prev_model is not None
+                                  else _default_family(name))
+        antibiotics = sorted(df["antibiotic"].astype(str).unique())
+        spec = {"family": model_family, "genes": genes, "ab_col": ab_col, "antibiotics": antibiotics,
+                "data_sha256": digest, "warm_start": None, "warm_from": None}
+        previous_params = None
+        if warm_start and prev_model is not None:
+            prev_clf = prev_model.steps[-1][1]
+            if estimator_family(prev_clf) == model_family:
+                previous_params = {k: v for k, v in vars(prev_clf).items() if not k.endswith("_")}
+                spec["warm_from"] = "hyperparameters"
+                if model_family == "logistic_regression":
+                    spec["warm_start"] = _previous_coefficients(
+                        prev_model, transformed_names(model_family, genes, ab_col, antibiotics))
+                    if spec["warm_start"] is not None:
+                        spec["warm_from"] = "coefficients"
+        specs[name] = spec
+        spec["candidates"] = _candidates(model_family, previous_params)
+
+        n_splits = min(folds, df["genome_id"].nunique())
+        splits = list(GroupKFold(n_splits=n_splits).split(df, groups=df["genome_id"].cat.codes))
+        spec["n_splits"] = n_splits
+        for c, params in enumerate(spec["candidates"]):
+            for k, (train, test) in enumerate(splits):
+                tasks.append({"pathogen": name, "candidate": c, "fold": k, "params": params, "spec": spec,
+                              "dataset_path": str(cache_path), "train": train, "test": test})
+
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    logger.info(f"Training {pathogens}: {len(tasks)} fits on {workers} workers")
+    t0 = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_fold, tasks))
+    else:
+        results = [_run_fold(t) for t in tasks]
+    search_s = time.perf_counter() - t0
+
+    run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-" + hashlib.sha256(json.dumps(
+        [{n: s["data_sha256"] for n, s in specs.items()}, previous, folds, warm_start, family],
+        sort_keys=True).encode()).hexdigest()[:8]
+    run_dir = Path(out_dir or TRAIN_DIR) / run_id
+    manifest: Dict[str, Any] = {"format": MANIFEST_FORMAT, "id": run_id,
+                                "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": SEED,
+                                "versions": _versions(), "settings": {"folds": folds, "warm_start": warm_start,
+                                                                      "workers": workers}, "models": {}}
+    for name, spec in specs.items():
+        df = frames[name]
+        y = df[LABEL_COLUMN].to_numpy()
+        fold_results = [r for r in results if r["pathogen"] == name]
+        timings[name]["search_cpu_s"] = sum(r["seconds"] for r in fold_results)
+
+        # Out-of-fold predictions per candidate → pick by AUC, then Brier
+        search = []
+        for c, params in enumerate(spec["candidates"]):
+            oof = np.empty(len(df))
+            for r in fold_results:
+                if r["candidate"] == c:
+                    oof[r["test"]] = r["probs"]
+            metrics = binary_metrics(y, oof)
+            search.append({"params": params, "metrics": metrics})
+        best = max(range(len(search)), key=lambda c: (search[c]["metrics"].get("auc") or 0.0,
+                                                      -search[c]["metrics"].get("brier", 1.0)))
+
+        t0 = time.perf_counter()
+        X = df[spec["genes"]].assign(**{spec["ab_col"]: df["antibiotic"].astype(str).to_numpy()})
+        pipeline = _fit(spec, X, y, spec["candidates"][best])
+        timings[name]["refit_s"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        importance = importance_table(pipeline, X, y, spec)
+        timings[name]["importance_s"] = time.perf_counter() - t0
+
+        model_dir = run_dir / name
+        model_dir.mkdir(parents=True, exist_ok=True)
+        joblib.dump(pipeline, model_dir / "model.pkl")
+        importance.to_csv(model_dir / "feature_importance.csv", index=False)
+
+        manifest["models"][name] = {
+            "estimator": spec["family"],
+            "params": spec["candidates"][best],
+            "features": [str(f) for f in pipeline.feature_names_in_],
+            "antibiotics": spec["antibiotics"],
+            "data": {"path": MODEL_DATASETS[name], "sha256": spec["data_sha256"], "rows": int(len(df)),
+                     "genomes": int(df["genome_id"].nunique()), "positives": int(y.sum())},
+            "previous_model": previous[name],
+            "warm_start": spec["warm_from"],
+            "model_sha256": file_digest(model_dir / "model.pkl"),
+            "metrics": {
+                "cross_validation": search[best]["metrics"],
+                "train": binary_metrics(y, pipeline.predict_proba(X)[:, 1]),
+            },
+            "search": search,
+            "timings": {k: round(v, 3) for k, v in timings[name].items()},
+        }
+        if install:
+            _install(model_dir, MODELS_DIR / name)
+            manifest["models"][name]["installed"] = str(MODELS_DIR / name)
+
+    manifest["timings"] = {"search_s": round(search_s, 3), "total_s": round(time.perf_counter() - run_start, 3)}
+    run_dir.mkdir(parents=True, exist_ok=True)
+    with open(run_dir / "manifest.json", "w") as fh:
+        json.dump(manifest, fh, indent=2, default=str)
+    logger.info(f"Training run {run_id} written to {run_dir} in {manifest['timings']['total_s']}s")
+    return manifest
+
+
+def _install(src: Path, dest: Path):
+    """Copy a trained model into models/<pathogen>/, replacing files atomically."""
+    dest.mkdir(parents=True, exist_ok=True)
+    for file_name in ("model.pkl", "feature_importance.csv"):
+        tmp = dest / f".{file_name}.tmp"
+        shutil.copyfile(src / file_name, tmp)
+        os.replace(tmp, dest / file_name)
+    logger.info(f"Installed {src} → {dest}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the pathogen models from the harmonized datasets.")
+    parser.add_argument("--models", nargs="*", help=f"Pathogens to train (default: {list(MODEL_DATASETS)})")
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: CPU count)")
+    parser.add_argument("--estimator", choices=list(ESTIMATORS), default=None,
+                        help="Estimator family (default: same as the previous model)")
+    parser.add_argument("--cold", action="store_true", help="Do not warm-start from the previous model")
+    parser.add_argument("--install", action="store_true", help="Copy the artifacts into models/<pathogen>/")
+    parser.add_argument("--out", type=Path, default=TRAIN_DIR, help="Run output directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    manifest = run_training(args.models, folds=args.folds, workers=args.workers, warm_start=not args.cold,
+                            install=args.install, family=args.estimator, out_dir=args.out)
+    print(f"\nRun {manifest['id']} ({manifest['timings']['total_s']}s)")
+    for name, info in manifest["models"].items():
+        cv = info["metrics"]["cross_validation"]
+        print(f"{name:<14}{info['estimator']:<22}{json.dumps(info['params'], default=str):<50}"
+              f"cv auc {cv.get('auc')}  brier {cv.get('brier')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,450 @@
+import itertools
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.services.distinct import HyperLogLog, hash_ids
+from app.services.query import canonical_terms
+
+logger = logging.getLogger(__name__)
+
+# ── Trend Engine ────────────────────────────────────────────────────
+# Keeps a dense (pathogen × antibiotic × state × year) cube of
+#   rows      – records in the cell
+#   tested    – records with a phenotype label
+#   resistant – sum of phenotype labels
+# Any trend series is a sum over the axes that are not part of its key, so
+# a request for dozens of series costs O(cells), never a scan over raw rows.
+# New or retracted rows are folded in with `apply()`, and a reloaded source
+# is swapped in with `replace()`, without a rebuild.
+# Distinct genomes per cell are kept as HyperLogLog sketches (one per
+# non-empty cell, keyed by labels and calendar year so they survive cube
+# resizes) and merged per series. Sketches cannot forget: after a bare
+# retraction the distinct counts are an upper bound until the next rebuild;
+# `replace()` empties the sketches of the cells it retracts.
+
+DIMENSIONS: Tuple[str, ...] = ("pathogen", "antibiotic", "state")
+DIMENSION_COLUMNS: Dict[str, str] = {
+    "pathogen": "pathogen",
+    "antibiotic": "antibiotic_name",
+    "state": "state",
+}
+UNKNOWN_LABEL = "Unknown"
+SMOOTHING_MODES = ("none", "rolling", "ewma")
+# Years trend views cover unless a request sets its own bounds; a few stray
+# old records must not stretch every series over a century of empty years
+TREND_YEAR_MIN, TREND_YEAR_MAX = 2011, 2024
+
+
+class _Snapshot:
+    """One consistent view of the cube, its sketches and its labels."""
+    __slots__ = ("rows", "tested", "resistant", "year_min", "year_max", "version", "labels", "lookup",
+                 "sketch_keys", "sketches")
+
+    def __init__(self, rows, tested, resistant, year_min, year_max, version, labels, lookup,
+                 sketch_keys, sketches):
+        self.rows = rows
+        self.tested = tested
+        self.resistant = resistant
+        self.year_min = year_min
+        self.year_max = year_max
+        self.version = version
+        self.labels = labels
+        self.lookup = lookup
+        self.sketch_keys = sketch_keys
+        self.sketches = sketches
+
+
+class TrendEngine:
+    def __init__(self, version: int = 0):
+        self.labels: Dict[str, List[str]] = {d: [] for d in DIMENSIONS}
+        self._lookup: Dict[str, Dict[str, int]] = {d: {} for d in DIMENSIONS}
+        self.year_min: Optional[int] = None
+        self.year_max: Optional[int] = None
+        # Last slot on the year axis collects rows with no usable year
+        shape = (0, 0, 0, 1)
+        self._rows = np.zeros(shape, dtype=np.int64)
+        self._tested = np.zeros(shape, dtype=np.int64)
+        self._resistant = np.zeros(shape, dtype=np.float64)
+        # Sketch cells: (pathogen, antibiotic, state, year or -1) → sketch row
+        self._sketch_index: Dict[Tuple[int, int, int, int], int] = {}
+        self._sketch_keys = np.zeros((0, 4), dtype=np.int64)
+        self._sketches = HyperLogLog()
+        self.version = version
+        # Writers build the next state beside the live one (serialized by
+        # _write_lock) and swap it in under _lock, so readers never wait on
+        # an update and never see half of one.
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, version: int = 0) -> "TrendEngine":
+        return cls.from_chunks([df], version=version)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[pd.DataFrame], version: int = 0) -> "TrendEngine":
+        """Engine over rows streamed in chunks (e.g. from the on-disk store),
+        folded in as one update; no chunk is held past its own fold."""
+        engine = cls(version=version)
+        with engine._write_lock:
+            engine._update(((chunk, 1) for chunk in chunks), version=version)
+        return engine
+
+    def __getstate__(self):
+        # Shared-state snapshot (see app.core.shared_state)
+        state = dict(self.__dict__)
+        del state["_write_lock"], state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    # ── Ingest ──
+
+    @staticmethod
+    def _encode(values: pd.Series, labels: List[str], lookup: Dict[str, int]) -> np.ndarray:
+        """Map a column to cube indices, growing the dimension vocabulary."""
+        codes, uniques = pd.factorize(values, use_na_sentinel=True)
+        mapping = np.empty(len(uniques) + 1, dtype=np.int64)
+        for i, label in enumerate(list(uniques) + [UNKNOWN_LABEL]):
+            label = str(label).strip() or UNKNOWN_LABEL
+            key = label.lower()
+            if key not in lookup:
+                lookup[key] = len(labels)
+                labels.append(label)
+            mapping[i] = lookup[key]
+        # NaN codes are -1 → last mapping slot (UNKNOWN_LABEL)
+        return mapping[codes]
+
+    def apply(self, df: pd.DataFrame, sign: int = 1):
+        """Fold rows into the cube (sign=-1 retracts previously applied rows)."""
+        if df.empty:
+            return
+        with self._write_lock:
+            self._update([(df, sign)])
+
+    def replace(self, old: pd.DataFrame, new: pd.DataFrame, version: Optional[int] = None):
+        """Swap previously applied `old` rows for `new` in one update.
+
+        Sketches of the cells `old` touched are rebuilt from `new`, which is
+        exact when `old` holds every row of those cells, e.g. a whole
+        pathogen's source (cells are keyed by pathogen). `version` is the
+        dataset version the result belongs to (default: the next one).
+        """
+        self.replace_chunks([old], [new], version=version)
+
+    def replace_chunks(self, old: Iterable[pd.DataFrame], new: Iterable[pd.DataFrame],
+                       version: Optional[int] = None):
+        """`replace()` with both sides streamed in chunks."""
+        with self._write_lock:
+            self._update(itertools.chain(((df, -1) for df in old), ((df, 1) for df in new)),
+                         reset_sketches=True, version=version)
+
+    def _update(self, batches: Iterable[Tuple[pd.DataFrame, int]], reset_sketches: bool = False,
+                version: Optional[int] = None):
+        # Batches are folded one at a time into copies of the live arrays,
+        # grown whenever a batch brings new labels or years
+        labels = {d: list(self.labels[d]) for d in DIMENSIONS}
+        lookup = {d: dict(self._lookup[d]) for d in DIMENSIONS}
+        year_min, year_max = self.year_min, self.year_max
+        cube, cube_year_min = None, self.year_min
+        sketch_index, sketch_keys, sketches = self._sketch_index, self._sketch_keys, self._sketches
+        for df, sign in batches:
+            if df.empty:
+                continue
+            idx = [self._encode(df[DIMENSION_COLUMNS[d]], labels[d], lookup[d]) for d in DIMENSIONS]
+            years = pd.to_numeric(df["year"], errors="coerce").to_numpy(dtype=np.float64)
+            valid_year = ~np.isnan(years)
+            if valid_year.any():
+                lo, hi = int(years[valid_year].min()), int(years[valid_year].max())
+                year_min = lo if year_min is None else min(year_min, lo)
+                year_max = hi if year_max is None else max(year_max, hi)
+            live = cube if cube is not None else [self._rows, self._tested, self._resistant]
+            cube = _resized(live, cube_year_min, labels, year_min, year_max, copy=cube is None)
+            cube_year_min = year_min
+            rows, tested, resistant = cube
+
+            n_years = 0 if year_min is None else year_max - year_min + 1
+            year_idx = np.full(len(df), n_years, dtype=np.int64)
+            year_idx[valid_year] = years[valid_year].astype(np.int64) - (year_min or 0)
+            phenotype = pd.to_numeric(df["phenotype_label"], errors="coerce").to_numpy(dtype=np.float64)
+            has_label = ~np.isnan(phenotype)
+            cell = (idx[0], idx[1], idx[2], year_idx)
+            np.add.at(rows, cell, sign)
+            np.add.at(tested, cell, sign * has_label.astype(np.int64))
+            np.add.at(resistant, cell, sign * np.where(has_label, phenotype, 0.0))
+
+            year_key = np.where(valid_year, years, -1).astype(np.int64)
+            keys = np.column_stack(idx + [year_key])
+            if sign < 0 and reset_sketches:
+                sketches = _cleared(sketches, sketch_index, keys)
+            elif sign > 0 and "genome_id" in df.columns:
+                sketch_index, sketch_keys, sketches = _with_sketches(
+                    sketch_index, sketch_keys, sketches, keys,
+                    hash_ids(df["genome_id"]), df["genome_id"].notna().to_numpy())
+        version = self.version + 1 if version is None else version
+        if cube is None:
+            with self._lock:
+                self.version = version
+            return
+
+        with self._lock:
+            self.labels, self._lookup = labels, lookup
+            self._rows, self._tested, self._resistant = cube
+            self.year_min, self.year_max = year_min, year_max
+            self._sketch_index, self._sketch_keys, self._sketches = sketch_index, sketch_keys, sketches
+            self.version = version
+
+    # ── Query ──
+
+    def resolve(self, dim: str, names: Optional[Sequence[str]],
+                lookup: Optional[Dict[str, int]] = None) -> Optional[List[int]]:
+        """Case-insensitive label → index lookup (pathogens and antibiotics by
+        any spelling of their term). A pathogen or antibiotic no vocabulary
+        knows raises QueryError; other names missing from the cube are dropped.
+        Pass the `lookup` captured with a snapshot to resolve against it."""
+        if not names:
+            return None
+        lookup = self._lookup[dim] if lookup is None else lookup
+        names = canonical_terms(dim, names)
+        return [lookup[n.strip().lower()] for n in names if n.strip().lower() in lookup]
+
+    def snapshot(self) -> _Snapshot:
+        """The live state, taken atomically; arrays are never mutated in place
+        once swapped in, so the snapshot stays consistent."""
+        with self._lock:
+            return _Snapshot(self._rows, self._tested, self._resistant, self.year_min, self.year_max,
+                             self.version, {d: list(self.labels[d]) for d in DIMENSIONS}, self._lookup,
+                             self._sketch_keys, self._sketches)
+
+    def aggregate(self, split_by: Sequence[str] = (), filters: Optional[Dict[str, Sequence[str]]] = None,
+                  snap: Optional[_Snapshot] = None):
+        """Collapse the cube to (split_by..., year) arrays after filtering.
+
+        Returns (rows, tested, resistant, year_min, year_max, labels, version);
+        the year axis keeps the trailing "unknown year" slot. Pass `snap` to
+        read a snapshot already taken (e.g. shared with `distinct()`).
+        """
+        snap = snap or self.snapshot()
+        rows, tested, resistant = snap.rows, snap.tested, snap.resistant
+        labels = {d: list(snap.labels[d]) for d in DIMENSIONS}
+        filters = filters or {}
+        for axis, dim in enumerate(DIMENSIONS):
+            if filters.get(dim):
+                keep = self.resolve(dim, filters[dim], snap.lookup[dim])
+                rows = np.take(rows, keep, axis=axis)
+                tested = np.take(tested, keep, axis=axis)
+                resistant = np.take(resistant, keep, axis=axis)
+                labels[dim] = [labels[dim][i] for i in keep]
+
+        # Move split dimensions to the front (in requested order), sum the rest
+        split_axes = [DIMENSIONS.index(d) for d in split_by]
+        other_axes = tuple(i for i in range(len(DIMENSIONS)) if i not in split_axes)
+        order = split_axes + list(other_axes) + [len(DIMENSIONS)]
+        sum_axes = tuple(range(len(split_axes), len(DIMENSIONS)))
+        rows = rows.transpose(order).sum(axis=sum_axes)
+        tested = tested.transpose(order).sum(axis=sum_axes)
+        resistant = resistant.transpose(order).sum(axis=sum_axes)
+        return rows, tested, resistant, snap.year_min, snap.year_max, labels, snap.version
+
+    def distinct(self, split_by: Sequence[str] = (), filters: Optional[Dict[str, Sequence[str]]] = None,
+                 year_min: Optional[int] = None, year_max: Optional[int] = None,
+                 snap: Optional[_Snapshot] = None) -> np.ndarray:
+        """Estimated distinct genomes per combination of `split_by` labels, laid
+        out like `aggregate()` over the same snapshot (without its year axis).
+        A year range drops rows without a year."""
+        snap = snap or self.snapshot()
+        keys, sketches, lookup = snap.sketch_keys, snap.sketches, snap.lookup
+        labels = {d: list(snap.labels[d]) for d in DIMENSIONS}
+        keep = np.ones(len(keys), dtype=bool)
+        position = {}
+        for axis, dim in enumerate(DIMENSIONS):
+            lut = np.arange(len(labels[dim]))
+            if filters and filters.get(dim):
+                chosen = self.resolve(dim, filters[dim], lookup[dim])
+                lut = np.full(len(labels[dim]), -1)
+                lut[chosen] = np.arange(len(chosen))
+                labels[dim] = [labels[dim][i] for i in chosen]
+            position[dim] = lut[keys[:, axis]] if len(keys) else np.zeros(0, dtype=np.int64)
+            keep &= position[dim] >= 0
+        if year_min is not None or year_max is not None:
+            year = keys[:, 3]
+            keep &= year >= 0
+            if year_min is not None:
+                keep &= year >= year_min
+            if year_max is not None:
+                keep &= year <= year_max
+
+        shape = tuple(len(labels[d]) for d in split_by)
+        group = np.zeros(int(keep.sum()), dtype=np.int64)
+        for dim, card in zip(split_by, shape):
+            group = group * card + position[dim][keep]
+        n_groups = int(np.prod(shape, dtype=np.int64)) if shape else 1
+        registers = sketches.union(group, n_groups, np.flatnonzero(keep))
+        counts = sketches.estimate(registers)
+        # Cells never seen (all-zero registers) estimate to exactly 0
+        return counts.reshape(shape)
+
+    def series(self, split_by: Sequence[str] = ("pathogen",),
+               filters: Optional[Dict[str, Sequence[str]]] = None,
+               year_min: Optional[int] = None, year_max: Optional[int] = None,
+               window: int = 1, smoothing: str = "rolling", alpha: float = 0.5,
+               min_isolates: int = 1, limit: int = 100) -> Dict[str, Any]:
+        """Build many trend series at once.
+
+        Each series is one combination of `split_by` labels; its rate per year
+        is resistant/tested over the (optionally smoothed) window, and `yoy`
+        is the change in rate from the previous year in percentage points.
+        `isolates` is the estimated number of distinct genomes in the window.
+        """
+        # One snapshot for the counts and the distinct estimates, so a refresh
+        # in between cannot change the layout under either
+        snap = self.snapshot()
+        rows, tested, resistant, y_lo, y_hi, labels, version = self.aggregate(split_by, filters, snap)
+        if y_lo is None:
+            return {"years": [], "series": [], "version": version}
+
+        # Unset bounds default to TREND_YEAR_MIN / TREND_YEAR_MAX, narrowed
+        # to the first / last year in the window with any tested isolate
+        lo = TREND_YEAR_MIN if year_min is None else year_min
+        hi = TREND_YEAR_MAX if year_max is None else year_max
+        active = y_lo + np.flatnonzero(tested[..., :-1].reshape(-1, y_hi - y_lo + 1).sum(axis=0))
+        active = active[(active >= lo) & (active <= hi)]
+        if (year_min is None or year_max is None) and active.size == 0:
+            return {"years": [], "series": [], "version": version}
+        start = int(active[0]) if year_min is None else max(year_min, y_lo)
+        end = int(active[-1]) if year_max is None else min(year_max, y_hi)
+        if start > end:
+            return {"years": [], "series": [], "version": version}
+        years = list(range(start, end + 1))
+
+        # Flatten split combinations into rows of a (n_series, n_years) matrix
+        sl = slice(start - y_lo, end - y_lo + 1)
+        n_split = len(split_by)
+        tested_y = tested[..., sl].reshape(-1, len(years)).astype(np.float64)
+        resistant_y = resistant[..., sl].reshape(-1, len(years))
+        totals = tested_y.sum(axis=1)
+
+        smooth_r, smooth_n = _smooth(resistant_y, tested_y, smoothing, window, alpha)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = np.where(smooth_n > 0, smooth_r / smooth_n, np.nan)
+        yoy = np.full_like(rate, np.nan)
+        yoy[:, 1:] = (rate[:, 1:] - rate[:, :-1]) * 100
+
+        shape = tested.shape[:n_split]
+        if len(snap.sketch_keys):
+            isolates = self.distinct(split_by, filters, start, end, snap).reshape(-1)
+        else:  # built from rows without genome ids: fall back to test counts
+            isolates = totals.astype(np.int64)
+        order = np.argsort(-totals, kind="stable")
+        candidates = order[(totals[order] > 0) & (isolates[order] >= min_isolates)]
+        selected = candidates[:limit]
+        combos = np.unravel_index(selected, shape) if n_split else ()
+        rates = _nan_to_none(rate[selected])
+        changes = _nan_to_none(yoy[selected])
+        tested_lists = tested_y[selected].astype(int).tolist()
+        out = []
+        for j, flat in enumerate(selected):
+            key = {dim: labels[dim][int(idx[j])] for dim, idx in zip(split_by, combos)}
+            out.append({
+                "key": key,
+                "label": " / ".join(key.values()) if key else "All",
+                "rate": rates[j],
+                "tested": tested_lists[j],
+                "yoy": changes[j],
+                "isolates": int(isolates[flat]),
+            })
+
+        return {
+            "years": years,
+            "series": out,
+            "total_series": len(candidates),
+            "version": version,
+        }
+
+
+def _resized(arrays: Sequence[np.ndarray], arrays_year_min: Optional[int], labels: Dict[str, List[str]],
+             year_min: Optional[int], year_max: Optional[int], copy: bool = False) -> List[np.ndarray]:
+    """Cube arrays grown to `labels` and the year range (the same arrays when
+    they already fit, unless `copy`)."""
+    n_years = 0 if year_min is None else year_max - year_min + 1
+    shape = tuple(len(labels[d]) for d in DIMENSIONS) + (n_years + 1,)
+    old_shape = arrays[0].shape
+    offset = 0 if arrays_year_min is None else arrays_year_min - year_min
+    if shape == old_shape and offset == 0:
+        return [arr.copy() for arr in arrays] if copy else list(arrays)
+    out = []
+    for arr in arrays:
+        new = np.zeros(shape, dtype=arr.dtype)
+        p, a, s, _ = old_shape
+        new[:p, :a, :s, offset:offset + old_shape[3] - 1] = arr[..., :-1]
+        new[:p, :a, :s, -1] = arr[..., -1]
+        out.append(new)
+    return out
+
+
+def _smooth(resistant: np.ndarray, tested: np.ndarray, mode: str, window: int, alpha: float):
+    """Smooth numerators and denominators along the year axis for all series at once."""
+    if mode == "none" or (mode == "rolling" and window <= 1):
+        return resistant, tested
+    if mode == "rolling":
+        def trailing(x):
+            c = np.cumsum(x, axis=1)
+            c[:, window:] = c[:, window:] - c[:, :-window]
+            return c
+        return trailing(resistant), trailing(tested)
+    if mode == "ewma":
+        r = np.empty_like(resistant)
+        n = np.empty_like(tested)
+        r[:, 0], n[:, 0] = resistant[:, 0], tested[:, 0]
+        for t in range(1, resistant.shape[1]):
+            r[:, t] = alpha * resistant[:, t] + (1 - alpha) * r[:, t - 1]
+            n[:, t] = alpha * tested[:, t] + (1 - alpha) * n[:, t - 1]
+        return r, n
+    raise ValueError(f"Unknown smoothing mode: {mode}")
+
+
+def _nan_to_none(arr: np.ndarray) -> List[Any]:
+    """JSON-safe nested lists: NaN → None."""
+    out = arr.astype(object)
+    out[np.isnan(arr)] = None
+    return out.tolist()
+
+
+def _with_sketches(index: Dict[Tuple[int, int, int, int], int], keys: np.ndarray, sketches: HyperLogLog,
+                   cells: np.ndarray, hashes: np.ndarray, valid: np.ndarray):
+    """Copies of the sketch index / keys / bank with hashes added to each row's cell."""
+    cells, hashes = cells[valid], hashes[valid]
+    uniq, inverse = np.unique(cells, axis=0, return_inverse=True)
+    index = dict(index)
+    rows = np.empty(len(uniq), dtype=np.int64)
+    new = []
+    for i, key in enumerate(map(tuple, uniq.tolist())):
+        row = index.get(key)
+        if row is None:
+            row = len(index)
+            index[key] = row
+            new.append(key)
+        rows[i] = row
+    bank = HyperLogLog(precision=sketches.precision)
+    bank.registers = sketches.registers
+    bank.grow(len(index))
+    bank.add(rows[inverse.ravel()], hashes)
+    if new:
+        keys = np.vstack([keys, np.array(new, dtype=np.int64)])
+    return index, keys, bank
+
+
+def _cleared(sketches: HyperLogLog, index: Dict[Tuple[int, int, int, int], int], cells: np.ndarray) -> HyperLogLog:
+    """Copy of the bank with the sketches of `cells` emptied."""
+    rows = [index[key] for key in map(tuple, np.unique(cells, axis=0).tolist()) if key in index]
+    bank = HyperLogLog(precision=sketches.precision)
+    bank.registers = sketches.registers.copy()
+    bank.registers[rows] = 0
+    return bank
+
@@ -0,0 +1,251 @@
+import logging
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# ── Canonical vocabulary ────────────────────────────────────────────
+# Pathogen, antibiotic and gene names arrive spelled many ways: title- or
+# upper-cased antibiotics in the source CSVs, "gene_"-prefixed model
+# features, model folder names (e_coli) beside display names (E. coli),
+# and whatever a client typed. Each Vocabulary gives every term a stable
+# integer id and resolves any known spelling (case, spacing, prefix or a
+# registered synonym) to it. Vocabularies are append-only: a term's id is
+# never reused or renumbered while the process runs, so ids survive a
+# live data refresh.
+#
+# Lookups ignore case, spacing and the separators '.', '-' and '_', so
+# "E coli", "e_coli" and "E. coli" are one spelling, as are "blaOXA-48" and
+# "blaOXA_48".
+#
+# Names are resolved once: at ingest for data columns (one lookup per
+# distinct value, `intern`) and once per request parameter (`resolve`,
+# memoized per raw spelling). Services index their axes by term id
+# (TermIndex), so filters compare integers instead of re-normalizing
+# strings against every label.
+
+RESOLVE_CACHE_SIZE = 4096   # raw spellings remembered per vocabulary
+_SEPARATORS = re.compile(r"[._\-]")
+
+
+def normalize(name: str) -> str:
+    """Lower-case form of a name with whitespace collapsed (punctuation kept)."""
+    return " ".join(str(name).split()).casefold()
+
+
+def fold(name: str) -> str:
+    """Lookup key of a name: case-, whitespace- and separator-insensitive."""
+    return normalize(_SEPARATORS.sub(" ", str(name)))
+
+
+class Vocabulary:
+    def __init__(self, kind: str, prefix: str = "", title: bool = False):
+        self.kind = kind
+        self.prefix = prefix    # optional lower-case prefix ignored in lookups (gene_)
+        self.title = title      # display names are title-cased (antibiotics)
+        self.names: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._resolved: Dict[str, Optional[int]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def key(self, name: str) -> str:
+        text = normalize(name)
+        if self.prefix and text.startswith(self.prefix):
+            text = text[len(self.prefix):]
+        return fold(text)
+
+    def _display(self, name: str) -> str:
+        text = " ".join(str(name).split())
+        if self.prefix and text.lower().startswith(self.prefix):
+            text = text[len(self.prefix):]
+        return text.title() if self.title else text
+
+    def add(self, name: str, synonyms: Iterable[str] = ()) -> int:
+        """Id of `name`, registering it (and any synonyms) if new."""
+        with self._lock:
+            key = self.key(name)
+            term = self._ids.get(key)
+            added = term is None
+            if added:
+                term = len(self.names)
+                self.names.append(self._display(name))
+                self._ids[key] = term
+            for synonym in synonyms:
+                if self.key(synonym) not in self._ids:
+                    self._ids[self.key(synonym)] = term
+                    added = True
+            if added:
+                self._resolved.clear()   # remembered misses may resolve now
+            return term
+
+    def resolve(self, name: Optional[str]) -> Optional[int]:
+        """Id of a known spelling of a term; None if unknown."""
+        if name is None:
+            return None
+        try:
+            return self._resolved[name]
+        except KeyError:
+            pass
+        term = self._ids.get(self.key(name))
+        if len(self._resolved) >= RESOLVE_CACHE_SIZE:
+            self._resolved.clear()
+        self._resolved[name] = term
+        return term
+
+    def canonical(self, name: Optional[str]) -> Optional[str]:
+        """Display name of a known spelling; None if unknown."""
+        term = self.resolve(name)
+        return None if term is None else self.names[term]
+
+    def term_key(self, term: int) -> str:
+        """Lower-case canonical name of a term (the form models are trained on)."""
+        return normalize(self.names[term])
+
+    def intern(self, values: pd.Series) -> pd.Series:
+        """Canonical names for a column, registering unseen terms.
+
+        Each distinct value is resolved once; blank and missing values are
+        kept as they are.
+        """
+        mapping = {v: self.names[self.add(v)] for v in values.dropna().unique() if self.key(v)}
+        return values.map(lambda v: mapping.get(v, v))
+
+    def index(self, labels: Sequence[str]) -> "TermIndex":
+        return TermIndex(self, labels)
+
+    def __reduce__(self):
+        # Pickled by reference: an unpickled index must use this process's vocabulary
+        return _vocabulary, (self.kind,)
+
+
+class TermIndex:
+    """Positions of an axis's labels, looked up by any spelling of their term."""
+
+    def __init__(self, vocabulary: Vocabulary, labels: Sequence[str]):
+        self.vocabulary = vocabulary
+        self._positions: Dict[int, int] = {}
+        for i, label in enumerate(labels):
+            self._positions.setdefault(vocabulary.add(label), i)
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __reduce__(self):
+        # Term ids are per process: pickle the names, re-registered on load
+        names = {self.vocabulary.names[term]: i for term, i in self._positions.items()}
+        return _term_index, (self.vocabulary, names)
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def get(self, name: Optional[str]) -> Optional[int]:
+        term = self.vocabulary.resolve(name)
+        return None if term is None else self._positions.get(term)
+
+    def select(self, names: Iterable[str]) -> List[int]:
+        """Positions of the known names, in request order (unknown ones dropped)."""
+        positions = (self.get(n) for n in names)
+        return [p for p in positions if p is not None]
+
+
+# ── Pathogens ──
+# Display name → (model directory name, other spellings)
+PATHOGEN_TERMS: Dict[str, Tuple[str, ...]] = {
+    "E. coli": ("e_coli", "E.coli", "ecoli", "Escherichia coli"),
+    "K. pneumoniae": ("k_pneumoniae", "K.pneumoniae", "Klebsiella pneumoniae"),
+    "S. aureus": ("s_aureus", "S.aureus", "Staphylococcus aureus", "Staph aureus"),
+    "A. baumannii": ("a_baumannii", "A.baumannii", "Acinetobacter baumannii"),
+    "P. aeruginosa": ("p_aeruginosa", "P.aeruginosa", "Pseudomonas aeruginosa"),
+}
+
+# ── Antibiotics ──
+# Antibiotic → class mapping (lowercase keys)
+ANTIBIOTIC_CLASSES: Dict[str, str] = {
+    # Carbapenems
+    "meropenem": "carbapenems", "imipenem": "carbapenems", "ertapenem": "carbapenems",
+    # Cephalosporins
+    "ceftriaxone": "cephalosporins", "cefotaxime": "cephalosporins",
+    "ceftazidime": "cephalosporins", "cefepime": "cephalosporins",
+    "cefoxitin": "cephalosporins", "cefuroxime": "cephalosporins",
+    "cefalothin": "cephalosporins", "cefazolin": "cephalosporins",
+    "ceftiofur": "cephalosporins",
+    # Penicillins
+    "ampicillin": "penicillins", "amoxicillin": "penicillins",
+    "ampicillin/sulbactam": "penicillins",
+    "amoxicillin/clavulanic acid": "penicillins",
+    "piperacillin/tazobactam": "penicillins",
+    # Fluoroquinolones
+    "ciprofloxacin": "fluoroquinolones", "levofloxacin": "fluoroquinolones",
+    "norfloxacin": "fluoroquinolones", "nalidixic acid": "fluoroquinolones",
+    # Aminoglycosides
+    "gentamicin": "aminoglycosides", "tobramycin": "aminoglycosides",
+    "amikacin": "aminoglycosides", "streptomycin": "aminoglycosides",
+    # Tetracyclines
+    "tetracycline": "tetracyclines", "doxycycline": "tetracyclines",
+    # Phenicols
+    "chloramphenicol": "phenicols",
+    # Sulfonamides
+    "sulfamethoxazole": "sulfonamides",
+    "trimethoprim/sulfamethoxazole": "sulfonamides",
+    "trimethoprim": "sulfonamides",
+    # Other
+    "aztreonam": "monobactams",
+    "fosfomycin": "fosfomycin",
+}
+
+# Canonical antibiotic → other spellings (abbreviations, hyphenated combinations)
+ANTIBIOTIC_SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    "trimethoprim/sulfamethoxazole": ("trimethoprim-sulfamethoxazole", "co-trimoxazole",
+                                      "cotrimoxazole", "sxt", "tmp/smx", "tmp-smx"),
+    "amoxicillin/clavulanic acid": ("amoxicillin-clavulanic acid", "amoxicillin/clavulanate",
+                                    "amoxicillin-clavulanate", "co-amoxiclav", "amc"),
+    "ampicillin/sulbactam": ("ampicillin-sulbactam", "sam"),
+    "piperacillin/tazobactam": ("piperacillin-tazobactam", "pip-tazo", "tzp"),
+    "cefalothin": ("cephalothin", "cefalotin"),
+    "cefazolin": ("cephazolin",),
+    "cefuroxime": ("cephuroxime",),
+}
+
+PATHOGENS = Vocabulary("pathogen")
+ANTIBIOTICS = Vocabulary("antibiotic", title=True)
+GENES = Vocabulary("gene", prefix="gene_")
+
+VOCABULARIES: Dict[str, Vocabulary] = {v.kind: v for v in (PATHOGENS, ANTIBIOTICS, GENES)}
+
+# Vocabularies of the query and trend dimensions that name terms
+DIMENSION_VOCABULARIES: Dict[str, Vocabulary] = {"pathogen": PATHOGENS, "antibiotic": ANTIBIOTICS}
+
+# Seeded terms get the same ids in every process, whatever data is loaded
+_MODEL_NAMES: Dict[int, str] = {
+    PATHOGENS.add(name, spellings): spellings[0] for name, spellings in PATHOGEN_TERMS.items()
+}
+_CLASSES: Dict[int, str] = {
+    ANTIBIOTICS.add(name, ANTIBIOTIC_SYNONYMS.get(name, ())): cls for name, cls in ANTIBIOTIC_CLASSES.items()
+}
+
+
+def _vocabulary(kind: str) -> Vocabulary:
+    return VOCABULARIES[kind]
+
+
+def _term_index(vocabulary: Vocabulary, positions: Dict[str, int]) -> TermIndex:
+    index = TermIndex(vocabulary, [])
+    for name, i in positions.items():
+        index._positions.setdefault(vocabulary.add(name), i)
+    return index
+
+
+def model_name(pathogen: str) -> Optional[str]:
+    """Model directory name of a pathogen (e.g. "E. coli" → "e_coli")."""
+    return _MODEL_NAMES.get(PATHOGENS.resolve(pathogen))
+
+
+def antibiotic_class(antibiotic: str) -> Optional[str]:
+    """Drug class of any spelling of an antibiotic; None if unclassified."""
+    return _CLASSES.get(ANTIBIOTICS.resolve(antibiotic))
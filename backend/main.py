@@ -1,7 +1,11 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routes import prediction, maps
+from fastapi.responses import PlainTextResponse
+from app.api.routes import prediction, maps, admin
 from app.core.loader import ModelLoader
+from app.core.metrics import MetricsMiddleware, render_metrics, CONTENT_TYPE_LATEST
+from app.core.profiling import ProfilingMiddleware
+from app.core.admission import AdmissionMiddleware
 import logging
 
 # Configure logging
@@ -21,13 +25,20 @@ origins = [
     "http://localhost:3000",
 ]
 
+# Cost-class admission. add_middleware wraps the app, so registering it
+# first puts it inside CORS: 503s still carry CORS headers (and preflight
+# requests are answered without being admitted).
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 # Initialize Model Loader on startup
 @app.on_event("startup")
@@ -35,15 +46,26 @@ async def startup_event():
     logger.info("Initializing Model Loader...")
     ModelLoader.get_instance().load_models()
     logger.info("Model Loader initialized successfully.")
+    maps.start_data_watcher()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    maps.stop_data_watcher()
 
 # Include Routers
 app.include_router(prediction.router, prefix="/api/v1/prediction", tags=["prediction"])
 app.include_router(maps.router, prefix="/api/v1/maps", tags=["maps"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"])
 
 @app.get("/health")
 def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
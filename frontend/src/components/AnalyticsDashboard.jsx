@@ -3,7 +3,8 @@ import {
     LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, Legend, ResponsiveContainer,
     PieChart, Pie, Cell, BarChart, Bar
 } from 'recharts';
-import { getTrendsData, getHeatmapData, getAntibiotics, getMapData } from '../services/api';
+import { getDashboardBundle } from '../services/api';
+import { useDatasetVersion } from '../services/useDatasetVersion';
 import { Filter, Calendar, Activity, Map as MapIcon, Grid } from 'lucide-react';
 
 const COLORS = ['#0088FE', '#00C49F', '#FFBB28', '#FF8042', '#8884d8', '#82ca9d', '#ffc658'];
@@ -80,70 +81,42 @@ const AnalyticsDashboard = () => {
     const [selectedPathogen, setSelectedPathogen] = useState('');
     const [loading, setLoading] = useState(true);
 
-    useEffect(() => {
-        loadInitialData();
-    }, []);
+    // Bumped when a dataset refresh makes the dashboard's data stale
+    const datasetVersion = useDatasetVersion('/analytics/dashboard');
 
     useEffect(() => {
-        loadTrends();
-        loadRegionalComparison();
-    }, [selectedAntibiotic, selectedPathogen]);
-
-    const loadInitialData = async () => {
-        setLoading(true);
-        try {
-            const [abList, hData] = await Promise.all([
-                getAntibiotics(),
-                getHeatmapData()
-            ]);
-            setAntibiotics(abList);
-            setHeatmapData(hData);
-            await loadTrends(); // Load initial trends
-            await loadRegionalComparison();
-        } catch (e) {
-            console.error("Dashboard init error", e);
-        }
-        setLoading(false);
-    };
+        loadDashboard();
+    }, [selectedAntibiotic, selectedPathogen, datasetVersion]);
 
-    const loadTrends = async () => {
+    // Every panel comes from one request for the current filters
+    const loadDashboard = async () => {
         try {
             const filters = {};
             if (selectedAntibiotic) filters.antibiotic = selectedAntibiotic;
             if (selectedPathogen) filters.pathogen = selectedPathogen;
 
-            const res = await getTrendsData(filters);
-            if (res && res.labels) {
-                const formatted = res.labels.map((year, i) => ({
-                    year,
-                    value: res.datasets[0].data[i] * 100 // Convert to percentage
-                }));
-                const pathogenDist = res.pathogen_distribution || [];
-                setTrendsData({ trends: formatted, pathogens: pathogenDist });
-            }
-        } catch (e) {
-            console.error("Trend load error", e);
-        }
-    };
+            const res = await getDashboardBundle(filters);
+            if (res) {
+                setAntibiotics(res.antibiotics || []);
+                setHeatmapData(res.heatmap);
 
-    const loadRegionalComparison = async () => {
-        try {
-            // Use 'antibiotic_performance' endpoint to get regional distribution
-            // passing selectedAntibiotic to filter
-            const res = await getMapData('antibiotic_performance', selectedAntibiotic);
-            if (res && res.data) {
-                // Filter out 'interpolated' or 'Other' if desired, or keep all
-                // Sort by resistance value descending
-                const sorted = [...res.data]
-                    .filter(d => d.value > 0)
-                    .sort((a, b) => b.value - a.value)
-                    .slice(0, 10); // Top 10 regions
+                const trends = res.trends;
+                if (trends && trends.labels) {
+                    const formatted = trends.labels.map((year, i) => ({
+                        year,
+                        value: trends.datasets[0].data[i] * 100 // Convert to percentage
+                    }));
+                    const pathogenDist = trends.pathogen_distribution || [];
+                    setTrendsData({ trends: formatted, pathogens: pathogenDist });
+                }
 
-                setRegionalData(sorted);
+                // Top 10 regions by resistance, already sorted server-side
+                setRegionalData(res.top_regions || []);
             }
         } catch (e) {
-            console.error("Regional load error", e);
+            console.error("Dashboard load error", e);
         }
+        setLoading(false);
     };
 
     if (loading) return <div style={{ padding: '2rem', textAlign: 'center', color: 'var(--color-text-secondary)' }}>Loading Analytics Dashboard...</div>;
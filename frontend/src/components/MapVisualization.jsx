@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { getMapData, getAntibiotics } from '../services/api';
+import { useDatasetVersion } from '../services/useDatasetVersion';
 import { Map, AlertCircle, Filter } from 'lucide-react';
 import IndiaMap from './IndiaMap';
 
@@ -10,6 +11,10 @@ const MapVisualization = () => {
     const [antibiotics, setAntibiotics] = useState([]);
     const [selectedAntibiotic, setSelectedAntibiotic] = useState('');
 
+    // Bumped when a dataset refresh makes the list or the current map stale
+    const antibioticsVersion = useDatasetVersion('/antibiotics');
+    const mapVersion = useDatasetVersion(`/${mapType}`);
+
     useEffect(() => {
         // Load antibiotic list on mount
         const loadAntibiotics = async () => {
@@ -17,11 +22,11 @@ const MapVisualization = () => {
             setAntibiotics(list);
         };
         loadAntibiotics();
-    }, []);
+    }, [antibioticsVersion]);
 
     useEffect(() => {
         fetchMapData(mapType, selectedAntibiotic);
-    }, [mapType, selectedAntibiotic]);
+    }, [mapType, selectedAntibiotic, mapVersion]);
 
     const fetchMapData = async (type, antibiotic) => {
         setLoading(true);
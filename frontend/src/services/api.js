@@ -79,3 +79,46 @@ export const getHeatmapData = async () => {
         return { x_labels: [], y_labels: [], data: [] };
     }
 };
+
+// Antibiotic list, heatmap, trends and top regions for one filter state
+export const getDashboardBundle = async (filters = {}) => {
+    try {
+        const response = await api.get('/maps/analytics/dashboard', { params: filters });
+        return response.data;
+    } catch (error) {
+        console.error("Failed to fetch dashboard", error);
+        return null;
+    }
+};
+
+// ── Live dataset updates ──
+// One shared EventSource for every subscriber; each `dataset` event carries
+// the version each maps route's data last changed at.
+const datasetListeners = new Set();
+let datasetSource = null;
+let latestDatasetEvent = null;
+
+export const subscribeDatasetUpdates = (listener) => {
+    if (typeof EventSource === 'undefined') return () => {};
+    datasetListeners.add(listener);
+    if (latestDatasetEvent) listener(latestDatasetEvent);
+    if (!datasetSource) {
+        datasetSource = new EventSource(`${API_URL}/maps/dataset/events`);
+        datasetSource.addEventListener('dataset', (e) => {
+            try {
+                latestDatasetEvent = JSON.parse(e.data);
+            } catch (error) {
+                console.warn("Ignoring malformed dataset event", error);
+                return;
+            }
+            datasetListeners.forEach((fn) => fn(latestDatasetEvent));
+        });
+    }
+    return () => {
+        datasetListeners.delete(listener);
+        if (datasetListeners.size === 0 && datasetSource) {
+            datasetSource.close();
+            datasetSource = null;
+        }
+    };
+};
@@ -0,0 +1,25 @@
+import { useEffect, useRef, useState } from 'react';
+import { subscribeDatasetUpdates } from './api';
+
+// Counter that increments whenever the server reports new data behind a
+// maps route (e.g. '/analytics/heatmap'). Add it to a panel's effect
+// dependencies to refetch just that panel after a dataset refresh.
+export const useDatasetVersion = (route) => {
+    const [changes, setChanges] = useState(0);
+    const seen = useRef(null);
+
+    useEffect(() => {
+        seen.current = null;
+        return subscribeDatasetUpdates((event) => {
+            const version = event.routes ? event.routes[route] : undefined;
+            if (version === undefined) return;
+            // The first event is the state the panel was loaded against
+            if (seen.current !== null && version !== seen.current) {
+                setChanges((n) => n + 1);
+            }
+            seen.current = version;
+        });
+    }, [route]);
+
+    return changes;
+};